@@ -32,14 +32,33 @@ class ConsolidatedController {
     async performMonthlyCalculation(req, res) {
         try {
             const { projectId } = req.params;
+            const {
+                cash_sweep, min_cash, sweep_priority, solve_circular, deposit_rate, method,
+                compute_tax, opening_tax_losses, loss_cap_pct, loss_cap_amount
+            } = req.body || {};
             
-            const result = await consolidatedService.performMonthlyCalculation(projectId);
+            const result = await consolidatedService.performMonthlyCalculation(projectId, {
+                cashSweep: cash_sweep,
+                minCash: min_cash,
+                sweepPriority: sweep_priority,
+                solveCircular: solve_circular,
+                depositRate: deposit_rate,
+                method,
+                computeTax: compute_tax,
+                openingTaxLosses: opening_tax_losses,
+                lossCapPct: loss_cap_pct,
+                lossCapAmount: loss_cap_amount
+            });
             
             if (result.success) {
                 res.json({
                     success: true,
                     calculationRunId: result.calculationRunId,
                     totalMonths: result.totalMonths,
+                    cashSweep: result.cashSweep,
+                    solver: result.solver,
+                    tax: result.tax,
+                    integrity: result.integrity,
                     message: result.message
                 });
             } else {
@@ -57,6 +76,139 @@ class ConsolidatedController {
         }
     }
 
+    async performDryRun(req, res) {
+        try {
+            const { projectId } = req.params;
+
+            const result = await consolidatedService.performDryRun(projectId, req.body || {});
+
+            if (result.success) {
+                res.json(result);
+            } else {
+                res.status(400).json({
+                    success: false,
+                    error: result.error
+                });
+            }
+        } catch (error) {
+            logger.error('Error performing dry run:', error);
+            res.status(500).json({
+                success: false,
+                error: 'Internal server error'
+            });
+        }
+    }
+
+    async enqueueCalculationJob(req, res) {
+        try {
+            const { projectId } = req.params;
+            const { stages, options, max_attempts, priority } = req.body || {};
+
+            const result = await consolidatedService.enqueueCalculationJob(projectId, {
+                stages,
+                options: options || {},
+                maxAttempts: max_attempts,
+                priority
+            }, req.user.id);
+
+            if (result.success) {
+                res.status(202).json({
+                    success: true,
+                    job: result.job,
+                    coalesced: result.coalesced
+                });
+            } else {
+                res.status(400).json({
+                    success: false,
+                    error: result.error
+                });
+            }
+        } catch (error) {
+            logger.error('Error enqueueing calculation job:', error);
+            res.status(500).json({
+                success: false,
+                error: 'Internal server error'
+            });
+        }
+    }
+
+    async getCalculationJob(req, res) {
+        try {
+            const { projectId, jobId } = req.params;
+
+            const result = await consolidatedService.getCalculationJob(projectId, jobId);
+
+            if (result.success) {
+                res.json({
+                    success: true,
+                    job: result.job,
+                    latestJob: result.latestJob
+                });
+            } else {
+                res.status(404).json({
+                    success: false,
+                    error: result.error
+                });
+            }
+        } catch (error) {
+            logger.error('Error getting calculation job:', error);
+            res.status(500).json({
+                success: false,
+                error: 'Internal server error'
+            });
+        }
+    }
+
+    async getCalculationJobMetrics(req, res) {
+        try {
+            const result = await consolidatedService.getCalculationJobMetrics();
+
+            if (result.success) {
+                res.json({
+                    success: true,
+                    metrics: result.metrics
+                });
+            } else {
+                res.status(400).json({
+                    success: false,
+                    error: result.error
+                });
+            }
+        } catch (error) {
+            logger.error('Error getting calculation job metrics:', error);
+            res.status(500).json({
+                success: false,
+                error: 'Internal server error'
+            });
+        }
+    }
+
+    async getCalculationJobs(req, res) {
+        try {
+            const { projectId } = req.params;
+
+            const result = await consolidatedService.getCalculationJobs(projectId);
+
+            if (result.success) {
+                res.json({
+                    success: true,
+                    jobs: result.jobs
+                });
+            } else {
+                res.status(400).json({
+                    success: false,
+                    error: result.error
+                });
+            }
+        } catch (error) {
+            logger.error('Error getting calculation jobs:', error);
+            res.status(500).json({
+                success: false,
+                error: 'Internal server error'
+            });
+        }
+    }
+
     async performQuarterlyCalculation(req, res) {
         try {
             const { projectId } = req.params;
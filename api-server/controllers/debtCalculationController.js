@@ -7,7 +7,7 @@ class DebtCalculationController {
   async performDebtCalculation(req, res) {
     try {
       const { projectId } = req.params;
-      const { change_reason } = req.body;
+      const { change_reason, repayment_mode, target_dscr } = req.body;
       const userId = req.user?.id;
 
       logger.info(`Performing debt calculation for project: ${projectId}`);
@@ -15,7 +15,8 @@ class DebtCalculationController {
       const result = await debtCalculationService.performDebtCalculation(
         projectId, 
         userId, 
-        change_reason
+        change_reason,
+        { repaymentMode: repayment_mode, targetDscr: target_dscr }
       );
 
       res.status(200).json({
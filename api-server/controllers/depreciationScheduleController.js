@@ -25,13 +25,14 @@ class DepreciationScheduleController {
   async performCalculation(req, res) {
     try {
       const { projectId } = req.params;
-      const { change_reason } = req.body;
+      const { change_reason, asset_classes } = req.body;
       const userId = req.user.id;
 
       const result = await depreciationScheduleService.performDepreciationCalculation(
         projectId, 
         userId, 
-        change_reason
+        change_reason,
+        { assetClasses: asset_classes }
       );
 
       res.json({
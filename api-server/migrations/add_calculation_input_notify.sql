@@ -0,0 +1,45 @@
+-- Migration: Notify calculation processes when project inputs change
+-- Every write to an input table sends '<table>:<project_id>' on the
+-- calculation_inputs_changed channel; scripts/input_cache.py listens on it to
+-- drop its cached latest versions. Postgres delivers the notification at commit
+-- and collapses identical payloads within a transaction.
+
+CREATE OR REPLACE FUNCTION notify_calculation_input_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_project_id UUID;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_project_id := OLD.project_id;
+    ELSE
+        changed_project_id := NEW.project_id;
+    END IF;
+    PERFORM pg_notify('calculation_inputs_changed', TG_TABLE_NAME || ':' || changed_project_id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_balance_sheet_data_change ON balance_sheet_data;
+CREATE TRIGGER notify_balance_sheet_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON balance_sheet_data
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_input_change();
+
+DROP TRIGGER IF EXISTS notify_profit_loss_data_change ON profit_loss_data;
+CREATE TRIGGER notify_profit_loss_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON profit_loss_data
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_input_change();
+
+DROP TRIGGER IF EXISTS notify_debt_structure_data_change ON debt_structure_data;
+CREATE TRIGGER notify_debt_structure_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON debt_structure_data
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_input_change();
+
+DROP TRIGGER IF EXISTS notify_growth_assumptions_data_change ON growth_assumptions_data;
+CREATE TRIGGER notify_growth_assumptions_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON growth_assumptions_data
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_input_change();
+
+DROP TRIGGER IF EXISTS notify_working_capital_data_change ON working_capital_data;
+CREATE TRIGGER notify_working_capital_data_change
+    AFTER INSERT OR UPDATE OR DELETE ON working_capital_data
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_input_change();
@@ -0,0 +1,18 @@
+-- Migration: Coalesce calculation job requests
+-- Requests for the same project and stages are folded into one job: while a job
+-- is queued, newer requests update its options and input versions instead of
+-- adding another; a request on the inputs a running job already uses joins that
+-- job. A queued job also supersedes a running or failed job of the same project
+-- and stages, which then stops at its next stage boundary with status
+-- 'superseded' instead of running its remaining stages or retrying.
+
+ALTER TABLE calculation_jobs
+    ADD COLUMN IF NOT EXISTS input_versions JSONB, -- input table -> latest version when requested
+    ADD COLUMN IF NOT EXISTS requests INTEGER NOT NULL DEFAULT 1, -- requests answered by this job
+    ADD COLUMN IF NOT EXISTS superseded_by UUID REFERENCES calculation_jobs(id) ON DELETE SET NULL;
+
+COMMENT ON COLUMN calculation_jobs.status IS '''queued'', ''running'', ''completed'', ''superseded'', ''dead''';
+
+-- Active jobs of a project, looked up on every request and stage boundary
+CREATE INDEX IF NOT EXISTS idx_calculation_jobs_project_active
+    ON calculation_jobs(project_id, status) WHERE status IN ('queued', 'running');
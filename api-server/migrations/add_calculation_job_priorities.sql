@@ -0,0 +1,45 @@
+-- Migration: Priority classes for calculation jobs
+-- Jobs are 'interactive' (a user pressed Calculate), 'scheduled' (recurring
+-- recalculations) or 'bulk' (portfolio-wide batches). Workers share their claims
+-- between the classes by weight (scripts/calculation_worker.py), and a bulk job
+-- yields its worker at the next stage boundary when interactive jobs are waiting;
+-- it is re-queued with its completed stages kept and counted in preemptions.
+
+ALTER TABLE calculation_jobs
+    ADD COLUMN IF NOT EXISTS priority_class VARCHAR(20) NOT NULL DEFAULT 'interactive'
+        CHECK (priority_class IN ('interactive', 'scheduled', 'bulk')),
+    ADD COLUMN IF NOT EXISTS preemptions INTEGER NOT NULL DEFAULT 0;
+
+-- Claim order within a class
+CREATE INDEX IF NOT EXISTS idx_calculation_jobs_queued_class
+    ON calculation_jobs(priority_class, run_after, created_at) WHERE status = 'queued';
+
+-- Queue depth of every class now, and waits and latencies of the last hour.
+-- wait: first claim - request; latency: completion - request
+CREATE OR REPLACE VIEW calculation_job_metrics AS
+SELECT
+    c.priority_class,
+    COUNT(j.id) FILTER (WHERE j.status = 'queued' AND j.run_after <= NOW()) AS ready,
+    COUNT(j.id) FILTER (WHERE j.status = 'queued' AND j.run_after > NOW()) AS delayed,
+    COUNT(j.id) FILTER (WHERE j.status = 'running') AS running,
+    COALESCE(ROUND(EXTRACT(EPOCH FROM NOW() - MIN(j.run_after) FILTER (
+        WHERE j.status = 'queued' AND j.run_after <= NOW())) * 1000), 0)::BIGINT AS oldest_wait_ms,
+    ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM j.started_at - j.created_at) * 1000)
+        FILTER (WHERE j.started_at >= NOW() - INTERVAL '1 hour'))::BIGINT AS wait_p50_ms,
+    ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM j.started_at - j.created_at) * 1000)
+        FILTER (WHERE j.started_at >= NOW() - INTERVAL '1 hour'))::BIGINT AS wait_p95_ms,
+    ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM j.finished_at - j.created_at) * 1000)
+        FILTER (WHERE j.status = 'completed' AND j.finished_at >= NOW() - INTERVAL '1 hour'))::BIGINT AS latency_p95_ms,
+    COUNT(j.id) FILTER (WHERE j.status = 'completed' AND j.finished_at >= NOW() - INTERVAL '1 hour')
+        AS completed_last_hour,
+    COUNT(j.id) FILTER (WHERE j.status = 'dead' AND j.finished_at >= NOW() - INTERVAL '1 hour') AS dead_last_hour,
+    COALESCE(SUM(j.preemptions) FILTER (WHERE j.started_at >= NOW() - INTERVAL '1 hour'), 0)
+        AS preemptions_last_hour
+FROM (VALUES (1, 'interactive'), (2, 'scheduled'), (3, 'bulk')) AS c(rank, priority_class)
+LEFT JOIN calculation_jobs j
+    ON j.priority_class = c.priority_class
+   AND (j.status IN ('queued', 'running')
+        OR j.started_at >= NOW() - INTERVAL '1 hour'
+        OR j.finished_at >= NOW() - INTERVAL '1 hour')
+GROUP BY c.rank, c.priority_class
+ORDER BY c.rank;
@@ -0,0 +1,56 @@
+-- Migration: Calculation job queue
+-- The API enqueues calculation pipelines here instead of running them inside the
+-- request; scripts/calculation_worker.py processes claim jobs with
+-- SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers in any number of
+-- containers can share the queue. A claimed job is invisible to other workers
+-- until locked_until; a worker that dies leaves the job to be reclaimed once that
+-- passes. Failed attempts are retried with backoff until max_attempts, then the
+-- job is dead-lettered (status 'dead') with its last error kept for inspection.
+
+CREATE TABLE IF NOT EXISTS calculation_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    stages TEXT[] NOT NULL, -- calculation types run in order, e.g. 'debt_calculation', 'kpi_calculation'
+    options JSONB NOT NULL DEFAULT '{}', -- stage options, as accepted by the calculation scripts
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'completed', 'dead'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMP NOT NULL DEFAULT NOW(), -- not claimed before this (retry backoff)
+    locked_by VARCHAR(255), -- worker holding the job
+    locked_until TIMESTAMP, -- visibility timeout of the current attempt
+    current_stage VARCHAR(50),
+    calculation_run_ids JSONB NOT NULL DEFAULT '{}', -- stage -> calculation run of its completed run
+    result JSONB, -- stage -> summary of the completed stages
+    last_error TEXT,
+    created_by UUID REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Claim order of the jobs ready to run
+CREATE INDEX IF NOT EXISTS idx_calculation_jobs_queued
+    ON calculation_jobs(run_after, created_at) WHERE status = 'queued';
+
+-- Running jobs whose visibility timeout has passed
+CREATE INDEX IF NOT EXISTS idx_calculation_jobs_running
+    ON calculation_jobs(locked_until) WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_calculation_jobs_project
+    ON calculation_jobs(project_id, created_at DESC);
+
+-- Wake idle workers as soon as a job is queued or re-queued
+CREATE OR REPLACE FUNCTION notify_calculation_job_queued()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.status = 'queued' THEN
+        PERFORM pg_notify('calculation_jobs_queued', NEW.id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_calculation_job_queued ON calculation_jobs;
+CREATE TRIGGER notify_calculation_job_queued
+    AFTER INSERT OR UPDATE OF status ON calculation_jobs
+    FOR EACH ROW EXECUTE FUNCTION notify_calculation_job_queued();
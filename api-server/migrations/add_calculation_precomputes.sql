@@ -0,0 +1,25 @@
+-- Migration: Speculative precomputes of the calculation pipeline
+-- With SPECULATIVE_PRECOMPUTE enabled, an autosave of a calculation input queues
+-- a bulk 'precompute' job; the worker runs the dry-run pipeline on the saved
+-- inputs and keeps its result here, keyed by a hash of the inputs and the
+-- options that change the result (scripts/speculative_precompute.py). A dry run
+-- of the saved inputs is then served from it, and a pipeline job on the same
+-- inputs persists its rows instead of recalculating (promotion).
+
+CREATE TABLE IF NOT EXISTS calculation_precomputes (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    input_hash VARCHAR(64) NOT NULL, -- sha256 of the latest input rows and options
+    options JSONB NOT NULL DEFAULT '{}',
+    result JSONB NOT NULL, -- dry-run result with its columnar tables
+    execution_time_ms INTEGER,
+    job_id UUID REFERENCES calculation_jobs(id) ON DELETE SET NULL,
+    hits INTEGER NOT NULL DEFAULT 0, -- requests served or promoted from it
+    promoted_job_id UUID REFERENCES calculation_jobs(id) ON DELETE SET NULL,
+    promoted_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (project_id, input_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_calculation_precomputes_project
+    ON calculation_precomputes(project_id, created_at DESC);
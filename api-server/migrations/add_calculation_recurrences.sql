@@ -0,0 +1,37 @@
+-- Migration: Recurring recalculations
+-- scripts/calculation_scheduler.py runs every enabled recurrence whose
+-- next_run_at has passed: its project (or every project with a balance sheet when
+-- project_id is NULL) is recalculated through the given stages in batches, then
+-- next_run_at moves on by whole repeat_every steps past the current time. A
+-- recurrence is leased to one scheduler at a time through locked_by/locked_until.
+--
+-- Example: refresh every project at 02:00 each night and apply run retention
+--   INSERT INTO calculation_recurrences (name, stages, next_run_at)
+--   VALUES ('Nightly refresh',
+--           ARRAY['debt_calculation', 'depreciation_schedule', 'monthly_consolidated',
+--                 'quarterly_consolidated', 'yearly_consolidated', 'kpi_calculation', 'retention'],
+--           date_trunc('day', NOW()) + INTERVAL '1 day 2 hours');
+
+CREATE TABLE IF NOT EXISTS calculation_recurrences (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    name VARCHAR(255) NOT NULL,
+    project_id UUID REFERENCES projects(id) ON DELETE CASCADE, -- NULL: every project
+    stages TEXT[] NOT NULL CHECK (stages <@ ARRAY[
+        'debt_calculation', 'depreciation_schedule', 'monthly_consolidated', 'quarterly_consolidated',
+        'yearly_consolidated', 'kpi_calculation', 'retention'
+    ]::TEXT[] AND cardinality(stages) > 0),
+    options JSONB NOT NULL DEFAULT '{}', -- as for calculation jobs, without sculpted repayment or asset classes
+    repeat_every INTERVAL NOT NULL DEFAULT INTERVAL '1 day' CHECK (repeat_every > INTERVAL '0'),
+    next_run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    locked_by VARCHAR(255), -- scheduler running it
+    locked_until TIMESTAMP, -- lease, extended after every batch
+    last_run_at TIMESTAMP,
+    last_status VARCHAR(20), -- 'completed', 'partial', 'failed'
+    last_result JSONB, -- project counts, batches, throughput and failures of the last run
+    created_by UUID REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_calculation_recurrences_due
+    ON calculation_recurrences(next_run_at) WHERE enabled;
@@ -0,0 +1,114 @@
+-- Migration: Array-column storage for calculation run schedules
+-- One row per run and schedule instead of one row per period. Numeric columns are
+-- stored as a 2-D float8 array (one inner array per column), text columns such as
+-- month_name as a 2-D text array. Written by scripts/run_storage.py when
+-- CALCULATION_RUN_STORAGE=arrays (or --storage arrays).
+
+CREATE TABLE IF NOT EXISTS calculation_run_series (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+    calculation_run_id UUID REFERENCES calculation_runs(id) ON DELETE CASCADE,
+    schedule VARCHAR(50) NOT NULL, -- Row table the series stands in for, e.g. 'monthly_consolidated'
+    row_count INTEGER NOT NULL,
+    columns TEXT[] NOT NULL,
+    data FLOAT8[] NOT NULL, -- data[column][row]
+    text_columns TEXT[],
+    text_data TEXT[], -- text_data[column][row]
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (calculation_run_id, schedule)
+);
+
+CREATE INDEX IF NOT EXISTS idx_calculation_run_series_project
+    ON calculation_run_series(project_id, schedule, created_at DESC);
+
+-- Expand one series row into one jsonb object per period, including project_id and calculation_run_id
+CREATE OR REPLACE FUNCTION calculation_run_series_rows(series calculation_run_series)
+RETURNS SETOF JSONB AS $$
+    SELECT jsonb_build_object('project_id', series.project_id, 'calculation_run_id', series.calculation_run_id)
+           || COALESCE((
+               SELECT jsonb_object_agg(series.columns[c], series.data[c][r])
+               FROM generate_subscripts(series.columns, 1) AS c
+           ), '{}'::jsonb)
+           || COALESCE((
+               SELECT jsonb_object_agg(series.text_columns[c], series.text_data[c][r])
+               FROM generate_subscripts(series.text_columns, 1) AS c
+           ), '{}'::jsonb)
+    FROM generate_series(1, series.row_count) AS r
+    ORDER BY r
+$$ LANGUAGE sql STABLE;
+
+-- The run's series, or with no run id the project's latest series unless the row
+-- table holds a newer run (projects may switch storage modes)
+CREATE OR REPLACE FUNCTION latest_calculation_run_series(p_schedule TEXT, p_project_id UUID,
+                                                         p_calculation_run_id UUID DEFAULT NULL)
+RETURNS SETOF calculation_run_series AS $$
+BEGIN
+    IF p_calculation_run_id IS NOT NULL THEN
+        RETURN QUERY
+            SELECT * FROM calculation_run_series s
+            WHERE s.schedule = p_schedule AND s.project_id = p_project_id
+              AND s.calculation_run_id = p_calculation_run_id;
+        RETURN;
+    END IF;
+
+    RETURN QUERY EXECUTE format('
+        SELECT s.* FROM calculation_run_series s
+        WHERE s.schedule = $1 AND s.project_id = $2
+          AND NOT EXISTS (SELECT 1 FROM %I t WHERE t.project_id = s.project_id AND t.created_at > s.created_at)
+        ORDER BY s.created_at DESC
+        LIMIT 1', p_schedule)
+    USING p_schedule, p_project_id;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Row-shaped accessor for one run as a jsonb array, for jsonb_populate_recordset:
+--   SELECT * FROM jsonb_populate_recordset(NULL::monthly_consolidated,
+--       calculation_run_series_records('monthly_consolidated', project_id, calculation_run_id))
+CREATE OR REPLACE FUNCTION calculation_run_series_records(p_schedule TEXT, p_project_id UUID,
+                                                          p_calculation_run_id UUID DEFAULT NULL)
+RETURNS JSONB AS $$
+    SELECT jsonb_agg(rows.value || jsonb_build_object('created_at', s.created_at) ORDER BY rows.n)
+    FROM latest_calculation_run_series(p_schedule, p_project_id, p_calculation_run_id) s,
+         LATERAL calculation_run_series_rows(s) WITH ORDINALITY AS rows(value, n)
+$$ LANGUAGE sql STABLE;
+
+-- Row-shaped views of every stored run, with the same columns as the tables they stand in for
+CREATE OR REPLACE VIEW monthly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::monthly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'monthly_consolidated';
+
+CREATE OR REPLACE VIEW quarterly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::quarterly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'quarterly_consolidated';
+
+CREATE OR REPLACE VIEW yearly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::yearly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'yearly_consolidated';
+
+CREATE OR REPLACE VIEW debt_calculations_series AS
+SELECT (jsonb_populate_record(NULL::debt_calculations, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'debt_calculations';
+
+CREATE OR REPLACE VIEW depreciation_schedule_series AS
+SELECT (jsonb_populate_record(NULL::depreciation_schedule, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'depreciation_schedule';
+
+CREATE OR REPLACE VIEW monthly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::monthly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'monthly_kpis';
+
+CREATE OR REPLACE VIEW quarterly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::quarterly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'quarterly_kpis';
+
+CREATE OR REPLACE VIEW yearly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::yearly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'yearly_kpis';
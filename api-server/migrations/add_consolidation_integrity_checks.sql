@@ -0,0 +1,22 @@
+-- Migration: Store balance sheet / cash flow integrity check summaries per calculation run
+
+CREATE TABLE IF NOT EXISTS consolidation_integrity_checks (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+    calculation_run_id UUID REFERENCES calculation_runs(id) ON DELETE CASCADE,
+    months_checked INTEGER NOT NULL,
+    balance_mismatches INTEGER NOT NULL, -- Months where total assets != total equity and liabilities
+    cash_mismatches INTEGER NOT NULL, -- Months where net cash flow != change in cash
+    max_balance_difference DECIMAL(15,2),
+    max_cash_difference DECIMAL(15,2),
+    first_balance_mismatch_month INTEGER,
+    first_cash_mismatch_month INTEGER,
+    tolerance DECIMAL(15,4),
+    passed BOOLEAN NOT NULL,
+    checked_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_consolidation_integrity_checks_project
+    ON consolidation_integrity_checks(project_id, checked_at DESC);
+CREATE INDEX IF NOT EXISTS idx_consolidation_integrity_checks_run
+    ON consolidation_integrity_checks(calculation_run_id);
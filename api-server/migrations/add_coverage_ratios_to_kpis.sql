@@ -0,0 +1,16 @@
+-- Migration: Store CFADS and the loan/project life coverage ratios at every KPI level
+
+ALTER TABLE monthly_kpis
+ADD COLUMN IF NOT EXISTS cfads DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS llcr DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS plcr DECIMAL(15,4);
+
+ALTER TABLE quarterly_kpis
+ADD COLUMN IF NOT EXISTS cfads DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS llcr DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS plcr DECIMAL(15,4);
+
+ALTER TABLE yearly_kpis
+ADD COLUMN IF NOT EXISTS cfads DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS llcr DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS plcr DECIMAL(15,4);
@@ -0,0 +1,23 @@
+-- Migration: Add per-class depreciation schedules
+-- depreciation_schedule keeps the total; this table holds one schedule per asset class
+
+CREATE TABLE IF NOT EXISTS depreciation_class_schedule (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
+    calculation_run_id UUID REFERENCES calculation_runs(id) ON DELETE CASCADE,
+    asset_class VARCHAR(100) NOT NULL,
+    depreciation_method VARCHAR(50) NOT NULL, -- 'straight_line', 'declining_balance', 'sum_of_years'
+    useful_life_years DECIMAL(6,2) NOT NULL,
+    share DECIMAL(7,6) NOT NULL, -- Share of opening PPE and capex allocated to the class
+    month INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    opening_balance DECIMAL(15,2),
+    capex_addition DECIMAL(15,2),
+    monthly_depreciation DECIMAL(15,2),
+    accumulated_depreciation DECIMAL(15,2),
+    net_book_value DECIMAL(15,2),
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_depreciation_class_schedule_project
+    ON depreciation_class_schedule(project_id, asset_class, month);
@@ -0,0 +1,14 @@
+-- Migration: Store last-twelve-month (LTM) variants of the flow-based monthly KPIs
+
+ALTER TABLE monthly_kpis
+ADD COLUMN IF NOT EXISTS ebitda_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS debt_service_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS interest_expense_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS debt_to_ebitda_ltm DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS debt_service_coverage_ratio_ltm DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS interest_coverage_ratio_ltm DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS operating_margin_ltm DECIMAL(15,4),
+ADD COLUMN IF NOT EXISTS fcff_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS fcfe_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS ar_cycle_days_ltm DECIMAL(15,2),
+ADD COLUMN IF NOT EXISTS inventory_cycle_days_ltm DECIMAL(15,2);
@@ -0,0 +1,5 @@
+-- Migration: Store tax loss carry-forward and deferred tax in the monthly consolidation
+
+ALTER TABLE monthly_consolidated
+ADD COLUMN IF NOT EXISTS tax_loss_carryforward DECIMAL(15,2) DEFAULT 0,
+ADD COLUMN IF NOT EXISTS deferred_tax_asset DECIMAL(15,2) DEFAULT 0;
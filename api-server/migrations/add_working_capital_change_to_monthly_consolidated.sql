@@ -0,0 +1,5 @@
+-- Migration: Store the cash-flow effect of working capital in the monthly consolidation
+-- Negative when working capital builds up; already included in net_cash_operating
+
+ALTER TABLE monthly_consolidated
+ADD COLUMN IF NOT EXISTS change_in_working_capital DECIMAL(15,2) DEFAULT 0;
@@ -0,0 +1,162 @@
+-- Migration: Hash-partition the calculation output tables by project and add
+-- composite indexes matching the script and API queries
+-- (scripts/benchmark_query_plans.py reports the plans of those queries)
+
+-- Latest input version per project: WHERE project_id = ? ORDER BY version DESC LIMIT 1
+CREATE INDEX IF NOT EXISTS idx_balance_sheet_data_project_version ON balance_sheet_data(project_id, version DESC);
+CREATE INDEX IF NOT EXISTS idx_profit_loss_data_project_version ON profit_loss_data(project_id, version DESC);
+CREATE INDEX IF NOT EXISTS idx_debt_structure_data_project_version ON debt_structure_data(project_id, version DESC);
+CREATE INDEX IF NOT EXISTS idx_growth_assumptions_data_project_version ON growth_assumptions_data(project_id, version DESC);
+CREATE INDEX IF NOT EXISTS idx_working_capital_data_project_version ON working_capital_data(project_id, version DESC);
+
+-- Rebuild a table as PARTITION BY HASH (project_id) with p_partitions partitions,
+-- keeping its columns, defaults, foreign keys, triggers and rows. The primary key
+-- becomes (id, project_id) since it has to contain the partition key. Does nothing
+-- for a table that is already partitioned.
+CREATE OR REPLACE FUNCTION partition_calculation_table(p_table TEXT, p_partitions INTEGER DEFAULT 16)
+RETURNS VOID AS $$
+DECLARE
+    legacy TEXT := p_table || '_unpartitioned';
+    definition RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = p_table::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', p_table, legacy);
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT IF EXISTS %I', legacy, p_table || '_pkey');
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY HASH (project_id)', p_table, legacy);
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN project_id SET NOT NULL', p_table);
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (id, project_id)', p_table, p_table || '_pkey');
+
+    FOR i IN 0 .. p_partitions - 1 LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                       p_table || '_p' || i, p_table, p_partitions, i);
+    END LOOP;
+
+    FOR definition IN
+        SELECT conname, pg_get_constraintdef(oid) AS def
+        FROM pg_constraint
+        WHERE conrelid = legacy::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', p_table, definition.conname, definition.def);
+    END LOOP;
+
+    FOR definition IN
+        SELECT pg_get_triggerdef(oid) AS def
+        FROM pg_trigger
+        WHERE tgrelid = legacy::regclass AND NOT tgisinternal
+    LOOP
+        EXECUTE regexp_replace(definition.def, ' ON \S+ ', format(' ON %I ', p_table));
+    END LOOP;
+
+    -- Rows without a project cannot be placed in a partition and are never read
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I WHERE project_id IS NOT NULL', p_table, legacy);
+    EXECUTE format('DROP TABLE %I', legacy);
+END;
+$$ LANGUAGE plpgsql;
+
+-- The row-shaped series views depend on the table row types; rebuild them afterwards
+DROP VIEW IF EXISTS monthly_consolidated_series, quarterly_consolidated_series, yearly_consolidated_series,
+    debt_calculations_series, depreciation_schedule_series,
+    monthly_kpis_series, quarterly_kpis_series, yearly_kpis_series;
+
+SELECT partition_calculation_table('monthly_consolidated');
+SELECT partition_calculation_table('quarterly_consolidated');
+SELECT partition_calculation_table('yearly_consolidated');
+SELECT partition_calculation_table('monthly_kpis');
+SELECT partition_calculation_table('quarterly_kpis');
+SELECT partition_calculation_table('yearly_kpis');
+SELECT partition_calculation_table('debt_calculations');
+SELECT partition_calculation_table('depreciation_schedule');
+
+-- One run in period order: WHERE project_id = ? AND calculation_run_id = ? ORDER BY <period>
+-- Latest run per project: WHERE project_id = ? ORDER BY created_at DESC LIMIT 1, DISTINCT ON (project_id)
+CREATE INDEX IF NOT EXISTS idx_monthly_consolidated_project_run
+    ON monthly_consolidated(project_id, calculation_run_id, year, month);
+CREATE INDEX IF NOT EXISTS idx_monthly_consolidated_project_created
+    ON monthly_consolidated(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+CREATE INDEX IF NOT EXISTS idx_quarterly_consolidated_project_run
+    ON quarterly_consolidated(project_id, calculation_run_id, year, quarter);
+CREATE INDEX IF NOT EXISTS idx_quarterly_consolidated_project_created
+    ON quarterly_consolidated(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+CREATE INDEX IF NOT EXISTS idx_yearly_consolidated_project_run
+    ON yearly_consolidated(project_id, calculation_run_id, year);
+CREATE INDEX IF NOT EXISTS idx_yearly_consolidated_project_created
+    ON yearly_consolidated(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+CREATE INDEX IF NOT EXISTS idx_monthly_kpis_project_run
+    ON monthly_kpis(project_id, calculation_run_id, year, month);
+CREATE INDEX IF NOT EXISTS idx_monthly_kpis_project_created
+    ON monthly_kpis(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+CREATE INDEX IF NOT EXISTS idx_quarterly_kpis_project_run
+    ON quarterly_kpis(project_id, calculation_run_id, year, quarter);
+CREATE INDEX IF NOT EXISTS idx_quarterly_kpis_project_created
+    ON quarterly_kpis(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+CREATE INDEX IF NOT EXISTS idx_yearly_kpis_project_run
+    ON yearly_kpis(project_id, calculation_run_id, year);
+CREATE INDEX IF NOT EXISTS idx_yearly_kpis_project_created
+    ON yearly_kpis(project_id, created_at DESC) INCLUDE (calculation_run_id);
+
+-- Debt and depreciation keep one run per project: WHERE project_id = ? ORDER BY month
+CREATE INDEX IF NOT EXISTS idx_debt_calculations_project_month
+    ON debt_calculations(project_id, month);
+CREATE INDEX IF NOT EXISTS idx_debt_calculations_project_created
+    ON debt_calculations(project_id, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_depreciation_schedule_project_month
+    ON depreciation_schedule(project_id, month);
+CREATE INDEX IF NOT EXISTS idx_depreciation_schedule_project_created
+    ON depreciation_schedule(project_id, created_at DESC);
+
+-- Runs deleted through calculation_runs cascade by run id
+CREATE INDEX IF NOT EXISTS idx_monthly_consolidated_calculation_run_id ON monthly_consolidated(calculation_run_id);
+CREATE INDEX IF NOT EXISTS idx_quarterly_consolidated_calculation_run_id ON quarterly_consolidated(calculation_run_id);
+CREATE INDEX IF NOT EXISTS idx_yearly_consolidated_calculation_run_id ON yearly_consolidated(calculation_run_id);
+CREATE INDEX IF NOT EXISTS idx_monthly_kpis_calculation_run_id ON monthly_kpis(calculation_run_id);
+CREATE INDEX IF NOT EXISTS idx_quarterly_kpis_calculation_run_id ON quarterly_kpis(calculation_run_id);
+CREATE INDEX IF NOT EXISTS idx_yearly_kpis_calculation_run_id ON yearly_kpis(calculation_run_id);
+
+CREATE OR REPLACE VIEW monthly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::monthly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'monthly_consolidated';
+
+CREATE OR REPLACE VIEW quarterly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::quarterly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'quarterly_consolidated';
+
+CREATE OR REPLACE VIEW yearly_consolidated_series AS
+SELECT (jsonb_populate_record(NULL::yearly_consolidated, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'yearly_consolidated';
+
+CREATE OR REPLACE VIEW debt_calculations_series AS
+SELECT (jsonb_populate_record(NULL::debt_calculations, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'debt_calculations';
+
+CREATE OR REPLACE VIEW depreciation_schedule_series AS
+SELECT (jsonb_populate_record(NULL::depreciation_schedule, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'depreciation_schedule';
+
+CREATE OR REPLACE VIEW monthly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::monthly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'monthly_kpis';
+
+CREATE OR REPLACE VIEW quarterly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::quarterly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'quarterly_kpis';
+
+CREATE OR REPLACE VIEW yearly_kpis_series AS
+SELECT (jsonb_populate_record(NULL::yearly_kpis, rows.value || jsonb_build_object('created_at', s.created_at))).*
+FROM calculation_run_series s, LATERAL calculation_run_series_rows(s) AS rows(value)
+WHERE s.schedule = 'yearly_kpis';
@@ -0,0 +1,183 @@
+const DatabaseService = require('../services/database');
+
+const INPUT_TABLES = [
+    'balance_sheet_data',
+    'profit_loss_data',
+    'debt_structure_data',
+    'growth_assumptions_data',
+    'working_capital_data'
+];
+
+// Latest version of every input table of the project
+const INPUT_VERSIONS_QUERY = `SELECT jsonb_build_object(${INPUT_TABLES.map(
+    (table) => `'${table}', (SELECT MAX(version) FROM ${table} WHERE project_id = $1)`
+).join(', ')}) AS input_versions`;
+
+// Highest priority first (migrations/add_calculation_job_priorities.sql)
+const PRIORITY_CLASSES = ['interactive', 'scheduled', 'bulk'];
+
+// First key of pg_advisory_xact_lock(int, int) for enqueueing; calculations use 4701
+const ENQUEUE_LOCK_NAMESPACE = 4702;
+
+// Jobs of the calculation queue (migrations/add_calculation_jobs.sql). The API only
+// enqueues and reads them; scripts/calculation_worker.py claims and runs them.
+class CalculationJobRepository {
+    constructor() {
+        this.db = DatabaseService;
+    }
+
+    // Queue a job, coalesced with the project's active jobs of the same stages: a
+    // running job on the same inputs and options answers the request, a queued job
+    // takes over the newer options and input versions, otherwise a job is added.
+    // Returns the job and whether it was coalesced.
+    async enqueueJob(data) {
+        const client = await this.db.getClient();
+        try {
+            await client.query('BEGIN');
+            // Serialise requests for the project until commit
+            await client.query('SELECT pg_advisory_xact_lock($1, hashtext($2))', [ENQUEUE_LOCK_NAMESPACE, data.project_id]);
+
+            const versionsResult = await client.query(INPUT_VERSIONS_QUERY, [data.project_id]);
+            const inputVersions = versionsResult.rows[0].input_versions;
+            const options = data.options || {};
+
+            const running = await client.query(`
+                UPDATE calculation_jobs SET requests = requests + 1
+                WHERE id = (
+                    SELECT id FROM calculation_jobs
+                    WHERE project_id = $1 AND status = 'running' AND stages = $2
+                      AND options = $3 AND input_versions = $4
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )
+                RETURNING *
+            `, [data.project_id, data.stages, options, inputVersions]);
+
+            // A queued job keeps the higher of its own and the request's priority. Stages it
+            // completed before a retry or preemption are dropped when the options or inputs
+            // changed, so every stage of the job runs on the same ones.
+            const queued = running.rows.length > 0 ? running : await client.query(`
+                UPDATE calculation_jobs
+                SET calculation_run_ids = CASE
+                        WHEN options IS DISTINCT FROM $3::jsonb OR input_versions IS DISTINCT FROM $4::jsonb
+                        THEN '{}'::jsonb ELSE calculation_run_ids END,
+                    result = CASE
+                        WHEN options IS DISTINCT FROM $3::jsonb OR input_versions IS DISTINCT FROM $4::jsonb
+                        THEN NULL ELSE result END,
+                    options = $3, input_versions = $4, max_attempts = $5, requests = requests + 1,
+                    priority_class = CASE
+                        WHEN array_position($6::text[], $7::text) < array_position($6::text[], priority_class)
+                        THEN $7 ELSE priority_class END
+                WHERE id = (
+                    SELECT id FROM calculation_jobs
+                    WHERE project_id = $1 AND status = 'queued' AND stages = $2
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )
+                RETURNING *
+            `, [data.project_id, data.stages, options, inputVersions, data.max_attempts || 3,
+                PRIORITY_CLASSES, data.priority_class]);
+
+            let job = queued.rows[0];
+            const coalesced = Boolean(job);
+            if (!job) {
+                const inserted = await client.query(`
+                    INSERT INTO calculation_jobs (project_id, stages, options, input_versions, max_attempts, created_by,
+                                                  priority_class)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    RETURNING *
+                `, [data.project_id, data.stages, options, inputVersions, data.max_attempts || 3, data.created_by || null,
+                    data.priority_class]);
+                job = inserted.rows[0];
+            }
+
+            await client.query('COMMIT');
+            return { job, coalesced };
+        } catch (error) {
+            await client.query('ROLLBACK');
+            console.error('Error enqueueing calculation job:', error);
+            throw error;
+        } finally {
+            client.release();
+        }
+    }
+
+    // The job that answers a request, following superseded jobs to their successor
+    async getLatestJob(projectId, jobId) {
+        try {
+            const query = `
+                WITH RECURSIVE chain AS (
+                    SELECT *, 0 AS depth FROM calculation_jobs WHERE id = $1 AND project_id = $2
+                    UNION ALL
+                    SELECT j.*, c.depth + 1 FROM calculation_jobs j
+                    JOIN chain c ON j.id = c.superseded_by
+                    WHERE c.depth < 100
+                )
+                SELECT * FROM chain ORDER BY depth DESC LIMIT 1
+            `;
+            const result = await this.db.query(query, [jobId, projectId]);
+            return result.rows[0];
+        } catch (error) {
+            console.error('Error getting latest calculation job:', error);
+            throw error;
+        }
+    }
+
+    // Options of the project's latest calculation request, for precomputing what it would ask for next
+    async getLatestJobOptions(projectId, excludeStages) {
+        try {
+            const query = `
+                SELECT options FROM calculation_jobs
+                WHERE project_id = $1 AND stages <> $2
+                ORDER BY created_at DESC
+                LIMIT 1
+            `;
+            const result = await this.db.query(query, [projectId, excludeStages]);
+            return result.rows[0] ? result.rows[0].options : {};
+        } catch (error) {
+            console.error('Error getting latest calculation job options:', error);
+            throw error;
+        }
+    }
+
+    // Queue depth, waits and latencies per priority class
+    async getQueueMetrics() {
+        try {
+            const result = await this.db.query(`SELECT * FROM calculation_job_metrics`);
+            return result.rows;
+        } catch (error) {
+            console.error('Error getting calculation job metrics:', error);
+            throw error;
+        }
+    }
+
+    async getJob(projectId, jobId) {
+        try {
+            const query = `SELECT * FROM calculation_jobs WHERE id = $1 AND project_id = $2`;
+            const result = await this.db.query(query, [jobId, projectId]);
+            return result.rows[0];
+        } catch (error) {
+            console.error('Error getting calculation job:', error);
+            throw error;
+        }
+    }
+
+    async getProjectJobs(projectId, limit = 20) {
+        try {
+            const query = `
+                SELECT * FROM calculation_jobs
+                WHERE project_id = $1
+                ORDER BY created_at DESC
+                LIMIT $2
+            `;
+            const result = await this.db.query(query, [projectId, limit]);
+            return result.rows;
+        } catch (error) {
+            console.error('Error getting calculation jobs:', error);
+            throw error;
+        }
+    }
+}
+
+module.exports = new CalculationJobRepository();
+module.exports.PRIORITY_CLASSES = PRIORITY_CLASSES;
@@ -1,4 +1,5 @@
 const DatabaseService = require('../services/database');
+const runSeriesRepository = require('./runSeriesRepository');
 
 class ConsolidatedRepository {
     constructor() {
@@ -8,6 +9,11 @@ class ConsolidatedRepository {
     // Monthly Consolidated Methods
     async getMonthlyConsolidatedByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('monthly_consolidated', projectId, calculationRunId, 'month, year');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query = `
                 SELECT * FROM monthly_consolidated 
                 WHERE project_id = $1
@@ -19,7 +25,14 @@ class ConsolidatedRepository {
                 params.push(calculationRunId);
                 query += ` ORDER BY month, year`;
             } else {
-                query += ` ORDER BY calculation_run_id DESC, month, year`;
+                // Latest run only; older runs are read by id
+                query += ` AND calculation_run_id = (
+                    SELECT calculation_run_id FROM monthly_consolidated
+                    WHERE project_id = $1
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )`;
+                query += ` ORDER BY month, year`;
             }
 
             const result = await this.db.query(query, params);
@@ -95,6 +108,11 @@ class ConsolidatedRepository {
     // Quarterly Consolidated Methods
     async getQuarterlyConsolidatedByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('quarterly_consolidated', projectId, calculationRunId, 'year, quarter');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query = `
                 SELECT * FROM quarterly_consolidated 
                 WHERE project_id = $1
@@ -106,7 +124,14 @@ class ConsolidatedRepository {
                 params.push(calculationRunId);
                 query += ` ORDER BY year, quarter`;
             } else {
-                query += ` ORDER BY calculation_run_id DESC, year, quarter`;
+                // Latest run only; older runs are read by id
+                query += ` AND calculation_run_id = (
+                    SELECT calculation_run_id FROM quarterly_consolidated
+                    WHERE project_id = $1
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )`;
+                query += ` ORDER BY year, quarter`;
             }
 
             const result = await this.db.query(query, params);
@@ -182,6 +207,11 @@ class ConsolidatedRepository {
     // Yearly Consolidated Methods
     async getYearlyConsolidatedByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('yearly_consolidated', projectId, calculationRunId, 'year');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query = `
                 SELECT * FROM yearly_consolidated 
                 WHERE project_id = $1
@@ -193,7 +223,14 @@ class ConsolidatedRepository {
                 params.push(calculationRunId);
                 query += ` ORDER BY year`;
             } else {
-                query += ` ORDER BY calculation_run_id DESC, year`;
+                // Latest run only; older runs are read by id
+                query += ` AND calculation_run_id = (
+                    SELECT calculation_run_id FROM yearly_consolidated
+                    WHERE project_id = $1
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                )`;
+                query += ` ORDER BY year`;
             }
 
             const result = await this.db.query(query, params);
@@ -319,6 +356,11 @@ class ConsolidatedRepository {
     // Additional methods for validation
     async getDebtCalculationsByProjectId(projectId) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('debt_calculations', projectId, null, 'month');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             const query = `SELECT * FROM debt_calculations WHERE project_id = $1 ORDER BY month`;
             const result = await this.db.query(query, [projectId]);
             return result.rows;
@@ -330,6 +372,11 @@ class ConsolidatedRepository {
 
     async getDepreciationScheduleByProjectId(projectId) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('depreciation_schedule', projectId, null, 'month');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             const query = `SELECT * FROM depreciation_schedule WHERE project_id = $1 ORDER BY month`;
             const result = await this.db.query(query, [projectId]);
             return result.rows;
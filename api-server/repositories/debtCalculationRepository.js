@@ -1,4 +1,5 @@
 const DatabaseService = require('../services/database');
+const runSeriesRepository = require('./runSeriesRepository');
 
 class DebtCalculationRepository {
   constructor() {
@@ -7,6 +8,11 @@ class DebtCalculationRepository {
 
   async getByProjectId(projectId) {
     try {
+      const seriesRows = await runSeriesRepository.getRows('debt_calculations', projectId, null, 'year, month');
+      if (seriesRows) {
+        return seriesRows;
+      }
+
       const query = `
         SELECT 
           id, project_id, month, year, opening_balance, payment, 
@@ -1,4 +1,5 @@
 const Database = require('../services/database');
+const runSeriesRepository = require('./runSeriesRepository');
 
 class DepreciationScheduleRepository {
   constructor() {
@@ -7,6 +8,11 @@ class DepreciationScheduleRepository {
 
   async getByProjectId(projectId) {
     try {
+      const seriesRows = await runSeriesRepository.getRows('depreciation_schedule', projectId, null, 'month');
+      if (seriesRows) {
+        return seriesRows;
+      }
+
       const query = `
         SELECT 
           id, project_id, month, year, asset_value, depreciation_method, 
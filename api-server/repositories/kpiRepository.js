@@ -1,4 +1,5 @@
 const DatabaseService = require('../services/database');
+const runSeriesRepository = require('./runSeriesRepository');
 
 class KpiRepository {
     constructor() {
@@ -8,6 +9,11 @@ class KpiRepository {
     // Monthly KPIs
     async getMonthlyKpisByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('monthly_kpis', projectId, calculationRunId, 'year, month');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query, params;
             
             if (calculationRunId) {
@@ -24,7 +30,7 @@ class KpiRepository {
                         SELECT calculation_run_id 
                         FROM monthly_kpis 
                         WHERE project_id = $1 
-                        ORDER BY calculation_run_id DESC 
+                        ORDER BY created_at DESC 
                         LIMIT 1
                     ) latest ON mk.calculation_run_id = latest.calculation_run_id
                     WHERE mk.project_id = $1 
@@ -63,6 +69,11 @@ class KpiRepository {
     // Quarterly KPIs
     async getQuarterlyKpisByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('quarterly_kpis', projectId, calculationRunId, 'year, quarter');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query, params;
             
             if (calculationRunId) {
@@ -79,7 +90,7 @@ class KpiRepository {
                         SELECT calculation_run_id 
                         FROM quarterly_kpis 
                         WHERE project_id = $1 
-                        ORDER BY calculation_run_id DESC 
+                        ORDER BY created_at DESC 
                         LIMIT 1
                     ) latest ON qk.calculation_run_id = latest.calculation_run_id
                     WHERE qk.project_id = $1 
@@ -118,6 +129,11 @@ class KpiRepository {
     // Yearly KPIs
     async getYearlyKpisByProjectId(projectId, calculationRunId = null) {
         try {
+            const seriesRows = await runSeriesRepository.getRows('yearly_kpis', projectId, calculationRunId, 'year');
+            if (seriesRows) {
+                return seriesRows;
+            }
+
             let query, params;
             
             if (calculationRunId) {
@@ -134,7 +150,7 @@ class KpiRepository {
                         SELECT calculation_run_id 
                         FROM yearly_kpis 
                         WHERE project_id = $1 
-                        ORDER BY calculation_run_id DESC 
+                        ORDER BY created_at DESC 
                         LIMIT 1
                     ) latest ON yk.calculation_run_id = latest.calculation_run_id
                     WHERE yk.project_id = $1 
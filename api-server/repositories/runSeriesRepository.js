@@ -0,0 +1,25 @@
+const DatabaseService = require('../services/database');
+
+// Row-shaped reads of runs kept in array storage (calculation_run_series, written by
+// scripts/run_storage.py). Each run is one row there; calculation_run_series_records()
+// expands it into the columns of the table it stands in for.
+class RunSeriesRepository {
+    constructor() {
+        this.db = DatabaseService;
+    }
+
+    // Rows of the run (the project's latest run when no id is given), or null when
+    // the run is stored in the row table
+    async getRows(table, projectId, calculationRunId = null, orderBy = 'month') {
+        const query = `
+            SELECT * FROM jsonb_populate_recordset(
+                NULL::${table}, calculation_run_series_records($1, $2, $3)
+            )
+            ORDER BY ${orderBy}
+        `;
+        const result = await this.db.query(query, [table, projectId, calculationRunId]);
+        return result.rows.length > 0 ? result.rows : null;
+    }
+}
+
+module.exports = new RunSeriesRepository();
@@ -83,6 +83,16 @@ router.post('/:projectId/yearly/calculate', projectOwnershipMiddleware, consolid
 router.get('/:projectId/yearly/data', projectOwnershipMiddleware, consolidatedController.getYearlyConsolidated);
 router.get('/:projectId/yearly/history', projectOwnershipMiddleware, consolidatedController.getYearlyCalculationHistory);
 
+// Dry run: full pipeline on the posted inputs, nothing persisted; with saved_inputs, on the
+// project's saved inputs, served from their precompute (scripts/speculative_precompute.py)
+router.post('/:projectId/dry-run', projectOwnershipMiddleware, consolidatedController.performDryRun);
+
+// Calculation jobs: queued pipelines run by scripts/calculation_worker.py
+router.get('/jobs/metrics', consolidatedController.getCalculationJobMetrics);
+router.post('/:projectId/jobs', projectOwnershipMiddleware, consolidatedController.enqueueCalculationJob);
+router.get('/:projectId/jobs', projectOwnershipMiddleware, consolidatedController.getCalculationJobs);
+router.get('/:projectId/jobs/:jobId', projectOwnershipMiddleware, consolidatedController.getCalculationJob);
+
 // Generic calculation run restoration
 router.get('/:projectId/:runId/restore', projectOwnershipMiddleware, runOwnershipMiddleware, consolidatedController.restoreCalculationRun);
 
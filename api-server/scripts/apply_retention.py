@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Calculation Run Retention
+Keeps the calculation output tables small while preserving restorable history.
+For each table and project the newest runs stay in full in the row table, older
+runs are compacted into one calculation_run_series row each (run_storage.py),
+which the scripts and the API still read by run id, and runs past the purge
+horizon are deleted from both. Work is done in short transactions of a few runs
+with a lock timeout, so calculations writing to the same tables are not blocked.
+"""
+
+import sys
+import os
+import json
+import argparse
+try:
+    import psycopg2
+    import psycopg2.errors
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+from result_protocol import add_format_argument, write_result
+from run_storage import save_run_series
+
+# Table -> order of a run's rows
+RETENTION_TABLES = {
+    'monthly_consolidated': 'year, month',
+    'quarterly_consolidated': 'year, quarter',
+    'yearly_consolidated': 'year',
+    'monthly_kpis': 'year, month',
+    'quarterly_kpis': 'year, quarter',
+    'yearly_kpis': 'year',
+}
+
+# Row columns that are not part of the schedule itself
+METADATA_COLUMNS = ('id', 'project_id', 'calculation_run_id', 'created_at', 'updated_at')
+
+
+def default_policy():
+    """
+    keep_runs: newest runs per project kept in full in the row table
+    purge_after_days: runs (rows or series) older than this are deleted; 0 keeps them forever
+    """
+    return {
+        'keep_runs': int(os.getenv('RETENTION_KEEP_RUNS', '5')),
+        'purge_after_days': int(os.getenv('RETENTION_PURGE_DAYS', '365')),
+    }
+
+
+def build_policies(keep_runs=None, purge_after_days=None, overrides=None):
+    """Policy per table: the defaults, then command-line values, then {table: {...}} overrides"""
+    base = default_policy()
+    if keep_runs is not None:
+        base['keep_runs'] = keep_runs
+    if purge_after_days is not None:
+        base['purge_after_days'] = purge_after_days
+
+    policies = {table: dict(base) for table in RETENTION_TABLES}
+    for table, values in (overrides or {}).items():
+        if table not in policies:
+            raise ValueError(f"Unknown table: {table}")
+        unknown = set(values) - set(base)
+        if unknown:
+            raise ValueError(f"Unknown policy setting for {table}: {', '.join(sorted(unknown))}")
+        policies[table].update({key: int(value) for key, value in values.items()})
+
+    for table, policy in policies.items():
+        if policy['keep_runs'] < 1:
+            raise ValueError(f"keep_runs must be at least 1 for {table}")
+    return policies
+
+
+class RunRetention:
+    def __init__(self, db_config, policies, batch_size=20, lock_timeout_ms=2000, dry_run=False):
+        self.db_config = db_config
+        self.policies = policies
+        self.batch_size = batch_size
+        self.lock_timeout_ms = lock_timeout_ms
+        self.dry_run = dry_run
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def get_expired_runs(self, cursor, table, project_ids=None):
+        """
+        Row-stored runs beyond each project's newest keep_runs, oldest first, with
+        whether they are past the purge horizon
+        """
+        policy = self.policies[table]
+        cursor.execute(f"""
+            WITH runs AS (
+                SELECT project_id, calculation_run_id, MAX(created_at) AS created_at
+                FROM {table}
+                WHERE %(all)s OR project_id::text = ANY(%(project_ids)s::text[])
+                GROUP BY project_id, calculation_run_id
+            ),
+            ranked AS (
+                SELECT runs.*, ROW_NUMBER() OVER (PARTITION BY project_id ORDER BY created_at DESC) AS position
+                FROM runs
+            )
+            SELECT project_id, calculation_run_id, created_at,
+                   %(purge_days)s > 0 AND created_at < NOW() - make_interval(days => %(purge_days)s) AS purge
+            FROM ranked
+            WHERE position > %(keep_runs)s
+            ORDER BY created_at
+        """, {'all': not project_ids, 'project_ids': list(project_ids or []),
+              'keep_runs': policy['keep_runs'], 'purge_days': policy['purge_after_days']})
+        return cursor.fetchall()
+
+    def compact_run(self, cursor, table, project_id, calculation_run_id, created_at):
+        """Move one run from the row table into a single series row"""
+        cursor.execute(f"""
+            SELECT * FROM {table}
+            WHERE project_id = %s AND calculation_run_id = %s
+            ORDER BY {RETENTION_TABLES[table]}
+        """, (project_id, calculation_run_id))
+        rows = [
+            {key: value for key, value in row.items() if key not in METADATA_COLUMNS}
+            for row in cursor.fetchall()
+        ]
+        save_run_series(cursor, table, project_id, calculation_run_id, rows, created_at=created_at)
+        self.delete_run(cursor, table, project_id, calculation_run_id)
+
+    def delete_run(self, cursor, table, project_id, calculation_run_id):
+        cursor.execute(f"DELETE FROM {table} WHERE project_id = %s AND calculation_run_id = %s",
+                       (project_id, calculation_run_id))
+
+    def purge_series(self, conn, table, project_ids=None):
+        """Delete compacted runs past the purge horizon, batch_size rows per transaction"""
+        days = self.policies[table]['purge_after_days']
+        if days <= 0:
+            return 0
+
+        params = {'schedule': table, 'days': days, 'limit': self.batch_size,
+                  'all': not project_ids, 'project_ids': list(project_ids or [])}
+        where = """
+            schedule = %(schedule)s AND created_at < NOW() - make_interval(days => %(days)s)
+            AND (%(all)s OR project_id::text = ANY(%(project_ids)s::text[]))
+        """
+        with conn.cursor() as cursor:
+            if self.dry_run:
+                cursor.execute(f"SELECT COUNT(*) FROM calculation_run_series WHERE {where}", params)
+                return cursor.fetchone()[0]
+
+            purged = 0
+            while True:
+                cursor.execute(f"""
+                    DELETE FROM calculation_run_series
+                    WHERE id IN (SELECT id FROM calculation_run_series WHERE {where} LIMIT %(limit)s)
+                """, params)
+                conn.commit()
+                purged += cursor.rowcount
+                if cursor.rowcount < self.batch_size:
+                    return purged
+
+    def apply_table(self, conn, table, project_ids=None):
+        """Apply the table's policy; returns counts of compacted, purged and skipped runs"""
+        with conn.cursor() as cursor:
+            expired = self.get_expired_runs(cursor, table, project_ids)
+        conn.commit()
+
+        summary = {
+            'policy': self.policies[table],
+            'compacted': sum(1 for run in expired if not run[3]),
+            'purged': sum(1 for run in expired if run[3]),
+            'skipped': 0,
+        }
+        if self.dry_run:
+            summary['purged_series'] = self.purge_series(conn, table, project_ids)
+            return summary
+
+        for start in range(0, len(expired), self.batch_size):
+            batch = expired[start:start + self.batch_size]
+            try:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                    # Give way to running calculations instead of queueing behind them
+                    cursor.execute("SET LOCAL lock_timeout = %s", (f'{self.lock_timeout_ms}ms',))
+                    for project_id, calculation_run_id, created_at, purge in batch:
+                        if purge:
+                            self.delete_run(cursor, table, project_id, calculation_run_id)
+                        else:
+                            self.compact_run(cursor, table, project_id, calculation_run_id, created_at)
+                conn.commit()
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+                summary['skipped'] += len(batch)
+                summary['compacted'] -= sum(1 for run in batch if not run[3])
+                summary['purged'] -= sum(1 for run in batch if run[3])
+
+        summary['purged_series'] = self.purge_series(conn, table, project_ids)
+        return summary
+
+    def apply(self, tables=None, project_ids=None):
+        conn = self.get_connection()
+        try:
+            return {table: self.apply_table(conn, table, project_ids) for table in (tables or RETENTION_TABLES)}
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact and purge old calculation runs')
+    parser.add_argument('project_ids', nargs='*', help='Project IDs (all projects when omitted)')
+    parser.add_argument('--tables', nargs='+', choices=list(RETENTION_TABLES), default=None,
+                        help='Tables to apply retention to (default: all)')
+    parser.add_argument('--keep-runs', type=int, default=None,
+                        help='Newest runs per project kept in full (default: RETENTION_KEEP_RUNS or 5)')
+    parser.add_argument('--purge-after-days', type=int, default=None,
+                        help='Delete runs older than this, 0 to keep them (default: RETENTION_PURGE_DAYS or 365)')
+    parser.add_argument('--policy', type=json.loads, default=None,
+                        help='JSON {table: {keep_runs, purge_after_days}} overrides')
+    parser.add_argument('--batch-size', type=int, default=20, help='Runs per transaction')
+    parser.add_argument('--lock-timeout-ms', type=int, default=2000,
+                        help='Skip a batch when its locks are not granted within this time')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be compacted or purged')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    try:
+        policies = build_policies(args.keep_runs, args.purge_after_days, args.policy)
+        retention = RunRetention(db_config, policies, args.batch_size, args.lock_timeout_ms, args.dry_run)
+        results = retention.apply(args.tables, args.project_ids)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    write_result({'success': True, 'dry_run': args.dry_run, 'retention': results}, args.result_format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Query Plan Benchmark
+Runs the read queries of the calculation scripts under EXPLAIN (ANALYZE, BUFFERS)
+for sample projects and reports timings, buffer use and the scan types chosen,
+so the indexes and partitioning of migrations/partition_and_index_calculation_tables.sql
+can be checked against real data. Every query runs inside a transaction that is
+rolled back.
+"""
+
+import sys
+import os
+import argparse
+import statistics
+try:
+    import psycopg2
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+from result_protocol import add_format_argument, write_result
+
+# Name -> query with %(project_id)s / %(calculation_run_id)s parameters, as issued by the scripts
+QUERIES = {
+    'balance_sheet_latest_version': """
+        SELECT * FROM balance_sheet_data WHERE project_id = %(project_id)s ORDER BY version DESC LIMIT 1
+    """,
+    'profit_loss_latest_version': """
+        SELECT * FROM profit_loss_data WHERE project_id = %(project_id)s ORDER BY version DESC LIMIT 1
+    """,
+    'debt_structure_latest_version': """
+        SELECT * FROM debt_structure_data WHERE project_id = %(project_id)s ORDER BY version DESC LIMIT 1
+    """,
+    'growth_assumptions_latest_version': """
+        SELECT * FROM growth_assumptions_data WHERE project_id = %(project_id)s ORDER BY version DESC LIMIT 1
+    """,
+    'working_capital_latest_version': """
+        SELECT * FROM working_capital_data WHERE project_id = %(project_id)s ORDER BY version DESC LIMIT 1
+    """,
+    'debt_calculations_by_month': """
+        SELECT * FROM debt_calculations WHERE project_id = %(project_id)s ORDER BY month
+    """,
+    'depreciation_schedule_by_month': """
+        SELECT * FROM depreciation_schedule WHERE project_id = %(project_id)s ORDER BY month
+    """,
+    'monthly_consolidated_run': """
+        SELECT * FROM monthly_consolidated
+        WHERE project_id = %(project_id)s AND calculation_run_id = %(calculation_run_id)s
+        ORDER BY year, month
+    """,
+    'monthly_consolidated_latest_run': """
+        SELECT * FROM monthly_consolidated
+        WHERE project_id = %(project_id)s AND calculation_run_id = (
+            SELECT calculation_run_id FROM monthly_consolidated
+            WHERE project_id = %(project_id)s
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        ORDER BY year, month
+    """,
+    'quarterly_consolidated_latest_run': """
+        SELECT * FROM quarterly_consolidated
+        WHERE project_id = %(project_id)s AND calculation_run_id = (
+            SELECT calculation_run_id FROM quarterly_consolidated
+            WHERE project_id = %(project_id)s
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        ORDER BY year, quarter
+    """,
+    'yearly_consolidated_latest_run': """
+        SELECT * FROM yearly_consolidated
+        WHERE project_id = %(project_id)s AND calculation_run_id = (
+            SELECT calculation_run_id FROM yearly_consolidated
+            WHERE project_id = %(project_id)s
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        ORDER BY year
+    """,
+    'monthly_kpis_latest_run': """
+        SELECT * FROM monthly_kpis
+        WHERE project_id = %(project_id)s AND calculation_run_id = (
+            SELECT calculation_run_id FROM monthly_kpis
+            WHERE project_id = %(project_id)s
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        ORDER BY year, month
+    """,
+    'monthly_consolidated_latest_batch': """
+        WITH latest AS (
+            SELECT DISTINCT ON (project_id) project_id, calculation_run_id
+            FROM monthly_consolidated
+            WHERE project_id = ANY(%(project_ids)s::uuid[])
+            ORDER BY project_id, created_at DESC
+        )
+        SELECT c.* FROM monthly_consolidated c
+        JOIN latest l ON l.project_id = c.project_id AND l.calculation_run_id = c.calculation_run_id
+        ORDER BY c.project_id, c.year, c.month
+    """,
+    'run_series_latest': """
+        SELECT * FROM latest_calculation_run_series('monthly_consolidated', %(project_id)s)
+    """,
+}
+
+
+def plan_nodes(node):
+    """Flatten an EXPLAIN JSON plan tree"""
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanBenchmark:
+    def __init__(self, db_config, repeat=3):
+        self.db_config = db_config
+        self.repeat = repeat
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def get_sample_projects(self, cursor, limit):
+        """Projects with the most monthly consolidated rows, i.e. the heaviest reads"""
+        cursor.execute("""
+            SELECT project_id FROM monthly_consolidated
+            GROUP BY project_id
+            ORDER BY COUNT(*) DESC
+            LIMIT %s
+        """, (limit,))
+        return [str(row[0]) for row in cursor.fetchall()]
+
+    def get_latest_run(self, cursor, project_id):
+        cursor.execute("""
+            SELECT calculation_run_id FROM monthly_consolidated
+            WHERE project_id = %s
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (project_id,))
+        row = cursor.fetchone()
+        return str(row[0]) if row and row[0] else None
+
+    def explain(self, cursor, query, params):
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+        return plan[0] if isinstance(plan, list) else plan
+
+    def run_query(self, conn, name, query, params):
+        """Best-of-repeat timings and the scans of one query for one parameter set"""
+        runs = []
+        for _ in range(self.repeat):
+            with conn.cursor() as cursor:
+                try:
+                    runs.append(self.explain(cursor, query, params))
+                finally:
+                    conn.rollback()
+
+        best = min(runs, key=lambda plan: plan['Execution Time'])
+        nodes = list(plan_nodes(best['Plan']))
+        return {
+            'query': name,
+            'project_id': params.get('project_id'),
+            'planning_ms': round(best['Planning Time'], 3),
+            'execution_ms': round(best['Execution Time'], 3),
+            'median_execution_ms': round(statistics.median(plan['Execution Time'] for plan in runs), 3),
+            'rows': best['Plan'].get('Actual Rows', 0),
+            'shared_hit_blocks': best['Plan'].get('Shared Hit Blocks', 0),
+            'shared_read_blocks': best['Plan'].get('Shared Read Blocks', 0),
+            'top_node': best['Plan']['Node Type'],
+            'relations_scanned': len({node['Relation Name'] for node in nodes if 'Relation Name' in node}),
+            'seq_scans': sorted({node['Relation Name'] for node in nodes
+                                 if node['Node Type'] == 'Seq Scan' and 'Relation Name' in node}),
+        }
+
+    def run(self, project_ids=None, sample_size=5, queries=None):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                project_ids = project_ids or self.get_sample_projects(cursor, sample_size)
+                runs = {project_id: self.get_latest_run(cursor, project_id) for project_id in project_ids}
+            conn.rollback()
+
+            results = []
+            for name in queries or QUERIES:
+                if name.endswith('_batch'):
+                    results.append(self.run_query(conn, name, QUERIES[name], {'project_ids': project_ids}))
+                    continue
+                for project_id, calculation_run_id in runs.items():
+                    if '%(calculation_run_id)s' in QUERIES[name] and not calculation_run_id:
+                        continue
+                    params = {'project_id': project_id, 'calculation_run_id': calculation_run_id}
+                    results.append(self.run_query(conn, name, QUERIES[name], params))
+            return results
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report query plans of the calculation read queries')
+    parser.add_argument('project_ids', nargs='*', help='Project IDs (default: the largest projects)')
+    parser.add_argument('--sample-size', type=int, default=5, help='Projects to sample when none are given')
+    parser.add_argument('--queries', nargs='+', choices=list(QUERIES), default=None,
+                        help='Queries to explain (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Executions per query and project')
+    parser.add_argument('--fail-on-seq-scan', action='store_true',
+                        help='Exit with status 1 when any plan contains a sequential scan')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    try:
+        benchmark = QueryPlanBenchmark(db_config, args.repeat)
+        plans = benchmark.run(args.project_ids, args.sample_size, args.queries)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    seq_scans = sorted({f"{plan['query']}: {table}" for plan in plans for table in plan['seq_scans']})
+    write_result({'success': True, 'seq_scans': seq_scans}, args.result_format,
+                 {'plans': plans})
+
+    if args.fail_on_seq_scan and seq_scans:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Debt Capacity Solver
+Goal-seeks the largest additional loan, the shortest maturity or the highest spread
+that still satisfies a set of KPI covenants, using the in-memory model engine.
+"""
+
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+import numpy as np
+
+import model_engine
+from input_cache import load_latest_input
+from result_protocol import add_format_argument, write_result
+
+# Search variable -> (tranche, term, objective)
+SEARCH_VARIABLES = {
+    'additional_loan_senior_secured': ('senior_secured', 'additional_loan', 'max'),
+    'additional_loan_short_term': ('short_term', 'additional_loan', 'max'),
+    'maturity_y_senior_secured': ('senior_secured', 'maturity_y', 'min'),
+    'maturity_y_short_term': ('short_term', 'maturity_y', 'min'),
+    'credit_risk_premiums_senior_secured': ('senior_secured', 'credit_risk_premiums', 'max'),
+    'credit_risk_premiums_short_term': ('short_term', 'credit_risk_premiums', 'max'),
+}
+
+MAX_MATURITY_Y = 30
+MAX_EXPANSIONS = 10
+MAX_SPREAD = 100.0  # percent per annum
+SPREAD_TOLERANCE = 0.0001
+
+
+class DebtCapacitySolver:
+    def __init__(self, db_config, points=16, tolerance=1.0, max_iterations=50):
+        self.db_config = db_config
+        self.points = points
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def get_latest_row(self, table, project_id):
+        """Get the latest input version for the project as a dict"""
+        return load_latest_input(self.get_connection, table, project_id)
+
+    def get_inputs(self, project_id):
+        """Get debt structure, balance sheet and profit & loss inputs"""
+        debt_structure = self.get_latest_row('debt_structure_data', project_id)
+        balance_sheet = self.get_latest_row('balance_sheet_data', project_id)
+        profit_loss = self.get_latest_row('profit_loss_data', project_id)
+        if not debt_structure or not balance_sheet or not profit_loss:
+            raise ValueError("Required data not found")
+        return debt_structure, balance_sheet, profit_loss
+
+    def evaluate(self, terms, ebitda, tranche, term, candidates):
+        """Evaluate every candidate value in one batch and return the KPI summary"""
+        batch_terms = {name: dict(values) for name, values in terms.items()}
+        batch_terms[tranche][term] = np.asarray(candidates, dtype=float)
+        schedule = model_engine.combined_debt_schedule(batch_terms)
+        return model_engine.kpi_summary(model_engine.debt_kpis(schedule['total'], ebitda))
+
+    @staticmethod
+    def is_feasible(summary, constraints):
+        """Check the covenant constraints against a batched KPI summary"""
+        feasible = np.ones_like(summary['min_dscr'], dtype=bool)
+        if constraints.get('min_dscr') is not None:
+            feasible &= summary['min_dscr'] >= constraints['min_dscr']
+        if constraints.get('max_debt_to_ebitda') is not None:
+            feasible &= summary['max_debt_to_ebitda'] <= constraints['max_debt_to_ebitda']
+        if constraints.get('min_interest_coverage') is not None:
+            feasible &= summary['min_interest_coverage'] >= constraints['min_interest_coverage']
+        return feasible
+
+    def search_maximum(self, feasible, lower, upper, tolerance, limit=None):
+        """
+        Batched bracketed bisection for the largest feasible value.
+        Assumes feasibility is monotone (feasible below the answer, infeasible above).
+        Each iteration evaluates self.points candidates at once, so the bracket
+        shrinks by a factor of points + 1 per engine call. Without a limit the
+        bracket is first grown geometrically until its upper end is infeasible.
+        """
+        evaluations = 0
+        iterations = 0
+
+        if limit is not None:
+            iterations, evaluations = 1, 1
+            if feasible([limit])[0]:
+                return limit, iterations, evaluations, False
+            upper = limit
+        else:
+            for _ in range(MAX_EXPANSIONS):
+                candidates = upper * 4.0 ** np.arange(self.points)
+                ok = feasible(candidates)
+                evaluations += len(candidates)
+                iterations += 1
+                if not ok.all():
+                    first_bad = int(np.argmin(ok))
+                    upper = candidates[first_bad]
+                    if first_bad > 0:
+                        lower = candidates[first_bad - 1]
+                    break
+                lower = candidates[-1]
+                upper = candidates[-1] * 4.0
+            else:
+                return lower, iterations, evaluations, False
+
+        while upper - lower > tolerance and iterations < self.max_iterations:
+            candidates = np.linspace(lower, upper, self.points + 2)[1:-1]
+            ok = feasible(candidates)
+            evaluations += len(candidates)
+            iterations += 1
+            if ok.any():
+                last_good = len(ok) - 1 - int(np.argmax(ok[::-1]))
+                lower = candidates[last_good]
+                if last_good + 1 < len(candidates):
+                    upper = candidates[last_good + 1]
+            else:
+                upper = candidates[0]
+
+        return lower, iterations, evaluations, True
+
+    def solve(self, project_id, variable, constraints):
+        """Find the best value of variable for one project"""
+        if variable not in SEARCH_VARIABLES:
+            raise ValueError(f"Unsupported search variable: {variable}")
+        tranche, term, objective = SEARCH_VARIABLES[variable]
+
+        debt_structure, balance_sheet, profit_loss = self.get_inputs(project_id)
+        terms = model_engine.tranche_terms(debt_structure, balance_sheet)
+        ebitda = model_engine.monthly_ebitda(profit_loss)
+        current_value = terms[tranche][term]
+
+        def feasible(candidates):
+            return self.is_feasible(self.evaluate(terms, ebitda, tranche, term, candidates), constraints)
+
+        if term == 'maturity_y':
+            # Maturities are whole years, so the full grid fits in a single batch
+            amortization_y = terms[tranche]['amortization_y']
+            candidates = np.arange(amortization_y + 1, MAX_MATURITY_Y + 1)
+            ok = feasible(candidates)
+            iterations, evaluations = 1, len(candidates)
+            found, bounded = bool(ok.any()), True
+            value = int(candidates[int(np.argmax(ok))]) if found else None
+        elif not feasible([0.0])[0]:
+            found, bounded, value, iterations, evaluations = False, True, None, 1, 1
+        elif term == 'credit_risk_premiums':
+            value, iterations, evaluations, bounded = self.search_maximum(
+                feasible, 0.0, MAX_SPREAD, SPREAD_TOLERANCE, limit=MAX_SPREAD)
+            found, value = True, round(float(value), 4)
+        else:
+            start = max(abs(current_value), 1000.0)
+            value, iterations, evaluations, bounded = self.search_maximum(
+                feasible, 0.0, start, self.tolerance)
+            found, value = True, round(float(value), 2)
+
+        result = {
+            'project_id': project_id,
+            'success': True,
+            'variable': variable,
+            'objective': objective,
+            'feasible': found,
+            'bounded': bounded,
+            'value': value,
+            'current_value': current_value,
+            'iterations': iterations,
+            'evaluations': evaluations,
+            'constraints': constraints,
+        }
+        if found:
+            summary = self.evaluate(terms, ebitda, tranche, term, [value])
+            result['kpis'] = {key: float(values[0]) for key, values in summary.items()}
+        return result
+
+
+def _solve_project(task):
+    """Worker entry point for parallel solving across projects"""
+    db_config, options, project_id, variable, constraints = task
+    solver = DebtCapacitySolver(db_config, **options)
+    try:
+        return solver.solve(project_id, variable, constraints)
+    except Exception as e:
+        return {'project_id': project_id, 'success': False, 'error': str(e)}
+
+
+def solve_projects(db_config, project_ids, variable, constraints, workers=None, **options):
+    """Solve the same goal-seek for a list of projects in parallel processes"""
+    tasks = [(db_config, options, project_id, variable, constraints) for project_id in project_ids]
+    if len(tasks) == 1 or workers == 1:
+        return [_solve_project(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_solve_project, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Goal-seek the debt capacity that satisfies KPI covenants')
+    parser.add_argument('project_ids', nargs='+', help='Project IDs')
+    parser.add_argument('--variable', default='additional_loan_senior_secured',
+                        choices=sorted(SEARCH_VARIABLES), help='Input to solve for')
+    parser.add_argument('--min-dscr', type=float, default=None, help='Minimum DSCR covenant')
+    parser.add_argument('--max-debt-to-ebitda', type=float, default=None, help='Maximum Debt/EBITDA covenant')
+    parser.add_argument('--min-interest-coverage', type=float, default=None, help='Minimum interest coverage covenant')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Bracket width at which the search stops')
+    parser.add_argument('--points', type=int, default=16, help='Candidates evaluated per iteration')
+    parser.add_argument('--workers', type=int, default=None, help='Parallel worker processes')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    import os
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    constraints = {
+        'min_dscr': args.min_dscr,
+        'max_debt_to_ebitda': args.max_debt_to_ebitda,
+        'min_interest_coverage': args.min_interest_coverage,
+    }
+    if all(value is None for value in constraints.values()):
+        write_result({'success': False, 'error': 'At least one KPI constraint is required'}, args.result_format)
+        sys.exit(1)
+
+    results = solve_projects(db_config, args.project_ids, args.variable, constraints, args.workers,
+                             points=args.points, tolerance=args.tolerance)
+
+    write_result({
+        'success': all(r['success'] for r in results),
+        'results': results
+    }, args.result_format)
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,8 @@ Uses exact logic from streamlit_app.py to calculate 120-month debt schedule
 """
 
 import sys
-import json
 import os
+import argparse
 from dotenv import load_dotenv
 try:
     import psycopg2
@@ -15,14 +15,22 @@ except ImportError:
     print("Try: pip install psycopg2-binary")
     sys.exit(1)
 import numpy_financial as npf
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
+import model_engine
+from result_protocol import add_format_argument, write_result
+from run_storage import add_storage_argument, load_run_series, resolve_storage, save_run_series
+from input_cache import load_latest_input
+from project_lock import project_lock
+
 # Load environment variables
 load_dotenv()
 
 class DebtScheduleCalculator:
-    def __init__(self):
+    def __init__(self, storage=None):
+        self.storage = resolve_storage(storage)
         self.db_config = {
             'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
             'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
@@ -37,33 +45,11 @@ class DebtScheduleCalculator:
 
     def get_debt_structure_data(self, project_id):
         """Get debt structure data from database"""
-        conn = self.get_connection()
-        try:
-            query = """
-                SELECT * FROM debt_structure_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """
-            df = pd.read_sql_query(query, conn, params=[project_id])
-            return df.iloc[0].to_dict() if not df.empty else None
-        finally:
-            conn.close()
+        return load_latest_input(self.get_connection, 'debt_structure_data', project_id)
 
     def get_balance_sheet_data(self, project_id):
         """Get balance sheet data from database"""
-        conn = self.get_connection()
-        try:
-            query = """
-                SELECT * FROM balance_sheet_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """
-            df = pd.read_sql_query(query, conn, params=[project_id])
-            return df.iloc[0].to_dict() if not df.empty else None
-        finally:
-            conn.close()
+        return load_latest_input(self.get_connection, 'balance_sheet_data', project_id)
 
     def delete_existing_calculations(self, project_id):
         """Delete existing debt calculations for the project"""
@@ -78,6 +64,17 @@ class DebtScheduleCalculator:
         finally:
             conn.close()
 
+    def save_calculation_series(self, project_id, calculation_run_id, rows):
+        """Replace the project's debt calculations with one array-column series row"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                save_run_series(cursor, 'debt_calculations', project_id, calculation_run_id, rows,
+                                replace_project=True)
+            conn.commit()
+        finally:
+            conn.close()
+
     def insert_calculation(self, calculation_data):
         conn = self.get_connection()
         try:
@@ -281,24 +278,30 @@ class DebtScheduleCalculator:
                     debt_calc_short_term.loc[i, 'Closing'] = 0.0
 
         # Combine results and save to database
-        self.delete_existing_calculations(project_id)
-        
+        total = {
+            column: (debt_calc_senior_secured[column] + debt_calc_short_term[column]).to_numpy()
+            for column in ['Opening', 'Interest', 'Repayment', 'Closing']
+        }
+        return self.save_schedule(project_id, calculation_run_id, total)
+
+    def schedule_rows(self, project_id, calculation_run_id, total):
+        """debt_calculations rows of the combined 120-month schedule"""
         cumulative_interest = 0
+        rows = []
         for i in range(1, 121):
             month = i
             year = (i - 1) // 12 + 1
             
             # Combine Senior Secured and Short Term results
-            opening_balance = debt_calc_senior_secured.loc[i, 'Opening'] + debt_calc_short_term.loc[i, 'Opening']
-            payment = debt_calc_senior_secured.loc[i, 'Repayment'] + debt_calc_short_term.loc[i, 'Repayment']
-            interest_payment = debt_calc_senior_secured.loc[i, 'Interest'] + debt_calc_short_term.loc[i, 'Interest']
-            principal_payment = debt_calc_senior_secured.loc[i, 'Repayment'] + debt_calc_short_term.loc[i, 'Repayment']
-            closing_balance = debt_calc_senior_secured.loc[i, 'Closing'] + debt_calc_short_term.loc[i, 'Closing']
+            opening_balance = float(total['Opening'][i - 1])
+            payment = float(total['Repayment'][i - 1])
+            interest_payment = float(total['Interest'][i - 1])
+            principal_payment = float(total['Repayment'][i - 1])
+            closing_balance = float(total['Closing'][i - 1])
             
             cumulative_interest += interest_payment
 
-            # Save to database
-            calculation_data = {
+            rows.append({
                 'project_id': project_id,
                 'month': month,
                 'year': year,
@@ -309,33 +312,144 @@ class DebtScheduleCalculator:
                 'closing_balance': round(closing_balance, 2),
                 'cumulative_interest': round(cumulative_interest, 2),
                 'calculation_run_id': calculation_run_id
-            }
-            
-            self.insert_calculation(calculation_data)
+            })
+        return rows
 
+    @staticmethod
+    def schedule_summary(rows):
+        """Summary of a schedule from its last month"""
         return {
             'success': True,
-            'total_months': 120,
-            'total_principal': round(opening_balance, 2),
-            'total_interest': round(cumulative_interest, 2),
-            'final_balance': round(closing_balance, 2)
+            'total_months': len(rows),
+            'total_principal': rows[-1]['opening_balance'],
+            'total_interest': rows[-1]['cumulative_interest'],
+            'final_balance': rows[-1]['closing_balance']
         }
 
+    def save_schedule(self, project_id, calculation_run_id, total):
+        """Replace the project's debt calculations with the combined 120-month schedule"""
+        rows = self.schedule_rows(project_id, calculation_run_id, total)
+        
+        # Save to database
+        if self.storage == 'arrays':
+            self.save_calculation_series(project_id, calculation_run_id, rows)
+        else:
+            self.delete_existing_calculations(project_id)
+            for calculation_data in rows:
+                self.insert_calculation(calculation_data)
+
+        return self.schedule_summary(rows)
+
+    def get_operating_lines(self, project_id):
+        """Get monthly operating lines for CFADS from the latest consolidated run"""
+        conn = self.get_connection()
+        try:
+            columns = ['month', 'ebitda', 'depreciation', 'income_tax_expense', 'capital_expenditures']
+            with conn.cursor() as cursor:
+                series = load_run_series(cursor, 'monthly_consolidated', project_id)
+            if series is not None:
+                df = pd.DataFrame({column: series[column] for column in columns})
+                return df.fillna(0).astype({'ebitda': float, 'depreciation': float,
+                                            'income_tax_expense': float, 'capital_expenditures': float})
+            
+            query = """
+                SELECT mc.month, mc.ebitda, mc.depreciation, mc.income_tax_expense, mc.capital_expenditures
+                FROM monthly_consolidated mc
+                INNER JOIN (
+                    SELECT calculation_run_id
+                    FROM monthly_consolidated
+                    WHERE project_id = %s
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) latest ON mc.calculation_run_id = latest.calculation_run_id
+                WHERE mc.project_id = %s
+                ORDER BY mc.month
+            """
+            df = pd.read_sql_query(query, conn, params=[project_id, project_id])
+            return df.fillna(0).astype({'ebitda': float, 'depreciation': float,
+                                        'income_tax_expense': float, 'capital_expenditures': float})
+        finally:
+            conn.close()
+
+    def get_profit_loss_data(self, project_id):
+        """Get profit loss data from database"""
+        return load_latest_input(self.get_connection, 'profit_loss_data', project_id)
+
+    def calculate_sculpted_debt_schedule(self, project_id, calculation_run_id=None, target_dscr=1.3,
+                                         tranche='senior_secured'):
+        """Calculate a 120-month schedule with repayments sculpted to a target DSCR against CFADS"""
+        debt_structure = self.get_debt_structure_data(project_id)
+        balance_sheet = self.get_balance_sheet_data(project_id)
+        profit_loss = self.get_profit_loss_data(project_id)
+
+        if not debt_structure or not balance_sheet or not profit_loss:
+            raise ValueError("Required data not found")
+        if target_dscr <= 0:
+            raise ValueError("Target DSCR must be positive")
+
+        # CFADS comes from the latest consolidated run, or the P&L inputs before the first run
+        operating = self.get_operating_lines(project_id)
+        if len(operating) == 120:
+            ebitda = operating['ebitda'].to_numpy()
+            depreciation = operating['depreciation'].to_numpy()
+            capex = operating['capital_expenditures'].to_numpy()
+            tax = operating['income_tax_expense'].to_numpy()
+        else:
+            ebitda = model_engine.monthly_ebitda(profit_loss)
+            depreciation = float(profit_loss.get('depreciation') or 0)
+            capex = 0.0
+            tax = float(profit_loss.get('taxes') or 0)
+
+        # With a tax rate the interest tax shield feeds back into CFADS
+        tax_rate = float(profit_loss.get('tax_rates') or 0) / 100 or None
+
+        result = model_engine.sculpt_to_dscr(
+            model_engine.tranche_terms(debt_structure, balance_sheet), ebitda, target_dscr,
+            tranche=tranche, capex=capex, tax=tax, tax_rate=tax_rate, depreciation=depreciation)
+
+        total = {
+            'Opening': result['total']['opening'][0],
+            'Interest': result['total']['interest'][0],
+            'Repayment': result['total']['repayment'][0],
+            'Closing': result['total']['closing'][0],
+        }
+        summary = self.save_schedule(project_id, calculation_run_id, total)
+        dscr = result['dscr'][0]
+        summary.update({
+            'repayment_mode': 'sculpted',
+            'target_dscr': target_dscr,
+            'min_dscr': round(float(np.nanmin(dscr)), 4) if np.isfinite(dscr).any() else None,
+            'iterations': result['iterations'],
+            'converged': result['converged']
+        })
+        return summary
+
 def main():
     """Main function to run the calculation"""
-    if len(sys.argv) < 2:
-        print("Usage: python calculate_debt_schedule.py <project_id> [calculation_run_id]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Calculate 120-month debt schedule')
+    parser.add_argument('project_id', help='Project ID')
+    parser.add_argument('calculation_run_id', nargs='?', default=None, help='Calculation run ID')
+    parser.add_argument('--repayment-mode', choices=['annuity', 'sculpted'], default='annuity',
+                        help='Level annuity (default) or repayments sculpted to a target DSCR')
+    parser.add_argument('--target-dscr', type=float, default=1.3, help='Target DSCR for sculpted repayment')
+    parser.add_argument('--sculpted-tranche', choices=sorted(model_engine.TRANCHES), default='senior_secured',
+                        help='Tranche whose repayments are sculpted')
+    add_format_argument(parser)
+    add_storage_argument(parser)
     
-    project_id = sys.argv[1]
-    calculation_run_id = sys.argv[2] if len(sys.argv) > 2 else None
-    calculator = DebtScheduleCalculator()
+    args = parser.parse_args()
+    calculator = DebtScheduleCalculator(args.storage)
     
     try:
-        result = calculator.calculate_debt_schedule(project_id, calculation_run_id)
-        print(json.dumps(result, indent=2))
+        with project_lock(calculator.db_config, args.project_id):
+            if args.repayment_mode == 'sculpted':
+                result = calculator.calculate_sculpted_debt_schedule(
+                    args.project_id, args.calculation_run_id, args.target_dscr, args.sculpted_tranche)
+            else:
+                result = calculator.calculate_debt_schedule(args.project_id, args.calculation_run_id)
+        write_result(result, args.result_format)
     except Exception as e:
-        print(json.dumps({'success': False, 'error': str(e)}, indent=2))
+        write_result({'success': False, 'error': str(e)}, args.result_format)
         sys.exit(1)
 
 if __name__ == "__main__":
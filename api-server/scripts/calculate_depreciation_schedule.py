@@ -13,57 +13,202 @@ import numpy as np
 from datetime import datetime
 import argparse
 
+import model_engine
+from result_protocol import add_format_argument, write_result
+from run_storage import add_storage_argument, resolve_storage, save_run_series
+from input_cache import load_latest_input
+from project_lock import project_lock
+
+
+def parse_asset_classes(text):
+    """Parse and validate the asset class JSON passed on the command line"""
+    asset_classes = json.loads(text)
+    if not isinstance(asset_classes, list) or not asset_classes:
+        raise ValueError("Asset classes must be a non-empty list")
+
+    names = set()
+    for asset_class in asset_classes:
+        name = asset_class.get('name')
+        if not name or name in names:
+            raise ValueError(f"Asset class names must be unique and non-empty: {name!r}")
+        names.add(name)
+        if asset_class.get('method', 'straight_line') not in model_engine.DEPRECIATION_METHODS:
+            raise ValueError(f"Unsupported depreciation method for {name}: {asset_class.get('method')}")
+        if float(asset_class.get('life_years', 0)) <= 0:
+            raise ValueError(f"Useful life must be positive for {name}")
+        if float(asset_class.get('share', -1)) < 0:
+            raise ValueError(f"Share must be non-negative for {name}")
+        asset_class['share'] = float(asset_class['share'])
+        asset_class['life_years'] = float(asset_class['life_years'])
+
+    if abs(sum(c['share'] for c in asset_classes) - 1) > 1e-6:
+        raise ValueError("Asset class shares must add up to 1")
+    return asset_classes
+
+
 class DepreciationScheduleCalculator:
-    def __init__(self, db_config):
+    def __init__(self, db_config, storage=None):
         self.db_config = db_config
+        self.storage = resolve_storage(storage)
 
     def get_connection(self):
         return psycopg2.connect(**self.db_config)
 
     def get_balance_sheet_data(self, project_id):
         """Get balance sheet data for the project"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT ppe, asset_depreciated_over_years, capital_expenditure_additions
-                FROM balance_sheet_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """, (project_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                raise ValueError("Balance sheet data not found")
+        result = load_latest_input(self.get_connection, 'balance_sheet_data', project_id)
             
-            return {
-                'ppe': float(result[0]) if result[0] else 0,
-                'asset_depreciated_over_years': int(result[1]) if result[1] else 10,
-                'capital_expenditure_additions': float(result[2]) if result[2] else 0
-            }
+        if not result:
+            raise ValueError("Balance sheet data not found")
+            
+        return {
+            'ppe': float(result['ppe']) if result['ppe'] else 0,
+            'asset_depreciated_over_years': (int(result['asset_depreciated_over_years'])
+                                             if result['asset_depreciated_over_years'] else 10),
+            'capital_expenditure_additions': (float(result['capital_expenditure_additions'])
+                                              if result['capital_expenditure_additions'] else 0)
+        }
 
     def get_growth_assumptions_data(self, project_id):
         """Get growth assumptions data for capex projections"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT 
-                    gr_capex_1, gr_capex_2, gr_capex_3, gr_capex_4, gr_capex_5,
-                    gr_capex_6, gr_capex_7, gr_capex_8, gr_capex_9, gr_capex_10
-                FROM growth_assumptions_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """, (project_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                # Return default values if no growth assumptions
-                return {year: 0 for year in range(1, 11)}
-            
-            # Map the capex values to years
-            capex_values = [float(val) if val else 0 for val in result]
-            return {year + 1: capex_values[year] for year in range(10)}
+        result = load_latest_input(self.get_connection, 'growth_assumptions_data', project_id)
+            
+        if not result:
+            # Return default values if no growth assumptions
+            return {year: 0 for year in range(1, 11)}
+            
+        # Map the capex values to years
+        capex_values = [float(result[f'gr_capex_{year}']) if result[f'gr_capex_{year}'] else 0
+                        for year in range(1, 11)]
+        return {year + 1: capex_values[year] for year in range(10)}
+
+    def calculate_class_depreciation_schedule(self, project_id, calculation_run_id, asset_classes):
+        """Calculate per-class, vintage-based 120-month depreciation schedules"""
+        try:
+            # Get input data
+            balance_sheet_data = self.get_balance_sheet_data(project_id)
+            growth_data = self.get_growth_assumptions_data(project_id)
+            
+            nb_months = 120
+            result, schedule_data, class_schedules = self.build_class_depreciation_schedule(
+                balance_sheet_data['ppe'], growth_data, asset_classes, nb_months)
+            
+            if len(asset_classes) == 1:
+                depreciation_method = asset_classes[0].get('method', 'straight_line')
+            else:
+                depreciation_method = 'multi_class'
+            # Share-weighted nominal monthly rate in percent
+            depreciation_rate = sum(100.0 * c['share'] / (c['life_years'] * 12) for c in asset_classes)
+            
+            # Save to database
+            self.save_depreciation_schedule(project_id, calculation_run_id, schedule_data, None,
+                                            depreciation_method, depreciation_rate)
+            self.save_class_depreciation_schedule(project_id, calculation_run_id, asset_classes, class_schedules)
+            
+            return {
+                'success': True,
+                'total_months': nb_months,
+                'total_depreciation': float(result['total']['depreciation'].sum()),
+                'final_net_book_value': float(result['total']['closing'][-1]),
+                'classes': {
+                    name: {
+                        'method': c.get('method', 'straight_line'),
+                        'life_years': c['life_years'],
+                        'share': c['share'],
+                        'total_depreciation': float(result['classes'][name]['depreciation'].sum()),
+                        'final_net_book_value': float(result['classes'][name]['closing'][-1])
+                    }
+                    for c in asset_classes for name in [c['name']]
+                },
+                'schedule': schedule_data
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def build_class_depreciation_schedule(self, ppe, growth_data, asset_classes, nb_months=120):
+        """
+        Run the per-class engine on monthly capex from the growth assumptions and
+        return the engine result, the total schedule rows and the per-class rows
+        """
+        months = np.arange(1, nb_months + 1)
+        years = (months - 1) // 12 + 1
+        capex = np.array([growth_data.get(year, 0) / 12 for year in years])
+        
+        result = model_engine.depreciation_by_class(ppe, capex, asset_classes, nb_months)
+        
+        class_schedules = {}
+        for asset_class in asset_classes:
+            name = asset_class['name']
+            schedule = result['classes'][name]
+            class_schedules[name] = self.build_schedule_rows(
+                schedule, capex * asset_class['share'], ppe * asset_class['share'])
+        schedule_data = self.build_schedule_rows(result['total'], capex, ppe)
+        return result, schedule_data, class_schedules
+
+    def build_schedule_rows(self, schedule, capex, ppe):
+        """Turn an engine schedule into rows shaped like the pooled schedule"""
+        closing = schedule['closing']
+        opening = np.concatenate([[ppe], closing[:-1]])
+        accumulated = schedule['accumulated_depreciation']
+        return [
+            {
+                'month': month,
+                'year': ((month - 1) // 12) + 1,
+                'month_name': datetime(2024, ((month - 1) % 12) + 1, 1).strftime("%B"),
+                'opening_balance': float(opening[i]),
+                'capex_addition': float(capex[i]),
+                'depreciation': float(schedule['depreciation'][i]),
+                'closing_balance': float(closing[i]),
+                'accumulated_depreciation': float(accumulated[i])
+            }
+            for i, month in enumerate(range(1, len(closing) + 1))
+        ]
+
+    def build_depreciation_schedule(self, ppe, asset_depreciated_over_years, growth_data, nb_months=120):
+        """Pooled straight-line schedule on opening PP&E plus monthly capex from the growth assumptions"""
+        # Create schedule dataframe
+        schedule_data = []
+        for month in range(1, nb_months + 1):
+            year = ((month - 1) // 12) + 1
+            month_name = datetime(2024, ((month - 1) % 12) + 1, 1).strftime("%B")
+            
+            # Calculate opening balance
+            if month == 1:
+                opening_balance = ppe
+            else:
+                opening_balance = schedule_data[month - 2]['closing_balance']
+            
+            # Calculate capex addition (monthly) - use growth data like streamlit
+            capex_addition = growth_data.get(year, 0) / 12
+            
+            # Calculate depreciation - match streamlit logic exactly
+            if month > nb_months:
+                depreciation = 0
+            else:
+                depreciation = (opening_balance + capex_addition) / (asset_depreciated_over_years * 12)
+            
+            # Calculate closing balance
+            closing_balance = (opening_balance + capex_addition) - depreciation
+            
+            # Calculate accumulated depreciation
+            accumulated_depreciation = ppe - closing_balance
+            
+            schedule_data.append({
+                'month': month,
+                'year': year,
+                'month_name': month_name,
+                'opening_balance': opening_balance,
+                'capex_addition': capex_addition,
+                'depreciation': depreciation,
+                'closing_balance': closing_balance,
+                'accumulated_depreciation': accumulated_depreciation
+            })
+        
+        return schedule_data
 
     def calculate_depreciation_schedule(self, project_id, calculation_run_id):
         """Calculate 120-month depreciation schedule"""
@@ -72,48 +217,10 @@ class DepreciationScheduleCalculator:
             balance_sheet_data = self.get_balance_sheet_data(project_id)
             growth_data = self.get_growth_assumptions_data(project_id)
             
-            # Initialize variables
-            ppe = balance_sheet_data['ppe']
             asset_depreciated_over_years = balance_sheet_data['asset_depreciated_over_years']
             nb_months = 120  # Fixed to 120 months like streamlit
-            
-            # Create schedule dataframe
-            schedule_data = []
-            for month in range(1, nb_months + 1):
-                year = ((month - 1) // 12) + 1
-                month_name = datetime(2024, ((month - 1) % 12) + 1, 1).strftime("%B")
-                
-                # Calculate opening balance
-                if month == 1:
-                    opening_balance = ppe
-                else:
-                    opening_balance = schedule_data[month - 2]['closing_balance']
-                
-                # Calculate capex addition (monthly) - use growth data like streamlit
-                capex_addition = growth_data.get(year, 0) / 12
-                
-                # Calculate depreciation - match streamlit logic exactly
-                if month > nb_months:
-                    depreciation = 0
-                else:
-                    depreciation = (opening_balance + capex_addition) / (asset_depreciated_over_years * 12)
-                
-                # Calculate closing balance
-                closing_balance = (opening_balance + capex_addition) - depreciation
-                
-                # Calculate accumulated depreciation
-                accumulated_depreciation = ppe - closing_balance
-                
-                schedule_data.append({
-                    'month': month,
-                    'year': year,
-                    'month_name': month_name,
-                    'opening_balance': opening_balance,
-                    'capex_addition': capex_addition,
-                    'depreciation': depreciation,
-                    'closing_balance': closing_balance,
-                    'accumulated_depreciation': accumulated_depreciation
-                })
+            schedule_data = self.build_depreciation_schedule(
+                balance_sheet_data['ppe'], asset_depreciated_over_years, growth_data, nb_months)
             
             # Save to database
             self.save_depreciation_schedule(project_id, calculation_run_id, schedule_data, asset_depreciated_over_years)
@@ -136,11 +243,31 @@ class DepreciationScheduleCalculator:
                 'error': str(e)
             }
 
-    def save_depreciation_schedule(self, project_id, calculation_run_id, schedule_data, asset_depreciated_over_years):
+    def save_depreciation_schedule(self, project_id, calculation_run_id, schedule_data, asset_depreciated_over_years,
+                                   depreciation_method='straight_line', depreciation_rate=None):
         """Save depreciation schedule to database"""
+        if depreciation_rate is None:
+            depreciation_rate = 100.0 / (asset_depreciated_over_years * 12)  # Monthly rate
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'depreciation_schedule', project_id, calculation_run_id, [
+                    {
+                        'month': row['month'],
+                        'year': row['year'],
+                        'asset_value': row['opening_balance'],
+                        'depreciation_method': depreciation_method,
+                        'depreciation_rate': depreciation_rate,
+                        'monthly_depreciation': row['depreciation'],
+                        'accumulated_depreciation': row['accumulated_depreciation'],
+                        'net_book_value': row['closing_balance']
+                    }
+                    for row in schedule_data
+                ], replace_project=True)
+                conn.commit()
+                return
+            
             # Delete existing calculations for this project
             cursor.execute("DELETE FROM depreciation_schedule WHERE project_id = %s", (project_id,))
             
@@ -157,8 +284,8 @@ class DepreciationScheduleCalculator:
                     row['month'],
                     row['year'],
                     row['opening_balance'],
-                    'straight_line',
-                    100.0 / (asset_depreciated_over_years * 12),  # Monthly rate
+                    depreciation_method,
+                    depreciation_rate,
                     row['depreciation'],
                     row['accumulated_depreciation'],
                     row['closing_balance'],
@@ -167,10 +294,50 @@ class DepreciationScheduleCalculator:
             
             conn.commit()
 
+    def save_class_depreciation_schedule(self, project_id, calculation_run_id, asset_classes, class_schedules):
+        """Save per-class depreciation schedules to database"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Delete existing class schedules for this project
+            cursor.execute("DELETE FROM depreciation_class_schedule WHERE project_id = %s", (project_id,))
+            
+            # Insert new class schedules
+            for asset_class in asset_classes:
+                for row in class_schedules[asset_class['name']]:
+                    cursor.execute("""
+                        INSERT INTO depreciation_class_schedule (
+                            project_id, calculation_run_id, asset_class, depreciation_method,
+                            useful_life_years, share, month, year, opening_balance, capex_addition,
+                            monthly_depreciation, accumulated_depreciation, net_book_value
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """, (
+                        project_id,
+                        calculation_run_id,
+                        asset_class['name'],
+                        asset_class.get('method', 'straight_line'),
+                        asset_class['life_years'],
+                        asset_class['share'],
+                        row['month'],
+                        row['year'],
+                        row['opening_balance'],
+                        row['capex_addition'],
+                        row['depreciation'],
+                        row['accumulated_depreciation'],
+                        row['closing_balance']
+                    ))
+            
+            conn.commit()
+
 def main():
     parser = argparse.ArgumentParser(description='Calculate depreciation schedule')
     parser.add_argument('project_id', help='Project ID')
     parser.add_argument('calculation_run_id', help='Calculation run ID')
+    parser.add_argument('--asset-classes', default=None,
+                        help='JSON list of asset classes: name, share, life_years, method '
+                             '(straight_line, declining_balance, sum_of_years) and optional factor')
+    add_format_argument(parser)
+    add_storage_argument(parser)
     
     args = parser.parse_args()
     
@@ -189,11 +356,29 @@ def main():
     }
     
     # Create calculator and perform calculation
-    calculator = DepreciationScheduleCalculator(db_config)
-    result = calculator.calculate_depreciation_schedule(args.project_id, args.calculation_run_id)
+    calculator = DepreciationScheduleCalculator(db_config, args.storage)
+    asset_classes = None
+    if args.asset_classes:
+        try:
+            asset_classes = parse_asset_classes(args.asset_classes)
+        except ValueError as e:
+            write_result({'success': False, 'error': str(e)}, args.result_format)
+            sys.exit(1)
+
+    try:
+        with project_lock(db_config, args.project_id):
+            if asset_classes:
+                result = calculator.calculate_class_depreciation_schedule(
+                    args.project_id, args.calculation_run_id, asset_classes)
+            else:
+                result = calculator.calculate_depreciation_schedule(args.project_id, args.calculation_run_id)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
     
-    # Output result as JSON
-    print(json.dumps(result))
+    # Output the summary with the schedule as a columnar table
+    schedule = result.pop('schedule', None)
+    write_result(result, args.result_format, {'schedule': schedule} if schedule else None)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
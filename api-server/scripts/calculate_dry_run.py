@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Dry-Run Calculator
+Runs the full pipeline (debt schedule, depreciation, monthly/quarterly/yearly
+consolidation and KPIs) on an input payload read from stdin and prints every
+schedule as a columnar table of the result protocol. Nothing is read from or written to the database, so
+what-if previews leave no calculation runs behind.
+
+The payload uses the input table column names:
+    {"balance_sheet": {...}, "profit_loss": {...}, "debt_structure": {...},
+     "growth_assumptions": {...}, "working_capital": {...} | null,
+     "asset_classes": [...] | null, "options": {...}}
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+import model_engine
+from calculate_depreciation_schedule import DepreciationScheduleCalculator, parse_asset_classes
+from calculate_monthly_consolidated import MonthlyConsolidatedCalculator
+from calculate_quarterly_consolidated import QuarterlyConsolidatedCalculator
+from calculate_yearly_consolidated import YearlyConsolidatedCalculator
+from calculate_kpis import KPICalculator, CONSOLIDATED_LEVELS
+from result_protocol import ResultWriter, add_format_argument, columnar, write_result
+
+NB_MONTHS = 120
+
+# Payload key -> input table its row is saved in
+INPUT_TABLES = {
+    'balance_sheet': 'balance_sheet_data',
+    'profit_loss': 'profit_loss_data',
+    'debt_structure': 'debt_structure_data',
+    'growth_assumptions': 'growth_assumptions_data',
+    'working_capital': 'working_capital_data',
+}
+
+# Options forwarded to MonthlyConsolidatedCalculator.build_monthly_consolidated
+MONTHLY_OPTIONS = ['cash_sweep', 'min_cash', 'sweep_priority', 'solve_circular', 'deposit_rate', 'tolerance',
+                   'method', 'compute_tax', 'opening_tax_losses', 'loss_cap_pct', 'loss_cap_amount']
+
+
+def _number(data, key, default=0):
+    value = (data or {}).get(key)
+    return float(value) if value not in (None, '') else default
+
+
+def balance_sheet_inputs(balance_sheet):
+    """Balance sheet payload in the shape of MonthlyConsolidatedCalculator.get_balance_sheet_data"""
+    return {
+        'cash': _number(balance_sheet, 'cash'),
+        'accounts_receivable': _number(balance_sheet, 'accounts_receivable'),
+        'inventory': _number(balance_sheet, 'inventory'),
+        'other_current_assets': _number(balance_sheet, 'other_current_assets'),
+        'ppe': _number(balance_sheet, 'ppe'),
+        'other_assets': _number(balance_sheet, 'other_assets'),
+        'accounts_payable': _number(balance_sheet, 'accounts_payable'),
+        'senior_secured': _number(balance_sheet, 'senior_secured'),
+        'debt_tranche1': _number(balance_sheet, 'debt_tranche1'),
+        'equity': _number(balance_sheet, 'total_equity'),
+        'retained_earning': _number(balance_sheet, 'retained_earnings'),
+    }
+
+
+def profit_loss_inputs(profit_loss):
+    """Profit & loss payload in the shape of MonthlyConsolidatedCalculator.get_profit_loss_data"""
+    return {
+        'revenue': _number(profit_loss, 'revenue'),
+        'cost_of_goods_sold': _number(profit_loss, 'cogs'),
+        'operating_expenses': _number(profit_loss, 'operating_expenses'),
+        'depreciation': _number(profit_loss, 'depreciation'),
+        'interest_expense': _number(profit_loss, 'interest_expense'),
+        'income_tax_expense': _number(profit_loss, 'taxes'),
+        'tax_rate': _number(profit_loss, 'tax_rates'),
+    }
+
+
+def working_capital_inputs(working_capital):
+    """Working capital payload in the shape of get_working_capital_data, or None"""
+    if not working_capital:
+        return None
+    return {
+        'ar_pct': _number(working_capital, 'account_receivable_percent'),
+        'inventory_pct': _number(working_capital, 'inventory_percent'),
+        'oca_pct': _number(working_capital, 'other_current_assets_percent'),
+        'ap_pct': _number(working_capital, 'accounts_payable_percent'),
+    }
+
+
+def debt_schedule_total(debt_structure, balance_sheet, nb_months=NB_MONTHS):
+    """
+    Combined debt schedule from the closed-form engine as the Opening, Interest,
+    Repayment and Closing arrays that DebtScheduleCalculator.save_schedule takes
+    """
+    total = model_engine.combined_debt_schedule(
+        model_engine.tranche_terms(debt_structure, balance_sheet), nb_months)['total']
+    return {column: total[column.lower()][0] for column in ('Opening', 'Interest', 'Repayment', 'Closing')}
+
+
+def debt_calculation_rows(debt_structure, balance_sheet, nb_months=NB_MONTHS):
+    """
+    Combined debt schedule, rounded and shaped like the debt_calculations rows
+    that MonthlyConsolidatedCalculator reads
+    """
+    total = debt_schedule_total(debt_structure, balance_sheet, nb_months)
+    cumulative_interest = np.cumsum(total['Interest'])
+    return [
+        {
+            'month': month,
+            'year': (month - 1) // 12 + 1,
+            'opening_balance': round(float(total['Opening'][i]), 2),
+            'payment': round(float(total['Repayment'][i]), 2),
+            'interest': round(float(total['Interest'][i]), 2),
+            'closing_balance': round(float(total['Closing'][i]), 2),
+            'additional_loan': 0,
+            'total_repayment': round(float(cumulative_interest[i]), 2)
+        }
+        for i, month in enumerate(range(1, nb_months + 1))
+    ]
+
+
+def depreciation_rows(balance_sheet, growth_assumptions, asset_classes=None, nb_months=NB_MONTHS):
+    """Pooled or per-class depreciation schedule rows"""
+    calculator = DepreciationScheduleCalculator(None)
+    ppe = _number(balance_sheet, 'ppe')
+    growth_data = {year: _number(growth_assumptions, f'gr_capex_{year}') for year in range(1, 11)}
+    if asset_classes:
+        _, schedule, _ = calculator.build_class_depreciation_schedule(ppe, growth_data, asset_classes, nb_months)
+    else:
+        years = int(_number(balance_sheet, 'asset_depreciated_over_years')) or 10
+        schedule = calculator.build_depreciation_schedule(ppe, years, growth_data, nb_months)
+    return schedule
+
+
+def run_dry_run(payload):
+    """Run the whole pipeline in memory and return the summary with columnar tables"""
+    started = time.perf_counter()
+    balance_sheet = payload.get('balance_sheet') or {}
+    debt_structure = payload.get('debt_structure') or {}
+    options = {key: value for key, value in (payload.get('options') or {}).items() if key in MONTHLY_OPTIONS}
+    asset_classes = payload.get('asset_classes')
+    if asset_classes:
+        asset_classes = parse_asset_classes(json.dumps(asset_classes))
+
+    debt_rows = debt_calculation_rows(debt_structure, balance_sheet)
+    schedule = depreciation_rows(balance_sheet, payload.get('growth_assumptions'), asset_classes)
+    depreciation_schedule = [
+        {
+            'month': row['month'],
+            'year': row['year'],
+            'asset_value': row['opening_balance'],
+            'monthly_depreciation': row['depreciation'],
+            'accumulated_depreciation': row['accumulated_depreciation'],
+            'net_book_value': row['closing_balance'],
+            'capex_addition': row['capex_addition']
+        }
+        for row in schedule
+    ]
+
+    monthly = MonthlyConsolidatedCalculator(None).build_monthly_consolidated(
+        None, None, balance_sheet_inputs(balance_sheet), profit_loss_inputs(payload.get('profit_loss')),
+        debt_rows, depreciation_schedule, working_capital_inputs(payload.get('working_capital')),
+        debt_structure, **options)
+    monthly_data = monthly['data']
+    quarterly_data = QuarterlyConsolidatedCalculator(None).build_quarterly_data(monthly_data)
+    yearly_data = YearlyConsolidatedCalculator(None).build_yearly_data(monthly_data)
+
+    kpi_calculator = KPICalculator(None, None, None, None, None, payload.get('discount_rate'))
+    tables = {
+        'debt_schedule': columnar(debt_rows),
+        'depreciation_schedule': columnar(schedule),
+        'monthly': columnar(monthly_data, exclude=('project_id', 'calculation_run_id')),
+        'quarterly': columnar(quarterly_data),
+        'yearly': columnar(yearly_data),
+    }
+    for level, data in (('monthly', monthly_data), ('quarterly', quarterly_data), ('yearly', yearly_data)):
+        _, _, period_columns, _, periods_per_year = CONSOLIDATED_LEVELS[level]
+        runs = [{'data': data, 'kpis': kpi_calculator.build_kpi_rows(data, period_columns)}]
+        if level == 'monthly':
+            kpi_calculator.add_ltm_kpis(runs)
+        kpi_calculator.add_coverage_kpis(runs, periods_per_year)
+        tables[f'kpis_{level}'] = columnar(runs[0]['kpis'])
+
+    result = {
+        'success': True,
+        'dry_run': True,
+        'tables': tables,
+    }
+    for key in ('cash_sweep', 'solver', 'tax', 'integrity'):
+        if key in monthly:
+            result[key] = monthly[key]
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the calculation pipeline on a JSON payload without persistence')
+    parser.add_argument('--input', default='-', help='Payload file (default: stdin)')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    try:
+        if args.input == '-':
+            payload = json.load(sys.stdin)
+        else:
+            with open(args.input) as f:
+                payload = json.load(f)
+        writer = ResultWriter(args.result_format)
+        result = run_dry_run(payload)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    for name, columns in result.pop('tables').items():
+        writer.table(name, columns)
+    writer.result(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Equity Returns Calculator
+Derives monthly equity cash flows (FCFE, as in the KPI calculator) from the latest
+consolidated run of each project and computes NPVs and IRRs for all projects in
+one batched solve.
+"""
+
+import sys
+import argparse
+try:
+    import psycopg2
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+import numpy as np
+
+import model_engine
+from run_storage import load_latest_series_batch, newer_series
+from numeric_decoding import register_float_numeric, decode_rows
+from result_protocol import add_format_argument, write_result
+
+PERIODS_PER_YEAR = 12
+
+
+def annual_to_monthly(rate_pct):
+    """Monthly rate equivalent to an annual percentage rate compounded monthly"""
+    return (1.0 + np.asarray(rate_pct, dtype=float) / 100) ** (1.0 / PERIODS_PER_YEAR) - 1.0
+
+
+def equity_cash_flows(runs, exit_value=True):
+    """
+    Build one equity cash-flow row per run: the initial equity at month 0 as an
+    outflow, then the monthly FCFE, plus the closing book equity in the last month
+    when exit_value is set. Shorter runs are padded with zeros, which leaves their
+    NPV and IRR unchanged.
+    """
+    nb_periods = 1 + max((len(run['months']) for run in runs), default=0)
+    cash_flows = np.zeros((len(runs), nb_periods))
+    for i, run in enumerate(runs):
+        months = run['months']
+        if not months:
+            continue
+        cash_flows[i, 0] = -months[0]['equity']
+        cash_flows[i, 1:len(months) + 1] = [
+            m['net_cash_operating'] + m['net_cash_investing'] + m['net_cash_financing'] for m in months
+        ]
+        if exit_value:
+            cash_flows[i, len(months)] += months[-1]['equity'] + months[-1]['retained_earning']
+    return cash_flows
+
+
+class EquityReturnsCalculator:
+    def __init__(self, db_config, tolerance=1e-10, max_iterations=100):
+        self.db_config = db_config
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+    def get_connection(self):
+        return register_float_numeric(psycopg2.connect(**self.db_config))
+
+    def get_latest_monthly_runs(self, project_ids=None):
+        """Get the equity-related columns of each project's latest monthly consolidated run"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH latest AS (
+                    SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at
+                    FROM monthly_consolidated
+                    WHERE %(all)s OR project_id::text = ANY(%(project_ids)s::text[])
+                    ORDER BY project_id, created_at DESC
+                )
+                SELECT mc.project_id, mc.calculation_run_id, l.created_at, mc.equity, mc.retained_earning,
+                       mc.net_cash_operating, mc.net_cash_investing, mc.net_cash_financing
+                FROM monthly_consolidated mc
+                JOIN latest l ON l.project_id = mc.project_id AND l.calculation_run_id = mc.calculation_run_id
+                ORDER BY mc.project_id, mc.year, mc.month
+            """, {'all': not project_ids, 'project_ids': list(project_ids or [])})
+            rows = cursor.fetchall()
+            
+            # Runs kept in array storage replace older row-stored runs
+            created_at = {str(row[0]): row[2] for row in rows}
+            series_runs = newer_series(load_latest_series_batch(cursor, 'monthly_consolidated', project_ids), created_at)
+
+        columns = ['equity', 'retained_earning', 'net_cash_operating', 'net_cash_investing', 'net_cash_financing']
+        runs = {}
+        for project_id, run_id, _, *values in rows:
+            if str(project_id) in series_runs:
+                continue
+            run = runs.setdefault(str(project_id), {'calculation_run_id': str(run_id), 'months': []})
+            run['months'].append(values)
+        for run in runs.values():
+            run['months'] = decode_rows(run['months'], columns)
+        
+        for project_id, series in series_runs.items():
+            runs[project_id] = {
+                'calculation_run_id': series['calculation_run_id'],
+                'months': decode_rows(list(zip(*(series['columns'][column] for column in columns))), columns),
+            }
+        return runs
+
+    def calculate_returns(self, runs, discount_rates=(), exit_value=True):
+        """NPV at each annual discount rate and IRR for every run, solved as one matrix"""
+        keys = list(runs)
+        cash_flows = equity_cash_flows([runs[key] for key in keys], exit_value)
+        solved = model_engine.irr(cash_flows, tolerance=self.tolerance, max_iterations=self.max_iterations)
+        npvs = model_engine.npv(annual_to_monthly(discount_rates), cash_flows) if discount_rates else None
+
+        results = {}
+        for i, key in enumerate(keys):
+            monthly_irr = solved['rate'][i]
+            converged = bool(solved['converged'][i])
+            results[key] = {
+                'calculation_run_id': runs[key].get('calculation_run_id'),
+                'months': len(runs[key]['months']),
+                'equity_invested': round(float(-cash_flows[i, 0]), 2) + 0.0,  # avoid -0.0
+                'irr_monthly': round(float(monthly_irr), 8) if converged else None,
+                'irr_annual': round(float((1.0 + monthly_irr) ** PERIODS_PER_YEAR - 1.0) * 100, 4) if converged else None,
+                'converged': converged,
+                'iterations': int(solved['iterations'][i]),
+                'npv': {str(rate): round(float(npvs[i, j]), 2) for j, rate in enumerate(discount_rates)},
+            }
+        return results
+
+    def calculate_projects(self, project_ids=None, discount_rates=(), exit_value=True):
+        """Load the latest runs of the projects in one query and calculate their returns"""
+        return self.calculate_returns(self.get_latest_monthly_runs(project_ids), discount_rates, exit_value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate equity NPV and IRR from consolidated runs')
+    parser.add_argument('project_ids', nargs='*', help='Project IDs (all projects when omitted)')
+    parser.add_argument('--discount-rates', type=float, nargs='*', default=[],
+                        help='Annual discount rates in percent for the NPVs')
+    parser.add_argument('--no-exit-value', action='store_true',
+                        help='Do not add the closing book equity as a final inflow')
+    parser.add_argument('--tolerance', type=float, default=1e-10, help='IRR solver tolerance')
+    parser.add_argument('--max-iterations', type=int, default=100, help='IRR solver iteration limit')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    import os
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    calculator = EquityReturnsCalculator(db_config, args.tolerance, args.max_iterations)
+    try:
+        results = calculator.calculate_projects(args.project_ids, args.discount_rates, not args.no_exit_value)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    write_result({
+        'success': True,
+        'projects': len(results),
+        'not_converged': sum(1 for result in results.values() if not result['converged']),
+        'results': results
+    }, args.result_format)
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,63 @@ Calculates Key Performance Indicators from consolidated financial data
 
 import sys
 import os
+import json
+import time
 import argparse
 import psycopg2
+import psycopg2.extras
 import pandas as pd
+import numpy as np
 from datetime import datetime
 from decimal import Decimal
 
+import model_engine
+from result_protocol import ResultWriter, add_format_argument
+from run_storage import (add_storage_argument, load_latest_series_batch, load_run_series, newer_series,
+                         resolve_storage, save_run_series)
+from numeric_decoding import decode_rows, register_float_numeric
+from project_lock import project_lock, project_locks
+
+MONTHLY_COLUMNS = ['month', 'year', 'month_name', 'revenue', 'cost_of_goods_sold', 'gross_profit',
+                   'operating_expenses', 'ebitda', 'depreciation', 'interest_expense', 'net_income_before_tax',
+                   'income_tax_expense', 'net_income', 'cash', 'accounts_receivable', 'inventory',
+                   'other_current_assets', 'ppe_net', 'other_assets', 'total_assets', 'accounts_payable',
+                   'senior_secured', 'debt_tranche1', 'equity', 'retained_earning', 'total_equity_liability',
+                   'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
+                   'repayment_debt', 'net_cash_financing', 'net_cash_flow']
+
+# Last-twelve-month variants stored next to the monthly KPIs
+LTM_KPIS = ['ebitda_ltm', 'debt_service_ltm', 'interest_expense_ltm', 'debt_to_ebitda_ltm',
+            'debt_service_coverage_ratio_ltm', 'interest_coverage_ratio_ltm', 'operating_margin_ltm',
+            'fcff_ltm', 'fcfe_ltm', 'ar_cycle_days_ltm', 'inventory_cycle_days_ltm']
+
+QUARTERLY_COLUMNS = ['quarter', 'year', 'quarter_name'] + MONTHLY_COLUMNS[3:]
+YEARLY_COLUMNS = ['year'] + MONTHLY_COLUMNS[3:]
+
+# Level -> (consolidated table, columns, period columns kept on KPI rows, sort order, periods per year)
+CONSOLIDATED_LEVELS = {
+    'monthly': ('monthly_consolidated', MONTHLY_COLUMNS, ['month', 'year', 'month_name'], 'year, month', 12),
+    'quarterly': ('quarterly_consolidated', QUARTERLY_COLUMNS, ['quarter', 'year', 'quarter_name'], 'year, quarter', 4),
+    'yearly': ('yearly_consolidated', YEARLY_COLUMNS, ['year'], 'year', 1),
+}
+
+# Lender coverage metrics stored at every level
+COVERAGE_KPIS = ['cfads', 'llcr', 'plcr']
+
+# Ratios stored at every level
+KPI_COLUMNS = ['debt_to_ebitda', 'debt_service_coverage_ratio', 'loan_to_value_ratio', 'interest_coverage_ratio',
+               'current_ratio', 'quick_ratio', 'debt_to_equity_ratio', 'operating_margin',
+               'fcff', 'fcfe', 'ar_cycle_days', 'inventory_cycle_days']
+
+# Level -> KPI columns after the period columns
+KPI_LEVEL_COLUMNS = {
+    'monthly': KPI_COLUMNS + LTM_KPIS + COVERAGE_KPIS,
+    'quarterly': KPI_COLUMNS + COVERAGE_KPIS,
+    'yearly': KPI_COLUMNS + COVERAGE_KPIS,
+}
+
 class KPICalculator:
-    def __init__(self, db_host, db_port, db_name, db_user, db_password):
+    def __init__(self, db_host, db_port, db_name, db_user, db_password, discount_rate=None, storage=None):
         self.db_config = {
             'host': db_host,
             'port': db_port,
@@ -21,16 +70,24 @@ class KPICalculator:
             'user': db_user,
             'password': db_password
         }
+        # Annual percent for LLCR/PLCR; None uses each run's implied cost of debt
+        self.discount_rate = discount_rate
+        self.storage = resolve_storage(storage)
     
     def get_connection(self):
         """Get database connection"""
-        return psycopg2.connect(**self.db_config)
+        return register_float_numeric(psycopg2.connect(**self.db_config))
     
     def get_monthly_consolidated_data(self, project_id, calculation_run_id=None):
         """Get monthly consolidated data for KPI calculations"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            series = load_run_series(cursor, 'monthly_consolidated', project_id, calculation_run_id)
+            if series is not None:
+                results = list(zip(*(series[column] for column in MONTHLY_COLUMNS)))
+                return decode_rows(results, MONTHLY_COLUMNS, passthrough=CONSOLIDATED_LEVELS['monthly'][2])
+            
             if calculation_run_id:
                 cursor.execute("""
                     SELECT month, year, month_name, revenue, cost_of_goods_sold, gross_profit,
@@ -58,7 +115,7 @@ class KPICalculator:
                         SELECT calculation_run_id 
                         FROM monthly_consolidated 
                         WHERE project_id = %s 
-                        ORDER BY calculation_run_id DESC 
+                        ORDER BY created_at DESC 
                         LIMIT 1
                     ) latest ON mc.calculation_run_id = latest.calculation_run_id
                     WHERE mc.project_id = %s
@@ -67,18 +124,153 @@ class KPICalculator:
             
             results = cursor.fetchall()
             
-            if not results:
-                return []
+            return decode_rows(results, MONTHLY_COLUMNS, passthrough=CONSOLIDATED_LEVELS['monthly'][2])
+    
+    def get_latest_consolidated_batch(self, level, project_ids=None):
+        """Get the latest consolidated run at the given level for many projects in one query"""
+        table, columns, period_columns, order, _ = CONSOLIDATED_LEVELS[level]
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                WITH latest AS (
+                    SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at
+                    FROM {table}
+                    WHERE %(all)s OR project_id::text = ANY(%(project_ids)s::text[])
+                    ORDER BY project_id, created_at DESC
+                )
+                SELECT c.project_id, c.calculation_run_id, l.created_at, {', '.join('c.' + col for col in columns)}
+                FROM {table} c
+                JOIN latest l ON l.project_id = c.project_id AND l.calculation_run_id = c.calculation_run_id
+                ORDER BY c.project_id, {order}
+            """, {'all': not project_ids, 'project_ids': list(project_ids or [])})
+            
+            runs, created_at = {}, {}
+            for project_id, run_id, run_created_at, *row in cursor.fetchall():
+                run = runs.setdefault(str(project_id), {'calculation_run_id': str(run_id), 'data': []})
+                run['data'].append(row)
+                created_at[str(project_id)] = run_created_at
+            for run in runs.values():
+                run['data'] = decode_rows(run['data'], columns, passthrough=period_columns)
+            
+            # Runs kept in array storage replace older row-stored runs
+            series_runs = newer_series(load_latest_series_batch(cursor, table, project_ids), created_at)
+            for project_id, series in series_runs.items():
+                runs[project_id] = {
+                    'calculation_run_id': series['calculation_run_id'],
+                    'data': decode_rows(list(zip(*(series['columns'][column] for column in columns))), columns,
+                                        passthrough=period_columns),
+                }
+            return runs
+    
+    def build_kpi_rows(self, consolidated_data, period_columns):
+        """Calculate the point-in-time KPIs for each consolidated period"""
+        kpi_data = []
+        
+        for row in consolidated_data:
+            # Loaded rows are already floats with NULL as 0 (numeric_decoding.py)
+            revenue = row['revenue']
+            ebitda = row['ebitda']
+            depreciation = row['depreciation']
+            interest_expense = row['interest_expense']
+            senior_secured = row['senior_secured']
+            debt_tranche1 = row['debt_tranche1']
+            ppe_net = row['ppe_net']
+            cash = row['cash']
+            accounts_receivable = row['accounts_receivable']
+            inventory = row['inventory']
+            other_current_assets = row['other_current_assets']
+            other_assets = row['other_assets']
+            accounts_payable = row['accounts_payable']
+            equity = row['equity']
+            retained_earning = row['retained_earning']
+            repayment_debt = row['repayment_debt']
+            net_cash_operating = row['net_cash_operating']
+            net_cash_investing = row['net_cash_investing']
+            net_cash_financing = row['net_cash_financing']
+            cost_of_goods_sold = row['cost_of_goods_sold']
             
-            columns = ['month', 'year', 'month_name', 'revenue', 'cost_of_goods_sold', 'gross_profit',
-                      'operating_expenses', 'ebitda', 'depreciation', 'interest_expense', 'net_income_before_tax',
-                      'income_tax_expense', 'net_income', 'cash', 'accounts_receivable', 'inventory',
-                      'other_current_assets', 'ppe_net', 'other_assets', 'total_assets', 'accounts_payable',
-                      'senior_secured', 'debt_tranche1', 'equity', 'retained_earning', 'total_equity_liability',
-                      'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
-                      'repayment_debt', 'net_cash_financing', 'net_cash_flow']
+            # Calculate KPIs
+            kpi_row = {column: row[column] for column in period_columns}
+            kpi_row.update({
+                # Debt-related KPIs
+                'debt_to_ebitda': round((senior_secured + debt_tranche1) / ebitda, 4) if ebitda != 0 else 0,
+                'debt_service_coverage_ratio': round(ebitda / abs(repayment_debt), 4) if repayment_debt != 0 else 0,
+                'loan_to_value_ratio': round((senior_secured + debt_tranche1) / ppe_net, 4) if ppe_net != 0 else 0,
+                'interest_coverage_ratio': round((ebitda + depreciation) / abs(interest_expense), 4) if interest_expense != 0 else 0,
+                
+                # Liquidity KPIs
+                'current_ratio': round((cash + accounts_receivable + inventory + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
+                'quick_ratio': round((cash + accounts_receivable + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
+                
+                # Leverage KPIs
+                'debt_to_equity_ratio': round((senior_secured + debt_tranche1) / (equity + retained_earning), 4) if (equity + retained_earning) != 0 else 0,
+                
+                # Profitability KPIs
+                'operating_margin': round(ebitda / revenue, 4) if revenue != 0 else 0,
+                
+                # Cash Flow KPIs
+                'fcff': round(net_cash_operating + net_cash_investing, 2),
+                'fcfe': round(net_cash_operating + net_cash_investing + net_cash_financing, 2),
+                
+                # Working Capital KPIs
+                'ar_cycle_days': round(365 * accounts_receivable / revenue, 2) if revenue != 0 else 0,
+                'inventory_cycle_days': round(365 * inventory / abs(cost_of_goods_sold), 2) if cost_of_goods_sold != 0 else 0
+            })
             
-            return [dict(zip(columns, row)) for row in results]
+            kpi_data.append(kpi_row)
+        
+        return kpi_data
+    
+    @staticmethod
+    def group_runs(runs):
+        """
+        Group runs ({'data', 'kpis'} dicts) of equal length so each group is one
+        engine call. Yields the group and a column(name) helper returning a
+        (projects, periods) array.
+        """
+        by_length = {}
+        for run in runs:
+            by_length.setdefault(len(run['data']), []).append(run)
+        
+        for group in by_length.values():
+            def column(name, group=group):
+                return np.array([[r[name] for r in run['data']] for run in group], dtype=float)
+            yield group, column
+    
+    def add_ltm_kpis(self, runs):
+        """Add LTM KPIs to the KPI rows of one or more monthly runs"""
+        for group, column in self.group_runs(runs):
+            ltm = model_engine.ltm_kpis(
+                column('revenue'), column('cost_of_goods_sold'), column('ebitda'), column('depreciation'),
+                column('interest_expense'), column('repayment_debt'), column('net_cash_operating'),
+                column('net_cash_investing'), column('net_cash_financing'),
+                column('senior_secured') + column('debt_tranche1'),
+                column('accounts_receivable'), column('inventory'))
+            
+            for i, run in enumerate(group):
+                for j, kpi_row in enumerate(run['kpis']):
+                    for key in LTM_KPIS:
+                        kpi_row[key] = round(float(ltm[key][i, j]), 4)
+    
+    def add_coverage_kpis(self, runs, periods_per_year):
+        """
+        Add CFADS, LLCR and PLCR to the KPI rows of one or more runs. The ratios
+        are measured on closing debt at the end of each period.
+        """
+        for group, column in self.group_runs(runs):
+            interest_expense = column('interest_expense')
+            coverage = model_engine.coverage_ratios(
+                model_engine.cfads(column('net_cash_operating'), interest_expense, column('net_cash_investing')),
+                column('senior_secured') + column('debt_tranche1'),
+                interest_expense,
+                discount_rate=self.discount_rate,
+                periods_per_year=periods_per_year)
+            
+            for i, run in enumerate(group):
+                for j, kpi_row in enumerate(run['kpis']):
+                    kpi_row['cfads'] = round(float(coverage['cfads'][i, j]), 2)
+                    kpi_row['llcr'] = round(float(coverage['llcr'][i, j]), 4)
+                    kpi_row['plcr'] = round(float(coverage['plcr'][i, j]), 4)
     
     def calculate_monthly_kpis(self, project_id, calculation_run_id, save_run_id=None):
         """Calculate monthly KPIs from consolidated data"""
@@ -92,63 +284,10 @@ class KPICalculator:
             if not monthly_data:
                 raise ValueError("Monthly consolidated data not found")
             
-            kpi_data = []
-            
-            for row in monthly_data:
-                # Convert to float for calculations
-                revenue = float(row['revenue']) if row['revenue'] else 0
-                ebitda = float(row['ebitda']) if row['ebitda'] else 0
-                depreciation = float(row['depreciation']) if row['depreciation'] else 0
-                interest_expense = float(row['interest_expense']) if row['interest_expense'] else 0
-                senior_secured = float(row['senior_secured']) if row['senior_secured'] else 0
-                debt_tranche1 = float(row['debt_tranche1']) if row['debt_tranche1'] else 0
-                ppe_net = float(row['ppe_net']) if row['ppe_net'] else 0
-                cash = float(row['cash']) if row['cash'] else 0
-                accounts_receivable = float(row['accounts_receivable']) if row['accounts_receivable'] else 0
-                inventory = float(row['inventory']) if row['inventory'] else 0
-                other_current_assets = float(row['other_current_assets']) if row['other_current_assets'] else 0
-                other_assets = float(row['other_assets']) if row['other_assets'] else 0
-                accounts_payable = float(row['accounts_payable']) if row['accounts_payable'] else 0
-                equity = float(row['equity']) if row['equity'] else 0
-                retained_earning = float(row['retained_earning']) if row['retained_earning'] else 0
-                repayment_debt = float(row['repayment_debt']) if row['repayment_debt'] else 0
-                net_cash_operating = float(row['net_cash_operating']) if row['net_cash_operating'] else 0
-                net_cash_investing = float(row['net_cash_investing']) if row['net_cash_investing'] else 0
-                net_cash_financing = float(row['net_cash_financing']) if row['net_cash_financing'] else 0
-                cost_of_goods_sold = float(row['cost_of_goods_sold']) if row['cost_of_goods_sold'] else 0
-                
-                # Calculate KPIs
-                kpi_row = {
-                    'month': row['month'],
-                    'year': row['year'],
-                    'month_name': row['month_name'],
-                    
-                    # Debt-related KPIs
-                    'debt_to_ebitda': round((senior_secured + debt_tranche1) / ebitda, 4) if ebitda != 0 else 0,
-                    'debt_service_coverage_ratio': round(ebitda / abs(repayment_debt), 4) if repayment_debt != 0 else 0,
-                    'loan_to_value_ratio': round((senior_secured + debt_tranche1) / ppe_net, 4) if ppe_net != 0 else 0,
-                    'interest_coverage_ratio': round((ebitda + depreciation) / abs(interest_expense), 4) if interest_expense != 0 else 0,
-                    
-                    # Liquidity KPIs
-                    'current_ratio': round((cash + accounts_receivable + inventory + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    'quick_ratio': round((cash + accounts_receivable + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    
-                    # Leverage KPIs
-                    'debt_to_equity_ratio': round((senior_secured + debt_tranche1) / (equity + retained_earning), 4) if (equity + retained_earning) != 0 else 0,
-                    
-                    # Profitability KPIs
-                    'operating_margin': round(ebitda / revenue, 4) if revenue != 0 else 0,
-                    
-                    # Cash Flow KPIs
-                    'fcff': round(net_cash_operating + net_cash_investing, 2),
-                    'fcfe': round(net_cash_operating + net_cash_investing + net_cash_financing, 2),
-                    
-                    # Working Capital KPIs
-                    'ar_cycle_days': round(365 * accounts_receivable / revenue, 2) if revenue != 0 else 0,
-                    'inventory_cycle_days': round(365 * inventory / abs(cost_of_goods_sold), 2) if cost_of_goods_sold != 0 else 0
-                }
-                
-                kpi_data.append(kpi_row)
+            kpi_data = self.build_kpi_rows(monthly_data, CONSOLIDATED_LEVELS['monthly'][2])
+            runs = [{'data': monthly_data, 'kpis': kpi_data}]
+            self.add_ltm_kpis(runs)
+            self.add_coverage_kpis(runs, 12)
             
             # Save to database
             self.save_monthly_kpis(project_id, save_id, kpi_data)
@@ -158,6 +297,153 @@ class KPICalculator:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def build_kpis_batch(self, project_ids=None):
+        """
+        KPI rows of the latest consolidated runs of many projects (all when
+        project_ids is empty): {level: {project_id: run with its 'kpis'}}
+        """
+        batch = {}
+        for level, (_, _, period_columns, _, periods_per_year) in CONSOLIDATED_LEVELS.items():
+            runs = self.get_latest_consolidated_batch(level, project_ids)
+            for run in runs.values():
+                run['kpis'] = self.build_kpi_rows(run['data'], period_columns)
+            if level == 'monthly':
+                self.add_ltm_kpis(list(runs.values()))
+            self.add_coverage_kpis(list(runs.values()), periods_per_year)
+            batch[level] = runs
+        return batch
+    
+    def get_project_ids(self):
+        """Ids of the projects with a monthly consolidated run"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM projects p
+                WHERE EXISTS (SELECT 1 FROM monthly_consolidated m WHERE m.project_id = p.id)
+                   OR EXISTS (SELECT 1 FROM calculation_run_series s
+                              WHERE s.project_id = p.id AND s.schedule = 'monthly_consolidated')
+                ORDER BY id
+            """)
+            return [str(row[0]) for row in cursor.fetchall()]
+    
+    def create_kpi_runs(self, batch):
+        """
+        A running kpi_calculation run per project of the batch, created with one
+        insert and committed so the KPI rows can reference them: {project_id: run id}
+        """
+        sources = {}
+        for level, runs in batch.items():
+            for project_id, run in runs.items():
+                sources.setdefault(project_id, {})[level] = run['calculation_run_id']
+        if not sources:
+            return {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO calculation_runs (project_id, run_name, calculation_type, status, run_description,
+                                              input_data)
+                SELECT v.project_id, 'KPI Calculation', 'kpi_calculation', 'running', 'KPI batch calculation',
+                       v.input_data
+                FROM (VALUES %s) AS v(project_id, input_data)
+                RETURNING project_id, id
+            """, [
+                (project_id, json.dumps({'projectId': project_id, 'calculationType': 'kpi_calculation',
+                                         'consolidatedRunIds': consolidated}))
+                for project_id, consolidated in sources.items()
+            ], template='(%s::uuid, %s::jsonb)', page_size=1000)
+            run_ids = {str(project_id): str(run_id) for project_id, run_id in cursor.fetchall()}
+            conn.commit()
+        return run_ids
+    
+    def finish_kpi_runs(self, run_ids, counts, started, error=None):
+        """Mark the batch's KPI runs completed with their row counts, or failed"""
+        if not run_ids:
+            return
+        execution_time_ms = int((time.perf_counter() - started) * 1000)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE calculation_runs r
+                SET status = v.status, completed_at = NOW(), execution_time_ms = v.execution_time_ms,
+                    output_data = v.output_data, error_message = v.error_message
+                FROM (VALUES %s) AS v(id, status, execution_time_ms, output_data, error_message)
+                WHERE r.id = v.id
+            """, [
+                (run_id, 'failed' if error else 'completed', execution_time_ms,
+                 None if error else json.dumps({'success': True, 'kpi_rows': counts.get(project_id, {})}), error)
+                for project_id, run_id in run_ids.items()
+            ], template='(%s::uuid, %s, %s::integer, %s::jsonb, %s)', page_size=1000)
+            conn.commit()
+    
+    def calculate_kpis_batch(self, project_ids=None):
+        """
+        Calculate monthly, quarterly and yearly KPIs for the latest consolidated
+        runs of many projects (all projects when project_ids is empty). Each level
+        is loaded in one query and its ratios computed in stacked engine calls.
+        Every project gets one kpi_calculation run, created in bulk, and its KPI
+        rows of all levels are saved under it, one multi-row insert per level.
+        Projects whose calculation lock is held are skipped.
+        """
+        run_ids = {}
+        started = time.perf_counter()
+        try:
+            project_ids = list(project_ids or []) or self.get_project_ids()
+            counts = {'monthly': 0, 'quarterly': 0, 'yearly': 0}
+            with project_locks(self.db_config, project_ids) as locked:
+                if locked:
+                    batch = self.build_kpis_batch(locked)
+                    run_ids = self.create_kpi_runs(batch)
+                    row_counts = {}
+                    for level, runs in batch.items():
+                        self.save_kpis_batch(level, runs, run_ids)
+                        counts[level] = len(runs)
+                        for project_id, run in runs.items():
+                            row_counts.setdefault(project_id, {})[level] = len(run['kpis'])
+                    self.finish_kpi_runs(run_ids, row_counts, started)
+            skipped = [project_id for project_id in project_ids if project_id not in locked]
+            
+            return {"success": True, "message": f"Calculated KPIs for {counts['monthly']} monthly, "
+                                                f"{counts['quarterly']} quarterly and {counts['yearly']} yearly runs",
+                    "calculation_run_ids": run_ids, "skipped_projects": skipped}
+            
+        except Exception as e:
+            try:
+                self.finish_kpi_runs(run_ids, {}, started, str(e))
+            except Exception:
+                pass
+            return {"success": False, "error": str(e)}
+    
+    def save_kpis_batch(self, level, runs, run_ids):
+        """
+        Save the KPI rows of many runs ({project_id: run with 'kpis'}) under the
+        projects' KPI runs (run_ids: {project_id: run id}) with one DELETE and
+        multi-row inserts, replacing those runs only
+        """
+        table = f'{level}_kpis'
+        runs = {project_id: run for project_id, run in runs.items() if run['kpis']}
+        if not runs:
+            return
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            if self.storage == 'arrays':
+                for project_id, run in runs.items():
+                    save_run_series(cursor, table, project_id, run_ids[project_id], run['kpis'])
+                conn.commit()
+                return
+            
+            cursor.execute(f"DELETE FROM {table} WHERE calculation_run_id = ANY(%s::uuid[])",
+                           ([run_ids[project_id] for project_id in runs],))
+            columns = CONSOLIDATED_LEVELS[level][2] + KPI_LEVEL_COLUMNS[level]
+            psycopg2.extras.execute_values(cursor, f"""
+                INSERT INTO {table} (project_id, calculation_run_id, {', '.join(columns)}) VALUES %s
+            """, [
+                (project_id, run_ids[project_id], *(row[column] for column in columns))
+                for project_id, run in runs.items()
+                for row in run['kpis']
+            ], page_size=1000)
+            conn.commit()
+    
     def calculate_quarterly_kpis(self, project_id, calculation_run_id, save_run_id=None):
         """Calculate quarterly KPIs from consolidated data"""
         try:
@@ -165,98 +451,40 @@ class KPICalculator:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT qc.quarter, qc.year, qc.quarter_name, qc.revenue, qc.cost_of_goods_sold, qc.gross_profit,
-                           qc.operating_expenses, qc.ebitda, qc.depreciation, qc.interest_expense, qc.net_income_before_tax,
-                           qc.income_tax_expense, qc.net_income, qc.cash, qc.accounts_receivable, qc.inventory,
-                           qc.other_current_assets, qc.ppe_net, qc.other_assets, qc.total_assets, qc.accounts_payable,
-                           qc.senior_secured, qc.debt_tranche1, qc.equity, qc.retained_earning, qc.total_equity_liability,
-                           qc.net_cash_operating, qc.capital_expenditures, qc.net_cash_investing, qc.proceeds_debt,
-                           qc.repayment_debt, qc.net_cash_financing, qc.net_cash_flow
-                    FROM quarterly_consolidated qc
-                    INNER JOIN (
-                        SELECT calculation_run_id 
-                        FROM quarterly_consolidated 
-                        WHERE project_id = %s 
-                        ORDER BY calculation_run_id DESC 
-                        LIMIT 1
-                    ) latest ON qc.calculation_run_id = latest.calculation_run_id
-                    WHERE qc.project_id = %s
-                    ORDER BY qc.year, qc.quarter
-                """, (project_id, project_id))
+                series = load_run_series(cursor, 'quarterly_consolidated', project_id)
+                if series is not None:
+                    results = list(zip(*(series[column] for column in QUARTERLY_COLUMNS)))
+                else:
+                    cursor.execute("""
+                        SELECT qc.quarter, qc.year, qc.quarter_name, qc.revenue, qc.cost_of_goods_sold, qc.gross_profit,
+                               qc.operating_expenses, qc.ebitda, qc.depreciation, qc.interest_expense, qc.net_income_before_tax,
+                               qc.income_tax_expense, qc.net_income, qc.cash, qc.accounts_receivable, qc.inventory,
+                               qc.other_current_assets, qc.ppe_net, qc.other_assets, qc.total_assets, qc.accounts_payable,
+                               qc.senior_secured, qc.debt_tranche1, qc.equity, qc.retained_earning, qc.total_equity_liability,
+                               qc.net_cash_operating, qc.capital_expenditures, qc.net_cash_investing, qc.proceeds_debt,
+                               qc.repayment_debt, qc.net_cash_financing, qc.net_cash_flow
+                        FROM quarterly_consolidated qc
+                        INNER JOIN (
+                            SELECT calculation_run_id 
+                            FROM quarterly_consolidated 
+                            WHERE project_id = %s 
+                            ORDER BY created_at DESC 
+                            LIMIT 1
+                        ) latest ON qc.calculation_run_id = latest.calculation_run_id
+                        WHERE qc.project_id = %s
+                        ORDER BY qc.year, qc.quarter
+                    """, (project_id, project_id))
                 
-                results = cursor.fetchall()
+                    results = cursor.fetchall()
                 
                 if not results:
                     raise ValueError("Quarterly consolidated data not found")
                 
-                columns = ['quarter', 'year', 'quarter_name', 'revenue', 'cost_of_goods_sold', 'gross_profit',
-                          'operating_expenses', 'ebitda', 'depreciation', 'interest_expense', 'net_income_before_tax',
-                          'income_tax_expense', 'net_income', 'cash', 'accounts_receivable', 'inventory',
-                          'other_current_assets', 'ppe_net', 'other_assets', 'total_assets', 'accounts_payable',
-                          'senior_secured', 'debt_tranche1', 'equity', 'retained_earning', 'total_equity_liability',
-                          'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
-                          'repayment_debt', 'net_cash_financing', 'net_cash_flow']
-                
-                quarterly_data = [dict(zip(columns, row)) for row in results]
-            
-            kpi_data = []
-            
-            for row in quarterly_data:
-                # Convert to float for calculations
-                revenue = float(row['revenue']) if row['revenue'] else 0
-                ebitda = float(row['ebitda']) if row['ebitda'] else 0
-                depreciation = float(row['depreciation']) if row['depreciation'] else 0
-                interest_expense = float(row['interest_expense']) if row['interest_expense'] else 0
-                senior_secured = float(row['senior_secured']) if row['senior_secured'] else 0
-                debt_tranche1 = float(row['debt_tranche1']) if row['debt_tranche1'] else 0
-                ppe_net = float(row['ppe_net']) if row['ppe_net'] else 0
-                cash = float(row['cash']) if row['cash'] else 0
-                accounts_receivable = float(row['accounts_receivable']) if row['accounts_receivable'] else 0
-                inventory = float(row['inventory']) if row['inventory'] else 0
-                other_current_assets = float(row['other_current_assets']) if row['other_current_assets'] else 0
-                other_assets = float(row['other_assets']) if row['other_assets'] else 0
-                accounts_payable = float(row['accounts_payable']) if row['accounts_payable'] else 0
-                equity = float(row['equity']) if row['equity'] else 0
-                retained_earning = float(row['retained_earning']) if row['retained_earning'] else 0
-                repayment_debt = float(row['repayment_debt']) if row['repayment_debt'] else 0
-                net_cash_operating = float(row['net_cash_operating']) if row['net_cash_operating'] else 0
-                net_cash_investing = float(row['net_cash_investing']) if row['net_cash_investing'] else 0
-                net_cash_financing = float(row['net_cash_financing']) if row['net_cash_financing'] else 0
-                cost_of_goods_sold = float(row['cost_of_goods_sold']) if row['cost_of_goods_sold'] else 0
-                
-                # Calculate KPIs (same formulas as monthly)
-                kpi_row = {
-                    'quarter': row['quarter'],
-                    'year': row['year'],
-                    'quarter_name': row['quarter_name'],
-                    
-                    # Debt-related KPIs
-                    'debt_to_ebitda': round((senior_secured + debt_tranche1) / ebitda, 4) if ebitda != 0 else 0,
-                    'debt_service_coverage_ratio': round(ebitda / abs(repayment_debt), 4) if repayment_debt != 0 else 0,
-                    'loan_to_value_ratio': round((senior_secured + debt_tranche1) / ppe_net, 4) if ppe_net != 0 else 0,
-                    'interest_coverage_ratio': round((ebitda + depreciation) / abs(interest_expense), 4) if interest_expense != 0 else 0,
-                    
-                    # Liquidity KPIs
-                    'current_ratio': round((cash + accounts_receivable + inventory + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    'quick_ratio': round((cash + accounts_receivable + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    
-                    # Leverage KPIs
-                    'debt_to_equity_ratio': round((senior_secured + debt_tranche1) / (equity + retained_earning), 4) if (equity + retained_earning) != 0 else 0,
-                    
-                    # Profitability KPIs
-                    'operating_margin': round(ebitda / revenue, 4) if revenue != 0 else 0,
-                    
-                    # Cash Flow KPIs
-                    'fcff': round(net_cash_operating + net_cash_investing, 2),
-                    'fcfe': round(net_cash_operating + net_cash_investing + net_cash_financing, 2),
-                    
-                    # Working Capital KPIs
-                    'ar_cycle_days': round(365 * accounts_receivable / revenue, 2) if revenue != 0 else 0,
-                    'inventory_cycle_days': round(365 * inventory / abs(cost_of_goods_sold), 2) if cost_of_goods_sold != 0 else 0
-                }
-                
-                kpi_data.append(kpi_row)
+                quarterly_data = decode_rows(results, QUARTERLY_COLUMNS,
+                                             passthrough=CONSOLIDATED_LEVELS['quarterly'][2])
+            
+            kpi_data = self.build_kpi_rows(quarterly_data, CONSOLIDATED_LEVELS['quarterly'][2])
+            self.add_coverage_kpis([{'data': quarterly_data, 'kpis': kpi_data}], 4)
             
             # Save to database
             save_id = save_run_id if save_run_id else calculation_run_id
@@ -274,96 +502,39 @@ class KPICalculator:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT yc.year, yc.revenue, yc.cost_of_goods_sold, yc.gross_profit,
-                           yc.operating_expenses, yc.ebitda, yc.depreciation, yc.interest_expense, yc.net_income_before_tax,
-                           yc.income_tax_expense, yc.net_income, yc.cash, yc.accounts_receivable, yc.inventory,
-                           yc.other_current_assets, yc.ppe_net, yc.other_assets, yc.total_assets, yc.accounts_payable,
-                           yc.senior_secured, yc.debt_tranche1, yc.equity, yc.retained_earning, yc.total_equity_liability,
-                           yc.net_cash_operating, yc.capital_expenditures, yc.net_cash_investing, yc.proceeds_debt,
-                           yc.repayment_debt, yc.net_cash_financing, yc.net_cash_flow
-                    FROM yearly_consolidated yc
-                    INNER JOIN (
-                        SELECT calculation_run_id 
-                        FROM yearly_consolidated 
-                        WHERE project_id = %s 
-                        ORDER BY calculation_run_id DESC 
-                        LIMIT 1
-                    ) latest ON yc.calculation_run_id = latest.calculation_run_id
-                    WHERE yc.project_id = %s
-                    ORDER BY yc.year
-                """, (project_id, project_id))
+                series = load_run_series(cursor, 'yearly_consolidated', project_id)
+                if series is not None:
+                    results = list(zip(*(series[column] for column in YEARLY_COLUMNS)))
+                else:
+                    cursor.execute("""
+                        SELECT yc.year, yc.revenue, yc.cost_of_goods_sold, yc.gross_profit,
+                               yc.operating_expenses, yc.ebitda, yc.depreciation, yc.interest_expense, yc.net_income_before_tax,
+                               yc.income_tax_expense, yc.net_income, yc.cash, yc.accounts_receivable, yc.inventory,
+                               yc.other_current_assets, yc.ppe_net, yc.other_assets, yc.total_assets, yc.accounts_payable,
+                               yc.senior_secured, yc.debt_tranche1, yc.equity, yc.retained_earning, yc.total_equity_liability,
+                               yc.net_cash_operating, yc.capital_expenditures, yc.net_cash_investing, yc.proceeds_debt,
+                               yc.repayment_debt, yc.net_cash_financing, yc.net_cash_flow
+                        FROM yearly_consolidated yc
+                        INNER JOIN (
+                            SELECT calculation_run_id 
+                            FROM yearly_consolidated 
+                            WHERE project_id = %s 
+                            ORDER BY created_at DESC 
+                            LIMIT 1
+                        ) latest ON yc.calculation_run_id = latest.calculation_run_id
+                        WHERE yc.project_id = %s
+                        ORDER BY yc.year
+                    """, (project_id, project_id))
                 
-                results = cursor.fetchall()
+                    results = cursor.fetchall()
                 
                 if not results:
                     raise ValueError("Yearly consolidated data not found")
                 
-                columns = ['year', 'revenue', 'cost_of_goods_sold', 'gross_profit',
-                          'operating_expenses', 'ebitda', 'depreciation', 'interest_expense', 'net_income_before_tax',
-                          'income_tax_expense', 'net_income', 'cash', 'accounts_receivable', 'inventory',
-                          'other_current_assets', 'ppe_net', 'other_assets', 'total_assets', 'accounts_payable',
-                          'senior_secured', 'debt_tranche1', 'equity', 'retained_earning', 'total_equity_liability',
-                          'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
-                          'repayment_debt', 'net_cash_financing', 'net_cash_flow']
-                
-                yearly_data = [dict(zip(columns, row)) for row in results]
-            
-            kpi_data = []
-            
-            for row in yearly_data:
-                # Convert to float for calculations
-                revenue = float(row['revenue']) if row['revenue'] else 0
-                ebitda = float(row['ebitda']) if row['ebitda'] else 0
-                depreciation = float(row['depreciation']) if row['depreciation'] else 0
-                interest_expense = float(row['interest_expense']) if row['interest_expense'] else 0
-                senior_secured = float(row['senior_secured']) if row['senior_secured'] else 0
-                debt_tranche1 = float(row['debt_tranche1']) if row['debt_tranche1'] else 0
-                ppe_net = float(row['ppe_net']) if row['ppe_net'] else 0
-                cash = float(row['cash']) if row['cash'] else 0
-                accounts_receivable = float(row['accounts_receivable']) if row['accounts_receivable'] else 0
-                inventory = float(row['inventory']) if row['inventory'] else 0
-                other_current_assets = float(row['other_current_assets']) if row['other_current_assets'] else 0
-                other_assets = float(row['other_assets']) if row['other_assets'] else 0
-                accounts_payable = float(row['accounts_payable']) if row['accounts_payable'] else 0
-                equity = float(row['equity']) if row['equity'] else 0
-                retained_earning = float(row['retained_earning']) if row['retained_earning'] else 0
-                repayment_debt = float(row['repayment_debt']) if row['repayment_debt'] else 0
-                net_cash_operating = float(row['net_cash_operating']) if row['net_cash_operating'] else 0
-                net_cash_investing = float(row['net_cash_investing']) if row['net_cash_investing'] else 0
-                net_cash_financing = float(row['net_cash_financing']) if row['net_cash_financing'] else 0
-                cost_of_goods_sold = float(row['cost_of_goods_sold']) if row['cost_of_goods_sold'] else 0
-                
-                # Calculate KPIs (same formulas as monthly/quarterly)
-                kpi_row = {
-                    'year': row['year'],
-                    
-                    # Debt-related KPIs
-                    'debt_to_ebitda': round((senior_secured + debt_tranche1) / ebitda, 4) if ebitda != 0 else 0,
-                    'debt_service_coverage_ratio': round(ebitda / abs(repayment_debt), 4) if repayment_debt != 0 else 0,
-                    'loan_to_value_ratio': round((senior_secured + debt_tranche1) / ppe_net, 4) if ppe_net != 0 else 0,
-                    'interest_coverage_ratio': round((ebitda + depreciation) / abs(interest_expense), 4) if interest_expense != 0 else 0,
-                    
-                    # Liquidity KPIs
-                    'current_ratio': round((cash + accounts_receivable + inventory + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    'quick_ratio': round((cash + accounts_receivable + other_current_assets + other_assets) / accounts_payable, 4) if accounts_payable != 0 else 0,
-                    
-                    # Leverage KPIs
-                    'debt_to_equity_ratio': round((senior_secured + debt_tranche1) / (equity + retained_earning), 4) if (equity + retained_earning) != 0 else 0,
-                    
-                    # Profitability KPIs
-                    'operating_margin': round(ebitda / revenue, 4) if revenue != 0 else 0,
-                    
-                    # Cash Flow KPIs
-                    'fcff': round(net_cash_operating + net_cash_investing, 2),
-                    'fcfe': round(net_cash_operating + net_cash_investing + net_cash_financing, 2),
-                    
-                    # Working Capital KPIs
-                    'ar_cycle_days': round(365 * accounts_receivable / revenue, 2) if revenue != 0 else 0,
-                    'inventory_cycle_days': round(365 * inventory / abs(cost_of_goods_sold), 2) if cost_of_goods_sold != 0 else 0
-                }
-                
-                kpi_data.append(kpi_row)
+                yearly_data = decode_rows(results, YEARLY_COLUMNS, passthrough=CONSOLIDATED_LEVELS['yearly'][2])
+            
+            kpi_data = self.build_kpi_rows(yearly_data, CONSOLIDATED_LEVELS['yearly'][2])
+            self.add_coverage_kpis([{'data': yearly_data, 'kpis': kpi_data}], 1)
             
             # Save to database
             save_id = save_run_id if save_run_id else calculation_run_id
@@ -379,8 +550,14 @@ class KPICalculator:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Delete existing KPIs for this project
-            cursor.execute("DELETE FROM monthly_kpis WHERE project_id = %s", (project_id,))
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'monthly_kpis', project_id, calculation_run_id, kpi_data)
+                conn.commit()
+                return
+            
+            # Replace this calculation run only; older runs are kept for the retention job
+            cursor.execute("DELETE FROM monthly_kpis WHERE project_id = %s AND calculation_run_id = %s",
+                           (project_id, calculation_run_id))
             
             # Insert new KPIs
             for row in kpi_data:
@@ -389,13 +566,19 @@ class KPICalculator:
                         project_id, month, year, month_name,
                         debt_to_ebitda, debt_service_coverage_ratio, loan_to_value_ratio, interest_coverage_ratio,
                         current_ratio, quick_ratio, debt_to_equity_ratio, operating_margin,
-                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id,
+                        ebitda_ltm, debt_service_ltm, interest_expense_ltm, debt_to_ebitda_ltm,
+                        debt_service_coverage_ratio_ltm, interest_coverage_ratio_ltm, operating_margin_ltm,
+                        fcff_ltm, fcfe_ltm, ar_cycle_days_ltm, inventory_cycle_days_ltm,
+                        cfads, llcr, plcr
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                              %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     project_id, row['month'], row['year'], row['month_name'],
                     row['debt_to_ebitda'], row['debt_service_coverage_ratio'], row['loan_to_value_ratio'], row['interest_coverage_ratio'],
                     row['current_ratio'], row['quick_ratio'], row['debt_to_equity_ratio'], row['operating_margin'],
-                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id
+                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id,
+                    *[row[key] for key in LTM_KPIS + COVERAGE_KPIS]
                 ))
             
             conn.commit()
@@ -405,8 +588,14 @@ class KPICalculator:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Delete existing KPIs for this project
-            cursor.execute("DELETE FROM quarterly_kpis WHERE project_id = %s", (project_id,))
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'quarterly_kpis', project_id, calculation_run_id, kpi_data)
+                conn.commit()
+                return
+            
+            # Replace this calculation run only; older runs are kept for the retention job
+            cursor.execute("DELETE FROM quarterly_kpis WHERE project_id = %s AND calculation_run_id = %s",
+                           (project_id, calculation_run_id))
             
             # Insert new KPIs
             for row in kpi_data:
@@ -415,13 +604,15 @@ class KPICalculator:
                         project_id, quarter, year, quarter_name,
                         debt_to_ebitda, debt_service_coverage_ratio, loan_to_value_ratio, interest_coverage_ratio,
                         current_ratio, quick_ratio, debt_to_equity_ratio, operating_margin,
-                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id,
+                        cfads, llcr, plcr
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     project_id, row['quarter'], row['year'], row['quarter_name'],
                     row['debt_to_ebitda'], row['debt_service_coverage_ratio'], row['loan_to_value_ratio'], row['interest_coverage_ratio'],
                     row['current_ratio'], row['quick_ratio'], row['debt_to_equity_ratio'], row['operating_margin'],
-                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id
+                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id,
+                    *[row[key] for key in COVERAGE_KPIS]
                 ))
             
             conn.commit()
@@ -431,8 +622,14 @@ class KPICalculator:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Delete existing KPIs for this project
-            cursor.execute("DELETE FROM yearly_kpis WHERE project_id = %s", (project_id,))
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'yearly_kpis', project_id, calculation_run_id, kpi_data)
+                conn.commit()
+                return
+            
+            # Replace this calculation run only; older runs are kept for the retention job
+            cursor.execute("DELETE FROM yearly_kpis WHERE project_id = %s AND calculation_run_id = %s",
+                           (project_id, calculation_run_id))
             
             # Insert new KPIs
             for row in kpi_data:
@@ -441,21 +638,29 @@ class KPICalculator:
                         project_id, year,
                         debt_to_ebitda, debt_service_coverage_ratio, loan_to_value_ratio, interest_coverage_ratio,
                         current_ratio, quick_ratio, debt_to_equity_ratio, operating_margin,
-                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        fcff, fcfe, ar_cycle_days, inventory_cycle_days, calculation_run_id,
+                        cfads, llcr, plcr
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     project_id, row['year'],
                     row['debt_to_ebitda'], row['debt_service_coverage_ratio'], row['loan_to_value_ratio'], row['interest_coverage_ratio'],
                     row['current_ratio'], row['quick_ratio'], row['debt_to_equity_ratio'], row['operating_margin'],
-                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id
+                    row['fcff'], row['fcfe'], row['ar_cycle_days'], row['inventory_cycle_days'], calculation_run_id,
+                    *[row[key] for key in COVERAGE_KPIS]
                 ))
             
             conn.commit()
 
 def main():
     parser = argparse.ArgumentParser(description='Calculate KPIs from consolidated data')
-    parser.add_argument('project_id', help='Project ID')
-    parser.add_argument('calculation_run_id', help='Calculation Run ID')
+    parser.add_argument('project_id', nargs='?', help='Project ID')
+    parser.add_argument('calculation_run_id', nargs='?', help='Calculation Run ID')
+    parser.add_argument('--batch', nargs='*', metavar='PROJECT_ID', default=None,
+                        help='Calculate KPIs for the latest runs of these projects (all when none given) in one pass')
+    parser.add_argument('--discount-rate', type=float, default=None,
+                        help='Annual discount rate in percent for LLCR/PLCR (default: implied cost of debt)')
+    add_format_argument(parser)
+    add_storage_argument(parser)
     parser.add_argument('--db-host', default=None, help='Database host')
     parser.add_argument('--db-port', default=None, help='Database port')
     parser.add_argument('--db-name', default=None, help='Database name')
@@ -477,21 +682,40 @@ def main():
     db_password = args.db_password or os.getenv('POSTGRESQL_PASSWORD', '')
     
     calculator = KPICalculator(
-        db_host, db_port, db_name, db_user, db_password
+        db_host, db_port, db_name, db_user, db_password, args.discount_rate, args.storage
     )
     
+    writer = ResultWriter(args.result_format)
+    
+    if args.batch is not None:
+        batch_result = calculator.calculate_kpis_batch(args.batch)
+        writer.result(batch_result)
+        if not batch_result.get('success'):
+            sys.exit(1)
+        return
+    
+    if not args.project_id or not args.calculation_run_id:
+        parser.error('project_id and calculation_run_id are required unless --batch is used')
+    
     # Calculate all KPI types - use None to get latest consolidated data, but pass calculation_run_id for saving
-    monthly_result = calculator.calculate_monthly_kpis(args.project_id, None, args.calculation_run_id)
-    quarterly_result = calculator.calculate_quarterly_kpis(args.project_id, None, args.calculation_run_id)
-    yearly_result = calculator.calculate_yearly_kpis(args.project_id, None, args.calculation_run_id)
+    try:
+        with project_lock(calculator.db_config, args.project_id):
+            monthly_result = calculator.calculate_monthly_kpis(args.project_id, None, args.calculation_run_id)
+            writer.stage('monthly', monthly_result)
+            quarterly_result = calculator.calculate_quarterly_kpis(args.project_id, None, args.calculation_run_id)
+            writer.stage('quarterly', quarterly_result)
+            yearly_result = calculator.calculate_yearly_kpis(args.project_id, None, args.calculation_run_id)
+            writer.stage('yearly', yearly_result)
+    except Exception as e:
+        writer.result({'success': False, 'error': str(e)})
+        sys.exit(1)
     
-    # Print results
-    print(f"Monthly KPIs: {monthly_result}")
-    print(f"Quarterly KPIs: {quarterly_result}")
-    print(f"Yearly KPIs: {yearly_result}")
+    failed = [result['error'] for result in (monthly_result, quarterly_result, yearly_result)
+              if not result.get('success')]
+    writer.result({'success': not failed, 'error': '; '.join(failed)} if failed else {'success': True})
     
     # Exit with error if any calculation failed
-    if not monthly_result.get('success') or not quarterly_result.get('success') or not yearly_result.get('success'):
+    if failed:
         sys.exit(1)
 
 if __name__ == "__main__":
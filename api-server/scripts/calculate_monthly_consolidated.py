@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import sys
-import json
 try:
     import psycopg2
 except ImportError:
@@ -13,127 +12,286 @@ import numpy as np
 from datetime import datetime
 import argparse
 
+import model_engine
+from check_integrity import IntegrityChecker
+from result_protocol import add_format_argument, write_result
+from run_storage import add_storage_argument, load_run_series, resolve_storage, save_run_series
+from numeric_decoding import decode_rows, register_float_numeric
+from input_cache import load_latest_input
+from project_lock import project_lock
+
 class MonthlyConsolidatedCalculator:
-    def __init__(self, db_config):
+    def __init__(self, db_config, storage=None):
         self.db_config = db_config
+        self.storage = resolve_storage(storage)
 
     def get_connection(self):
-        return psycopg2.connect(**self.db_config)
+        return register_float_numeric(psycopg2.connect(**self.db_config))
 
     def get_balance_sheet_data(self, project_id):
         """Get balance sheet data for the project"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT cash, accounts_receivable, inventory, other_current_assets, ppe, other_assets,
-                       accounts_payable, senior_secured, debt_tranche1, total_equity, retained_earnings
-                FROM balance_sheet_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """, (project_id,))
-            result = cursor.fetchone()
+        result = load_latest_input(self.get_connection, 'balance_sheet_data', project_id)
             
-            if not result:
-                raise ValueError("Balance sheet data not found")
+        if not result:
+            raise ValueError("Balance sheet data not found")
             
-            return {
-                'cash': float(result[0]) if result[0] else 0,
-                'accounts_receivable': float(result[1]) if result[1] else 0,
-                'inventory': float(result[2]) if result[2] else 0,
-                'other_current_assets': float(result[3]) if result[3] else 0,
-                'ppe': float(result[4]) if result[4] else 0,
-                'other_assets': float(result[5]) if result[5] else 0,
-                'accounts_payable': float(result[6]) if result[6] else 0,
-                'senior_secured': float(result[7]) if result[7] else 0,
-                'debt_tranche1': float(result[8]) if result[8] else 0,
-                'equity': float(result[9]) if result[9] else 0,  # total_equity from DB
-                'retained_earning': float(result[10]) if result[10] else 0  # retained_earnings from DB
-            }
+        return {
+            'cash': float(result['cash']) if result['cash'] else 0,
+            'accounts_receivable': float(result['accounts_receivable']) if result['accounts_receivable'] else 0,
+            'inventory': float(result['inventory']) if result['inventory'] else 0,
+            'other_current_assets': float(result['other_current_assets']) if result['other_current_assets'] else 0,
+            'ppe': float(result['ppe']) if result['ppe'] else 0,
+            'other_assets': float(result['other_assets']) if result['other_assets'] else 0,
+            'accounts_payable': float(result['accounts_payable']) if result['accounts_payable'] else 0,
+            'senior_secured': float(result['senior_secured']) if result['senior_secured'] else 0,
+            'debt_tranche1': float(result['debt_tranche1']) if result['debt_tranche1'] else 0,
+            'equity': float(result['total_equity']) if result['total_equity'] else 0,
+            'retained_earning': float(result['retained_earnings']) if result['retained_earnings'] else 0
+        }
 
     def get_profit_loss_data(self, project_id):
         """Get profit loss data for the project"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT revenue, cogs, operating_expenses, depreciation, interest_expense, taxes
-                FROM profit_loss_data 
-                WHERE project_id = %s 
-                ORDER BY version DESC 
-                LIMIT 1
-            """, (project_id,))
-            result = cursor.fetchone()
+        result = load_latest_input(self.get_connection, 'profit_loss_data', project_id)
             
-            if not result:
-                raise ValueError("Profit loss data not found")
+        if not result:
+            raise ValueError("Profit loss data not found")
             
-            return {
-                'revenue': float(result[0]) if result[0] else 0,
-                'cost_of_goods_sold': float(result[1]) if result[1] else 0,  # cogs from DB
-                'operating_expenses': float(result[2]) if result[2] else 0,
-                'depreciation': float(result[3]) if result[3] else 0,
-                'interest_expense': float(result[4]) if result[4] else 0,
-                'income_tax_expense': float(result[5]) if result[5] else 0  # taxes from DB
+        return {
+            'revenue': float(result['revenue']) if result['revenue'] else 0,
+            'cost_of_goods_sold': float(result['cogs']) if result['cogs'] else 0,
+            'operating_expenses': float(result['operating_expenses']) if result['operating_expenses'] else 0,
+            'depreciation': float(result['depreciation']) if result['depreciation'] else 0,
+            'interest_expense': float(result['interest_expense']) if result['interest_expense'] else 0,
+            'income_tax_expense': float(result['taxes']) if result['taxes'] else 0,
+            'tax_rate': float(result['tax_rates']) if result['tax_rates'] else 0  # in percent
+        }
+
+    def get_working_capital_data(self, project_id):
+        """Get working capital drivers for the project, in percent"""
+        result = load_latest_input(self.get_connection, 'working_capital_data', project_id)
+            
+        if not result:
+            return None
+            
+        return {
+            'ar_pct': float(result['account_receivable_percent']) if result['account_receivable_percent'] else 0,
+            'inventory_pct': float(result['inventory_percent']) if result['inventory_percent'] else 0,
+            'oca_pct': float(result['other_current_assets_percent']) if result['other_current_assets_percent'] else 0,
+            'ap_pct': float(result['accounts_payable_percent']) if result['accounts_payable_percent'] else 0
+        }
+
+    def calculate_working_capital(self, balance_sheet_data, profit_loss_data, working_capital_data, nb_months=120):
+        """
+        Working-capital balances from forward 12-month revenue and costs, or the
+        static balance sheet values when no working capital drivers are stored
+        """
+        opening_working_capital = (balance_sheet_data['accounts_receivable'] + balance_sheet_data['inventory']
+                                   + balance_sheet_data['other_current_assets']
+                                   - balance_sheet_data['accounts_payable'])
+        if not working_capital_data:
+            static = {
+                key: np.full(nb_months, balance_sheet_data[key])
+                for key in ('accounts_receivable', 'inventory', 'other_current_assets', 'accounts_payable')
             }
+            static['change_in_working_capital'] = np.zeros(nb_months)
+            return static
+
+        return model_engine.working_capital(
+            np.full(nb_months, profit_loss_data['revenue']),
+            np.full(nb_months, profit_loss_data['cost_of_goods_sold']),
+            np.full(nb_months, profit_loss_data['operating_expenses']),
+            working_capital_data['ar_pct'],
+            working_capital_data['inventory_pct'],
+            working_capital_data['oca_pct'],
+            working_capital_data['ap_pct'],
+            opening_working_capital)
+
+    def get_debt_structure_data(self, project_id):
+        """Get debt structure data for the project"""
+        columns = [
+            f'{term}_{suffix}'
+            for suffix in ('senior_secured', 'short_term')
+            for term in ('additional_loan', 'bank_base_rate', 'liquidity_premiums',
+                         'credit_risk_premiums', 'maturity_y', 'amortization_y')
+        ]
+        result = load_latest_input(self.get_connection, 'debt_structure_data', project_id)
+            
+        if not result:
+            raise ValueError("Debt structure data not found")
+            
+        return {column: result[column] for column in columns}
 
     def get_debt_calculations(self, project_id):
         """Get debt calculations for the project"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT month, year, opening_balance, payment, interest_payment, closing_balance, cumulative_interest
-                FROM debt_calculations 
-                WHERE project_id = %s 
-                ORDER BY month
-            """, (project_id,))
-            results = cursor.fetchall()
-            
-            if not results:
-                return []
+            columns = ['month', 'year', 'opening_balance', 'payment', 'interest_payment', 'closing_balance',
+                       'cumulative_interest']
+            series = load_run_series(cursor, 'debt_calculations', project_id)
+            if series is not None:
+                results = list(zip(*(series[column] for column in columns)))
+            else:
+                cursor.execute(f"""
+                    SELECT {', '.join(columns)}
+                    FROM debt_calculations 
+                    WHERE project_id = %s 
+                    ORDER BY month
+                """, (project_id,))
+                results = cursor.fetchall()
             
-            return [
-                {
-                    'month': row[0],
-                    'year': row[1],
-                    'opening_balance': float(row[2]) if row[2] else 0,
-                    'payment': float(row[3]) if row[3] else 0,
-                    'interest': float(row[4]) if row[4] else 0,  # interest_payment from DB
-                    'closing_balance': float(row[5]) if row[5] else 0,
-                    'additional_loan': 0,  # Not available in DB
-                    'total_repayment': float(row[6]) if row[6] else 0  # cumulative_interest from DB
-                }
-                for row in results
-            ]
+            # interest and total_repayment are interest_payment and cumulative_interest from DB
+            names = ['month', 'year', 'opening_balance', 'payment', 'interest', 'closing_balance', 'total_repayment']
+            # additional_loan is not available in DB
+            return decode_rows(results, names, passthrough=('month', 'year'), constants={'additional_loan': 0})
 
     def get_depreciation_schedule(self, project_id):
         """Get depreciation schedule for the project"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT month, year, asset_value, monthly_depreciation, accumulated_depreciation, net_book_value
-                FROM depreciation_schedule 
-                WHERE project_id = %s 
-                ORDER BY month
-            """, (project_id,))
-            results = cursor.fetchall()
-            
-            if not results:
-                return []
+            columns = ['month', 'year', 'asset_value', 'monthly_depreciation', 'accumulated_depreciation',
+                       'net_book_value']
+            series = load_run_series(cursor, 'depreciation_schedule', project_id)
+            if series is not None:
+                results = list(zip(*(series[column] for column in columns)))
+            else:
+                cursor.execute(f"""
+                    SELECT {', '.join(columns)}
+                    FROM depreciation_schedule 
+                    WHERE project_id = %s 
+                    ORDER BY month
+                """, (project_id,))
+                results = cursor.fetchall()
             
-            return [
-                {
-                    'month': row[0],
-                    'year': row[1],
-                    'asset_value': float(row[2]) if row[2] else 0,
-                    'monthly_depreciation': float(row[3]) if row[3] else 0,
-                    'accumulated_depreciation': float(row[4]) if row[4] else 0,
-                    'net_book_value': float(row[5]) if row[5] else 0,
-                    'capex_addition': 0  # Not available in DB
-                }
-                for row in results
-            ]
+            # capex_addition is not available in DB
+            return decode_rows(results, columns, passthrough=('month', 'year'), constants={'capex_addition': 0})
+
+    def apply_tax(self, monthly_data, tax_rate, opening_tax_losses=0.0, loss_cap_pct=None, loss_cap_amount=None):
+        """Charge tax on pre-tax income with loss carry-forward and restate net income and cash flows"""
+        schedule = model_engine.tax_schedule(
+            np.array([r['net_income_before_tax'] for r in monthly_data]), tax_rate,
+            opening_tax_losses, loss_cap_pct, loss_cap_amount)
+        for i, record in enumerate(monthly_data):
+            income_tax_expense = round(float(schedule['tax_payable'][i]), 2)
+            net_income = round(record['net_income_before_tax'] - income_tax_expense, 2)
+            net_cash_operating = round(net_income + record['depreciation'] + record['change_in_working_capital'], 2)
+            record.update({
+                'income_tax_expense': income_tax_expense,
+                'net_income': net_income,
+                'net_cash_operating': net_cash_operating,
+                'net_cash_flow': round(net_cash_operating + record['net_cash_investing']
+                                       + record['net_cash_financing'], 2),
+                'tax_loss_carryforward': round(float(schedule['loss_carryforward'][i]), 2),
+                'deferred_tax_asset': round(float(schedule['deferred_tax_asset'][i]), 2),
+            })
+        return self.summarize_tax(schedule, tax_rate)
+
+    def summarize_tax(self, schedule, tax_rate):
+        """Summary of a tax schedule for the script output"""
+        return {
+            'tax_rate': tax_rate,
+            'total_tax_payable': round(float(schedule['tax_payable'].sum()), 2),
+            'total_losses_used': round(float(schedule['losses_used'].sum()), 2),
+            'closing_loss_carryforward': round(float(schedule['loss_carryforward'].ravel()[-1]), 2),
+            'closing_deferred_tax_asset': round(float(schedule['deferred_tax_asset'].ravel()[-1]), 2),
+        }
+
+    def apply_cash_waterfall(self, monthly_data, balance_sheet_data, debt_structure_data, cash_sweep=False,
+                             min_cash=0.0, priority=None, tax_rate=None, deposit_rate=0.0,
+                             opening_tax_losses=0.0, loss_cap_pct=None, loss_cap_amount=None,
+                             tolerance=0.01, method='anderson'):
+        """
+        Roll cash and debt forward through the model engine and restate interest,
+        tax, debt balances, cash and cash flows. With cash_sweep, cash above
+        min_cash prepays tranches in priority order. With a tax_rate, tax and
+        interest earned on cash are solved together with the debt as a fixed point.
+        """
+        terms = model_engine.tranche_terms(debt_structure_data, {
+            'senior_secured': balance_sheet_data['senior_secured'],
+            'debt_tranche1': balance_sheet_data['debt_tranche1'],
+        })
+        nb_months = len(monthly_data)
+        model = model_engine.monthly_model(
+            terms,
+            ebitda=np.array([r['ebitda'] for r in monthly_data]),
+            opening_cash=balance_sheet_data['cash'],
+            depreciation=np.array([r['depreciation'] for r in monthly_data]),
+            capex=np.array([r['capital_expenditures'] for r in monthly_data]),
+            working_capital_change=np.array([r['change_in_working_capital'] for r in monthly_data]),
+            tax=np.array([r['income_tax_expense'] for r in monthly_data]),
+            tax_rate=tax_rate,
+            deposit_rate=deposit_rate,
+            min_cash=min_cash if cash_sweep else np.inf,
+            priority=priority,
+            opening_tax_losses=opening_tax_losses,
+            loss_cap_pct=loss_cap_pct,
+            loss_cap_amount=loss_cap_amount,
+            tolerance=tolerance,
+            method=method,
+            nb_months=nb_months)
+
+        tranches = model['tranches']
+        total = model['total']
+        for i, record in enumerate(monthly_data):
+            # Interest earned on cash is netted against interest on debt
+            interest_expense = round(float(total['interest'][0, i] - model['interest_income'][0, i]), 2)
+            net_income_before_tax = round(record['ebitda'] - record['depreciation'] - interest_expense, 2)
+            income_tax_expense = round(float(model['tax'][0, i]), 2)
+            net_income = round(net_income_before_tax - income_tax_expense, 2)
+            cash = round(float(model['closing_cash'][0, i]), 2)
+            senior_secured = round(float(tranches['senior_secured']['closing'][0, i]), 2)
+            debt_tranche1 = round(float(tranches['short_term']['closing'][0, i]), 2)
 
-    def calculate_monthly_consolidated(self, project_id, calculation_run_id):
+            # Debt service includes interest, which net income already deducts
+            net_cash_operating = round(net_income + record['depreciation'] + record['change_in_working_capital'], 2)
+            proceeds_debt = round(float(total['additional_loan'][0, i]), 2)
+            repayment_debt = round(float(total['repayment'][0, i] + total['interest'][0, i]), 2)
+            net_cash_financing = round(proceeds_debt + repayment_debt, 2)
+
+            record.update({
+                'interest_expense': interest_expense,
+                'net_income_before_tax': net_income_before_tax,
+                'income_tax_expense': income_tax_expense,
+                'net_income': net_income,
+                'cash': cash,
+                'total_assets': round(cash + record['accounts_receivable'] + record['inventory']
+                                      + record['other_current_assets'] + record['ppe_net']
+                                      + record['other_assets'], 2),
+                'senior_secured': senior_secured,
+                'debt_tranche1': debt_tranche1,
+                'total_equity_liability': round(record['accounts_payable'] + senior_secured + debt_tranche1
+                                                + record['equity'] + record['retained_earning'], 2),
+                'net_cash_operating': net_cash_operating,
+                'proceeds_debt': proceeds_debt,
+                'repayment_debt': repayment_debt,
+                'net_cash_financing': net_cash_financing,
+                'net_cash_flow': round(net_cash_operating + record['net_cash_investing'] + net_cash_financing, 2),
+            })
+            if model['tax_schedule'] is not None:
+                record['tax_loss_carryforward'] = round(float(model['tax_schedule']['loss_carryforward'][0, i]), 2)
+                record['deferred_tax_asset'] = round(float(model['tax_schedule']['deferred_tax_asset'][0, i]), 2)
+
+        debt_free = np.flatnonzero(total['closing'][0] == 0)
+        summary = {
+            'solver': {key: value for key, value in model['solver'].items() if key != 'residuals'},
+        }
+        if model['tax_schedule'] is not None:
+            summary['tax'] = self.summarize_tax(model['tax_schedule'], tax_rate)
+        if cash_sweep:
+            summary['cash_sweep'] = {
+                'iterations': model['iterations'],
+                'converged': model['converged'],
+                'min_cash': min_cash,
+                'priority': list(tranches),
+                'total_prepayment': round(float(-total['prepayment'][0].sum()), 2),
+                'total_interest': round(float(total['interest'][0].sum()), 2),
+                'debt_free_month': int(monthly_data[debt_free[0]]['month']) if len(debt_free) else None,
+            }
+        return summary
+
+    def calculate_monthly_consolidated(self, project_id, calculation_run_id, cash_sweep=False,
+                                       min_cash=0.0, sweep_priority=None, solve_circular=False,
+                                       deposit_rate=0.0, tolerance=0.01, method='anderson', compute_tax=False,
+                                       opening_tax_losses=0.0, loss_cap_pct=None, loss_cap_amount=None):
         """Calculate monthly consolidated financial statements"""
         try:
             # Get input data
@@ -141,112 +299,16 @@ class MonthlyConsolidatedCalculator:
             profit_loss_data = self.get_profit_loss_data(project_id)
             debt_calculations = self.get_debt_calculations(project_id)
             depreciation_schedule = self.get_depreciation_schedule(project_id)
+            working_capital_data = self.get_working_capital_data(project_id)
+            debt_structure_data = (self.get_debt_structure_data(project_id)
+                                   if cash_sweep or solve_circular else None)
             
-            if not debt_calculations or not depreciation_schedule:
-                raise ValueError("Debt calculations or depreciation schedule not found")
-            
-            # Create monthly consolidated data
-            monthly_data = []
-            
-            for month in range(1, 121):  # 120 months (10 years)
-                year = ((month - 1) // 12) + 1
-                month_in_year = ((month - 1) % 12) + 1
-                
-                # Get debt calculation for this month
-                debt_data = next((d for d in debt_calculations if d['month'] == month), None)
-                if not debt_data:
-                    continue
-                
-                # Get depreciation data for this month
-                dep_data = next((d for d in depreciation_schedule if d['month'] == month), None)
-                if not dep_data:
-                    continue
-                
-                # Calculate P&L items
-                revenue = round(profit_loss_data['revenue'], 2)
-                cost_of_goods_sold = round(profit_loss_data['cost_of_goods_sold'], 2)
-                gross_profit = round(revenue - cost_of_goods_sold, 2)
-                operating_expenses = round(profit_loss_data['operating_expenses'], 2)
-                ebitda = round(gross_profit - operating_expenses, 2)
-                depreciation = round(dep_data['monthly_depreciation'], 2)
-                interest_expense = round(debt_data['interest'], 2)
-                net_income_before_tax = round(ebitda - depreciation - interest_expense, 2)
-                income_tax_expense = round(profit_loss_data['income_tax_expense'], 2)
-                net_income = round(net_income_before_tax - income_tax_expense, 2)
-                
-                # Calculate Balance Sheet items
-                cash = round(balance_sheet_data['cash'], 2)
-                accounts_receivable = round(balance_sheet_data['accounts_receivable'], 2)
-                inventory = round(balance_sheet_data['inventory'], 2)
-                other_current_assets = round(balance_sheet_data['other_current_assets'], 2)
-                ppe_net = round(dep_data['net_book_value'], 2)
-                other_assets = round(balance_sheet_data['other_assets'], 2)
-                total_assets = round(cash + accounts_receivable + inventory + other_current_assets + ppe_net + other_assets, 2)
-                
-                accounts_payable = round(balance_sheet_data['accounts_payable'], 2)
-                senior_secured = round(balance_sheet_data['senior_secured'], 2)
-                debt_tranche1 = round(balance_sheet_data['debt_tranche1'], 2)
-                equity = round(balance_sheet_data['equity'], 2)
-                retained_earning = round(balance_sheet_data['retained_earning'], 2)
-                total_equity_liability = round(accounts_payable + senior_secured + debt_tranche1 + equity + retained_earning, 2)
-                
-                # Calculate Cash Flow items
-                net_cash_operating = round(net_income + depreciation, 2)
-                capital_expenditures = 0  # Not available in input data
-                net_cash_investing = round(-capital_expenditures, 2)
-                proceeds_debt = round(debt_data['additional_loan'], 2)
-                repayment_debt = round(debt_data['payment'], 2)
-                net_cash_financing = round(proceeds_debt - repayment_debt, 2)
-                net_cash_flow = round(net_cash_operating + net_cash_investing + net_cash_financing, 2)
-                
-                # Create monthly record
-                month_name = datetime(2020 + year - 1, month_in_year, 1).strftime('%B %Y')
-                
-                monthly_record = {
-                    'project_id': project_id,
-                    'month': month,
-                    'year': year,
-                    'month_name': month_name,
-                    'revenue': revenue,
-                    'cost_of_goods_sold': cost_of_goods_sold,
-                    'gross_profit': gross_profit,
-                    'operating_expenses': operating_expenses,
-                    'ebitda': ebitda,
-                    'depreciation': depreciation,
-                    'interest_expense': interest_expense,
-                    'net_income_before_tax': net_income_before_tax,
-                    'income_tax_expense': income_tax_expense,
-                    'net_income': net_income,
-                    'cash': cash,
-                    'accounts_receivable': accounts_receivable,
-                    'inventory': inventory,
-                    'other_current_assets': other_current_assets,
-                    'ppe_net': ppe_net,
-                    'other_assets': other_assets,
-                    'total_assets': total_assets,
-                    'accounts_payable': accounts_payable,
-                    'senior_secured': senior_secured,
-                    'debt_tranche1': debt_tranche1,
-                    'equity': equity,
-                    'retained_earning': retained_earning,
-                    'total_equity_liability': total_equity_liability,
-                    'net_cash_operating': net_cash_operating,
-                    'capital_expenditures': capital_expenditures,
-                    'net_cash_investing': net_cash_investing,
-                    'proceeds_debt': proceeds_debt,
-                    'repayment_debt': repayment_debt,
-                    'net_cash_financing': net_cash_financing,
-                    'net_cash_flow': net_cash_flow,
-                    'calculation_run_id': calculation_run_id
-                }
-                
-                monthly_data.append(monthly_record)
-            
-            return {
-                'success': True,
-                'total_months': len(monthly_data),
-                'data': monthly_data
-            }
+            return self.build_monthly_consolidated(
+                project_id, calculation_run_id, balance_sheet_data, profit_loss_data, debt_calculations,
+                depreciation_schedule, working_capital_data, debt_structure_data, cash_sweep=cash_sweep,
+                min_cash=min_cash, sweep_priority=sweep_priority, solve_circular=solve_circular,
+                deposit_rate=deposit_rate, tolerance=tolerance, method=method, compute_tax=compute_tax,
+                opening_tax_losses=opening_tax_losses, loss_cap_pct=loss_cap_pct, loss_cap_amount=loss_cap_amount)
             
         except Exception as e:
             return {
@@ -254,11 +316,161 @@ class MonthlyConsolidatedCalculator:
                 'error': str(e)
             }
 
+    def build_monthly_consolidated(self, project_id, calculation_run_id, balance_sheet_data, profit_loss_data,
+                                   debt_calculations, depreciation_schedule, working_capital_data,
+                                   debt_structure_data=None, cash_sweep=False, min_cash=0.0, sweep_priority=None,
+                                   solve_circular=False, deposit_rate=0.0, tolerance=0.01, method='anderson',
+                                   compute_tax=False, opening_tax_losses=0.0, loss_cap_pct=None,
+                                   loss_cap_amount=None):
+        """
+        Build the monthly statements from already loaded inputs, without touching
+        the database. debt_structure_data is only needed for the cash sweep and
+        the circular solve.
+        """
+        if not debt_calculations or not depreciation_schedule:
+            raise ValueError("Debt calculations or depreciation schedule not found")
+        
+        working_capital = self.calculate_working_capital(
+            balance_sheet_data, profit_loss_data, working_capital_data)
+        
+        # Create monthly consolidated data
+        monthly_data = []
+        
+        for month in range(1, 121):  # 120 months (10 years)
+            year = ((month - 1) // 12) + 1
+            month_in_year = ((month - 1) % 12) + 1
+            
+            # Get debt calculation for this month
+            debt_data = next((d for d in debt_calculations if d['month'] == month), None)
+            if not debt_data:
+                continue
+            
+            # Get depreciation data for this month
+            dep_data = next((d for d in depreciation_schedule if d['month'] == month), None)
+            if not dep_data:
+                continue
+            
+            # Calculate P&L items
+            revenue = round(profit_loss_data['revenue'], 2)
+            cost_of_goods_sold = round(profit_loss_data['cost_of_goods_sold'], 2)
+            gross_profit = round(revenue - cost_of_goods_sold, 2)
+            operating_expenses = round(profit_loss_data['operating_expenses'], 2)
+            ebitda = round(gross_profit - operating_expenses, 2)
+            depreciation = round(dep_data['monthly_depreciation'], 2)
+            interest_expense = round(debt_data['interest'], 2)
+            net_income_before_tax = round(ebitda - depreciation - interest_expense, 2)
+            income_tax_expense = round(profit_loss_data['income_tax_expense'], 2)
+            net_income = round(net_income_before_tax - income_tax_expense, 2)
+            
+            # Calculate Balance Sheet items
+            cash = round(balance_sheet_data['cash'], 2)
+            accounts_receivable = round(float(working_capital['accounts_receivable'][month - 1]), 2)
+            inventory = round(float(working_capital['inventory'][month - 1]), 2)
+            other_current_assets = round(float(working_capital['other_current_assets'][month - 1]), 2)
+            ppe_net = round(dep_data['net_book_value'], 2)
+            other_assets = round(balance_sheet_data['other_assets'], 2)
+            total_assets = round(cash + accounts_receivable + inventory + other_current_assets + ppe_net + other_assets, 2)
+            
+            accounts_payable = round(float(working_capital['accounts_payable'][month - 1]), 2)
+            senior_secured = round(balance_sheet_data['senior_secured'], 2)
+            debt_tranche1 = round(balance_sheet_data['debt_tranche1'], 2)
+            equity = round(balance_sheet_data['equity'], 2)
+            retained_earning = round(balance_sheet_data['retained_earning'], 2)
+            total_equity_liability = round(accounts_payable + senior_secured + debt_tranche1 + equity + retained_earning, 2)
+            
+            # Calculate Cash Flow items
+            change_in_working_capital = round(float(working_capital['change_in_working_capital'][month - 1]), 2) + 0.0  # avoid -0.0
+            net_cash_operating = round(net_income + depreciation + change_in_working_capital, 2)
+            capital_expenditures = 0  # Not available in input data
+            net_cash_investing = round(-capital_expenditures, 2)
+            proceeds_debt = round(debt_data['additional_loan'], 2)
+            repayment_debt = round(debt_data['payment'], 2)
+            net_cash_financing = round(proceeds_debt - repayment_debt, 2)
+            net_cash_flow = round(net_cash_operating + net_cash_investing + net_cash_financing, 2)
+            
+            # Create monthly record
+            month_name = datetime(2020 + year - 1, month_in_year, 1).strftime('%B %Y')
+            
+            monthly_record = {
+                'project_id': project_id,
+                'month': month,
+                'year': year,
+                'month_name': month_name,
+                'revenue': revenue,
+                'cost_of_goods_sold': cost_of_goods_sold,
+                'gross_profit': gross_profit,
+                'operating_expenses': operating_expenses,
+                'ebitda': ebitda,
+                'depreciation': depreciation,
+                'interest_expense': interest_expense,
+                'net_income_before_tax': net_income_before_tax,
+                'income_tax_expense': income_tax_expense,
+                'net_income': net_income,
+                'cash': cash,
+                'accounts_receivable': accounts_receivable,
+                'inventory': inventory,
+                'other_current_assets': other_current_assets,
+                'ppe_net': ppe_net,
+                'other_assets': other_assets,
+                'total_assets': total_assets,
+                'accounts_payable': accounts_payable,
+                'senior_secured': senior_secured,
+                'debt_tranche1': debt_tranche1,
+                'equity': equity,
+                'retained_earning': retained_earning,
+                'total_equity_liability': total_equity_liability,
+                'change_in_working_capital': change_in_working_capital,
+                'net_cash_operating': net_cash_operating,
+                'capital_expenditures': capital_expenditures,
+                'net_cash_investing': net_cash_investing,
+                'proceeds_debt': proceeds_debt,
+                'repayment_debt': repayment_debt,
+                'net_cash_financing': net_cash_financing,
+                'net_cash_flow': net_cash_flow,
+                'tax_loss_carryforward': 0.0,
+                'deferred_tax_asset': 0.0,
+                'calculation_run_id': calculation_run_id
+            }
+            
+            monthly_data.append(monthly_record)
+        
+        result = {
+            'success': True,
+            'total_months': len(monthly_data),
+            'data': monthly_data
+        }
+        
+        tax_options = {
+            'opening_tax_losses': opening_tax_losses,
+            'loss_cap_pct': loss_cap_pct,
+            'loss_cap_amount': loss_cap_amount,
+        }
+        tax_rate = profit_loss_data['tax_rate'] / 100 if solve_circular or compute_tax else None
+        if cash_sweep or solve_circular:
+            result.update(self.apply_cash_waterfall(
+                monthly_data, balance_sheet_data, debt_structure_data, cash_sweep=cash_sweep,
+                min_cash=min_cash, priority=sweep_priority, tax_rate=tax_rate,
+                deposit_rate=deposit_rate if solve_circular else 0.0,
+                tolerance=tolerance, method=method, **tax_options))
+        elif compute_tax:
+            result['tax'] = self.apply_tax(monthly_data, tax_rate, **tax_options)
+        
+        # Check that the balance sheet ties out and cash reconciles
+        result['integrity'] = IntegrityChecker(self.db_config).check_records(
+            monthly_data, balance_sheet_data['cash'])
+        
+        return result
+
     def save_monthly_consolidated(self, project_id, calculation_run_id, monthly_data):
         """Save monthly consolidated data to database"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'monthly_consolidated', project_id, calculation_run_id, monthly_data)
+                conn.commit()
+                return
+            
             # Delete existing data for this calculation run
             cursor.execute("""
                 DELETE FROM monthly_consolidated 
@@ -274,10 +486,11 @@ class MonthlyConsolidatedCalculator:
                         income_tax_expense, net_income, cash, accounts_receivable, inventory,
                         other_current_assets, ppe_net, other_assets, total_assets, accounts_payable,
                         senior_secured, debt_tranche1, equity, retained_earning, total_equity_liability,
-                        net_cash_operating, capital_expenditures, net_cash_investing, proceeds_debt,
-                        repayment_debt, net_cash_financing, net_cash_flow, calculation_run_id
+                        change_in_working_capital, net_cash_operating, capital_expenditures, net_cash_investing,
+                        proceeds_debt, repayment_debt, net_cash_financing, net_cash_flow,
+                        tax_loss_carryforward, deferred_tax_asset, calculation_run_id
                     ) VALUES (
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
                     )
                 """, (
                     record['project_id'], record['month'], record['year'], record['month_name'],
@@ -287,9 +500,11 @@ class MonthlyConsolidatedCalculator:
                     record['net_income'], record['cash'], record['accounts_receivable'], record['inventory'],
                     record['other_current_assets'], record['ppe_net'], record['other_assets'], record['total_assets'],
                     record['accounts_payable'], record['senior_secured'], record['debt_tranche1'], record['equity'],
-                    record['retained_earning'], record['total_equity_liability'], record['net_cash_operating'],
+                    record['retained_earning'], record['total_equity_liability'],
+                    record['change_in_working_capital'], record['net_cash_operating'],
                     record['capital_expenditures'], record['net_cash_investing'], record['proceeds_debt'],
-                    record['repayment_debt'], record['net_cash_financing'], record['net_cash_flow'], record['calculation_run_id']
+                    record['repayment_debt'], record['net_cash_financing'], record['net_cash_flow'],
+                    record['tax_loss_carryforward'], record['deferred_tax_asset'], record['calculation_run_id']
                 ))
             
             conn.commit()
@@ -303,6 +518,26 @@ def main():
     parser.add_argument('--database', default=None, help='Database name')
     parser.add_argument('--user', default=None, help='Database user')
     parser.add_argument('--password', default=None, help='Database password')
+    parser.add_argument('--cash-sweep', action='store_true', help='Sweep excess cash into debt prepayments')
+    parser.add_argument('--min-cash', type=float, default=0.0, help='Minimum cash balance kept before sweeping')
+    parser.add_argument('--sweep-priority', default='senior_secured,short_term',
+                        help='Comma-separated tranche order for prepayments')
+    parser.add_argument('--solve-circular', action='store_true',
+                        help='Solve interest, tax and cash together instead of using static inputs')
+    parser.add_argument('--deposit-rate', type=float, default=0.0,
+                        help='Interest earned on cash in percent per annum (with --solve-circular)')
+    parser.add_argument('--compute-tax', action='store_true',
+                        help='Charge tax at the P&L tax rate with loss carry-forward instead of the static input')
+    parser.add_argument('--opening-tax-losses', type=float, default=0.0, help='Tax losses brought forward')
+    parser.add_argument('--loss-cap-pct', type=float, default=None,
+                        help='Maximum share of each year\'s taxable income that losses may offset, in percent')
+    parser.add_argument('--loss-cap-amount', type=float, default=None,
+                        help='Maximum losses used per tax year')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='Fixed-point convergence tolerance')
+    parser.add_argument('--method', default='anderson', choices=['anderson', 'picard'],
+                        help='Fixed-point iteration method')
+    add_format_argument(parser)
+    add_storage_argument(parser)
     
     args = parser.parse_args()
     
@@ -319,24 +554,51 @@ def main():
         'password': args.password or os.getenv('POSTGRESQL_PASSWORD', ''),
     }
     
-    calculator = MonthlyConsolidatedCalculator(db_config)
+    calculator = MonthlyConsolidatedCalculator(db_config, args.storage)
     
     # Calculate monthly consolidated data
-    result = calculator.calculate_monthly_consolidated(args.project_id, args.calculation_run_id)
+    sweep_priority = [name.strip() for name in args.sweep_priority.split(',') if name.strip()]
+    unknown = [name for name in sweep_priority if name not in model_engine.TRANCHES]
+    if unknown:
+        write_result({
+            'success': False,
+            'error': f'Unknown tranche in sweep priority: {", ".join(unknown)}'
+        }, args.result_format)
+        sys.exit(1)
     
+    try:
+        with project_lock(db_config, args.project_id):
+            result = calculator.calculate_monthly_consolidated(
+                args.project_id, args.calculation_run_id,
+                cash_sweep=args.cash_sweep, min_cash=args.min_cash, sweep_priority=sweep_priority,
+                solve_circular=args.solve_circular, deposit_rate=args.deposit_rate,
+                tolerance=args.tolerance, method=args.method, compute_tax=args.compute_tax,
+                opening_tax_losses=args.opening_tax_losses, loss_cap_pct=args.loss_cap_pct,
+                loss_cap_amount=args.loss_cap_amount)
+
+            if result['success']:
+                # Save to database
+                calculator.save_monthly_consolidated(args.project_id, args.calculation_run_id, result['data'])
+                IntegrityChecker(db_config).save_summary(
+                    args.project_id, args.calculation_run_id, result['integrity'])
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+
     if result['success']:
-        # Save to database
-        calculator.save_monthly_consolidated(args.project_id, args.calculation_run_id, result['data'])
-        print(json.dumps({
+        output = {
             'success': True,
             'total_months': result['total_months'],
             'message': f'Successfully calculated {result["total_months"]} months of consolidated data'
-        }))
+        }
+        for key in ('cash_sweep', 'solver', 'tax', 'integrity'):
+            if key in result:
+                output[key] = result[key]
+        write_result(output, args.result_format)
     else:
-        print(json.dumps({
+        write_result({
             'success': False,
             'error': result['error']
-        }))
+        }, args.result_format)
         sys.exit(1)
 
 if __name__ == '__main__':
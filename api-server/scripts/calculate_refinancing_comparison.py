@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Refinancing Comparison
+Evaluates the as-is debt (balance sheet debt without additional loans, optionally
+under overridden terms) and the restructured debt side by side in one batched
+model engine run, and reports per-month deltas and the NPV of the savings.
+"""
+
+import sys
+import json
+import argparse
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+import numpy as np
+
+import model_engine
+from input_cache import load_latest_input
+from result_protocol import add_format_argument, write_result
+
+SERIES = ['interest', 'debt_service', 'additional_loan', 'closing_debt',
+          'debt_service_coverage_ratio', 'debt_to_ebitda', 'interest_coverage_ratio']
+
+
+def _json_number(value, digits):
+    """Round for output, mapping NaN and infinities (no debt service, no EBITDA) to None"""
+    value = float(value)
+    return round(value, digits) if np.isfinite(value) else None
+
+
+def apply_overrides(terms, overrides):
+    """Copy of terms with {tranche: {term: value}} overrides applied"""
+    result = {tranche: dict(values) for tranche, values in terms.items()}
+    for tranche, values in (overrides or {}).items():
+        if tranche not in result:
+            raise ValueError(f"Unknown tranche: {tranche}")
+        for term, value in values.items():
+            if term not in result[tranche]:
+                raise ValueError(f"Unknown term for {tranche}: {term}")
+            result[tranche][term] = value
+    return result
+
+
+def as_is_terms(terms, overrides=None):
+    """Status quo: the balance sheet debt only, under the current terms unless overridden"""
+    base = {tranche: dict(values, additional_loan=0.0) for tranche, values in terms.items()}
+    return apply_overrides(base, overrides)
+
+
+def blended_rate(terms):
+    """Annual rate in percent weighted by each tranche's opening plus additional balance"""
+    weights = np.array([t['opening'] + t['additional_loan'] for t in terms.values()])
+    rates = np.array([float(model_engine.monthly_rate(t)) * 12 * 100 for t in terms.values()])
+    return float((weights * rates).sum() / weights.sum()) if weights.sum() > 0 else float(rates.mean())
+
+
+class RefinancingComparison:
+    def __init__(self, db_config, nb_months=model_engine.NB_MONTHS):
+        self.db_config = db_config
+        self.nb_months = nb_months
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def get_latest_row(self, table, project_id):
+        """Get the latest input version for the project as a dict"""
+        return load_latest_input(self.get_connection, table, project_id)
+
+    def get_inputs(self, project_id):
+        """Get debt structure, balance sheet and profit & loss inputs"""
+        debt_structure = self.get_latest_row('debt_structure_data', project_id)
+        balance_sheet = self.get_latest_row('balance_sheet_data', project_id)
+        profit_loss = self.get_latest_row('profit_loss_data', project_id)
+        if not debt_structure or not balance_sheet or not profit_loss:
+            raise ValueError(f"Required data not found for project {project_id}")
+        return debt_structure, balance_sheet, profit_loss
+
+    def compare(self, inputs, as_is_overrides=None, restructured_overrides=None, discount_rate=None):
+        """
+        Compare the structures of every project in inputs ({project_id: (debt_structure,
+        balance_sheet, profit_loss)}) in one engine call
+        """
+        project_ids = list(inputs)
+        restructured, as_is, ebitda = [], [], []
+        for project_id in project_ids:
+            debt_structure, balance_sheet, profit_loss = inputs[project_id]
+            terms = model_engine.tranche_terms(debt_structure, balance_sheet)
+            as_is.append(as_is_terms(terms, as_is_overrides))
+            restructured.append(apply_overrides(terms, restructured_overrides))
+            ebitda.append(model_engine.monthly_ebitda(profit_loss))
+
+        # Savings are discounted at the cost of the debt being replaced unless given
+        rates = [discount_rate if discount_rate is not None else blended_rate(terms) for terms in as_is]
+        comparison = model_engine.compare_structures(
+            model_engine.stack_terms(as_is), model_engine.stack_terms(restructured),
+            np.array(ebitda), np.array(rates), self.nb_months)
+
+        results = {}
+        for i, project_id in enumerate(project_ids):
+            rows = []
+            for month in range(self.nb_months):
+                row = {'month': month + 1}
+                for key in SERIES:
+                    digits = 2 if key in ('interest', 'debt_service', 'additional_loan', 'closing_debt') else 4
+                    row[f'{key}_as_is'] = _json_number(comparison['as_is'][key][i, month], digits)
+                    row[f'{key}_restructured'] = _json_number(comparison['restructured'][key][i, month], digits)
+                    row[f'{key}_delta'] = _json_number(comparison['delta'][key][i, month], digits)
+                row['savings'] = _json_number(comparison['savings'][i, month], 2)
+                rows.append(row)
+
+            results[project_id] = {
+                'discount_rate': round(rates[i], 4),
+                'npv_savings': _json_number(comparison['npv_savings'][i], 2),
+                'npv_net_cash_savings': _json_number(comparison['npv_net_cash_savings'][i], 2),
+                'total_interest_delta': _json_number(comparison['delta']['interest'][i].sum(), 2),
+                'as_is': {key: _json_number(values[i], 4) for key, values in comparison['as_is_summary'].items()},
+                'restructured': {key: _json_number(values[i], 4)
+                                 for key, values in comparison['restructured_summary'].items()},
+                'months': rows,
+            }
+        return results
+
+    def compare_projects(self, project_ids, as_is_overrides=None, restructured_overrides=None, discount_rate=None):
+        inputs = {project_id: self.get_inputs(project_id) for project_id in project_ids}
+        return self.compare(inputs, as_is_overrides, restructured_overrides, discount_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the as-is and restructured debt side by side')
+    parser.add_argument('project_ids', nargs='+', help='Project IDs')
+    parser.add_argument('--as-is-terms', type=json.loads, default=None,
+                        help='JSON {tranche: {term: value}} overrides for the existing debt')
+    parser.add_argument('--restructured-terms', type=json.loads, default=None,
+                        help='JSON {tranche: {term: value}} overrides for the restructured debt')
+    parser.add_argument('--discount-rate', type=float, default=None,
+                        help='Annual discount rate in percent for the savings (default: as-is blended rate)')
+    parser.add_argument('--months', type=int, default=model_engine.NB_MONTHS, help='Months to project')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    import os
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    comparison = RefinancingComparison(db_config, args.months)
+    try:
+        results = comparison.compare_projects(args.project_ids, args.as_is_terms, args.restructured_terms,
+                                              args.discount_rate)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    write_result({'success': True, 'results': results}, args.result_format)
+
+if __name__ == "__main__":
+    main()
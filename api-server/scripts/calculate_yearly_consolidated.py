@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import sys
-import json
 try:
     import psycopg2
 except ImportError:
@@ -13,19 +12,38 @@ import numpy as np
 from datetime import datetime
 import argparse
 
+from result_protocol import add_format_argument, write_result
+from run_storage import add_storage_argument, load_run_series, resolve_storage, save_run_series
+from period_consolidation import add_consolidation_argument, consolidate_runs, resolve_consolidation
+from numeric_decoding import decode_rows, register_float_numeric
+from project_lock import project_lock
+
+MONTHLY_COLUMNS = ['month', 'year', 'month_name', 'revenue', 'cost_of_goods_sold', 'gross_profit',
+                   'operating_expenses', 'ebitda', 'depreciation', 'interest_expense', 'net_income_before_tax',
+                   'income_tax_expense', 'net_income', 'cash', 'accounts_receivable', 'inventory',
+                   'other_current_assets', 'ppe_net', 'other_assets', 'total_assets', 'accounts_payable',
+                   'senior_secured', 'debt_tranche1', 'equity', 'retained_earning', 'total_equity_liability',
+                   'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
+                   'repayment_debt', 'net_cash_financing', 'net_cash_flow']
+
 class YearlyConsolidatedCalculator:
-    def __init__(self, db_config):
+    def __init__(self, db_config, storage=None, consolidation=None):
         self.db_config = db_config
+        self.storage = resolve_storage(storage)
+        self.consolidation = resolve_consolidation(consolidation)
 
     def get_connection(self):
-        return psycopg2.connect(**self.db_config)
+        return register_float_numeric(psycopg2.connect(**self.db_config))
 
     def get_monthly_consolidated_data(self, project_id, calculation_run_id):
         """Get monthly consolidated data for the project"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            if calculation_run_id:
+            series = load_run_series(cursor, 'monthly_consolidated', project_id, calculation_run_id)
+            if series is not None:
+                results = list(zip(*(series[column] for column in MONTHLY_COLUMNS)))
+            elif calculation_run_id:
                 cursor.execute("""
                     SELECT month, year, month_name, revenue, cost_of_goods_sold, gross_profit,
                            operating_expenses, ebitda, depreciation, interest_expense, net_income_before_tax,
@@ -38,6 +56,7 @@ class YearlyConsolidatedCalculator:
                     WHERE project_id = %s AND calculation_run_id = %s
                     ORDER BY month
                 """, (project_id, calculation_run_id))
+                results = cursor.fetchall()
             else:
                 cursor.execute("""
                     SELECT month, year, month_name, revenue, cost_of_goods_sold, gross_profit,
@@ -48,151 +67,39 @@ class YearlyConsolidatedCalculator:
                            net_cash_operating, capital_expenditures, net_cash_investing, proceeds_debt,
                            repayment_debt, net_cash_financing, net_cash_flow
                     FROM monthly_consolidated 
-                    WHERE project_id = %s
-                    ORDER BY calculation_run_id DESC, month
-                """, (project_id,))
-            results = cursor.fetchall()
-            
-            if not results:
-                return []
+                    WHERE project_id = %s AND calculation_run_id = (
+                        SELECT calculation_run_id FROM monthly_consolidated
+                        WHERE project_id = %s
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    )
+                    ORDER BY month
+                """, (project_id, project_id))
+                results = cursor.fetchall()
             
-            return [
-                {
-                    'month': row[0],
-                    'year': row[1],
-                    'month_name': row[2],
-                    'revenue': float(row[3]) if row[3] else 0,
-                    'cost_of_goods_sold': float(row[4]) if row[4] else 0,
-                    'gross_profit': float(row[5]) if row[5] else 0,
-                    'operating_expenses': float(row[6]) if row[6] else 0,
-                    'ebitda': float(row[7]) if row[7] else 0,
-                    'depreciation': float(row[8]) if row[8] else 0,
-                    'interest_expense': float(row[9]) if row[9] else 0,
-                    'net_income_before_tax': float(row[10]) if row[10] else 0,
-                    'income_tax_expense': float(row[11]) if row[11] else 0,
-                    'net_income': float(row[12]) if row[12] else 0,
-                    'cash': float(row[13]) if row[13] else 0,
-                    'accounts_receivable': float(row[14]) if row[14] else 0,
-                    'inventory': float(row[15]) if row[15] else 0,
-                    'other_current_assets': float(row[16]) if row[16] else 0,
-                    'ppe_net': float(row[17]) if row[17] else 0,
-                    'other_assets': float(row[18]) if row[18] else 0,
-                    'total_assets': float(row[19]) if row[19] else 0,
-                    'accounts_payable': float(row[20]) if row[20] else 0,
-                    'senior_secured': float(row[21]) if row[21] else 0,
-                    'debt_tranche1': float(row[22]) if row[22] else 0,
-                    'equity': float(row[23]) if row[23] else 0,
-                    'retained_earning': float(row[24]) if row[24] else 0,
-                    'total_equity_liability': float(row[25]) if row[25] else 0,
-                    'net_cash_operating': float(row[26]) if row[26] else 0,
-                    'capital_expenditures': float(row[27]) if row[27] else 0,
-                    'net_cash_investing': float(row[28]) if row[28] else 0,
-                    'proceeds_debt': float(row[29]) if row[29] else 0,
-                    'repayment_debt': float(row[30]) if row[30] else 0,
-                    'net_cash_financing': float(row[31]) if row[31] else 0,
-                    'net_cash_flow': float(row[32]) if row[32] else 0
-                }
-                for row in results
-            ]
+            return decode_rows(results, MONTHLY_COLUMNS, passthrough=('month', 'year', 'month_name'))
 
     def calculate_yearly_consolidated(self, project_id, calculation_run_id):
         """Calculate yearly consolidated financial statements from monthly data"""
         try:
-            # Get monthly data using the latest monthly calculation run
-            monthly_data = self.get_monthly_consolidated_data(project_id, None)  # Get latest monthly data
-            
-            if not monthly_data:
-                raise ValueError("Monthly consolidated data not found")
-            
-            # Group monthly data by year
-            yearly_data = []
-            
-            for year in range(1, 11):  # 10 years
-                # Get months for this year (take only first 12 months to avoid duplicates)
-                year_months = [m for m in monthly_data if m['year'] == year][:12]
-                
-                if not year_months:
-                    continue
-                
-                # Sum flow items (revenue, costs, etc.)
-                revenue = sum(m['revenue'] for m in year_months)
-                cost_of_goods_sold = sum(m['cost_of_goods_sold'] for m in year_months)
-                gross_profit = sum(m['gross_profit'] for m in year_months)
-                operating_expenses = sum(m['operating_expenses'] for m in year_months)
-                ebitda = sum(m['ebitda'] for m in year_months)
-                depreciation = sum(m['depreciation'] for m in year_months)
-                interest_expense = sum(m['interest_expense'] for m in year_months)
-                net_income_before_tax = sum(m['net_income_before_tax'] for m in year_months)
-                income_tax_expense = sum(m['income_tax_expense'] for m in year_months)
-                net_income = sum(m['net_income'] for m in year_months)
+            if self.consolidation == 'sql':
+                # Aggregate and store in one statement without loading the monthly rows
+                with self.get_connection() as conn:
+                    consolidated = consolidate_runs(conn, 'yearly', {project_id: calculation_run_id}, self.storage)
+                    yearly_data = consolidated.get(str(project_id))
+                    if not yearly_data:
+                        raise ValueError("Monthly consolidated data not found")
+            else:
+                # Get monthly data using the latest monthly calculation run
+                monthly_data = self.get_monthly_consolidated_data(project_id, None)  # Get latest monthly data
                 
-                # Cash flow items
-                net_cash_operating = sum(m['net_cash_operating'] for m in year_months)
-                capital_expenditures = sum(m['capital_expenditures'] for m in year_months)
-                net_cash_investing = sum(m['net_cash_investing'] for m in year_months)
-                proceeds_debt = sum(m['proceeds_debt'] for m in year_months)
-                repayment_debt = sum(m['repayment_debt'] for m in year_months)
-                net_cash_financing = sum(m['net_cash_financing'] for m in year_months)
-                net_cash_flow = sum(m['net_cash_flow'] for m in year_months)
+                if not monthly_data:
+                    raise ValueError("Monthly consolidated data not found")
                 
-                # Take balance sheet items from last month of year (end of period)
-                last_month = year_months[-1]
-                cash = last_month['cash']
-                accounts_receivable = last_month['accounts_receivable']
-                inventory = last_month['inventory']
-                other_current_assets = last_month['other_current_assets']
-                ppe_net = last_month['ppe_net']
-                other_assets = last_month['other_assets']
-                total_assets = last_month['total_assets']
-                accounts_payable = last_month['accounts_payable']
-                senior_secured = last_month['senior_secured']
-                debt_tranche1 = last_month['debt_tranche1']
-                equity = last_month['equity']
-                retained_earning = last_month['retained_earning']
-                total_equity_liability = last_month['total_equity_liability']
+                yearly_data = self.build_yearly_data(monthly_data)
                 
-                yearly_data.append({
-                    'year': year,
-                    
-                    # Profit & Loss (summed)
-                    'revenue': revenue,
-                    'cost_of_goods_sold': cost_of_goods_sold,
-                    'gross_profit': gross_profit,
-                    'operating_expenses': operating_expenses,
-                    'ebitda': ebitda,
-                    'depreciation': depreciation,
-                    'interest_expense': interest_expense,
-                    'net_income_before_tax': net_income_before_tax,
-                    'income_tax_expense': income_tax_expense,
-                    'net_income': net_income,
-                    
-                    # Balance Sheet (end of period)
-                    'cash': cash,
-                    'accounts_receivable': accounts_receivable,
-                    'inventory': inventory,
-                    'other_current_assets': other_current_assets,
-                    'ppe_net': ppe_net,
-                    'other_assets': other_assets,
-                    'total_assets': total_assets,
-                    'accounts_payable': accounts_payable,
-                    'senior_secured': senior_secured,
-                    'debt_tranche1': debt_tranche1,
-                    'equity': equity,
-                    'retained_earning': retained_earning,
-                    'total_equity_liability': total_equity_liability,
-                    
-                    # Cash Flow (summed)
-                    'net_cash_operating': net_cash_operating,
-                    'capital_expenditures': capital_expenditures,
-                    'net_cash_investing': net_cash_investing,
-                    'proceeds_debt': proceeds_debt,
-                    'repayment_debt': repayment_debt,
-                    'net_cash_financing': net_cash_financing,
-                    'net_cash_flow': net_cash_flow
-                })
-            
-            # Save to database using the calculation run ID from the service
-            self.save_yearly_consolidated(project_id, calculation_run_id, yearly_data)
+                # Save to database using the calculation run ID from the service
+                self.save_yearly_consolidated(project_id, calculation_run_id, yearly_data)
             
             return {
                 'success': True,
@@ -206,13 +113,110 @@ class YearlyConsolidatedCalculator:
                 'error': str(e)
             }
 
+    def build_yearly_data(self, monthly_data):
+        """Aggregate monthly consolidated rows into yearly rows: flows summed, balances at period end"""
+        # Group monthly data by year
+        yearly_data = []
+        
+        for year in range(1, 11):  # 10 years
+            # Get months for this year (take only first 12 months to avoid duplicates)
+            year_months = [m for m in monthly_data if m['year'] == year][:12]
+            
+            if not year_months:
+                continue
+            
+            # Sum flow items (revenue, costs, etc.)
+            revenue = sum(m['revenue'] for m in year_months)
+            cost_of_goods_sold = sum(m['cost_of_goods_sold'] for m in year_months)
+            gross_profit = sum(m['gross_profit'] for m in year_months)
+            operating_expenses = sum(m['operating_expenses'] for m in year_months)
+            ebitda = sum(m['ebitda'] for m in year_months)
+            depreciation = sum(m['depreciation'] for m in year_months)
+            interest_expense = sum(m['interest_expense'] for m in year_months)
+            net_income_before_tax = sum(m['net_income_before_tax'] for m in year_months)
+            income_tax_expense = sum(m['income_tax_expense'] for m in year_months)
+            net_income = sum(m['net_income'] for m in year_months)
+            
+            # Cash flow items
+            net_cash_operating = sum(m['net_cash_operating'] for m in year_months)
+            capital_expenditures = sum(m['capital_expenditures'] for m in year_months)
+            net_cash_investing = sum(m['net_cash_investing'] for m in year_months)
+            proceeds_debt = sum(m['proceeds_debt'] for m in year_months)
+            repayment_debt = sum(m['repayment_debt'] for m in year_months)
+            net_cash_financing = sum(m['net_cash_financing'] for m in year_months)
+            net_cash_flow = sum(m['net_cash_flow'] for m in year_months)
+            
+            # Take balance sheet items from last month of year (end of period)
+            last_month = year_months[-1]
+            cash = last_month['cash']
+            accounts_receivable = last_month['accounts_receivable']
+            inventory = last_month['inventory']
+            other_current_assets = last_month['other_current_assets']
+            ppe_net = last_month['ppe_net']
+            other_assets = last_month['other_assets']
+            total_assets = last_month['total_assets']
+            accounts_payable = last_month['accounts_payable']
+            senior_secured = last_month['senior_secured']
+            debt_tranche1 = last_month['debt_tranche1']
+            equity = last_month['equity']
+            retained_earning = last_month['retained_earning']
+            total_equity_liability = last_month['total_equity_liability']
+            
+            yearly_data.append({
+                'year': year,
+                
+                # Profit & Loss (summed)
+                'revenue': revenue,
+                'cost_of_goods_sold': cost_of_goods_sold,
+                'gross_profit': gross_profit,
+                'operating_expenses': operating_expenses,
+                'ebitda': ebitda,
+                'depreciation': depreciation,
+                'interest_expense': interest_expense,
+                'net_income_before_tax': net_income_before_tax,
+                'income_tax_expense': income_tax_expense,
+                'net_income': net_income,
+                
+                # Balance Sheet (end of period)
+                'cash': cash,
+                'accounts_receivable': accounts_receivable,
+                'inventory': inventory,
+                'other_current_assets': other_current_assets,
+                'ppe_net': ppe_net,
+                'other_assets': other_assets,
+                'total_assets': total_assets,
+                'accounts_payable': accounts_payable,
+                'senior_secured': senior_secured,
+                'debt_tranche1': debt_tranche1,
+                'equity': equity,
+                'retained_earning': retained_earning,
+                'total_equity_liability': total_equity_liability,
+                
+                # Cash Flow (summed)
+                'net_cash_operating': net_cash_operating,
+                'capital_expenditures': capital_expenditures,
+                'net_cash_investing': net_cash_investing,
+                'proceeds_debt': proceeds_debt,
+                'repayment_debt': repayment_debt,
+                'net_cash_financing': net_cash_financing,
+                'net_cash_flow': net_cash_flow
+            })
+        
+        return yearly_data
+
     def save_yearly_consolidated(self, project_id, calculation_run_id, yearly_data):
         """Save yearly consolidated data to database"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Delete existing calculations for this project
-            cursor.execute("DELETE FROM yearly_consolidated WHERE project_id = %s", (project_id,))
+            if self.storage == 'arrays':
+                save_run_series(cursor, 'yearly_consolidated', project_id, calculation_run_id, yearly_data)
+                conn.commit()
+                return
+            
+            # Replace this calculation run only; older runs are kept for the retention job
+            cursor.execute("DELETE FROM yearly_consolidated WHERE project_id = %s AND calculation_run_id = %s",
+                           (project_id, calculation_run_id))
             
             # Insert new calculations
             for row in yearly_data:
@@ -245,6 +249,9 @@ def main():
     parser = argparse.ArgumentParser(description='Calculate yearly consolidated financial statements')
     parser.add_argument('project_id', help='Project ID')
     parser.add_argument('calculation_run_id', help='Calculation run ID')
+    add_format_argument(parser)
+    add_storage_argument(parser)
+    add_consolidation_argument(parser)
     
     args = parser.parse_args()
     
@@ -263,11 +270,16 @@ def main():
     }
     
     # Create calculator and perform calculation
-    calculator = YearlyConsolidatedCalculator(db_config)
-    result = calculator.calculate_yearly_consolidated(args.project_id, args.calculation_run_id)
+    calculator = YearlyConsolidatedCalculator(db_config, args.storage, args.consolidation)
+    try:
+        with project_lock(db_config, args.project_id):
+            result = calculator.calculate_yearly_consolidated(args.project_id, args.calculation_run_id)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
     
-    # Output result as JSON
-    print(json.dumps(result))
+    # Output the summary with the yearly rows as a columnar table
+    rows = result.pop('yearly_data', None)
+    write_result(result, args.result_format, {'yearly_data': rows} if rows else None)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+"""
+Calculation Scheduler
+Runs the recurring recalculations of calculation_recurrences
+(migrations/add_calculation_recurrences.sql), such as a nightly refresh of every
+project after rate or assumption updates. Due recurrences are leased, their
+projects grouped by stages and options, and each group is recalculated in
+batches of projects, one stage at a time for the whole batch:
+
+- the batch's inputs are read with one query per input table;
+- debt schedules come from one stacked model_engine call, and depreciation,
+  monthly consolidation and KPIs are built in memory, monthly from the batch's
+  own debt and depreciation results;
+- quarterly and yearly consolidation run in SQL (period_consolidation.py);
+- each output table is written with one DELETE and multi-row INSERTs (one series
+  row per run in array storage), in one transaction per stage.
+
+Every project still gets a calculation_runs row per stage, holding its share of
+the batch time. Every batch stage also adds a run without project that records
+the batch's execution time, throughput and failed projects. A project that
+fails drops out of its batch's later stages without stopping the others.
+Projects whose calculation lock is held (project_lock.py) are skipped until the
+recurrence's next run.
+"""
+
+import sys
+import os
+import json
+import time
+import signal
+import socket
+import argparse
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+import model_engine
+from result_protocol import ResultWriter, add_format_argument, write_result
+from numeric_decoding import register_float_numeric, decode_rows
+from project_lock import project_locks
+from run_storage import KEY_COLUMNS, load_latest_series_batch, resolve_storage, save_run_series
+from period_consolidation import consolidate_runs
+from check_integrity import DEFAULT_TOLERANCE
+from apply_retention import RunRetention, build_policies
+from calculate_dry_run import (INPUT_TABLES, balance_sheet_inputs, depreciation_rows, profit_loss_inputs,
+                               working_capital_inputs)
+from calculate_debt_schedule import DebtScheduleCalculator
+from calculate_monthly_consolidated import MonthlyConsolidatedCalculator
+from calculate_kpis import KPICalculator
+from calculation_worker import MONTHLY_OPTIONS, STAGES, monthly_kwargs, stage_summary
+
+RETENTION_STAGE = 'retention'
+
+# Recurrence options the batched pipeline supports
+BATCH_OPTIONS = MONTHLY_OPTIONS + ('discount_rate', 'storage', 'consolidation')
+
+# Upstream stage -> saved table, its columns, their names in the monthly consolidation and
+# constant fields, as read by MonthlyConsolidatedCalculator.get_debt_calculations and
+# get_depreciation_schedule
+SAVED_SCHEDULES = {
+    'debt_calculation': (
+        'debt_calculations',
+        ['month', 'year', 'opening_balance', 'payment', 'interest_payment', 'closing_balance', 'cumulative_interest'],
+        ['month', 'year', 'opening_balance', 'payment', 'interest', 'closing_balance', 'total_repayment'],
+        {'additional_loan': 0},
+    ),
+    'depreciation_schedule': (
+        'depreciation_schedule',
+        ['month', 'year', 'asset_value', 'monthly_depreciation', 'accumulated_depreciation', 'net_book_value'],
+        ['month', 'year', 'asset_value', 'monthly_depreciation', 'accumulated_depreciation', 'net_book_value'],
+        {'capex_addition': 0},
+    ),
+}
+
+# Project errors kept in a recurrence's last_result
+MAX_RECORDED_FAILURES = 100
+
+
+def check_options(options):
+    """Raise ValueError for options the batched pipeline does not support"""
+    unsupported = sorted(key for key, value in (options or {}).items()
+                         if value is not None and key not in BATCH_OPTIONS)
+    if unsupported:
+        raise ValueError(f"Options not supported by batched recalculation: {', '.join(unsupported)}")
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BatchPipeline:
+    """Recalculates batches of projects through a list of stages with bulk reads and writes"""
+
+    def __init__(self, db_config, stages, options=None, created_by=None, description=None):
+        self.db_config = db_config
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.retention = RETENTION_STAGE in stages
+        self.options = options or {}
+        self.storage = resolve_storage(self.options.get('storage'))
+        self.created_by = created_by
+        self.description = description
+        self.columns = {}
+
+    def get_connection(self):
+        return register_float_numeric(psycopg2.connect(**self.db_config))
+
+    def run(self, project_ids):
+        """
+        Recalculate the projects; returns each project's error (None when all its
+        stages completed) and the batch summary of every stage
+        """
+        errors = {project_id: None for project_id in project_ids}
+        summaries = {}
+        conn = self.get_connection()
+        try:
+            inputs = self.fetch_inputs(conn, project_ids)
+            upstream = {}
+            for stage in self.stages:
+                remaining = [project_id for project_id in project_ids if errors[project_id] is None]
+                if not remaining:
+                    break
+                summaries[stage] = self.run_stage(conn, stage, remaining, inputs, upstream, errors)
+        finally:
+            conn.close()
+
+        completed = [project_id for project_id in project_ids if errors[project_id] is None]
+        if self.retention and completed:
+            summaries[RETENTION_STAGE] = RunRetention(self.db_config, build_policies()).apply(project_ids=completed)
+        return errors, summaries
+
+    def run_stage(self, conn, stage, project_ids, inputs, upstream, errors):
+        """
+        Run a stage for the projects in one transaction, recording a run per project
+        and one for the batch; failed projects get their error in errors
+        """
+        batch_run_id = self.create_batch_run(conn, stage, project_ids)
+        run_ids = self.create_runs(conn, stage, project_ids, batch_run_id)
+        started = time.perf_counter()
+        try:
+            results, failed = getattr(self, f'run_{stage}')(conn, project_ids, run_ids, inputs, upstream)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            results, failed = {}, {project_id: str(e) for project_id in project_ids}
+        elapsed = time.perf_counter() - started
+
+        for project_id, error in failed.items():
+            errors[project_id] = f"{stage}: {error}"
+        batch = {
+            'projects': len(project_ids),
+            'completed': len(project_ids) - len(failed),
+            'failed': len(failed),
+            'execution_time_ms': int(elapsed * 1000),
+            'projects_per_second': round(len(project_ids) / elapsed, 1) if elapsed > 0 else None,
+        }
+        self.finish_runs(conn, run_ids, results, failed, batch_run_id, int(elapsed * 1000 / len(project_ids)))
+        self.finish_batch_run(conn, batch_run_id, batch, failed)
+        conn.commit()
+        return batch
+
+    def create_batch_run(self, conn, stage, project_ids):
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO calculation_runs (project_id, run_name, calculation_type, status, run_description,
+                                              input_data, created_by)
+                VALUES (NULL, %s, %s, 'running', %s, %s, %s)
+                RETURNING id
+            """, (f"{STAGES[stage]} Batch", stage, self.description,
+                  json.dumps({'calculationType': stage, 'projectIds': project_ids, 'options': self.options}),
+                  self.created_by))
+            return str(cursor.fetchone()[0])
+
+    def create_runs(self, conn, stage, project_ids, batch_run_id):
+        """A running calculation run per project, committed so the stage's rows can reference them"""
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO calculation_runs (project_id, run_name, calculation_type, status, run_description,
+                                              input_data, created_by)
+                SELECT project_id, %s, %s, 'running', %s,
+                       jsonb_build_object('projectId', project_id) || %s::jsonb, %s
+                FROM unnest(%s::uuid[]) AS project_id
+                RETURNING project_id, id
+            """, (STAGES[stage], stage, self.description,
+                  json.dumps({'calculationType': stage, 'batchRunId': batch_run_id, 'options': self.options}),
+                  self.created_by, project_ids))
+            run_ids = {str(project_id): str(run_id) for project_id, run_id in cursor.fetchall()}
+        conn.commit()
+        return run_ids
+
+    def finish_runs(self, conn, run_ids, results, failed, batch_run_id, execution_time_ms):
+        with conn.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE calculation_runs r
+                SET status = v.status, completed_at = NOW(), execution_time_ms = v.execution_time_ms,
+                    output_data = v.output_data, error_message = v.error_message
+                FROM (VALUES %s) AS v(id, status, execution_time_ms, output_data, error_message)
+                WHERE r.id = v.id
+            """, [
+                (run_id, 'failed' if project_id in failed else 'completed', execution_time_ms,
+                 None if project_id in failed
+                 else json.dumps({**results.get(project_id, {}), 'batch_run_id': batch_run_id}, default=str),
+                 failed.get(project_id))
+                for project_id, run_id in run_ids.items()
+            ], template='(%s::uuid, %s, %s::integer, %s::jsonb, %s)', page_size=1000)
+
+    def finish_batch_run(self, conn, batch_run_id, batch, failed):
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE calculation_runs
+                SET status = %s, completed_at = NOW(), execution_time_ms = %s, output_data = %s, error_message = %s
+                WHERE id = %s
+            """, ('failed' if batch['completed'] == 0 else 'completed', batch['execution_time_ms'],
+                  json.dumps({**batch, 'failures': failed}),
+                  f"{len(failed)} of {batch['projects']} projects failed" if failed else None, batch_run_id))
+
+    def fetch_inputs(self, conn, project_ids):
+        """Latest input rows of the projects, one query per table: {payload key: {project_id: row}}"""
+        inputs = {}
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            for key, table in INPUT_TABLES.items():
+                cursor.execute(f"""
+                    SELECT DISTINCT ON (project_id) * FROM {table}
+                    WHERE project_id = ANY(%s::uuid[])
+                    ORDER BY project_id, version DESC
+                """, (project_ids,))
+                inputs[key] = {str(row['project_id']): dict(row) for row in cursor.fetchall()}
+        conn.commit()
+        return inputs
+
+    def missing_inputs(self, project_ids, inputs, keys):
+        """Errors of the projects lacking one of the inputs"""
+        failed = {}
+        for project_id in project_ids:
+            missing = [INPUT_TABLES[key] for key in keys if project_id not in inputs[key]]
+            if missing:
+                failed[project_id] = f"Input data not found: {', '.join(missing)}"
+        return failed
+
+    def table_columns(self, cursor, table):
+        if table not in self.columns:
+            cursor.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s
+            """, (table,))
+            self.columns[table] = {row[0] for row in cursor.fetchall()}
+        return self.columns[table]
+
+    def write_runs(self, conn, table, run_ids, runs, replace_project=False, storage=None):
+        """
+        Save the rows of many runs ({project_id: rows}) with one DELETE and multi-row
+        INSERTs, or as one series row per run in array storage. Replaces the runs'
+        earlier rows, or all of the projects' rows with replace_project. Row keys
+        that are columns of the table are written.
+        """
+        runs = {project_id: rows for project_id, rows in runs.items() if rows}
+        if not runs:
+            return
+        with conn.cursor() as cursor:
+            if (storage or self.storage) == 'arrays':
+                for project_id, rows in runs.items():
+                    save_run_series(cursor, table, project_id, run_ids[project_id], rows,
+                                    replace_project=replace_project)
+                return
+
+            if replace_project:
+                cursor.execute(f"DELETE FROM {table} WHERE project_id = ANY(%s::uuid[])", (list(runs),))
+            else:
+                cursor.execute(f"DELETE FROM {table} WHERE calculation_run_id = ANY(%s::uuid[])",
+                               ([run_ids[project_id] for project_id in runs],))
+            table_columns = self.table_columns(cursor, table)
+            columns = [column for column in next(iter(runs.values()))[0]
+                       if column in table_columns and column not in KEY_COLUMNS]
+            psycopg2.extras.execute_values(cursor, f"""
+                INSERT INTO {table} (project_id, calculation_run_id, {', '.join(columns)}) VALUES %s
+            """, [
+                (project_id, run_ids[project_id], *(row.get(column) for column in columns))
+                for project_id, rows in runs.items()
+                for row in rows
+            ], page_size=1000)
+
+    def upstream_schedules(self, conn, upstream, stage, project_ids):
+        """
+        Rows of an upstream stage in the shape the monthly consolidation reads: this
+        batch's results when it ran the stage, else the projects' latest saved rows
+        """
+        if stage in upstream:
+            return upstream[stage]
+        table, columns, names, constants = SAVED_SCHEDULES[stage]
+        with conn.cursor() as cursor:
+            results = {
+                project_id: list(zip(*(series['columns'][column] for column in columns)))
+                for project_id, series in load_latest_series_batch(cursor, table, project_ids).items()
+            }
+            rest = [project_id for project_id in project_ids if project_id not in results]
+            if rest:
+                cursor.execute(f"""
+                    SELECT project_id, {', '.join(columns)} FROM {table}
+                    WHERE project_id = ANY(%s::uuid[])
+                    ORDER BY project_id, month
+                """, (rest,))
+                for project_id, *row in cursor.fetchall():
+                    results.setdefault(str(project_id), []).append(row)
+        return {
+            project_id: decode_rows(rows, names, passthrough=('month', 'year'), constants=constants)
+            for project_id, rows in results.items()
+        }
+
+    def run_debt_calculation(self, conn, project_ids, run_ids, inputs, upstream):
+        """Debt schedules of all projects from one stacked engine call"""
+        failed = self.missing_inputs(project_ids, inputs, ('debt_structure', 'balance_sheet'))
+        ready = [project_id for project_id in project_ids if project_id not in failed]
+        if not ready:
+            return {}, failed
+
+        total = model_engine.combined_debt_schedule(model_engine.stack_terms([
+            model_engine.tranche_terms(inputs['debt_structure'][project_id], inputs['balance_sheet'][project_id])
+            for project_id in ready
+        ]))['total']
+
+        calculator = DebtScheduleCalculator(self.storage)
+        runs, results = {}, {}
+        for i, project_id in enumerate(ready):
+            runs[project_id] = calculator.schedule_rows(project_id, run_ids[project_id], {
+                column: total[column.lower()][i] for column in ('Opening', 'Interest', 'Repayment', 'Closing')
+            })
+            results[project_id] = stage_summary(calculator.schedule_summary(runs[project_id]))
+        self.write_runs(conn, 'debt_calculations', run_ids, runs, replace_project=True)
+
+        upstream['debt_calculation'] = {
+            project_id: [
+                {
+                    'month': row['month'],
+                    'year': row['year'],
+                    'opening_balance': row['opening_balance'],
+                    'payment': row['payment'],
+                    'interest': row['interest_payment'],
+                    'closing_balance': row['closing_balance'],
+                    'total_repayment': row['cumulative_interest'],
+                    'additional_loan': 0
+                }
+                for row in rows
+            ]
+            for project_id, rows in runs.items()
+        }
+        return results, failed
+
+    def run_depreciation_schedule(self, conn, project_ids, run_ids, inputs, upstream):
+        """Pooled straight-line depreciation schedules"""
+        failed = self.missing_inputs(project_ids, inputs, ('balance_sheet',))
+        runs, results, schedules = {}, {}, {}
+        for project_id in project_ids:
+            if project_id in failed:
+                continue
+            balance_sheet = inputs['balance_sheet'][project_id]
+            try:
+                schedule = depreciation_rows(balance_sheet, inputs['growth_assumptions'].get(project_id))
+            except Exception as e:
+                failed[project_id] = str(e)
+                continue
+            years = int(balance_sheet.get('asset_depreciated_over_years') or 0) or 10
+            runs[project_id] = [
+                {
+                    'month': row['month'],
+                    'year': row['year'],
+                    'asset_value': row['opening_balance'],
+                    'depreciation_method': 'straight_line',
+                    'depreciation_rate': 100.0 / (years * 12),
+                    'monthly_depreciation': row['depreciation'],
+                    'accumulated_depreciation': row['accumulated_depreciation'],
+                    'net_book_value': row['closing_balance']
+                }
+                for row in schedule
+            ]
+            schedules[project_id] = [
+                {**{key: row[key] for key in SAVED_SCHEDULES['depreciation_schedule'][2]}, 'capex_addition': 0}
+                for row in runs[project_id]
+            ]
+            results[project_id] = {
+                'total_months': len(schedule),
+                'total_depreciation': sum(row['depreciation'] for row in schedule),
+                'final_net_book_value': schedule[-1]['closing_balance']
+            }
+        self.write_runs(conn, 'depreciation_schedule', run_ids, runs, replace_project=True)
+        upstream['depreciation_schedule'] = schedules
+        return results, failed
+
+    def run_monthly_consolidated(self, conn, project_ids, run_ids, inputs, upstream):
+        """Monthly statements built in memory from the inputs and the debt and depreciation schedules"""
+        kwargs = monthly_kwargs(self.options)
+        needs_debt_structure = kwargs.get('cash_sweep') or kwargs.get('solve_circular')
+        failed = self.missing_inputs(project_ids, inputs, ('balance_sheet', 'profit_loss')
+                                     + (('debt_structure',) if needs_debt_structure else ()))
+        ready = [project_id for project_id in project_ids if project_id not in failed]
+        debt = self.upstream_schedules(conn, upstream, 'debt_calculation', ready)
+        depreciation = self.upstream_schedules(conn, upstream, 'depreciation_schedule', ready)
+
+        calculator = MonthlyConsolidatedCalculator(self.db_config, self.storage)
+        runs, results, integrity = {}, {}, {}
+        for project_id in ready:
+            try:
+                if not debt.get(project_id):
+                    raise ValueError("Debt calculations not found")
+                if not depreciation.get(project_id):
+                    raise ValueError("Depreciation schedule not found")
+                result = calculator.build_monthly_consolidated(
+                    project_id, run_ids[project_id], balance_sheet_inputs(inputs['balance_sheet'][project_id]),
+                    profit_loss_inputs(inputs['profit_loss'][project_id]), debt[project_id],
+                    depreciation[project_id], working_capital_inputs(inputs['working_capital'].get(project_id)),
+                    inputs['debt_structure'].get(project_id) if needs_debt_structure else None, **kwargs)
+                results[project_id] = stage_summary(result)
+            except Exception as e:
+                failed[project_id] = str(e)
+                continue
+            runs[project_id] = result['data']
+            integrity[project_id] = [{**result['integrity'], 'tolerance': DEFAULT_TOLERANCE}]
+        self.write_runs(conn, 'monthly_consolidated', run_ids, runs)
+        self.write_runs(conn, 'consolidation_integrity_checks', run_ids, integrity, storage='rows')
+        return results, failed
+
+    def consolidate(self, conn, level, project_ids, run_ids, count_key):
+        """Consolidate the projects' latest monthly runs at the level in one statement"""
+        consolidated = consolidate_runs(conn, level, {project_id: run_ids[project_id] for project_id in project_ids},
+                                        self.storage)
+        failed = {project_id: "Monthly consolidated data not found"
+                  for project_id in project_ids if project_id not in consolidated}
+        return {project_id: {count_key: len(rows)} for project_id, rows in consolidated.items()}, failed
+
+    def run_quarterly_consolidated(self, conn, project_ids, run_ids, inputs, upstream):
+        return self.consolidate(conn, 'quarterly', project_ids, run_ids, 'total_quarters')
+
+    def run_yearly_consolidated(self, conn, project_ids, run_ids, inputs, upstream):
+        return self.consolidate(conn, 'yearly', project_ids, run_ids, 'total_years')
+
+    def run_kpi_calculation(self, conn, project_ids, run_ids, inputs, upstream):
+        """KPIs of the projects' latest consolidated runs, stored under the KPI runs"""
+        calculator = KPICalculator(
+            self.db_config['host'], self.db_config['port'], self.db_config['database'], self.db_config['user'],
+            self.db_config['password'], self.options.get('discount_rate'), self.storage
+        )
+        levels = calculator.build_kpis_batch(project_ids)
+        failed = {}
+        for level, runs in levels.items():
+            for project_id in project_ids:
+                if project_id not in runs and project_id not in failed:
+                    failed[project_id] = f"{level.capitalize()} consolidated data not found"
+
+        results = {project_id: {} for project_id in project_ids if project_id not in failed}
+        for level, runs in levels.items():
+            kpis = {project_id: run['kpis'] for project_id, run in runs.items() if project_id in results}
+            self.write_runs(conn, f'{level}_kpis', run_ids, kpis)
+            for project_id, rows in kpis.items():
+                results[project_id][level] = {'message': f"Calculated {len(rows)} {level} KPIs"}
+        return results, failed
+
+
+class CalculationScheduler:
+    def __init__(self, db_config, scheduler_id=None, batch_size=200, lease=3600, poll_interval=60):
+        self.db_config = db_config
+        self.scheduler_id = scheduler_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        # Seconds a recurrence stays leased without a completed batch
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.conn = None
+        self.stopping = False
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = self.get_connection()
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+    def execute(self, query, params=None):
+        with self.connect().cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall() if cursor.description else cursor.rowcount
+
+    def claim_due(self):
+        """Lease the enabled recurrences that are due and not leased by another scheduler"""
+        return self.execute("""
+            UPDATE calculation_recurrences r
+            SET locked_by = %(scheduler_id)s, locked_until = NOW() + make_interval(secs => %(lease)s)
+            WHERE r.id IN (
+                SELECT id FROM calculation_recurrences
+                WHERE enabled AND next_run_at <= NOW() AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY next_run_at
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING r.*
+        """, {'scheduler_id': self.scheduler_id, 'lease': self.lease})
+
+    def extend_lease(self, recurrences):
+        self.execute("""
+            UPDATE calculation_recurrences SET locked_until = NOW() + make_interval(secs => %s)
+            WHERE id = ANY(%s::uuid[]) AND locked_by = %s
+        """, (self.lease, [str(recurrence['id']) for recurrence in recurrences], self.scheduler_id))
+
+    def finish(self, recurrence, status, result):
+        """Record the run and move next_run_at past now by whole repeat_every steps"""
+        self.execute("""
+            UPDATE calculation_recurrences
+            SET next_run_at = next_run_at + repeat_every * (
+                    FLOOR(EXTRACT(EPOCH FROM NOW() - next_run_at) / EXTRACT(EPOCH FROM repeat_every)) + 1),
+                last_run_at = NOW(), last_status = %s, last_result = %s, locked_by = NULL, locked_until = NULL
+            WHERE id = %s AND locked_by = %s
+        """, (status, json.dumps(result, default=str), recurrence['id'], self.scheduler_id))
+
+    def release(self, recurrences):
+        """Give leased recurrences back unrun, for the next scheduler to pick up"""
+        self.execute("""
+            UPDATE calculation_recurrences SET locked_by = NULL, locked_until = NULL
+            WHERE id = ANY(%s::uuid[]) AND locked_by = %s
+        """, ([str(recurrence['id']) for recurrence in recurrences], self.scheduler_id))
+
+    def due_projects(self, recurrence):
+        """The recurrence's project, or every project with a balance sheet"""
+        if recurrence['project_id']:
+            return [str(recurrence['project_id'])]
+        rows = self.execute("""
+            SELECT p.id FROM projects p
+            WHERE EXISTS (SELECT 1 FROM balance_sheet_data b WHERE b.project_id = p.id)
+            ORDER BY p.id
+        """)
+        return [str(row['id']) for row in rows]
+
+    def group(self, recurrences):
+        """
+        Recurrences -> groups of the same stages and options with each recurrence's
+        projects, listed once when the recurrence is run, and their union
+        """
+        groups = {}
+        for recurrence in recurrences:
+            key = (tuple(recurrence['stages']), json.dumps(recurrence['options'] or {}, sort_keys=True))
+            group = groups.setdefault(key, {'recurrences': [], 'projects': {}, 'project_ids': {}})
+            project_ids = self.due_projects(recurrence)
+            group['recurrences'].append(recurrence)
+            group['projects'][recurrence['id']] = project_ids
+            group['project_ids'].update(dict.fromkeys(project_ids))
+        return list(groups.values())
+
+    def run_group(self, group, writer):
+        """Recalculate a group in batches; returns each project's outcome and error"""
+        first = group['recurrences'][0]
+        pipeline = BatchPipeline(
+            self.db_config, first['stages'], first['options'], first['created_by'],
+            f"Recurring recalculation: {', '.join(recurrence['name'] for recurrence in group['recurrences'])}")
+        outcomes, errors = {}, {}
+        for number, batch in enumerate(chunks(list(group['project_ids']), self.batch_size), start=1):
+            if self.stopping:
+                break
+            started = time.perf_counter()
+            with project_locks(self.db_config, batch) as locked:
+                batch_errors, summaries = pipeline.run(locked) if locked else ({}, {})
+            for project_id in batch:
+                if project_id not in batch_errors:
+                    # Another calculation of the project is running
+                    outcomes[project_id] = 'deferred'
+                elif batch_errors[project_id]:
+                    outcomes[project_id] = 'failed'
+                    errors[project_id] = batch_errors[project_id]
+                else:
+                    outcomes[project_id] = 'completed'
+            elapsed = time.perf_counter() - started
+            writer.stage(f"{first['id']}:{number}", {
+                'projects': len(batch),
+                'locked': len(locked),
+                'failed': sum(1 for error in batch_errors.values() if error),
+                'execution_time_ms': int(elapsed * 1000),
+                'projects_per_second': round(len(locked) / elapsed, 1) if elapsed > 0 else None,
+                'stages': summaries,
+            })
+            self.extend_lease(group['recurrences'])
+        return outcomes, errors
+
+    def tick(self, writer):
+        """Run every due recurrence once; returns how many ran"""
+        recurrences = []
+        for recurrence in self.claim_due():
+            try:
+                check_options(recurrence['options'])
+            except ValueError as e:
+                self.finish(recurrence, 'failed', {'error': str(e)})
+                continue
+            recurrences.append(recurrence)
+
+        for group in self.group(recurrences):
+            started = time.perf_counter()
+            try:
+                outcomes, errors = self.run_group(group, writer)
+            except Exception as e:
+                # Record the failure rather than leaving the recurrences leased until the lease expires
+                for recurrence in group['recurrences']:
+                    self.finish(recurrence, 'failed', {'error': str(e)})
+                continue
+            execution_time_ms = int((time.perf_counter() - started) * 1000)
+            if self.stopping:
+                self.release(group['recurrences'])
+                continue
+            for recurrence in group['recurrences']:
+                project_ids = group['projects'][recurrence['id']]
+                counts = {outcome: 0 for outcome in ('completed', 'failed', 'deferred')}
+                for project_id in project_ids:
+                    # Projects of batches not run count as deferred
+                    counts[outcomes.get(project_id, 'deferred')] += 1
+                failures = {project_id: errors[project_id] for project_id in project_ids if project_id in errors}
+                status = ('completed' if counts['completed'] == len(project_ids)
+                          else 'failed' if counts['completed'] == 0 and project_ids else 'partial')
+                self.finish(recurrence, status, {
+                    'projects': len(project_ids),
+                    **counts,
+                    'execution_time_ms': execution_time_ms,
+                    'projects_per_second': (round(len(outcomes) / execution_time_ms * 1000, 1)
+                                            if execution_time_ms else None),
+                    'failures': dict(list(failures.items())[:MAX_RECORDED_FAILURES]),
+                })
+        return len(recurrences)
+
+    def stop(self, *_):
+        """Finish the current batch, then exit"""
+        self.stopping = True
+
+    def run(self, writer, once=False):
+        """Run due recurrences until stopped (with once, a single pass); returns how many ran"""
+        ran = 0
+        while not self.stopping:
+            try:
+                ran += self.tick(writer)
+            except psycopg2.OperationalError as e:
+                writer.stage('connection_error', {'scheduler_id': self.scheduler_id, 'error': str(e)})
+                self.close()
+            if once:
+                break
+            deadline = time.monotonic() + self.poll_interval
+            while not self.stopping and time.monotonic() < deadline:
+                time.sleep(min(1, self.poll_interval))
+        return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run recurring recalculations in batches')
+    parser.add_argument('--scheduler-id', default=None, help='Name recorded on leased recurrences (default: host:pid)')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('CALCULATION_BATCH_SIZE', '200')),
+                        help='Projects recalculated together per batch')
+    parser.add_argument('--lease', type=int, default=3600,
+                        help='Seconds a recurrence stays leased without a completed batch')
+    parser.add_argument('--poll-interval', type=float, default=60, help='Seconds between checks for due recurrences')
+    parser.add_argument('--once', action='store_true', help='Run the due recurrences once and exit')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    if args.batch_size < 1:
+        write_result({'success': False, 'error': 'batch size must be at least 1'}, args.result_format)
+        sys.exit(1)
+
+    scheduler = CalculationScheduler(db_config, args.scheduler_id, args.batch_size, args.lease, args.poll_interval)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+
+    writer = ResultWriter(args.result_format)
+    try:
+        ran = scheduler.run(writer, args.once)
+    except Exception as e:
+        writer.result({'success': False, 'scheduler_id': scheduler.scheduler_id, 'error': str(e)})
+        sys.exit(1)
+    finally:
+        scheduler.close()
+
+    writer.result({'success': True, 'scheduler_id': scheduler.scheduler_id, 'recurrences': ran})
+
+if __name__ == "__main__":
+    main()
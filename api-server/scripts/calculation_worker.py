@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+"""
+Calculation Worker
+Processes the calculation_jobs queue (migrations/add_calculation_jobs.sql) so
+calculations run outside the API process. Workers claim one job at a time with
+SELECT ... FOR UPDATE SKIP LOCKED and may run side by side in as many containers
+as needed. Each stage of a job (debt schedule, depreciation, monthly, quarterly
+and yearly consolidation, KPIs) runs in-process and is recorded as its own
+calculation_runs row with its status and execution time. A claim holds the job
+for the visibility timeout and is extended before every stage; jobs of workers
+that stop extending it are re-queued, failed attempts are retried with
+exponential backoff from the first unfinished stage, and jobs out of attempts
+are dead-lettered. A job runs under its project's calculation lock
+(project_lock.py), and gives way at the next stage boundary when a newer job
+for the same project and stages has been queued.
+
+Jobs have a priority class. Each worker shares its claims between the classes
+with ready jobs in proportion to their weights (weighted fair queuing), so
+interactive requests are served first without starving scheduled or bulk work,
+and a bulk job hands its worker over at a stage boundary when an interactive job
+has been left waiting. Queue depth and wait times per class are in the
+calculation_job_metrics view (--metrics).
+
+'precompute' jobs, queued by autosaves in speculative mode, keep a dry run of
+the project's saved inputs (speculative_precompute.py). A job whose stages start
+the pipeline persists such a precompute of its inputs and options instead of
+running its stages, still recording a calculation run per stage.
+"""
+
+import sys
+import os
+import json
+import time
+import select
+import signal
+import socket
+import argparse
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+from result_protocol import ResultWriter, add_format_argument, write_result
+from input_cache import enable_input_cache
+from project_lock import project_lock
+from speculative_precompute import PRECOMPUTE_STAGE, SpeculativePrecompute
+from check_integrity import IntegrityChecker
+from calculate_debt_schedule import DebtScheduleCalculator
+from calculate_depreciation_schedule import DepreciationScheduleCalculator, parse_asset_classes
+from calculate_monthly_consolidated import MonthlyConsolidatedCalculator
+from calculate_quarterly_consolidated import QuarterlyConsolidatedCalculator
+from calculate_yearly_consolidated import YearlyConsolidatedCalculator
+from calculate_kpis import KPICalculator
+
+# Stage (the calculation_type of its runs) -> run name, in pipeline order
+STAGES = {
+    'debt_calculation': 'Debt Calculation',
+    'depreciation_schedule': 'Depreciation Schedule Calculation',
+    'monthly_consolidated': 'Monthly Consolidated Calculation',
+    'quarterly_consolidated': 'Quarterly Consolidated Calculation',
+    'yearly_consolidated': 'Yearly Consolidated Calculation',
+    'kpi_calculation': 'KPI Calculation',
+}
+
+JOB_CHANNEL = 'calculation_jobs_queued'
+
+# Priority class -> share of claims while every class has ready jobs, highest priority first
+PRIORITY_WEIGHTS = {'interactive': 16, 'scheduled': 4, 'bulk': 1}
+
+# Job options passed through to MonthlyConsolidatedCalculator.calculate_monthly_consolidated
+MONTHLY_OPTIONS = ('cash_sweep', 'min_cash', 'sweep_priority', 'solve_circular', 'deposit_rate', 'tolerance',
+                   'method', 'compute_tax', 'opening_tax_losses', 'loss_cap_pct', 'loss_cap_amount')
+
+
+def parse_weights(text):
+    """'interactive=16,scheduled=4,bulk=1' -> priority class weights; omitted classes keep their default"""
+    weights = dict(PRIORITY_WEIGHTS)
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, value = item.partition('=')
+        if name not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority class: {name}")
+        if float(value) <= 0:
+            raise ValueError(f"Weight of {name} must be positive")
+        weights[name] = float(value)
+    return weights
+
+
+def monthly_kwargs(options):
+    """Job options -> keyword arguments of the monthly consolidation"""
+    kwargs = {name: options[name] for name in MONTHLY_OPTIONS if options.get(name) is not None}
+    if isinstance(kwargs.get('sweep_priority'), str):
+        kwargs['sweep_priority'] = [name.strip() for name in kwargs['sweep_priority'].split(',') if name.strip()]
+    return kwargs
+
+
+class StageError(Exception):
+    """A stage reported an unsuccessful result"""
+
+
+class LostJobError(Exception):
+    """The job's claim expired and it was re-queued or taken by another worker"""
+
+
+def stage_summary(result):
+    """A stage result without its rows, as stored in output_data and the job result"""
+    if not result.get('success'):
+        raise StageError(result.get('error') or 'Calculation failed')
+    return {key: value for key, value in result.items() if key != 'success' and not isinstance(value, list)}
+
+
+class CalculationWorker:
+    def __init__(self, db_config, worker_id=None, visibility_timeout=300, retry_delay=30, poll_interval=5,
+                 weights=None, preempt_after=0.25):
+        self.db_config = db_config
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.weights = weights or dict(PRIORITY_WEIGHTS)
+        # Seconds an interactive job may wait before a bulk job yields to it
+        self.preempt_after = preempt_after
+        # Weighted fair queuing: claims served per class, in units of 1 / weight
+        self.virtual_time = {name: 0.0 for name in self.weights}
+        self.preferred_class = None
+        self.precomputes = SpeculativePrecompute(db_config)
+        self.conn = None
+        self.stopping = False
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def connect(self):
+        """The worker's queue connection, in autocommit and listening for new jobs"""
+        if self.conn is None or self.conn.closed:
+            self.conn = self.get_connection()
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {JOB_CHANNEL}")
+        return self.conn
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+    def execute(self, query, params=None):
+        with self.connect().cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall() if cursor.description else cursor.rowcount
+
+    def reap_expired(self):
+        """
+        Re-queue running jobs past their visibility timeout, or dead-letter them when
+        out of attempts, or mark them superseded when a newer job of theirs is queued
+        """
+        return self.execute("""
+            WITH expired AS (
+                SELECT j.id, (
+                    SELECT q.id FROM calculation_jobs q
+                    WHERE q.project_id = j.project_id AND q.stages = j.stages AND q.status = 'queued'
+                    ORDER BY q.created_at DESC
+                    LIMIT 1
+                ) AS superseded_by
+                FROM calculation_jobs j
+                WHERE j.status = 'running' AND j.locked_until < NOW()
+                FOR UPDATE OF j SKIP LOCKED
+            )
+            UPDATE calculation_jobs j
+            SET status = CASE WHEN e.superseded_by IS NOT NULL THEN 'superseded'
+                              WHEN j.attempts >= j.max_attempts THEN 'dead'
+                              ELSE 'queued' END,
+                superseded_by = e.superseded_by,
+                finished_at = CASE WHEN e.superseded_by IS NOT NULL OR j.attempts >= j.max_attempts THEN NOW() END,
+                last_error = 'Visibility timeout expired on ' || COALESCE(j.locked_by, 'unknown worker')
+                             || COALESCE(' during ' || j.current_stage, ''),
+                locked_by = NULL,
+                locked_until = NULL
+            FROM expired e
+            WHERE j.id = e.id
+            RETURNING j.id, j.status
+        """)
+
+    def class_order(self):
+        """
+        Classes in claim order: after a preemption the class preempted for, then by
+        virtual finish time, the class furthest behind its weighted share first
+        """
+        order = sorted(self.weights, key=lambda name: self.virtual_time[name] + 1 / self.weights[name])
+        if self.preferred_class:
+            order.remove(self.preferred_class)
+            order.insert(0, self.preferred_class)
+            self.preferred_class = None
+        return order
+
+    def claim(self):
+        """Claim a job of the first class in fair-queuing order that has one ready"""
+        skipped = []
+        for priority_class in self.class_order():
+            job = self.claim_class(priority_class)
+            if job is None:
+                skipped.append(priority_class)
+                continue
+            # Idle classes do not bank credit for later bursts
+            for name in skipped:
+                self.virtual_time[name] = max(self.virtual_time[name], self.virtual_time[priority_class])
+            self.virtual_time[priority_class] += 1 / self.weights[priority_class]
+            return job
+        return None
+
+    def claim_class(self, priority_class):
+        """
+        Take the class's oldest ready job of a project without a running job,
+        skipping those other workers are claiming
+        """
+        rows = self.execute("""
+            WITH next AS (
+                SELECT id FROM calculation_jobs q
+                WHERE status = 'queued' AND priority_class = %(priority_class)s AND run_after <= NOW()
+                  AND NOT EXISTS (
+                      SELECT 1 FROM calculation_jobs r WHERE r.project_id = q.project_id AND r.status = 'running'
+                  )
+                ORDER BY run_after, created_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE calculation_jobs j
+            SET status = 'running',
+                attempts = j.attempts + 1,
+                locked_by = %(worker_id)s,
+                locked_until = NOW() + make_interval(secs => %(timeout)s),
+                started_at = COALESCE(j.started_at, NOW())
+            FROM next
+            WHERE j.id = next.id
+            RETURNING j.*, ROUND(EXTRACT(EPOCH FROM NOW() - GREATEST(j.created_at, j.run_after)) * 1000)::BIGINT
+                AS wait_ms
+        """, {'worker_id': self.worker_id, 'timeout': self.visibility_timeout, 'priority_class': priority_class})
+        return rows[0] if rows else None
+
+    def update_claimed(self, job, assignments, params=None):
+        """Update the job while this attempt still holds it, else raise LostJobError"""
+        updated = self.execute(f"""
+            UPDATE calculation_jobs SET {assignments}
+            WHERE id = %(job_id)s AND status = 'running' AND locked_by = %(worker_id)s AND attempts = %(attempt)s
+        """, {**(params or {}), 'job_id': job['id'], 'worker_id': self.worker_id, 'attempt': job['attempts']})
+        if not updated:
+            raise LostJobError(f"Job {job['id']} is no longer held by {self.worker_id}")
+
+    def heartbeat(self, job, stage):
+        """Extend the claim before starting a stage"""
+        self.update_claimed(job, """
+            locked_until = NOW() + make_interval(secs => %(timeout)s), current_stage = %(stage)s
+        """, {'timeout': self.visibility_timeout, 'stage': stage})
+
+    def record_stage(self, job, stage, calculation_run_id, summary):
+        self.update_claimed(job, """
+            calculation_run_ids = calculation_run_ids || jsonb_build_object(%(stage)s, %(run_id)s::text),
+            result = COALESCE(result, '{}') || jsonb_build_object(%(stage)s, %(summary)s::jsonb)
+        """, {'stage': stage, 'run_id': calculation_run_id, 'summary': json.dumps(summary, default=str)})
+
+    def complete(self, job):
+        self.update_claimed(job, """
+            status = 'completed', finished_at = NOW(), current_stage = NULL,
+            locked_by = NULL, locked_until = NULL, last_error = NULL
+        """)
+
+    def fail(self, job, error):
+        """
+        Schedule a retry with exponential backoff, dead-letter the job, or give way
+        to a newer queued job of its project; returns the new status
+        """
+        newer = self.find_superseding(job)
+        status = 'superseded' if newer else 'dead' if job['attempts'] >= job['max_attempts'] else 'queued'
+        self.update_claimed(job, """
+            status = %(status)s,
+            superseded_by = %(newer)s,
+            run_after = NOW() + make_interval(secs => %(delay)s * power(2, attempts - 1)),
+            finished_at = CASE WHEN %(status)s = 'queued' THEN NULL ELSE NOW() END,
+            last_error = %(error)s,
+            locked_by = NULL,
+            locked_until = NULL
+        """, {'status': status, 'newer': newer, 'delay': self.retry_delay, 'error': error})
+        return status
+
+    def release(self, job):
+        """Put the job back without using up an attempt, for when its project is locked"""
+        self.update_claimed(job, """
+            status = 'queued',
+            attempts = attempts - 1,
+            run_after = NOW() + make_interval(secs => %(delay)s),
+            locked_by = NULL,
+            locked_until = NULL
+        """, {'delay': self.poll_interval})
+        return 'deferred'
+
+    def interactive_waiting(self):
+        """Whether an interactive job that could run has been waiting longer than preempt_after"""
+        rows = self.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM calculation_jobs q
+                WHERE status = 'queued' AND priority_class = 'interactive'
+                  AND run_after <= NOW() - make_interval(secs => %s)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM calculation_jobs r WHERE r.project_id = q.project_id AND r.status = 'running'
+                  )
+            ) AS waiting
+        """, (self.preempt_after,))
+        return rows[0]['waiting']
+
+    def preempt(self, job):
+        """Re-queue a bulk job between stages, keeping its completed stages and attempt, to serve interactive work"""
+        self.update_claimed(job, """
+            status = 'queued',
+            attempts = attempts - 1,
+            preemptions = preemptions + 1,
+            run_after = NOW(),
+            current_stage = NULL,
+            locked_by = NULL,
+            locked_until = NULL
+        """)
+        self.preferred_class = 'interactive'
+        return 'preempted'
+
+    def find_superseding(self, job):
+        """The newest job queued for the same project and stages, whose run makes this one's redundant"""
+        rows = self.execute("""
+            SELECT id FROM calculation_jobs
+            WHERE project_id = %s AND stages = %s::text[] AND status = 'queued' AND id <> %s
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (job['project_id'], list(job['stages']), job['id']))
+        return str(rows[0]['id']) if rows else None
+
+    def supersede(self, job, newer):
+        self.update_claimed(job, """
+            status = 'superseded', superseded_by = %(newer)s, finished_at = NOW(),
+            current_stage = NULL, locked_by = NULL, locked_until = NULL
+        """, {'newer': newer})
+        return 'superseded'
+
+    def create_run(self, job, stage, input_data):
+        rows = self.execute("""
+            INSERT INTO calculation_runs (project_id, run_name, calculation_type, status, run_description,
+                                          input_data, created_by)
+            VALUES (%s, %s, %s, 'running', %s, %s, %s)
+            RETURNING id
+        """, (job['project_id'], STAGES[stage], stage, f"Calculation job {job['id']} (attempt {job['attempts']})",
+              json.dumps(input_data, default=str), job['created_by']))
+        return str(rows[0]['id'])
+
+    def finish_run(self, calculation_run_id, started, summary=None, error=None):
+        self.execute("""
+            UPDATE calculation_runs
+            SET status = %s, completed_at = NOW(), execution_time_ms = %s, output_data = %s, error_message = %s
+            WHERE id = %s
+        """, ('failed' if error else 'completed', int((time.perf_counter() - started) * 1000),
+              json.dumps(summary, default=str) if summary is not None else None, error, calculation_run_id))
+
+    def run_debt_calculation(self, project_id, calculation_run_id, options):
+        calculator = DebtScheduleCalculator(options.get('storage'))
+        if options.get('repayment_mode') == 'sculpted':
+            return calculator.calculate_sculpted_debt_schedule(
+                project_id, calculation_run_id, float(options.get('target_dscr', 1.3)),
+                options.get('sculpted_tranche', 'senior_secured'))
+        return calculator.calculate_debt_schedule(project_id, calculation_run_id)
+
+    def run_depreciation_schedule(self, project_id, calculation_run_id, options):
+        calculator = DepreciationScheduleCalculator(self.db_config, options.get('storage'))
+        if options.get('asset_classes'):
+            asset_classes = parse_asset_classes(json.dumps(options['asset_classes']))
+            return calculator.calculate_class_depreciation_schedule(project_id, calculation_run_id, asset_classes)
+        return calculator.calculate_depreciation_schedule(project_id, calculation_run_id)
+
+    def run_monthly_consolidated(self, project_id, calculation_run_id, options):
+        calculator = MonthlyConsolidatedCalculator(self.db_config, options.get('storage'))
+        result = calculator.calculate_monthly_consolidated(project_id, calculation_run_id, **monthly_kwargs(options))
+        if result['success']:
+            calculator.save_monthly_consolidated(project_id, calculation_run_id, result['data'])
+            IntegrityChecker(self.db_config).save_summary(project_id, calculation_run_id, result['integrity'])
+        return result
+
+    def run_quarterly_consolidated(self, project_id, calculation_run_id, options):
+        calculator = QuarterlyConsolidatedCalculator(self.db_config, options.get('storage'),
+                                                     options.get('consolidation'))
+        return calculator.calculate_quarterly_consolidated(project_id, calculation_run_id)
+
+    def run_yearly_consolidated(self, project_id, calculation_run_id, options):
+        calculator = YearlyConsolidatedCalculator(self.db_config, options.get('storage'),
+                                                  options.get('consolidation'))
+        return calculator.calculate_yearly_consolidated(project_id, calculation_run_id)
+
+    def run_kpi_calculation(self, project_id, calculation_run_id, options):
+        calculator = KPICalculator(
+            self.db_config['host'], self.db_config['port'], self.db_config['database'], self.db_config['user'],
+            self.db_config['password'], options.get('discount_rate'), options.get('storage')
+        )
+        results = {
+            'monthly': calculator.calculate_monthly_kpis(project_id, None, calculation_run_id),
+            'quarterly': calculator.calculate_quarterly_kpis(project_id, None, calculation_run_id),
+            'yearly': calculator.calculate_yearly_kpis(project_id, None, calculation_run_id),
+        }
+        failed = [result['error'] for result in results.values() if not result.get('success')]
+        if failed:
+            return {'success': False, 'error': '; '.join(failed)}
+        return {'success': True, **{level: stage_summary(result) for level, result in results.items()}}
+
+    def run_stage(self, job, stage, calculation_run_ids, precompute=None):
+        """
+        Run one stage as its own calculation run, or persist it from a precompute;
+        returns the run id and the stage summary
+        """
+        project_id = str(job['project_id'])
+        options = job['options'] or {}
+        input_data = {'projectId': project_id, 'calculationType': stage, 'jobId': str(job['id']), 'options': options}
+        if stage in ('quarterly_consolidated', 'yearly_consolidated') and 'monthly_consolidated' in calculation_run_ids:
+            input_data['monthlyCalculationRunId'] = calculation_run_ids['monthly_consolidated']
+        if precompute:
+            input_data['precomputeId'] = str(precompute['id'])
+
+        calculation_run_id = self.create_run(job, stage, input_data)
+        started = time.perf_counter()
+        try:
+            if precompute:
+                result = self.precomputes.persist_stage(stage, project_id, calculation_run_id, precompute['result'],
+                                                        options)
+            else:
+                result = getattr(self, f'run_{stage}')(project_id, calculation_run_id, options)
+            summary = stage_summary(result)
+        except Exception as e:
+            self.finish_run(calculation_run_id, started, error=str(e))
+            raise
+        self.finish_run(calculation_run_id, started, summary)
+        return calculation_run_id, summary
+
+    def process(self, job):
+        """Run the job under its project's calculation lock; returns the job's outcome"""
+        try:
+            if list(job['stages']) == [PRECOMPUTE_STAGE]:
+                # Writes no calculation rows, so other calculations of the project may run meanwhile
+                return self.run_precompute(job)
+            with project_lock(self.db_config, job['project_id'], wait=False) as locked:
+                if not locked:
+                    # A calculation of the project is running outside the queue
+                    return self.release(job)
+                return self.run_job(job)
+        except LostJobError:
+            return 'lost'
+
+    def find_precompute(self, job, calculation_run_ids):
+        """
+        A precompute of the project's current inputs and the job's options that can
+        replace its stages: they must start the pipeline, so that none of them reads
+        rows left by an earlier calculation, and none may have run yet
+        """
+        stages = list(job['stages'])
+        if calculation_run_ids or stages != list(STAGES)[:len(stages)]:
+            return None
+        return self.precomputes.lookup(job['project_id'], job['options'] or {})
+
+    def run_precompute(self, job):
+        """Keep a dry run of the project's saved inputs for a later request to be served or promoted from"""
+        try:
+            self.heartbeat(job, PRECOMPUTE_STAGE)
+            started = time.perf_counter()
+            precompute, computed = self.precomputes.precompute(job['project_id'], job['options'] or {}, job['id'])
+        except LostJobError:
+            raise
+        except Exception as e:
+            return self.fail(job, f"{PRECOMPUTE_STAGE}: {e}")
+
+        if precompute is None:
+            summary = {'skipped': 'Options not supported by the dry run'}
+        else:
+            summary = {'precompute_id': str(precompute['id']), 'input_hash': precompute['input_hash'],
+                       'computed': computed, 'execution_time_ms': int((time.perf_counter() - started) * 1000)}
+        self.update_claimed(job, "result = jsonb_build_object(%(stage)s, %(summary)s::jsonb)",
+                            {'stage': PRECOMPUTE_STAGE, 'summary': json.dumps(summary)})
+        self.complete(job)
+        return 'completed'
+
+    def run_job(self, job):
+        """Run the job's unfinished stages in order"""
+        calculation_run_ids = dict(job['calculation_run_ids'] or {})
+        stage = None
+        ran_stage = False
+        try:
+            precompute = self.find_precompute(job, calculation_run_ids)
+            for stage in job['stages']:
+                if stage in calculation_run_ids:
+                    # Completed by an earlier attempt
+                    continue
+                # Newer inputs were requested meanwhile; the queued job recalculates from here
+                newer = self.find_superseding(job)
+                if newer:
+                    return self.supersede(job, newer)
+                # Every claim runs at least one stage, so bulk work still progresses under load
+                if ran_stage and job['priority_class'] == 'bulk' and self.interactive_waiting():
+                    return self.preempt(job)
+                self.heartbeat(job, stage)
+                calculation_run_id, summary = self.run_stage(job, stage, calculation_run_ids, precompute)
+                calculation_run_ids[stage] = calculation_run_id
+                self.record_stage(job, stage, calculation_run_id, summary)
+                ran_stage = True
+            if precompute:
+                self.precomputes.record_hit(precompute['id'], str(job['id']))
+            self.complete(job)
+            return 'completed'
+        except LostJobError:
+            raise
+        except Exception as e:
+            error = f"{stage}: {e}" if stage else str(e)
+        return self.fail(job, error)
+
+    def queue_metrics(self):
+        """Queue depth, waits and latencies per priority class"""
+        return self.execute("SELECT * FROM calculation_job_metrics")
+
+    def wait(self):
+        """Sleep until a job is queued or the poll interval passes"""
+        conn = self.connect()
+        if select.select([conn], [], [], self.poll_interval) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+
+    def stop(self, *_):
+        """Finish the current job, then exit"""
+        self.stopping = True
+
+    def run(self, writer, once=False, max_jobs=None):
+        """Process jobs until stopped (with once, until no job is ready); returns outcome counts"""
+        outcomes = {'completed': 0, 'queued': 0, 'dead': 0, 'superseded': 0, 'deferred': 0, 'preempted': 0,
+                    'lost': 0}
+        processed = 0
+        while not self.stopping and (max_jobs is None or processed < max_jobs):
+            try:
+                self.reap_expired()
+                job = self.claim()
+                if job is None:
+                    if once:
+                        break
+                    self.wait()
+                    continue
+
+                started = time.perf_counter()
+                outcome = self.process(job)
+            except psycopg2.OperationalError as e:
+                writer.stage('connection_error', {'worker_id': self.worker_id, 'error': str(e)})
+                self.close()
+                time.sleep(self.poll_interval)
+                continue
+
+            processed += 1
+            outcomes[outcome] += 1
+            writer.stage(str(job['id']), {
+                'project_id': str(job['project_id']),
+                'priority_class': job['priority_class'],
+                'wait_ms': int(job['wait_ms']),
+                'attempt': job['attempts'],
+                'outcome': outcome,
+                'execution_time_ms': int((time.perf_counter() - started) * 1000),
+            })
+        return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process queued calculation jobs')
+    parser.add_argument('--worker-id', default=None, help='Name recorded on claimed jobs (default: host:pid)')
+    parser.add_argument('--visibility-timeout', type=int, default=int(os.getenv('CALCULATION_JOB_TIMEOUT', '300')),
+                        help='Seconds a claimed stage may run before the job is handed to another worker')
+    parser.add_argument('--retry-delay', type=int, default=30,
+                        help='Seconds before the first retry of a failed job, doubled on every further attempt')
+    parser.add_argument('--poll-interval', type=float, default=5, help='Seconds between queue polls when idle')
+    parser.add_argument('--once', action='store_true', help='Exit when no job is ready instead of waiting')
+    parser.add_argument('--max-jobs', type=int, default=None, help='Exit after processing this many jobs')
+    parser.add_argument('--weights', default=os.getenv('CALCULATION_CLASS_WEIGHTS', ''),
+                        help='Claim shares per priority class, e.g. interactive=16,scheduled=4,bulk=1')
+    parser.add_argument('--preempt-after', type=float, default=0.25,
+                        help='Seconds an interactive job may wait before running bulk jobs yield between stages')
+    parser.add_argument('--metrics', action='store_true', help='Report queue depth and wait times, then exit')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    try:
+        weights = parse_weights(args.weights)
+    except ValueError as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    worker = CalculationWorker(db_config, args.worker_id, args.visibility_timeout, args.retry_delay,
+                               args.poll_interval, weights, args.preempt_after)
+
+    if args.metrics:
+        try:
+            metrics = worker.queue_metrics()
+        except Exception as e:
+            write_result({'success': False, 'error': str(e)}, args.result_format)
+            sys.exit(1)
+        finally:
+            worker.close()
+        write_result({'success': True}, args.result_format, {'metrics': metrics})
+        return
+
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    writer = ResultWriter(args.result_format)
+    try:
+        # Stages of the jobs of a project read the same inputs
+        enable_input_cache(db_config)
+        outcomes = worker.run(writer, args.once, args.max_jobs)
+    except Exception as e:
+        writer.result({'success': False, 'worker_id': worker.worker_id, 'error': str(e)})
+        sys.exit(1)
+    finally:
+        worker.close()
+
+    writer.result({'success': True, 'worker_id': worker.worker_id, 'jobs': outcomes})
+
+if __name__ == "__main__":
+    main()
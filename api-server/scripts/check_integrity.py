@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Consolidation Integrity Checker
+Checks that the monthly balance sheet ties out (assets = liabilities + equity) and
+that net cash flow reconciles to the change in cash, for one or many projects in a
+single vectorized comparison, and stores a compact mismatch summary per run.
+"""
+
+import sys
+import argparse
+try:
+    import psycopg2
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+import numpy as np
+
+import model_engine
+from run_storage import load_latest_series_batch, newer_series
+from result_protocol import add_format_argument, write_result
+
+DEFAULT_TOLERANCE = 0.05
+
+
+class IntegrityChecker:
+    def __init__(self, db_config, tolerance=DEFAULT_TOLERANCE):
+        self.db_config = db_config
+        self.tolerance = tolerance
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def get_latest_monthly_runs(self, project_ids=None):
+        """Get the latest monthly consolidated run of each project, with its opening cash"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH latest AS (
+                    SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at
+                    FROM monthly_consolidated
+                    WHERE %(all)s OR project_id::text = ANY(%(project_ids)s::text[])
+                    ORDER BY project_id, created_at DESC
+                ),
+                opening AS (
+                    SELECT DISTINCT ON (project_id) project_id, cash
+                    FROM balance_sheet_data
+                    ORDER BY project_id, version DESC
+                )
+                SELECT mc.project_id, mc.calculation_run_id, l.created_at, mc.month, COALESCE(o.cash, 0),
+                       mc.cash, mc.total_assets, mc.total_equity_liability, mc.net_cash_flow
+                FROM monthly_consolidated mc
+                JOIN latest l ON l.project_id = mc.project_id AND l.calculation_run_id = mc.calculation_run_id
+                LEFT JOIN opening o ON o.project_id = mc.project_id
+                ORDER BY mc.project_id, mc.month
+            """, {'all': not project_ids, 'project_ids': list(project_ids or [])})
+            rows = cursor.fetchall()
+            
+            # Runs kept in array storage replace older row-stored runs
+            created_at = {str(row[0]): row[2] for row in rows}
+            series_runs = newer_series(load_latest_series_batch(cursor, 'monthly_consolidated', project_ids), created_at)
+            opening = {}
+            if series_runs:
+                cursor.execute("""
+                    SELECT DISTINCT ON (project_id) project_id, cash
+                    FROM balance_sheet_data
+                    WHERE project_id::text = ANY(%s::text[])
+                    ORDER BY project_id, version DESC
+                """, (list(series_runs),))
+                opening = {str(project_id): float(cash or 0) for project_id, cash in cursor.fetchall()}
+
+        runs = {}
+        for project_id, run_id, _, month, opening_cash, *values in rows:
+            if str(project_id) in series_runs:
+                continue
+            run = runs.setdefault(str(project_id), {
+                'calculation_run_id': str(run_id),
+                'opening_cash': float(opening_cash),
+                'months': [],
+                'values': [],
+            })
+            run['months'].append(month)
+            run['values'].append([float(v) if v is not None else 0.0 for v in values])
+        
+        for project_id, series in series_runs.items():
+            columns = series['columns']
+            runs[project_id] = {
+                'calculation_run_id': series['calculation_run_id'],
+                'opening_cash': opening.get(project_id, 0.0),
+                'months': columns['month'],
+                'values': [[float(v) if v is not None else 0.0 for v in values]
+                           for values in zip(columns['cash'], columns['total_assets'],
+                                             columns['total_equity_liability'], columns['net_cash_flow'])],
+            }
+        return runs
+
+    def check_records(self, monthly_data, opening_cash):
+        """Check one run given as monthly consolidated records"""
+        check = model_engine.integrity_check(
+            [r['total_assets'] for r in monthly_data],
+            [r['total_equity_liability'] for r in monthly_data],
+            [r['cash'] for r in monthly_data],
+            [r['net_cash_flow'] for r in monthly_data],
+            opening_cash,
+            self.tolerance)
+        return model_engine.integrity_summary(check, [r['month'] for r in monthly_data])[0]
+
+    def check_projects(self, project_ids=None):
+        """Check the latest run of many projects at once"""
+        runs = self.get_latest_monthly_runs(project_ids)
+        if not runs:
+            return {}
+
+        # Pad runs to a common length so all projects go through one comparison
+        nb_months = max(len(run['months']) for run in runs.values())
+        values = np.zeros((len(runs), nb_months, 4))
+        valid = np.zeros((len(runs), nb_months), dtype=bool)
+        for i, run in enumerate(runs.values()):
+            values[i, :len(run['months'])] = run['values']
+            valid[i, :len(run['months'])] = True
+        opening_cash = np.array([run['opening_cash'] for run in runs.values()])
+
+        check = model_engine.integrity_check(
+            values[..., 1], values[..., 2], values[..., 0], values[..., 3], opening_cash, self.tolerance)
+        check['balance_mismatch'] &= valid
+        check['cash_mismatch'] &= valid
+
+        results = {}
+        for i, (project_id, run) in enumerate(runs.items()):
+            n = len(run['months'])
+            row = {key: value[i:i + 1, :n] for key, value in check.items()}
+            summary = model_engine.integrity_summary(row, run['months'])[0]
+            summary['calculation_run_id'] = run['calculation_run_id']
+            results[project_id] = summary
+        return results
+
+    def save_summary(self, project_id, calculation_run_id, summary):
+        """Save the mismatch summary of one run, replacing any earlier check of that run"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM consolidation_integrity_checks 
+                WHERE calculation_run_id = %s
+            """, (calculation_run_id,))
+            cursor.execute("""
+                INSERT INTO consolidation_integrity_checks (
+                    project_id, calculation_run_id, months_checked, balance_mismatches, cash_mismatches,
+                    max_balance_difference, max_cash_difference, first_balance_mismatch_month,
+                    first_cash_mismatch_month, tolerance, passed
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                project_id, calculation_run_id, summary['months_checked'], summary['balance_mismatches'],
+                summary['cash_mismatches'], summary['max_balance_difference'], summary['max_cash_difference'],
+                summary['first_balance_mismatch_month'], summary['first_cash_mismatch_month'],
+                self.tolerance, summary['passed']
+            ))
+            conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check balance sheet and cash flow integrity of consolidated runs')
+    parser.add_argument('project_ids', nargs='*', help='Project IDs (all projects when omitted)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Largest difference accepted as rounding')
+    parser.add_argument('--no-save', action='store_true', help='Report without storing the summaries')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    import os
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    checker = IntegrityChecker(db_config, args.tolerance)
+    try:
+        results = checker.check_projects(args.project_ids)
+        if not args.no_save:
+            for project_id, summary in results.items():
+                checker.save_summary(project_id, summary['calculation_run_id'], summary)
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    write_result({
+        'success': True,
+        'projects_checked': len(results),
+        'projects_failed': sum(1 for summary in results.values() if not summary['passed']),
+        'results': results
+    }, args.result_format)
+
+if __name__ == "__main__":
+    main()
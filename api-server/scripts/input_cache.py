@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Input Cache
+Latest-version lookups of the calculation inputs (SELECT * FROM <table> WHERE
+project_id = ? ORDER BY version DESC LIMIT 1) go through latest_input(). In a
+long-running process that calls enable_input_cache(), the rows are kept in a
+size-bounded LRU keyed by table and project, so chained and repeated
+calculations of a project read their inputs from memory. Entries are dropped
+when Postgres notifies a change on the calculation_inputs_changed channel
+(migrations/add_calculation_input_notify.sql); notifications are applied
+before every lookup. Short-lived scripts leave the cache disabled and query
+directly.
+"""
+
+import os
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+from numeric_decoding import FLOAT_NUMERIC
+
+INPUT_TABLES = ('balance_sheet_data', 'profit_loss_data', 'debt_structure_data', 'growth_assumptions_data',
+                'working_capital_data')
+
+NOTIFY_CHANNEL = 'calculation_inputs_changed'
+
+_cache = None
+
+
+def fetch_latest_input(cursor, table, project_id):
+    """The project's latest version row of an input table as a dict, or None"""
+    if table not in INPUT_TABLES:
+        raise ValueError(f"Unknown input table: {table}")
+    psycopg2.extensions.register_type(FLOAT_NUMERIC, cursor)
+    cursor.execute(f"""
+        SELECT * FROM {table}
+        WHERE project_id = %s
+        ORDER BY version DESC
+        LIMIT 1
+    """, (project_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return dict(row)
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+class InputCache:
+    def __init__(self, db_config, max_entries=None):
+        self.db_config = db_config
+        self.max_entries = max_entries or int(os.getenv('INPUT_CACHE_SIZE', '512'))
+        self.entries = OrderedDict()
+        self.listener = None
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.notifications = 0
+
+    def listen(self):
+        """(Re)open the LISTEN connection; missed notifications are covered by clearing the cache"""
+        self.close()
+        self.entries.clear()
+        # Reads in flight may predate the new listener, so they count as changed
+        self.notifications += 1
+        self.listener = psycopg2.connect(**self.db_config)
+        self.listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+    def close(self):
+        for conn in (self.listener, self.conn):
+            if conn is not None and not conn.closed:
+                conn.close()
+        self.listener = None
+        self.conn = None
+
+    def apply_notifications(self):
+        """Drop the entries named by pending notifications"""
+        try:
+            if self.listener is None or self.listener.closed:
+                self.listen()
+            self.listener.poll()
+        except psycopg2.OperationalError:
+            # The listener is gone and notifications may have been lost
+            self.close()
+            self.entries.clear()
+            return
+        while self.listener.notifies:
+            table, _, project_id = self.listener.notifies.pop(0).payload.partition(':')
+            self.notifications += 1
+            self.invalidate(table, project_id)
+
+    def invalidate(self, table=None, project_id=None):
+        """Drop one table's entry for a project, all entries of a project, or everything"""
+        keys = [key for key in self.entries
+                if (table is None or key[0] == table) and (project_id is None or key[1] == str(project_id))]
+        for key in keys:
+            del self.entries[key]
+        self.invalidations += len(keys)
+
+    def get(self, table, project_id):
+        """Latest version row of the input table for the project (None when missing)"""
+        self.apply_notifications()
+        key = (table, str(project_id))
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            row = self.entries[key]
+            return dict(row) if row is not None else None
+
+        self.misses += 1
+        notifications = self.notifications
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**self.db_config)
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.conn.cursor() as cursor:
+            row = fetch_latest_input(cursor, table, project_id)
+
+        # Only keep the row when no input change arrived while it was read
+        self.apply_notifications()
+        if self.listener is not None and self.notifications == notifications:
+            self.entries[key] = row
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return dict(row) if row is not None else None
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'notifications': self.notifications,
+        }
+
+
+def enable_input_cache(db_config, max_entries=None):
+    """Turn on the process-wide input cache (for long-running calculation processes)"""
+    global _cache
+    if _cache is None:
+        _cache = InputCache(db_config, max_entries)
+        _cache.listen()
+    return _cache
+
+
+def disable_input_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def latest_input(cursor, table, project_id):
+    """
+    The project's latest version row of an input table as a dict (None when
+    missing), from the process-wide cache when enabled, else read with cursor.
+    Numeric columns are floats.
+    """
+    if _cache is not None:
+        return _cache.get(table, project_id)
+    return fetch_latest_input(cursor, table, project_id)
+
+
+def load_latest_input(get_connection, table, project_id):
+    """
+    latest_input() for callers without an open connection: a cache hit needs no
+    connection, otherwise one is opened with get_connection for the read
+    """
+    if _cache is not None:
+        return _cache.get(table, project_id)
+    conn = get_connection()
+    try:
+        return fetch_latest_input(conn.cursor(), table, project_id)
+    finally:
+        conn.close()
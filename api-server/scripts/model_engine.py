@@ -0,0 +1,950 @@
+#!/usr/bin/env python3
+"""
+In-Memory Model Engine
+Vectorized NumPy version of the calculation scripts, used for batch and what-if work.
+Every function accepts scalars or 1-D arrays (one entry per scenario) and returns
+arrays of shape (scenarios, months), so many candidate inputs are evaluated in one call.
+"""
+
+import time
+
+import numpy as np
+
+NB_MONTHS = 120
+
+# Tranche name -> (balance sheet opening column, debt structure column suffix)
+TRANCHES = {
+    'senior_secured': ('senior_secured', 'senior_secured'),
+    'short_term': ('debt_tranche1', 'short_term'),
+}
+
+
+def _value(data, key, default=0):
+    """Read a numeric field from an input row, mapping NULL to the default"""
+    value = data.get(key) if data else None
+    return float(value) if value is not None else default
+
+
+def tranche_terms(debt_structure, balance_sheet):
+    """Extract per-tranche terms from debt structure and balance sheet rows"""
+    terms = {}
+    for tranche, (opening_column, suffix) in TRANCHES.items():
+        terms[tranche] = {
+            'opening': _value(balance_sheet, opening_column),
+            'additional_loan': _value(debt_structure, f'additional_loan_{suffix}'),
+            'bank_base_rate': _value(debt_structure, f'bank_base_rate_{suffix}'),
+            'liquidity_premiums': _value(debt_structure, f'liquidity_premiums_{suffix}'),
+            'credit_risk_premiums': _value(debt_structure, f'credit_risk_premiums_{suffix}'),
+            'maturity_y': int(_value(debt_structure, f'maturity_y_{suffix}')),
+            'amortization_y': int(_value(debt_structure, f'amortization_y_{suffix}')),
+        }
+    return terms
+
+
+def monthly_rate(terms):
+    """Monthly interest rate from base rate and premiums given in percent"""
+    annual = (np.asarray(terms['bank_base_rate'], dtype=float)
+              + np.asarray(terms['liquidity_premiums'], dtype=float)
+              + np.asarray(terms['credit_risk_premiums'], dtype=float)) / 100
+    return annual / 12
+
+
+def debt_schedule(opening, additional_loan, rate_per_month, maturity_m, amortization_m, nb_months=NB_MONTHS):
+    """
+    Closed-form version of the DebtScheduleCalculator loop for one tranche.
+
+    Interest capitalises during the interest-only (amortization) period, then the
+    balance is repaid with a level annuity (npf.pmt convention, so repayments are
+    negative) over the remaining maturity. Balances below 1 are zeroed and the
+    tranche stays closed afterwards, exactly as in the script.
+    """
+    opening, additional_loan, rate, maturity_m, amortization_m = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float))
+          for x in (opening, additional_loan, rate_per_month, maturity_m, amortization_m)))
+    t = np.arange(1, nb_months + 1, dtype=float)[None, :]
+    rate = rate[:, None]
+    amortization_m = amortization_m[:, None]
+    repayment_over_m = (maturity_m[:, None] - amortization_m)
+    principal = (opening + additional_loan)[:, None]
+
+    growth = (1 + rate) ** np.minimum(t, amortization_m)
+    outstanding_after_amortization = principal * (1 + rate) ** amortization_m
+
+    # Level annuity after the interest-only period
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(
+            rate == 0,
+            outstanding_after_amortization / repayment_over_m,
+            outstanding_after_amortization * rate / (1 - (1 + rate) ** -repayment_over_m))
+    annuity = np.where(repayment_over_m > 0, annuity, 0.0)
+
+    k = np.clip(t - amortization_m, 0, None)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        compounded = (1 + rate) ** k
+        paid = np.where(rate == 0, annuity * k, annuity * (compounded - 1) / np.where(rate == 0, 1, rate))
+        raw_closing = np.where(t <= amortization_m, principal * growth,
+                               outstanding_after_amortization * compounded - paid)
+    raw_closing = np.where((repayment_over_m > 0) & (k >= repayment_over_m), 0.0, raw_closing)
+    raw_repayment = np.where(t > amortization_m, -annuity, 0.0)
+
+    # Once a balance drops below 1 the tranche is closed for good
+    alive = np.cumprod(np.abs(raw_closing) >= 1, axis=1).astype(bool)
+    alive_before = np.concatenate([np.ones_like(alive[:, :1]), alive[:, :-1]], axis=1)
+
+    closing = np.where(alive, raw_closing, 0.0)
+    opening_balance = np.concatenate([opening[:, None], closing[:, :-1]], axis=1)
+    additional = np.zeros_like(closing)
+    additional[:, 0] = additional_loan
+    interest = (opening_balance + additional) * rate
+    repayment = np.where(alive_before, raw_repayment, 0.0)
+
+    return {
+        'opening': opening_balance,
+        'additional_loan': additional,
+        'interest': interest,
+        'repayment': repayment,
+        'closing': closing,
+    }
+
+
+def combined_debt_schedule(terms, nb_months=NB_MONTHS):
+    """Run every tranche in terms and return per-tranche and total schedules"""
+    tranches = {
+        name: debt_schedule(
+            t['opening'], t['additional_loan'], monthly_rate(t),
+            np.asarray(t['maturity_y'], dtype=float) * 12,
+            np.asarray(t['amortization_y'], dtype=float) * 12,
+            nb_months)
+        for name, t in terms.items()
+    }
+    total = {key: sum(s[key] for s in tranches.values()) for key in next(iter(tranches.values()))}
+    return {'tranches': tranches, 'total': total}
+
+
+def monthly_ebitda(profit_loss):
+    """Monthly EBITDA as used by calculate_monthly_consolidated"""
+    return (_value(profit_loss, 'revenue') - _value(profit_loss, 'cogs')
+            - _value(profit_loss, 'operating_expenses'))
+
+
+def _filled(values, fill):
+    return np.where(np.isnan(values), fill, values)
+
+
+def debt_kpis(total_schedule, ebitda):
+    """
+    Monthly debt KPIs using the calculate_kpis formulas, but with the scheduled
+    closing balance as debt so additional loans show up in the ratios.
+    Months without debt service have no DSCR (NaN) instead of 0, and debt
+    against non-positive EBITDA counts as unbounded leverage.
+    """
+    ebitda = np.broadcast_to(np.asarray(ebitda, dtype=float), total_schedule['closing'].shape)
+    debt = total_schedule['closing']
+    debt_service = np.abs(total_schedule['repayment'])
+    interest = np.abs(total_schedule['interest'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dscr = np.where(debt_service > 0, ebitda / debt_service, np.nan)
+        debt_to_ebitda = np.where(ebitda > 0, debt / ebitda, np.where(debt > 0, np.inf, 0.0))
+        interest_coverage = np.where(interest > 0, ebitda / interest, np.nan)
+    return {
+        'debt_service_coverage_ratio': dscr,
+        'debt_to_ebitda': debt_to_ebitda,
+        'interest_coverage_ratio': interest_coverage,
+    }
+
+
+def kpi_summary(kpis):
+    """Per-scenario covenant figures: minimum coverage ratios and maximum leverage"""
+    return {
+        'min_dscr': _filled(kpis['debt_service_coverage_ratio'], np.inf).min(axis=1),
+        'max_debt_to_ebitda': kpis['debt_to_ebitda'].max(axis=1),
+        'min_interest_coverage': _filled(kpis['interest_coverage_ratio'], np.inf).min(axis=1),
+    }
+
+
+def sculpted_schedule(opening, additional_loan, rate_per_month, maturity_m, amortization_m, debt_service,
+                      nb_months=NB_MONTHS):
+    """
+    Debt schedule whose repayment after the interest-only period follows a given
+    debt service profile instead of a level annuity.
+
+    The balance recursion B_t = B_{t-1} * (1 + r) - DS_t is solved in closed form
+    with a cumulative sum of discounted debt service. The final payment is capped
+    at the outstanding balance and anything left at maturity is repaid as a balloon.
+    """
+    opening, additional_loan, rate, maturity_m, amortization_m = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float))
+          for x in (opening, additional_loan, rate_per_month, maturity_m, amortization_m)))
+    debt_service = np.broadcast_to(np.asarray(debt_service, dtype=float), (len(opening), nb_months))
+    t = np.arange(1, nb_months + 1, dtype=float)[None, :]
+    rate = rate[:, None]
+    amortization_m = amortization_m[:, None]
+    maturity_m = maturity_m[:, None]
+    principal = (opening + additional_loan)[:, None]
+
+    k = t - amortization_m
+    in_window = (k > 0) & (t <= maturity_m)
+    outstanding_after_amortization = principal * (1 + rate) ** amortization_m
+    discounted = np.where(in_window, np.clip(debt_service, 0, None) * (1 + rate) ** -k, 0.0)
+    raw_closing = np.where(t <= amortization_m, principal * (1 + rate) ** t,
+                           (1 + rate) ** k * (outstanding_after_amortization - np.cumsum(discounted, axis=1)))
+    raw_closing = np.where((maturity_m > amortization_m) & (t >= maturity_m), 0.0, raw_closing)
+
+    alive = np.cumprod(raw_closing >= 1, axis=1).astype(bool)
+    closing = np.where(alive, raw_closing, 0.0)
+    opening_balance = np.concatenate([opening[:, None], closing[:, :-1]], axis=1)
+    additional = np.zeros_like(closing)
+    additional[:, 0] = additional_loan
+    interest = (opening_balance + additional) * rate
+    repayment = closing - opening_balance - additional - interest
+
+    return {
+        'opening': opening_balance,
+        'additional_loan': additional,
+        'interest': interest,
+        'repayment': repayment,
+        'closing': closing,
+    }
+
+
+def sculpt_to_dscr(terms, ebitda, target_dscr, tranche='senior_secured', capex=0.0, tax=0.0,
+                   tax_rate=None, depreciation=0.0, tolerance=1e-6, max_iterations=50, nb_months=NB_MONTHS):
+    """
+    Sculpt one tranche so total debt service stays at CFADS / target_dscr.
+
+    CFADS = EBITDA - capex - tax. With a tax_rate, tax is charged on
+    EBITDA - depreciation - interest, which makes CFADS depend on the sculpted
+    interest; the whole schedule is then recomputed per pass until interest
+    changes by less than tolerance. Other tranches keep their annuity schedules.
+    """
+    others = {name: t for name, t in terms.items() if name != tranche}
+    other_total = combined_debt_schedule(others, nb_months)['total'] if others else None
+    other_interest = other_total['interest'] if others else 0.0
+    other_debt_service = -other_total['repayment'] if others else 0.0
+
+    sculpted_terms = terms[tranche]
+    rate = monthly_rate(sculpted_terms)
+    maturity_m = np.asarray(sculpted_terms['maturity_y'], dtype=float) * 12
+    amortization_m = np.asarray(sculpted_terms['amortization_y'], dtype=float) * 12
+
+    interest = np.zeros(nb_months)
+    converged = False
+    for iteration in range(1, max_iterations + 1):
+        if tax_rate is not None:
+            taxable = np.asarray(ebitda) - np.asarray(depreciation) - interest
+            period_tax = tax_rate * np.clip(taxable, 0, None)
+        else:
+            period_tax = tax
+        cfads = np.asarray(ebitda, dtype=float) - np.asarray(capex, dtype=float) - period_tax
+        cfads = np.broadcast_to(cfads, np.broadcast_shapes(np.shape(cfads), (1, nb_months)))
+        target = cfads / target_dscr - other_debt_service
+        schedule = sculpted_schedule(sculpted_terms['opening'], sculpted_terms['additional_loan'], rate,
+                                     maturity_m, amortization_m, target, nb_months)
+        new_interest = schedule['interest'] + other_interest
+        delta = np.max(np.abs(new_interest - interest))
+        interest = new_interest
+        if tax_rate is None or delta < tolerance:
+            converged = True
+            break
+
+    tranches = {tranche: schedule}
+    if others:
+        tranches.update(combined_debt_schedule(others, nb_months)['tranches'])
+    total = {key: sum(s[key] for s in tranches.values()) for key in schedule}
+    debt_service = -total['repayment']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dscr = np.where(debt_service > 0, cfads / debt_service, np.nan)
+
+    return {
+        'tranches': tranches,
+        'total': total,
+        'cfads': cfads,
+        'dscr': dscr,
+        'iterations': iteration,
+        'converged': converged,
+    }
+
+
+def _accumulate_balance(opening, growth, increments):
+    """
+    Solve B_t = B_{t-1} * growth + x_t for every month at once using a
+    discounted cumulative sum (growth and increments have the month axis last).
+    """
+    t = np.arange(1, increments.shape[-1] + 1)
+    factor = growth[..., None] ** t
+    return factor * (opening[..., None] + np.cumsum(increments / factor, axis=-1))
+
+
+def cash_waterfall(terms, operating_cash_flow, opening_cash, min_cash=0.0, priority=None,
+                   tolerance=0.01, max_iterations=50, nb_months=NB_MONTHS):
+    """
+    Roll cash forward month by month and sweep everything above min_cash into
+    voluntary prepayments, applied to tranches in priority order.
+
+    operating_cash_flow is the pre-financing cash flow (CFADS). Scheduled debt
+    service stays as in the annuity schedule, so prepayments shorten the tenor
+    and lower the interest on later months. Each pass is fully vectorized over
+    months: balances follow from a discounted cumulative sum, the cumulative sweep
+    from a running maximum of the pre-sweep cash, and passes repeat until
+    payments stop changing by more than tolerance.
+    """
+    names = list(priority or []) + [name for name in terms if name not in (priority or [])]
+    base = combined_debt_schedule({name: terms[name] for name in names}, nb_months)['tranches']
+    operating_cash_flow = np.atleast_2d(np.asarray(operating_cash_flow, dtype=float))
+    opening_cash = np.atleast_1d(np.asarray(opening_cash, dtype=float))
+    batch = max(base[names[0]]['repayment'].shape[0], operating_cash_flow.shape[0], opening_cash.shape[0])
+    shape = (batch, nb_months)
+
+    scheduled = np.stack([np.broadcast_to(-base[name]['repayment'], shape) for name in names])
+    additional = np.stack([np.broadcast_to(base[name]['additional_loan'], shape) for name in names])
+    opening_balance = np.stack([np.broadcast_to(base[name]['opening'][:, 0], batch) for name in names])
+    rate = np.stack([np.broadcast_to(monthly_rate(terms[name]), batch) for name in names])
+    growth = 1 + rate
+    operating_cash_flow = np.broadcast_to(operating_cash_flow, shape)
+    opening_cash = np.broadcast_to(opening_cash, batch)
+    proceeds = additional.sum(axis=0)
+
+    paid = scheduled.copy()
+    prepayment = np.zeros_like(scheduled)
+    converged = False
+    for iteration in range(1, max_iterations + 1):
+        increments = growth[..., None] * additional - paid - prepayment
+        closing = np.clip(_accumulate_balance(opening_balance, growth, increments), 0, None)
+        opening = np.concatenate([opening_balance[..., None], closing[..., :-1]], axis=-1)
+        owed = (opening + additional) * growth[..., None]
+
+        new_paid = np.minimum(scheduled, owed)
+        flow = operating_cash_flow + proceeds - new_paid.sum(axis=0)
+        pre_sweep_cash = opening_cash[:, None] + np.cumsum(flow, axis=-1)
+        cumulative_sweep = np.maximum.accumulate(np.clip(pre_sweep_cash - min_cash, 0, None), axis=-1)
+        sweep = np.diff(cumulative_sweep, axis=-1, prepend=0.0)
+
+        # Hand each month's sweep down the priority list up to each tranche's balance
+        new_prepayment = np.zeros_like(prepayment)
+        remaining = sweep
+        for j in range(len(names)):
+            new_prepayment[j] = np.minimum(remaining, np.clip(owed[j] - new_paid[j], 0, None))
+            remaining = remaining - new_prepayment[j]
+
+        delta = max(np.max(np.abs(new_paid - paid)), np.max(np.abs(new_prepayment - prepayment)))
+        paid, prepayment = new_paid, new_prepayment
+        if delta < tolerance:
+            converged = True
+            break
+
+    increments = growth[..., None] * additional - paid - prepayment
+    closing = np.clip(_accumulate_balance(opening_balance, growth, increments), 0, None)
+    closing = np.where(closing < 1, 0.0, closing)
+    opening = np.concatenate([opening_balance[..., None], closing[..., :-1]], axis=-1)
+    interest = (opening + additional) * rate[..., None]
+    repayment = closing - opening - additional - interest
+
+    flow = operating_cash_flow + proceeds + repayment.sum(axis=0)
+    closing_cash = opening_cash[:, None] + np.cumsum(flow, axis=-1)
+    opening_cash_balance = np.concatenate([opening_cash[:, None], closing_cash[:, :-1]], axis=-1)
+
+    tranches = {
+        name: {
+            'opening': opening[j],
+            'additional_loan': additional[j],
+            'interest': interest[j],
+            'repayment': repayment[j],
+            'prepayment': -prepayment[j],
+            'closing': closing[j],
+        }
+        for j, name in enumerate(names)
+    }
+    total = {key: sum(s[key] for s in tranches.values()) for key in tranches[names[0]]}
+    return {
+        'tranches': tranches,
+        'total': total,
+        'opening_cash': opening_cash_balance,
+        'closing_cash': closing_cash,
+        'iterations': iteration,
+        'converged': converged,
+    }
+
+
+def solve_fixed_point(func, x0, tolerance=1e-6, max_iterations=100, method='anderson', memory=5):
+    """
+    Solve x = func(x) for an array x of any shape.
+
+    method='anderson' mixes the last `memory` iterates (Anderson acceleration,
+    type II) and usually needs a handful of evaluations; method='picard' is plain
+    successive substitution. Returns the final func(x) and iteration metrics.
+    """
+    if method not in ('anderson', 'picard'):
+        raise ValueError(f"Unsupported fixed-point method: {method}")
+
+    start = time.perf_counter()
+    x = np.asarray(x0, dtype=float)
+    g = np.asarray(func(x), dtype=float)
+    f = g - x
+    residuals = [float(np.max(np.abs(f))) if f.size else 0.0]
+    g_history, f_history = [], []
+
+    while residuals[-1] >= tolerance and len(residuals) < max_iterations:
+        if method == 'anderson' and g_history:
+            dg = np.stack([(g - g_prev).ravel() for g_prev in g_history], axis=1)
+            df = np.stack([(f - f_prev).ravel() for f_prev in f_history], axis=1)
+            gamma = np.linalg.lstsq(df, f.ravel(), rcond=None)[0]
+            x = g - (dg @ gamma).reshape(g.shape)
+            if not np.all(np.isfinite(x)):
+                # Restart from a plain substitution step if the mixing blew up
+                x, g_history, f_history = g, [], []
+        else:
+            x = g
+        g_history = (g_history + [g])[-memory:]
+        f_history = (f_history + [f])[-memory:]
+
+        g = np.asarray(func(x), dtype=float)
+        f = g - x
+        residuals.append(float(np.max(np.abs(f))))
+
+    return g, {
+        'method': method,
+        'iterations': len(residuals),
+        'residual': residuals[-1],
+        'residuals': residuals,
+        'converged': residuals[-1] < tolerance,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+def monthly_model(terms, ebitda, opening_cash, depreciation=0.0, capex=0.0, tax=0.0, tax_rate=None,
+                  working_capital_change=0.0, deposit_rate=0.0, min_cash=np.inf, priority=None,
+                  opening_tax_losses=0.0, loss_cap_pct=None, loss_cap_amount=None,
+                  tolerance=0.01, max_iterations=100, method='anderson', nb_months=NB_MONTHS):
+    """
+    Solve the circular monthly model: interest depends on debt, debt on the cash
+    sweep, cash on net income, and net income on interest and tax.
+
+    The unknowns are monthly tax and interest earned on cash (deposit_rate, in
+    percent per annum, on the opening cash balance). With a tax_rate, tax is
+    charged on EBITDA - depreciation - net interest through tax_schedule, with
+    loss carry-forward and optional caps; otherwise the given tax is used.
+    working_capital_change is the cash-flow effect of working capital (negative
+    for a build-up). min_cash=inf disables the sweep. Returns the cash waterfall
+    plus the solved tax, interest income, net income and solver metrics.
+    """
+    ebitda = np.asarray(ebitda, dtype=float)
+    depreciation = np.asarray(depreciation, dtype=float)
+    capex = np.asarray(capex, dtype=float)
+    working_capital_change = np.asarray(working_capital_change, dtype=float)
+    deposit_per_month = np.asarray(deposit_rate, dtype=float) / 100 / 12
+    state = {}
+
+    def step(x):
+        period_tax, interest_income = x
+        cfads = ebitda - capex + working_capital_change - period_tax + interest_income
+        waterfall = cash_waterfall(terms, cfads, opening_cash, min_cash, priority,
+                                   tolerance=tolerance / 100, nb_months=nb_months)
+        interest_income = np.clip(waterfall['opening_cash'], 0, None) * deposit_per_month
+        interest = waterfall['total']['interest']
+        if tax_rate is not None:
+            state['tax_schedule'] = tax_schedule(
+                ebitda - depreciation - interest + interest_income, tax_rate,
+                opening_tax_losses, loss_cap_pct, loss_cap_amount)
+            period_tax = state['tax_schedule']['tax_payable']
+        else:
+            period_tax = np.broadcast_to(np.asarray(tax, dtype=float), interest.shape)
+        state['waterfall'], state['x'] = waterfall, x
+        return np.stack([period_tax, interest_income])
+
+    base = cash_waterfall(terms, ebitda - capex + working_capital_change, opening_cash, min_cash, priority,
+                          nb_months=nb_months)
+    x0 = np.zeros((2,) + base['closing_cash'].shape)
+    _, solver = solve_fixed_point(step, x0, tolerance, max_iterations, method)
+
+    # Report the inputs of the last pass so cash, debt and income stay consistent
+    waterfall = state['waterfall']
+    period_tax, interest_income = state['x']
+    interest = waterfall['total']['interest']
+    net_income = ebitda - depreciation - interest + interest_income - period_tax
+    return dict(waterfall, tax=period_tax, interest_income=interest_income,
+                net_income=net_income, tax_schedule=state.get('tax_schedule'), solver=solver)
+
+
+DEPRECIATION_METHODS = ('straight_line', 'declining_balance', 'sum_of_years')
+
+
+def depreciation_profile(method, life_m, nb_months=NB_MONTHS, factor=2.0):
+    """
+    Share of one vintage's cost depreciated at each age in months (age 0 is the
+    month the asset is added). Declining balance switches to straight line once
+    that charges more, so every method is fully depreciated after life_m months.
+    """
+    if method not in DEPRECIATION_METHODS:
+        raise ValueError(f"Unsupported depreciation method: {method}")
+    life_m = int(life_m)
+    if life_m < 1:
+        raise ValueError("Useful life must be at least one month")
+
+    age = np.arange(nb_months)
+    in_life = age < life_m
+    if method == 'straight_line':
+        return np.where(in_life, 1.0 / life_m, 0.0)
+    if method == 'sum_of_years':
+        return np.where(in_life, (life_m - age) / (life_m * (life_m + 1) / 2), 0.0)
+
+    rate = min(factor / life_m, 1.0)
+    switch = max(int(np.ceil(life_m - 1 / rate)), 0)
+    declining = rate * (1 - rate) ** age
+    straight = (1 - rate) ** switch / (life_m - switch)
+    return np.where(age < switch, declining, np.where(in_life, straight, 0.0))
+
+
+def vintage_depreciation(additions, life_m, method='straight_line', factor=2.0):
+    """
+    Depreciate every monthly vintage of additions at once.
+
+    additions has the month axis last. Each vintage follows the same age
+    profile, so the vintage x month matrix is a lower-triangular Toeplitz matrix
+    and the monthly charge is a single matrix product instead of a nested loop.
+    """
+    additions = np.asarray(additions, dtype=float)
+    nb_months = additions.shape[-1]
+    profile = depreciation_profile(method, life_m, nb_months, factor)
+    age = np.arange(nb_months)[:, None] - np.arange(nb_months)[None, :]
+    toeplitz = np.where(age >= 0, profile[np.clip(age, 0, None)], 0.0)
+
+    depreciation = additions @ toeplitz.T
+    closing = np.cumsum(additions - depreciation, axis=-1)
+    opening = closing - additions + depreciation
+    return {
+        'opening': opening,
+        'additions': additions,
+        'depreciation': depreciation,
+        'accumulated_depreciation': np.cumsum(depreciation, axis=-1),
+        'closing': closing,
+    }
+
+
+def depreciation_by_class(opening_ppe, capex, asset_classes, nb_months=NB_MONTHS):
+    """
+    Split opening PPE and monthly capex across asset classes by share and run
+    each class's vintages. Opening PPE is treated as a vintage added in month 1.
+    Returns per-class schedules and their total.
+    """
+    capex = np.broadcast_to(np.asarray(capex, dtype=float), (nb_months,))
+    classes = {}
+    for asset_class in asset_classes:
+        additions = capex * asset_class['share']
+        additions = additions + np.eye(1, nb_months)[0] * opening_ppe * asset_class['share']
+        classes[asset_class['name']] = vintage_depreciation(
+            additions, round(asset_class['life_years'] * 12), asset_class.get('method', 'straight_line'),
+            asset_class.get('factor', 2.0))
+    total = {key: sum(s[key] for s in classes.values()) for key in next(iter(classes.values()))}
+    return {'classes': classes, 'total': total}
+
+
+def forward_window_sum(values, window=12):
+    """
+    Sum of values over months t .. t+window-1 for every month t, truncated at the
+    end of the horizon (like PnLStatMtlyTbl.loc[i:i+11].sum() in the Streamlit app).
+    """
+    values = np.asarray(values, dtype=float)
+    nb_months = values.shape[-1]
+    prefix = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+    end = np.minimum(np.arange(nb_months) + window, nb_months)
+    return prefix[..., end] - prefix[..., :nb_months]
+
+
+def trailing_window_sum(values, window=12):
+    """Sum of values over months t-window+1 .. t, truncated at the start of the horizon"""
+    values = np.asarray(values, dtype=float)
+    nb_months = values.shape[-1]
+    prefix = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+    start = np.maximum(np.arange(1, nb_months + 1) - window, 0)
+    return prefix[..., 1:] - prefix[..., start]
+
+
+def working_capital(revenue, cogs, operating_expenses, ar_pct, inventory_pct, oca_pct, ap_pct,
+                    opening_working_capital=0.0, window=12):
+    """
+    Working-capital balances driven by forward 12-month revenue and costs, as in
+    the Streamlit model. Percentages are given in percent. Returns the balances,
+    net working capital and the cash-flow effect of its change (negative when
+    working capital builds up); month 1 is measured against opening_working_capital.
+    """
+    forward_revenue = forward_window_sum(revenue, window)
+    forward_cogs = forward_window_sum(cogs, window)
+    forward_opex = forward_window_sum(operating_expenses, window)
+
+    accounts_receivable = ar_pct / 100 * forward_revenue
+    inventory = inventory_pct / 100 * forward_cogs
+    other_current_assets = oca_pct / 100 * forward_revenue
+    accounts_payable = ap_pct / 100 * (forward_cogs + forward_opex)
+    net_working_capital = accounts_receivable + inventory + other_current_assets - accounts_payable
+
+    opening = np.broadcast_to(np.asarray(opening_working_capital, dtype=float)[..., None],
+                              net_working_capital.shape[:-1] + (1,))
+    change = np.diff(net_working_capital, axis=-1, prepend=opening)
+    return {
+        'accounts_receivable': accounts_receivable,
+        'inventory': inventory,
+        'other_current_assets': other_current_assets,
+        'accounts_payable': accounts_payable,
+        'working_capital': net_working_capital,
+        'change_in_working_capital': -change,
+    }
+
+
+def tax_schedule(pre_tax_income, tax_rate, opening_losses=0.0, cap_pct=None, cap_amount=None,
+                 periods_per_year=12):
+    """
+    Tax payable with loss carry-forward. tax_rate is a fraction.
+
+    Without caps, losses carry forward indefinitely. The income taxed to date
+    is then the running maximum of cumulative income (net of opening losses),
+    floored at zero, so the whole schedule is one cumulative-max scan. Caps
+    limit the loss used each tax year to cap_pct percent of that year's
+    positive income and/or cap_amount. They need a scan over periods that is
+    vectorized across the batch. Returns taxable income, losses used, the
+    closing loss balance, tax payable, the deferred tax asset on unused losses,
+    and deferred tax expense.
+    """
+    income = np.asarray(pre_tax_income, dtype=float)
+    opening_losses = np.asarray(opening_losses, dtype=float)
+    tax_rate = np.asarray(tax_rate, dtype=float)
+
+    if cap_pct is None and cap_amount is None:
+        cumulative = np.cumsum(income, axis=-1) - opening_losses[..., None]
+        taxed = np.clip(np.maximum.accumulate(cumulative, axis=-1), 0, None)
+        taxable = np.diff(taxed, axis=-1, prepend=0.0)
+        losses = taxed - cumulative
+    else:
+        taxable = np.zeros_like(income)
+        losses = np.zeros_like(income)
+        balance = np.broadcast_to(opening_losses, income.shape[:-1]).astype(float)
+        used_in_year = np.zeros(income.shape[:-1])
+        for t in range(income.shape[-1]):
+            if t % periods_per_year == 0:
+                used_in_year = np.zeros(income.shape[:-1])
+            positive = np.clip(income[..., t], 0, None)
+            balance = balance + np.clip(-income[..., t], 0, None)
+            allowance = positive if cap_pct is None else positive * min(cap_pct, 100) / 100
+            if cap_amount is not None:
+                allowance = np.minimum(allowance, np.clip(cap_amount - used_in_year, 0, None))
+            used = np.minimum(balance, allowance)
+            balance = balance - used
+            used_in_year = used_in_year + used
+            taxable[..., t] = positive - used
+            losses[..., t] = balance
+
+    losses_used = np.clip(income, 0, None) - taxable
+    deferred_tax_asset = tax_rate[..., None] * losses if tax_rate.ndim else tax_rate * losses
+    opening_asset = np.broadcast_to((tax_rate * opening_losses)[..., None], losses.shape[:-1] + (1,))
+    previous_asset = np.concatenate([opening_asset, deferred_tax_asset[..., :-1]], axis=-1)
+    return {
+        'taxable_income': taxable,
+        'losses_used': losses_used,
+        'loss_carryforward': losses,
+        'tax_payable': tax_rate[..., None] * taxable if tax_rate.ndim else tax_rate * taxable,
+        'deferred_tax_asset': deferred_tax_asset,
+        'deferred_tax': previous_asset - deferred_tax_asset,
+    }
+
+
+def integrity_check(total_assets, total_equity_liability, cash, net_cash_flow, opening_cash, tolerance=0.05):
+    """
+    Check every (project, month) at once: assets must equal liabilities plus
+    equity, and net cash flow must equal the change in cash. Inputs have the
+    month axis last; opening_cash is the cash before month 1.
+    """
+    cash = np.asarray(cash, dtype=float)
+    opening_cash = np.asarray(opening_cash, dtype=float)
+    previous_cash = np.concatenate(
+        [np.broadcast_to(opening_cash[..., None], cash.shape[:-1] + (1,)), cash[..., :-1]], axis=-1)
+    balance_difference = np.asarray(total_assets, dtype=float) - np.asarray(total_equity_liability, dtype=float)
+    cash_difference = (cash - previous_cash) - np.asarray(net_cash_flow, dtype=float)
+    return {
+        'balance_difference': balance_difference,
+        'cash_difference': cash_difference,
+        'balance_mismatch': np.abs(balance_difference) > tolerance,
+        'cash_mismatch': np.abs(cash_difference) > tolerance,
+    }
+
+
+def integrity_summary(check, months=None):
+    """Compact per-row summary of an integrity_check result (rows are projects)"""
+    summaries = []
+    balance_mismatch = np.atleast_2d(check['balance_mismatch'])
+    cash_mismatch = np.atleast_2d(check['cash_mismatch'])
+    balance_difference = np.atleast_2d(check['balance_difference'])
+    cash_difference = np.atleast_2d(check['cash_difference'])
+    months = np.arange(1, balance_mismatch.shape[-1] + 1) if months is None else np.asarray(months)
+
+    for row in range(balance_mismatch.shape[0]):
+        balance_months = months[balance_mismatch[row]]
+        cash_months = months[cash_mismatch[row]]
+        summaries.append({
+            'months_checked': int(balance_mismatch.shape[-1]),
+            'balance_mismatches': int(len(balance_months)),
+            'cash_mismatches': int(len(cash_months)),
+            'max_balance_difference': round(float(np.max(np.abs(balance_difference[row]), initial=0)), 2),
+            'max_cash_difference': round(float(np.max(np.abs(cash_difference[row]), initial=0)), 2),
+            'first_balance_mismatch_month': int(balance_months[0]) if len(balance_months) else None,
+            'first_cash_mismatch_month': int(cash_months[0]) if len(cash_months) else None,
+            'passed': not len(balance_months) and not len(cash_months),
+        })
+    return summaries
+
+
+def _ratio(numerator, denominator):
+    """Elementwise ratio that is 0 where the denominator is 0, like the KPI scripts"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    safe = np.where(denominator != 0, denominator, 1.0)
+    return np.where(denominator != 0, numerator / safe, 0.0)
+
+
+def ltm_kpis(revenue, cost_of_goods_sold, ebitda, depreciation, interest_expense, repayment_debt,
+             net_cash_operating, net_cash_investing, net_cash_financing, debt, accounts_receivable,
+             inventory, window=12):
+    """
+    Last-twelve-month variants of the flow-based KPIs, for arrays with the month
+    axis last (one row per project). Flows are trailing 12-month sums from a
+    prefix-sum window; the first 11 months are annualised from the months
+    available. Formulas mirror the monthly KPIs, with 0 where a denominator is 0.
+    """
+    nb_months = np.shape(revenue)[-1]
+    annualise = window / np.minimum(np.arange(1, nb_months + 1), window)
+
+    def ltm(values):
+        return trailing_window_sum(values, window) * annualise
+
+    revenue_ltm = ltm(revenue)
+    cogs_ltm = ltm(cost_of_goods_sold)
+    ebitda_ltm = ltm(ebitda)
+    depreciation_ltm = ltm(depreciation)
+    interest_ltm = ltm(interest_expense)
+    debt_service_ltm = ltm(np.abs(np.asarray(repayment_debt, dtype=float)))
+    fcff_ltm = ltm(np.asarray(net_cash_operating, dtype=float) + np.asarray(net_cash_investing, dtype=float))
+    fcfe_ltm = fcff_ltm + ltm(net_cash_financing)
+
+    return {
+        'ebitda_ltm': ebitda_ltm,
+        'debt_service_ltm': debt_service_ltm,
+        'interest_expense_ltm': interest_ltm,
+        'debt_to_ebitda_ltm': _ratio(debt, ebitda_ltm),
+        'debt_service_coverage_ratio_ltm': _ratio(ebitda_ltm, debt_service_ltm),
+        'interest_coverage_ratio_ltm': _ratio(ebitda_ltm + depreciation_ltm, np.abs(interest_ltm)),
+        'operating_margin_ltm': _ratio(ebitda_ltm, revenue_ltm),
+        'fcff_ltm': fcff_ltm,
+        'fcfe_ltm': fcfe_ltm,
+        'ar_cycle_days_ltm': _ratio(365 * np.asarray(accounts_receivable, dtype=float), revenue_ltm),
+        'inventory_cycle_days_ltm': _ratio(365 * np.asarray(inventory, dtype=float), np.abs(cogs_ltm)),
+    }
+
+
+def _reverse_cumsum(values):
+    """Sum of each element and everything after it along the last axis"""
+    return np.cumsum(values[..., ::-1], axis=-1)[..., ::-1]
+
+
+def cfads(net_cash_operating, interest_expense, net_cash_investing):
+    """Cash flow available for debt service: operating cash flow before interest, after capex"""
+    return (np.asarray(net_cash_operating, dtype=float) + np.asarray(interest_expense, dtype=float)
+            + np.asarray(net_cash_investing, dtype=float))
+
+
+def coverage_ratios(cash_flow, debt, interest_expense, discount_rate=None, periods_per_year=12,
+                    min_debt=0.5):
+    """
+    Loan and project life coverage ratios for arrays with the period axis last
+    (one row per project).
+
+    At the end of each period the NPV of the remaining CFADS is divided by the
+    closing debt. The loan life runs up to the period in which the debt is last
+    repaid; the project life to the end of the horizon. Discounting uses
+    reverse cumulative sums of cash_flow * v^s, so every period is O(1).
+
+    discount_rate is in percent per annum (scalar or one per project). When it
+    is None the implied cost of debt is used: total interest over the summed
+    closing debt, annualised.
+    """
+    cash_flow = np.atleast_2d(np.asarray(cash_flow, dtype=float))
+    debt = np.broadcast_to(np.asarray(debt, dtype=float), cash_flow.shape)
+    nb_periods = cash_flow.shape[-1]
+
+    if discount_rate is None:
+        interest = np.broadcast_to(np.abs(np.asarray(interest_expense, dtype=float)), cash_flow.shape)
+        rate = _ratio(interest.sum(axis=-1), debt.sum(axis=-1))
+    else:
+        rate = np.asarray(discount_rate, dtype=float) / 100 / periods_per_year
+    rate = np.broadcast_to(rate, cash_flow.shape[:-1])[..., None]
+
+    # discount[s] = v^s, so sum_{s>t} cf_s v^(s-t) = (sum_{s>t} cf_s discount[s]) / discount[t]
+    discount = (1.0 + rate) ** -np.arange(nb_periods)
+    discounted = cash_flow * discount
+
+    outstanding = debt > min_debt
+    has_debt = outstanding.any(axis=-1, keepdims=True)
+    last_debt = nb_periods - 1 - np.argmax(outstanding[..., ::-1], axis=-1)[..., None]
+    # Debt outstanding at the end of t is serviced up to and including the next period
+    loan_end = np.where(has_debt, np.minimum(last_debt + 1, nb_periods - 1), -1)
+    in_loan_life = np.arange(nb_periods) <= loan_end
+
+    npv_project_life = (_reverse_cumsum(discounted) - discounted) / discount
+    loan_discounted = np.where(in_loan_life, discounted, 0.0)
+    npv_loan_life = (_reverse_cumsum(loan_discounted) - loan_discounted) / discount
+
+    closing_debt = np.where(outstanding, debt, 0.0)
+    return {
+        'cfads': cash_flow,
+        'npv_cfads_loan_life': npv_loan_life,
+        'npv_cfads_project_life': npv_project_life,
+        'llcr': _ratio(npv_loan_life, closing_debt),
+        'plcr': _ratio(npv_project_life, closing_debt),
+        'discount_rate': rate[..., 0] * periods_per_year * 100,
+    }
+
+
+def npv(rates, cash_flows):
+    """
+    NPV of every cash-flow row at every per-period rate, with the first flow
+    undiscounted like numpy_financial.npv. Returns shape (rows, rates).
+    """
+    cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+    rates = np.atleast_1d(np.asarray(rates, dtype=float))
+    discount = (1.0 + rates[:, None]) ** -np.arange(cash_flows.shape[-1])
+    return cash_flows @ discount.T
+
+
+def _scaled_npv(rates, cash_flows):
+    """
+    NPV for a grid of rates, rescaled by a positive factor so it cannot overflow:
+    future value for negative rates, present value otherwise. Only the sign is used.
+    """
+    periods = np.arange(cash_flows.shape[-1])
+    growth = 1.0 + rates[:, None]
+    factors = np.where(rates[:, None] < 0, growth ** (periods[-1] - periods), growth ** -periods)
+    return cash_flows @ factors.T
+
+
+def irr(cash_flows, tolerance=1e-10, max_iterations=100, grid_points=200, max_rate=10.0):
+    """
+    Per-period IRR of every cash-flow row, solved together.
+
+    Each row is bracketed on a shared grid of rates in (-1, max_rate]; where a
+    row has several sign changes the root closest to zero is taken, like
+    numpy_financial.irr. Safeguarded Newton then refines all brackets at once,
+    falling back to bisection when a step leaves the bracket. Rows without a
+    sign change, including all-zero rows, are NaN with converged False.
+    """
+    cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+    nb_rows, nb_periods = cash_flows.shape
+    periods = np.arange(nb_periods)
+    scale = np.maximum(np.abs(cash_flows).max(axis=-1), 1.0)
+
+    grid = np.expm1(np.linspace(np.log(0.01), np.log1p(max_rate), grid_points))
+    signs = np.sign(_scaled_npv(grid, cash_flows))
+    exact = signs == 0
+    change = (signs[:, :-1] * signs[:, 1:] < 0) | exact[:, :-1]
+    # Only rows with both inflows and outflows have an IRR; an all-zero row has a zero NPV everywhere
+    mixed = (cash_flows > 0).any(axis=-1) & (cash_flows < 0).any(axis=-1)
+    found = change.any(axis=-1) & mixed
+
+    # Of all brackets, take the one whose midpoint is closest to a zero rate
+    midpoints = np.abs(grid[:-1] + grid[1:])
+    bracket = np.argmin(np.where(change, midpoints, np.inf), axis=-1)
+    lower = np.where(found, grid[bracket], np.nan)
+    upper = np.where(found, grid[bracket + 1], np.nan)
+    lower_sign = signs[np.arange(nb_rows), bracket]
+
+    rate = np.where(exact[np.arange(nb_rows), bracket], lower, (lower + upper) / 2)
+    converged = exact[np.arange(nb_rows), bracket] & found
+    iterations = np.zeros(nb_rows, dtype=int)
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            active = found & ~converged
+            if not active.any():
+                break
+            iterations += active
+
+            discount = (1.0 + rate[:, None]) ** -periods
+            value = (cash_flows * discount).sum(axis=-1)
+            derivative = -(cash_flows * periods * discount / (1.0 + rate[:, None])).sum(axis=-1)
+
+            converged |= active & ((np.abs(value) <= tolerance * scale) | (upper - lower <= tolerance))
+
+            # Shrink the bracket around the root
+            same_side = np.sign(value) == lower_sign
+            lower = np.where(active & same_side, rate, lower)
+            upper = np.where(active & ~same_side, rate, upper)
+
+            step = rate - value / derivative
+            inside = np.isfinite(step) & (step > lower) & (step < upper)
+            rate = np.where(active & ~converged, np.where(inside, step, (lower + upper) / 2), rate)
+
+    return {
+        'rate': np.where(found, rate, np.nan),
+        'converged': converged,
+        'iterations': iterations,
+    }
+
+
+def stack_terms(terms_list):
+    """Stack per-project tranche terms into one terms dict with a value array per term"""
+    return {
+        tranche: {term: np.array([terms[tranche][term] for terms in terms_list])
+                  for term in terms_list[0][tranche]}
+        for tranche in terms_list[0]
+    }
+
+
+def compare_structures(as_is_terms, restructured_terms, ebitda, discount_rate, nb_months=NB_MONTHS):
+    """
+    Run the as-is and restructured debt structures of one or more projects in a
+    single batched schedule and return both sides plus per-month deltas
+    (restructured minus as-is) of interest, debt service, closing debt and the
+    debt KPIs.
+
+    Savings are the as-is debt service less the restructured one; the net cash
+    savings also count the additional loans drawn. Both are discounted at
+    discount_rate (percent per annum, one per project or shared).
+    """
+    nb_projects = len(np.atleast_1d(as_is_terms[next(iter(as_is_terms))]['opening']))
+    terms = {
+        tranche: {
+            term: np.concatenate([
+                np.broadcast_to(np.asarray(as_is_terms[tranche][term], dtype=float), (nb_projects,)),
+                np.broadcast_to(np.asarray(restructured_terms[tranche][term], dtype=float), (nb_projects,)),
+            ])
+            for term in as_is_terms[tranche]
+        }
+        for tranche in as_is_terms
+    }
+    total = combined_debt_schedule(terms, nb_months)['total']
+    ebitda = np.broadcast_to(np.asarray(ebitda, dtype=float).reshape(nb_projects, -1), (nb_projects, nb_months))
+    kpis = debt_kpis(total, np.concatenate([ebitda, ebitda]))
+
+    series = {
+        'interest': total['interest'],
+        'debt_service': -total['repayment'],
+        'additional_loan': total['additional_loan'],
+        'closing_debt': total['closing'],
+        **kpis,
+    }
+    as_is = {key: values[:nb_projects] for key, values in series.items()}
+    restructured = {key: values[nb_projects:] for key, values in series.items()}
+    with np.errstate(invalid='ignore'):
+        delta = {key: restructured[key] - as_is[key] for key in series}
+
+    savings = as_is['debt_service'] - restructured['debt_service']
+    net_cash_savings = savings + restructured['additional_loan'] - as_is['additional_loan']
+    rate = np.broadcast_to(np.asarray(discount_rate, dtype=float), (nb_projects,)) / 100 / 12
+    discount = (1.0 + rate[:, None]) ** -np.arange(1, nb_months + 1)
+
+    return {
+        'as_is': as_is,
+        'restructured': restructured,
+        'delta': delta,
+        'savings': savings,
+        'npv_savings': (savings * discount).sum(axis=1),
+        'npv_net_cash_savings': (net_cash_savings * discount).sum(axis=1),
+        'as_is_summary': kpi_summary({key: as_is[key] for key in kpis}),
+        'restructured_summary': kpi_summary({key: restructured[key] for key in kpis}),
+    }
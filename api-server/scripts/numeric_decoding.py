@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Numeric Decoding
+psycopg2 returns numeric columns as Decimal, which the loaders then turned back
+into float one cell at a time. register_float_numeric() makes a connection parse
+numeric straight to float with psycopg2's own float typecaster, and decode_rows()
+maps NULL to 0 for whole columns at once in NumPy instead of per cell.
+"""
+
+import numpy as np
+import psycopg2.extensions
+
+# numeric -> float using the C float parser; NULL stays None
+FLOAT_NUMERIC = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'FLOAT_NUMERIC', psycopg2.extensions.FLOAT)
+
+
+def register_float_numeric(conn):
+    """Return numeric columns as float on this connection; returns the connection"""
+    psycopg2.extensions.register_type(FLOAT_NUMERIC, conn)
+    return conn
+
+
+def decode_columns(results, names, passthrough=()):
+    """
+    Query rows (tuples in names order) -> columnar {name: [values]}. Every column
+    not in passthrough becomes a list of floats with NULL (and NaN) as 0.
+    """
+    if not results:
+        return {}
+    columns = {}
+    for name, values in zip(names, zip(*results)):
+        if name in passthrough:
+            columns[name] = list(values)
+        else:
+            array = np.array(values, dtype=float)
+            array[np.isnan(array)] = 0.0
+            columns[name] = array.tolist()
+    return columns
+
+
+def decode_rows(results, names, passthrough=(), constants=None):
+    """
+    Query rows -> row dicts keyed by names, decoded as in decode_columns, with
+    optional constant fields added to every row
+    """
+    columns = decode_columns(results, names, passthrough)
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    if constants:
+        for row in rows:
+            row.update(constants)
+    return rows
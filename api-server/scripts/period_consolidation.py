@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Period Consolidation in SQL
+Builds quarterly and yearly consolidated rows from each project's latest
+monthly_consolidated run inside Postgres, with one INSERT ... SELECT ... GROUP BY
+for any number of projects: flows are summed, balances are taken from the last
+month of the period. The monthly run may be stored as rows or as a series
+(run_storage.py). This is the 'sql' consolidation mode of the quarterly and
+yearly calculators; the default 'python' mode aggregates in the calculator.
+"""
+
+import sys
+import os
+import argparse
+try:
+    import psycopg2
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+from result_protocol import add_format_argument, write_result
+from run_storage import add_storage_argument, resolve_storage, save_run_series
+
+CONSOLIDATION_MODES = ['python', 'sql']
+
+# Summed over the period
+FLOW_COLUMNS = ['revenue', 'cost_of_goods_sold', 'gross_profit', 'operating_expenses', 'ebitda', 'depreciation',
+                'interest_expense', 'net_income_before_tax', 'income_tax_expense', 'net_income',
+                'net_cash_operating', 'capital_expenditures', 'net_cash_investing', 'proceeds_debt',
+                'repayment_debt', 'net_cash_financing', 'net_cash_flow']
+
+# Value of the last month of the period
+BALANCE_COLUMNS = ['cash', 'accounts_receivable', 'inventory', 'other_current_assets', 'ppe_net', 'other_assets',
+                   'total_assets', 'accounts_payable', 'senior_secured', 'debt_tranche1', 'equity',
+                   'retained_earning', 'total_equity_liability']
+
+# Level -> target table, period columns computed per month, months included, row
+# order, and whether flows are rounded to cents as in the calculator's python mode
+LEVELS = {
+    'quarterly': {
+        'table': 'quarterly_consolidated',
+        'periods': {
+            'quarter': 'mod(month - 1, 12) / 3 + 1',
+            'year': '(month - 1) / 12 + 1',
+        },
+        'labels': {'quarter_name': "'Q' || period_quarter"},
+        'where': 'month BETWEEN 1 AND 120',
+        'order': ('year', 'quarter'),
+        'round_flows': True,
+    },
+    'yearly': {
+        'table': 'yearly_consolidated',
+        'periods': {'year': 'year'},
+        'labels': {},
+        'where': 'year BETWEEN 1 AND 10',
+        'order': ('year',),
+        'round_flows': False,
+    },
+}
+
+
+def resolve_consolidation(consolidation=None):
+    """Consolidation mode from the argument, else CONSOLIDATION_MODE, else 'python'"""
+    consolidation = consolidation or os.getenv('CONSOLIDATION_MODE', 'python')
+    if consolidation not in CONSOLIDATION_MODES:
+        raise ValueError(f"Unsupported consolidation mode: {consolidation}")
+    return consolidation
+
+
+def add_consolidation_argument(parser):
+    """Add the shared --consolidation option to a script's argument parser"""
+    parser.add_argument('--consolidation', default=None, choices=CONSOLIDATION_MODES,
+                        help='Aggregate monthly rows in Python or in one SQL statement '
+                             '(default: CONSOLIDATION_MODE or python)')
+
+
+def output_columns(level):
+    """Columns of the consolidated rows, in table order after project_id"""
+    config = LEVELS[level]
+    return list(config['periods']) + list(config['labels']) + FLOW_COLUMNS + BALANCE_COLUMNS
+
+
+def build_consolidation_query(level, insert=True):
+    """
+    The consolidation statement for a level. Parameters: project_ids and the
+    matching calculation_run_ids the consolidated rows are stored under. With
+    insert it writes the rows to the level's table and returns them, otherwise
+    it only selects them. The latest monthly run of each project is picked before
+    any series is expanded, so older stored runs are never read. Amounts come
+    back as float8.
+    """
+    config = LEVELS[level]
+    monthly_columns = ['month', 'year'] + FLOW_COLUMNS + BALANCE_COLUMNS
+    monthly_columns_m = ', '.join(f"m.{column}" for column in monthly_columns)
+    monthly_columns_r = ', '.join(f"r.{column}" for column in monthly_columns)
+    periods = ', '.join(f"{expression} AS period_{name}" for name, expression in config['periods'].items())
+    period_keys = ', '.join(f"period_{name}" for name in config['periods'])
+
+    flows = [
+        f"round(COALESCE(sum({column}), 0)::numeric, 2)::float8" if config['round_flows']
+        else f"COALESCE(sum({column}), 0)::float8"
+        for column in FLOW_COLUMNS
+    ]
+    balances = [f"COALESCE((array_agg({column} ORDER BY month DESC))[1], 0)::float8" for column in BALANCE_COLUMNS]
+    select_list = ', '.join(
+        ['project_id', 'target_run_id']
+        + [f"period_{name}" for name in config['periods']]
+        + list(config['labels'].values())
+        + flows + balances
+    )
+
+    query = f"""
+        WITH targets AS (
+            SELECT * FROM unnest(%(project_ids)s::uuid[], %(calculation_run_ids)s::uuid[])
+                AS t(project_id, calculation_run_id)
+        ),
+        latest AS (
+            SELECT DISTINCT ON (project_id) project_id, calculation_run_id, is_series
+            FROM (
+                (SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at, FALSE AS is_series
+                 FROM monthly_consolidated
+                 WHERE project_id IN (SELECT project_id FROM targets)
+                 ORDER BY project_id, created_at DESC)
+                UNION ALL
+                (SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at, TRUE AS is_series
+                 FROM calculation_run_series
+                 WHERE schedule = 'monthly_consolidated' AND project_id IN (SELECT project_id FROM targets)
+                 ORDER BY project_id, created_at DESC)
+            ) runs
+            ORDER BY project_id, created_at DESC
+        ),
+        monthly AS (
+            SELECT m.project_id, m.calculation_run_id, {monthly_columns_m}
+            FROM monthly_consolidated m
+            JOIN latest l ON l.project_id = m.project_id AND l.calculation_run_id = m.calculation_run_id
+            WHERE NOT l.is_series
+            UNION ALL
+            SELECT s.project_id, s.calculation_run_id, {monthly_columns_r}
+            FROM latest l
+            JOIN calculation_run_series s
+              ON s.schedule = 'monthly_consolidated' AND s.calculation_run_id = l.calculation_run_id
+            CROSS JOIN LATERAL calculation_run_series_rows(s) AS rows(value)
+            CROSS JOIN LATERAL jsonb_populate_record(NULL::monthly_consolidated, rows.value) AS r
+            WHERE l.is_series
+        ),
+        months AS (
+            SELECT m.*, t.calculation_run_id AS target_run_id, {periods}
+            FROM monthly m
+            JOIN targets t ON t.project_id = m.project_id
+            WHERE {config['where']}
+        )
+    """
+    select = f"""
+        SELECT {select_list}
+        FROM months
+        GROUP BY project_id, target_run_id, {period_keys}
+    """
+    if not insert:
+        return query + select
+
+    columns = ', '.join(output_columns(level))
+    returning = ', '.join(list(config['periods']) + list(config['labels'])
+                          + [f"{column}::float8" for column in FLOW_COLUMNS + BALANCE_COLUMNS])
+    return query + f"""
+        INSERT INTO {config['table']} (project_id, calculation_run_id, {columns})
+        {select}
+        RETURNING project_id, {returning}
+    """
+
+
+def consolidate_runs(conn, level, runs, storage='rows'):
+    """
+    Consolidate the latest monthly run of every project in runs
+    ({project_id: calculation_run_id to store under}) in one statement, replacing
+    those runs' previous rows or series. Returns {project_id: rows in period order};
+    projects without monthly data are left out. The caller commits.
+    """
+    project_ids = list(runs)
+    params = {'project_ids': project_ids, 'calculation_run_ids': [runs[project_id] for project_id in project_ids]}
+    config = LEVELS[level]
+    columns = output_columns(level)
+
+    with conn.cursor() as cursor:
+        if storage == 'arrays':
+            cursor.execute(build_consolidation_query(level, insert=False), params)
+            results = [(project_id, *values) for project_id, _, *values in cursor.fetchall()]
+        else:
+            cursor.execute(f"""
+                DELETE FROM {config['table']}
+                WHERE (project_id, calculation_run_id) IN (
+                    SELECT * FROM unnest(%(project_ids)s::uuid[], %(calculation_run_ids)s::uuid[])
+                )
+            """, params)
+            cursor.execute(build_consolidation_query(level), params)
+            results = cursor.fetchall()
+
+        consolidated = {}
+        for project_id, *values in results:
+            # Flows and balances are selected as float8
+            consolidated.setdefault(str(project_id), []).append(dict(zip(columns, values)))
+
+        for project_id, rows in consolidated.items():
+            rows.sort(key=lambda row: [row[column] for column in config['order']])
+            if storage == 'arrays':
+                save_run_series(cursor, config['table'], project_id, runs[project_id], rows)
+
+    return consolidated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consolidate the latest monthly runs of many projects in SQL')
+    parser.add_argument('level', choices=list(LEVELS), help='Period to consolidate to')
+    parser.add_argument('runs', nargs='+', metavar='PROJECT_ID:CALCULATION_RUN_ID',
+                        help='Project and the calculation run ID to store its rows under')
+    add_format_argument(parser)
+    add_storage_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    try:
+        runs = dict(run.split(':', 1) for run in args.runs)
+        conn = psycopg2.connect(**db_config)
+        try:
+            consolidated = consolidate_runs(conn, args.level, runs, resolve_storage(args.storage))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    write_result({
+        'success': True,
+        'level': args.level,
+        'periods': {project_id: len(rows) for project_id, rows in consolidated.items()},
+        'missing_projects': [project_id for project_id in runs if project_id not in consolidated],
+    }, args.result_format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Result Protocol
+Versioned output format shared by the calculation scripts and the Node services
+(services/pythonResultParser.js).
+
+Version 1: a result is a dict of summary fields, optional named stages and
+optional named tables. Tables (lists of row dicts) are sent columnar, one array
+per field, instead of repeating every key in every row. NaN and infinities
+(e.g. a DSCR without debt service) are sent as null in every format.
+
+Formats:
+    json     one object: {"protocol": 1, ...fields, "stages": {...}, "tables": {name: {column: [...]}}}
+    ndjson   one line per table ({"protocol": 1, "stage": "table", "name", "rows", "columns"}) and
+             per stage ({"protocol": 1, "stage": name, ...}) as soon as it is ready, then a final
+             {"protocol": 1, "stage": "result", ...fields} line
+    msgpack  the json object encoded with msgpack (optional dependency)
+"""
+
+import sys
+import json
+import math
+
+PROTOCOL_VERSION = 1
+FORMATS = ['json', 'ndjson', 'msgpack']
+
+
+def columnar(rows, exclude=()):
+    """List of row dicts -> {column: [values]} in the column order of the first row"""
+    if not rows:
+        return {}
+    return {key: [row.get(key) for row in rows] for key in rows[0] if key not in exclude}
+
+
+def finite(value):
+    """Copy of a message with its non-finite floats replaced by None, which JSON can encode"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    return value
+
+
+def add_format_argument(parser):
+    """Add the shared --format option to a script's argument parser"""
+    parser.add_argument('--format', dest='result_format', default='json', choices=FORMATS,
+                        help='Result encoding (protocol version %d)' % PROTOCOL_VERSION)
+
+
+class ResultWriter:
+    """
+    Writes one result in the chosen format. With ndjson every table and stage is
+    flushed as soon as it is added, so the reader can parse while the script runs;
+    the other formats buffer everything until result() is called.
+    """
+
+    def __init__(self, fmt='json', stream=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported result format: {fmt}")
+        if fmt == 'msgpack':
+            try:
+                import msgpack  # noqa: F401
+            except ImportError:
+                raise ValueError("msgpack module not found. Try: pip install msgpack")
+        self.fmt = fmt
+        self.stream = stream or sys.stdout
+        self.tables = {}
+        self.stages = {}
+
+    def _write_line(self, message):
+        self.stream.write(json.dumps(finite({'protocol': PROTOCOL_VERSION, **message}), separators=(',', ':'),
+                                     allow_nan=False))
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def table(self, name, rows, exclude=()):
+        """Add a table given as row dicts or as an already columnar dict"""
+        columns = rows if isinstance(rows, dict) else columnar(rows, exclude)
+        nb_rows = len(next(iter(columns.values()))) if columns else 0
+        if self.fmt == 'ndjson':
+            self._write_line({'stage': 'table', 'name': name, 'rows': nb_rows, 'columns': columns})
+        else:
+            self.tables[name] = columns
+
+    def stage(self, name, data):
+        """Add the result of one named stage of a multi-stage script"""
+        if self.fmt == 'ndjson':
+            self._write_line({'stage': name, **data})
+        else:
+            self.stages[name] = data
+
+    def result(self, data):
+        """Write the final summary fields, and everything buffered so far"""
+        if self.fmt == 'ndjson':
+            self._write_line({'stage': 'result', **data})
+            return
+
+        message = {'protocol': PROTOCOL_VERSION, **data}
+        if self.stages:
+            message['stages'] = self.stages
+        if self.tables:
+            message['tables'] = self.tables
+        message = finite(message)
+        if self.fmt == 'msgpack':
+            import msgpack
+            stream = getattr(self.stream, 'buffer', self.stream)
+            stream.write(msgpack.packb(message, use_single_float=False))
+            stream.flush()
+        else:
+            self.stream.write(json.dumps(message, separators=(',', ':'), allow_nan=False))
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+def write_result(result, fmt='json', tables=None):
+    """Write a single-stage result with optional {name: rows} tables"""
+    writer = ResultWriter(fmt)
+    for name, rows in (tables or {}).items():
+        writer.table(name, rows)
+    writer.result(result)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Run Storage
+Array-column storage for calculation run schedules
+(migrations/add_calculation_run_series.sql).
+
+In 'rows' mode (the default) a run's schedule is one table row per period, as
+before. In 'arrays' mode the whole schedule is one calculation_run_series row:
+numeric columns go into a 2-D float8 array and text columns (month_name, ...)
+into a 2-D text array, so a 120-month run is one row instead of 120. Readers
+prefer a run's series and fall back to the row table, so both modes can live
+side by side; the <table>_series views and calculation_run_series_records()
+give row-shaped access in SQL.
+"""
+
+import os
+import math
+
+STORAGE_MODES = ['rows', 'arrays']
+
+# Stored as float8 and restored as int on load
+INTEGER_COLUMNS = {'month', 'year', 'quarter'}
+
+# Kept on the series row itself, not in the arrays
+KEY_COLUMNS = ('project_id', 'calculation_run_id')
+
+
+def resolve_storage(storage=None):
+    """Storage mode from the argument, else CALCULATION_RUN_STORAGE, else 'rows'"""
+    storage = storage or os.getenv('CALCULATION_RUN_STORAGE', 'rows')
+    if storage not in STORAGE_MODES:
+        raise ValueError(f"Unsupported run storage: {storage}")
+    return storage
+
+
+def add_storage_argument(parser):
+    """Add the shared --storage option to a script's argument parser"""
+    parser.add_argument('--storage', default=None, choices=STORAGE_MODES,
+                        help='Store schedules as rows or as one array row per run '
+                             '(default: CALCULATION_RUN_STORAGE or rows)')
+
+
+def _float(value):
+    if value is None:
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def split_columns(rows, exclude=KEY_COLUMNS):
+    """Row dicts -> (numeric columns, data[column][row], text columns, text_data[column][row])"""
+    names = [key for key in rows[0] if key not in exclude]
+    text_columns = [key for key in names if any(isinstance(row.get(key), str) for row in rows)]
+    columns = [key for key in names if key not in text_columns]
+    data = [[_float(row.get(key)) for row in rows] for key in columns]
+    text_data = [[row.get(key) for row in rows] for key in text_columns]
+    return columns, data, text_columns, text_data
+
+
+def series_columns(columns, data, text_columns=None, text_data=None):
+    """Stored arrays -> columnar {column: [values]}"""
+    result = {}
+    for name, values in zip(columns, data):
+        if name in INTEGER_COLUMNS:
+            values = [int(value) if value is not None else None for value in values]
+        result[name] = values
+    for name, values in zip(text_columns or [], text_data or []):
+        result[name] = values
+    return result
+
+
+def series_rows(columns):
+    """Columnar {column: [values]} -> list of row dicts"""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())] if names else []
+
+
+def save_run_series(cursor, schedule, project_id, calculation_run_id, rows, replace_project=False,
+                    created_at=None):
+    """
+    Store one run's schedule as a single series row. Replaces the run's previous
+    series, or all of the project's series for the schedule with replace_project
+    (for schedules whose row tables keep only the latest run). created_at keeps
+    the original run time when compacting an existing run.
+    """
+    if replace_project:
+        cursor.execute("DELETE FROM calculation_run_series WHERE project_id = %s AND schedule = %s",
+                       (project_id, schedule))
+    else:
+        cursor.execute("DELETE FROM calculation_run_series WHERE calculation_run_id = %s AND schedule = %s",
+                       (calculation_run_id, schedule))
+    if not rows:
+        return
+
+    columns, data, text_columns, text_data = split_columns(rows)
+    cursor.execute("""
+        INSERT INTO calculation_run_series (
+            project_id, calculation_run_id, schedule, row_count, columns, data, text_columns, text_data,
+            created_at
+        ) VALUES (%s, %s, %s, %s, %s, %s::float8[], %s, %s::text[], COALESCE(%s, NOW()))
+    """, (project_id, calculation_run_id, schedule, len(rows), columns, data,
+          text_columns or None, text_data or None, created_at))
+
+
+def load_run_series(cursor, schedule, project_id, calculation_run_id=None):
+    """
+    Columnar data of the run's series (the latest run when no run id is given),
+    or None when the run is stored as rows
+    """
+    cursor.execute("""
+        SELECT columns, data, text_columns, text_data
+        FROM latest_calculation_run_series(%s, %s, %s)
+    """, (schedule, project_id, calculation_run_id))
+    row = cursor.fetchone()
+    return series_columns(*row) if row else None
+
+
+def load_latest_series_batch(cursor, schedule, project_ids=None):
+    """
+    Latest series of many projects (all when project_ids is empty) in one query:
+    {project_id: {'calculation_run_id', 'created_at', 'columns'}}
+    """
+    cursor.execute("""
+        SELECT DISTINCT ON (project_id) project_id, calculation_run_id, created_at,
+               columns, data, text_columns, text_data
+        FROM calculation_run_series
+        WHERE schedule = %(schedule)s
+          AND (%(all)s OR project_id::text = ANY(%(project_ids)s::text[]))
+        ORDER BY project_id, created_at DESC
+    """, {'schedule': schedule, 'all': not project_ids, 'project_ids': list(project_ids or [])})
+    return {
+        str(project_id): {
+            'calculation_run_id': str(run_id),
+            'created_at': created_at,
+            'columns': series_columns(*arrays),
+        }
+        for project_id, run_id, created_at, *arrays in cursor.fetchall()
+    }
+
+
+def newer_series(series_runs, created_at):
+    """
+    Keep the series runs that are newer than the project's latest row-stored run
+    ({project_id: created_at}), for batch readers that load both storages
+    """
+    return {
+        project_id: run for project_id, run in series_runs.items()
+        if project_id not in created_at or run['created_at'] >= created_at[project_id]
+    }
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Speculative Precompute
+With SPECULATIVE_PRECOMPUTE enabled, an autosave of a calculation input queues a
+bulk 'precompute' job (services/autoSaveService.js). The worker runs the dry-run
+pipeline (calculate_dry_run.py) on the project's saved inputs and keeps the
+result in calculation_precomputes, keyed by a hash of the latest input rows and
+the options that change the result; nothing else is written.
+
+When the calculation is then requested on the same inputs, the precompute
+answers it without recalculating: a dry run of the saved inputs (this script,
+POST /consolidated/:projectId/dry-run with saved_inputs) is served from it, and
+a calculation job whose stages start the pipeline persists its rows through the
+calculators' save methods instead of running them (promotion). Options the dry
+run does not model (sculpted repayment, asset classes) are never precomputed.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import numpy as np
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:
+    print("Error: psycopg2 module not found. Please ensure it's installed.")
+    print("Try: pip install psycopg2-binary")
+    sys.exit(1)
+
+from result_protocol import ResultWriter, add_format_argument, write_result
+from input_cache import latest_input
+from check_integrity import IntegrityChecker
+from calculate_dry_run import INPUT_TABLES, MONTHLY_OPTIONS, debt_schedule_total, run_dry_run
+from calculate_debt_schedule import DebtScheduleCalculator
+from calculate_depreciation_schedule import DepreciationScheduleCalculator
+from calculate_monthly_consolidated import MonthlyConsolidatedCalculator
+from calculate_quarterly_consolidated import QuarterlyConsolidatedCalculator
+from calculate_yearly_consolidated import YearlyConsolidatedCalculator
+from calculate_kpis import KPICalculator
+
+PRECOMPUTE_STAGE = 'precompute'
+
+# Bumped when the stored result changes shape, so older precomputes stop matching
+PRECOMPUTE_VERSION = 1
+
+# Inputs (calculate_dry_run.INPUT_TABLES) without which the pipeline cannot run
+REQUIRED_INPUTS = ('balance_sheet', 'profit_loss', 'debt_structure')
+
+# Audit columns of the input tables, which change on every save without changing the result
+METADATA_COLUMNS = {'id', 'project_id', 'version', 'created_at', 'updated_at', 'last_modified', 'created_by',
+                    'updated_by', 'change_reason'}
+
+# Job options that change the result and that the dry run models
+RESULT_OPTIONS = tuple(MONTHLY_OPTIONS) + ('discount_rate',)
+
+# Job options that only change how rows are stored
+STORAGE_OPTIONS = ('storage', 'consolidation')
+
+# Non-finite floats are stored as these strings, since jsonb has no NaN or Infinity
+NON_FINITE = {'nan', 'inf', '-inf'}
+
+
+def result_options(options):
+    """The options a precompute is keyed by, or None when the dry run cannot stand in for them"""
+    options = options or {}
+    if any(key not in RESULT_OPTIONS + STORAGE_OPTIONS for key, value in options.items() if value is not None):
+        return None
+    return {key: options[key] for key in RESULT_OPTIONS if options.get(key) is not None}
+
+
+def input_hash(inputs, options):
+    """sha256 of the input rows without their audit columns, and of the result options"""
+    content = {
+        'version': PRECOMPUTE_VERSION,
+        'inputs': {
+            key: {column: value for column, value in row.items() if column not in METADATA_COLUMNS}
+            if row else None
+            for key, row in inputs.items()
+        },
+        'options': options,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def encode(value):
+    """A result as JSON values that jsonb accepts"""
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [encode(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+def decode(value):
+    """A stored result with its non-finite floats restored"""
+    if isinstance(value, dict):
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if isinstance(value, str) and value in NON_FINITE:
+        return float(value)
+    return value
+
+
+def table_rows(columns):
+    """Columnar table -> list of row dicts"""
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+class SpeculativePrecompute:
+    def __init__(self, db_config, keep=None):
+        self.db_config = db_config
+        # Precomputes kept per project, newest first
+        self.keep = keep or int(os.getenv('SPECULATIVE_PRECOMPUTE_KEEP', '3'))
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def load_inputs(self, cursor, project_id):
+        """The project's latest input rows by dry-run payload key"""
+        inputs = {key: latest_input(cursor, table, project_id) for key, table in INPUT_TABLES.items()}
+        missing = [INPUT_TABLES[key] for key in REQUIRED_INPUTS if not inputs[key]]
+        if missing:
+            raise ValueError(f"Input data not found: {', '.join(missing)}")
+        return inputs
+
+    def find(self, cursor, project_id, digest):
+        cursor.execute("""
+            SELECT id, input_hash, options, result, execution_time_ms, created_at
+            FROM calculation_precomputes
+            WHERE project_id = %s AND input_hash = %s
+        """, (project_id, digest))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {**row, 'result': decode(row['result'])}
+
+    def lookup(self, project_id, options):
+        """
+        The precompute of the project's current inputs and options, or None; also None
+        when inputs are missing or the lookup fails, so the caller runs its stages
+        """
+        keyed_options = result_options(options)
+        if keyed_options is None:
+            return None
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                inputs = self.load_inputs(cursor, project_id)
+                return self.find(cursor, project_id, input_hash(inputs, keyed_options))
+        except (ValueError, psycopg2.Error):
+            return None
+
+    def precompute(self, project_id, options, job_id=None):
+        """
+        The precompute of the project's current inputs and options, running the dry
+        run when there is none yet; returns it and whether it was computed now, or
+        (None, False) when the options are not supported
+        """
+        keyed_options = result_options(options)
+        if keyed_options is None:
+            return None, False
+        with self.get_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            inputs = self.load_inputs(cursor, project_id)
+            digest = input_hash(inputs, keyed_options)
+            existing = self.find(cursor, project_id, digest)
+            if existing:
+                return existing, False
+
+            started = time.perf_counter()
+            result = self.build_result(inputs, keyed_options)
+            execution_time_ms = int((time.perf_counter() - started) * 1000)
+            cursor.execute("""
+                INSERT INTO calculation_precomputes (project_id, input_hash, options, result, execution_time_ms,
+                                                     job_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (project_id, input_hash) DO UPDATE
+                SET result = EXCLUDED.result, execution_time_ms = EXCLUDED.execution_time_ms, created_at = NOW()
+                RETURNING id, input_hash, options, execution_time_ms, created_at
+            """, (project_id, digest, json.dumps(keyed_options), json.dumps(encode(result)), execution_time_ms,
+                  job_id))
+            precompute = {**cursor.fetchone(), 'result': result}
+
+            # Older inputs are unlikely to come back
+            cursor.execute("""
+                DELETE FROM calculation_precomputes
+                WHERE project_id = %s AND id NOT IN (
+                    SELECT id FROM calculation_precomputes
+                    WHERE project_id = %s
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                )
+            """, (project_id, project_id, self.keep))
+            conn.commit()
+        return precompute, True
+
+    def build_result(self, inputs, options):
+        """The dry-run result with what promotion needs beyond its tables"""
+        monthly_options = {key: value for key, value in options.items() if key in MONTHLY_OPTIONS}
+        if isinstance(monthly_options.get('sweep_priority'), str):
+            monthly_options['sweep_priority'] = [
+                name.strip() for name in monthly_options['sweep_priority'].split(',') if name.strip()]
+        result = run_dry_run({**inputs, 'options': monthly_options, 'discount_rate': options.get('discount_rate')})
+        balance_sheet = inputs['balance_sheet']
+        result['debt_total'] = debt_schedule_total(inputs['debt_structure'], balance_sheet)
+        result['asset_depreciated_over_years'] = int(balance_sheet.get('asset_depreciated_over_years') or 0) or 10
+        return result
+
+    def record_hit(self, precompute_id, promoted_job_id=None):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE calculation_precomputes
+                SET hits = hits + 1,
+                    promoted_job_id = COALESCE(%s, promoted_job_id),
+                    promoted_at = CASE WHEN %s IS NOT NULL THEN NOW() ELSE promoted_at END
+                WHERE id = %s
+            """, (promoted_job_id, promoted_job_id, precompute_id))
+            conn.commit()
+
+    def persist_stage(self, stage, project_id, calculation_run_id, result, options):
+        """
+        Save a stage's rows from a precompute result with the stage's own save
+        method; returns the result the stage's calculation would have returned
+        """
+        storage = options.get('storage')
+        tables = result['tables']
+        if stage == 'debt_calculation':
+            return DebtScheduleCalculator(storage).save_schedule(project_id, calculation_run_id, result['debt_total'])
+
+        if stage == 'depreciation_schedule':
+            schedule = table_rows(tables['depreciation_schedule'])
+            DepreciationScheduleCalculator(self.db_config, storage).save_depreciation_schedule(
+                project_id, calculation_run_id, schedule, result['asset_depreciated_over_years'])
+            return {
+                'success': True,
+                'total_months': len(schedule),
+                'total_depreciation': sum(row['depreciation'] for row in schedule),
+                'final_net_book_value': schedule[-1]['closing_balance']
+            }
+
+        if stage == 'monthly_consolidated':
+            monthly_data = [
+                {**row, 'project_id': project_id, 'calculation_run_id': calculation_run_id}
+                for row in table_rows(tables['monthly'])
+            ]
+            MonthlyConsolidatedCalculator(self.db_config, storage).save_monthly_consolidated(
+                project_id, calculation_run_id, monthly_data)
+            IntegrityChecker(self.db_config).save_summary(project_id, calculation_run_id, result['integrity'])
+            summary = {key: result[key] for key in ('cash_sweep', 'solver', 'tax', 'integrity') if key in result}
+            return {'success': True, 'total_months': len(monthly_data), **summary}
+
+        if stage == 'quarterly_consolidated':
+            quarterly_data = table_rows(tables['quarterly'])
+            QuarterlyConsolidatedCalculator(self.db_config, storage).save_quarterly_consolidated(
+                project_id, calculation_run_id, quarterly_data)
+            return {'success': True, 'total_quarters': len(quarterly_data)}
+
+        if stage == 'yearly_consolidated':
+            yearly_data = table_rows(tables['yearly'])
+            YearlyConsolidatedCalculator(self.db_config, storage).save_yearly_consolidated(
+                project_id, calculation_run_id, yearly_data)
+            return {'success': True, 'total_years': len(yearly_data)}
+
+        if stage == 'kpi_calculation':
+            calculator = KPICalculator(
+                self.db_config['host'], self.db_config['port'], self.db_config['database'], self.db_config['user'],
+                self.db_config['password'], options.get('discount_rate'), storage
+            )
+            summary = {}
+            for level in ('monthly', 'quarterly', 'yearly'):
+                kpi_data = table_rows(tables[f'kpis_{level}'])
+                getattr(calculator, f'save_{level}_kpis')(project_id, calculation_run_id, kpi_data)
+                summary[level] = {'message': f"Calculated {len(kpi_data)} {level} KPIs"}
+            return {'success': True, **summary}
+
+        raise ValueError(f"Unknown stage: {stage}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry run of a project's saved inputs, served from its precompute")
+    parser.add_argument('--project-id', required=True, help='Project ID')
+    parser.add_argument('--options', default='{}', help='Calculation options as a JSON object')
+    add_format_argument(parser)
+
+    args = parser.parse_args()
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    db_config = {
+        'host': os.getenv('POSTGRESQL_HOST', 'localhost'),
+        'port': int(os.getenv('POSTGRESQL_PORT', '5432')),
+        'database': os.getenv('POSTGRESQL_DATABASE', 'refi_wizard'),
+        'user': os.getenv('POSTGRESQL_USER', 'postgres'),
+        'password': os.getenv('POSTGRESQL_PASSWORD', 'postgres')
+    }
+
+    try:
+        options = json.loads(args.options)
+        if result_options(options) is None:
+            raise ValueError("The dry run does not support these options: "
+                             + ', '.join(sorted(set(options) - set(RESULT_OPTIONS + STORAGE_OPTIONS))))
+        speculative = SpeculativePrecompute(db_config)
+        precompute, computed = speculative.precompute(args.project_id, options)
+        if not computed:
+            speculative.record_hit(precompute['id'])
+    except Exception as e:
+        write_result({'success': False, 'error': str(e)}, args.result_format)
+        sys.exit(1)
+
+    writer = ResultWriter(args.result_format)
+    result = dict(precompute['result'])
+    for name, columns in result.pop('tables').items():
+        writer.table(name, columns)
+    for key in ('debt_total', 'asset_depreciated_over_years'):
+        result.pop(key)
+    writer.result({
+        **result,
+        'precompute_id': str(precompute['id']),
+        'input_hash': precompute['input_hash'],
+        'precomputed': not computed,
+    })
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,23 @@
 const db = require('./database');
+const consolidatedService = require('./consolidatedService');
 const loggerService = require('./logger');
 const logger = loggerService.logger;
 
+// Tables the calculations read; saving one queues a precompute in speculative mode
+const CALCULATION_INPUT_TABLES = [
+  'balance_sheet_data',
+  'profit_loss_data',
+  'debt_structure_data',
+  'growth_assumptions_data',
+  'working_capital_data'
+];
+
 class AutoSaveService {
   constructor() {
     this.pendingSaves = new Map(); // projectId -> { timer, data, section }
     this.debounceDelay = 2000; // 2 seconds
+    // Precompute calculations in the background after input saves (opt-in)
+    this.speculativePrecompute = process.env.SPECULATIVE_PRECOMPUTE === 'true';
   }
 
   /**
@@ -65,6 +77,11 @@ class AutoSaveService {
         recordId: result.id 
       });
 
+      if (this.speculativePrecompute && CALCULATION_INPUT_TABLES.includes(tableName)) {
+        // Not awaited: the save is done whether or not the precompute can be queued
+        consolidatedService.enqueuePrecompute(projectId, userId);
+      }
+
       return result;
     } catch (error) {
       logger.error('Auto-save error', { 
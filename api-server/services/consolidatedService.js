@@ -1,9 +1,25 @@
 const { spawn } = require('child_process');
 const path = require('path');
 const consolidatedRepository = require('../repositories/consolidatedRepository');
+const calculationJobRepository = require('../repositories/calculationJobRepository');
 const loggerService = require('./logger');
+const { PythonResultParser } = require('./pythonResultParser');
+const singleFlight = require('./singleFlight');
 const logger = loggerService.logger;
 
+// Stages a calculation job can run, in pipeline order (see scripts/calculation_worker.py)
+const JOB_STAGES = [
+    'debt_calculation',
+    'depreciation_schedule',
+    'monthly_consolidated',
+    'quarterly_consolidated',
+    'yearly_consolidated',
+    'kpi_calculation'
+];
+
+// Stage of the jobs that keep a dry run of the saved inputs (scripts/speculative_precompute.py)
+const PRECOMPUTE_STAGE = 'precompute';
+
 class ConsolidatedService {
     constructor() {
         this.scriptsPath = path.join(__dirname, '..', 'scripts');
@@ -42,8 +58,70 @@ class ConsolidatedService {
         }
     }
 
-    async performMonthlyCalculation(projectId) {
+    buildMonthlyScriptArgs({
+        cashSweep, minCash, sweepPriority, solveCircular, depositRate, method,
+        computeTax, openingTaxLosses, lossCapPct, lossCapAmount
+    } = {}) {
+        const args = [];
+        const pushNonNegative = (flag, name, raw) => {
+            if (raw === undefined || raw === null) {
+                return;
+            }
+            const value = Number(raw);
+            if (!Number.isFinite(value) || value < 0) {
+                throw new Error(`${name} must be a non-negative number`);
+            }
+            args.push(flag, String(value));
+        };
+
+        if (cashSweep) {
+            args.push('--cash-sweep');
+            pushNonNegative('--min-cash', 'min_cash', minCash);
+            if (sweepPriority) {
+                const order = Array.isArray(sweepPriority) ? sweepPriority : String(sweepPriority).split(',');
+                const tranches = order.map((name) => String(name).trim()).filter(Boolean);
+                const unknown = tranches.filter((name) => !['senior_secured', 'short_term'].includes(name));
+                if (unknown.length > 0) {
+                    throw new Error(`Unknown tranche in sweep_priority: ${unknown.join(', ')}`);
+                }
+                args.push('--sweep-priority', tranches.join(','));
+            }
+        }
+
+        if (solveCircular) {
+            args.push('--solve-circular');
+            pushNonNegative('--deposit-rate', 'deposit_rate', depositRate);
+        }
+
+        if (computeTax || solveCircular) {
+            if (computeTax) {
+                args.push('--compute-tax');
+            }
+            pushNonNegative('--opening-tax-losses', 'opening_tax_losses', openingTaxLosses);
+            pushNonNegative('--loss-cap-pct', 'loss_cap_pct', lossCapPct);
+            pushNonNegative('--loss-cap-amount', 'loss_cap_amount', lossCapAmount);
+        }
+
+        if ((cashSweep || solveCircular) && method) {
+            if (!['anderson', 'picard'].includes(method)) {
+                throw new Error('method must be either "anderson" or "picard"');
+            }
+            args.push('--method', method);
+        }
+
+        return args;
+    }
+
+    // Concurrent requests with the same options share one run
+    async performMonthlyCalculation(projectId, options = {}) {
+        return singleFlight.run(singleFlight.key(projectId, 'monthly_consolidated', options),
+            () => this.runMonthlyCalculation(projectId, options));
+    }
+
+    async runMonthlyCalculation(projectId, options) {
         try {
+            const scriptArgs = this.buildMonthlyScriptArgs(options);
+
             // Create calculation run
             const calculationRun = await consolidatedRepository.createCalculationRun({
                 project_id: projectId,
@@ -51,20 +129,27 @@ class ConsolidatedService {
                 status: 'running',
                 description: 'Monthly consolidated financial statements calculation',
                 run_name: 'Monthly Consolidated Calculation',
-                input_data: { projectId, calculationType: 'monthly_consolidated' }
+                input_data: { projectId, calculationType: 'monthly_consolidated', options }
             });
 
             // Execute Python script
             const result = await this.executePythonScript(
                 'calculate_monthly_consolidated.py',
-                [projectId, calculationRun.id]
+                [projectId, calculationRun.id, ...scriptArgs]
             );
 
             if (result.success) {
+                const integrity = result.integrity;
+                const integrityNote = integrity && !integrity.passed
+                    ? ` Integrity check: ${integrity.balance_mismatches} balance sheet and ${integrity.cash_mismatches} cash flow mismatches.`
+                    : '';
                 await consolidatedRepository.updateCalculationRun(calculationRun.id, {
                     status: 'completed',
-                    description: `Monthly calculation completed successfully. Generated ${result.total_months} months of data.`
+                    description: `Monthly calculation completed successfully. Generated ${result.total_months} months of data.${integrityNote}`
                 });
+                if (integrityNote) {
+                    logger.warn(`Monthly consolidation ${calculationRun.id} for project ${projectId}:${integrityNote}`);
+                }
 
                 // Auto-generate quarterly and yearly calculations
                 try {
@@ -79,6 +164,10 @@ class ConsolidatedService {
                     success: true,
                     calculationRunId: calculationRun.id,
                     totalMonths: result.total_months,
+                    cashSweep: result.cash_sweep,
+                    solver: result.solver,
+                    tax: result.tax,
+                    integrity: result.integrity,
                     message: 'Monthly consolidated calculation completed successfully. Quarterly and yearly calculations auto-generated.'
                 };
             } else {
@@ -101,7 +190,202 @@ class ConsolidatedService {
         }
     }
 
+    async performDryRun(projectId, payload = {}) {
+        try {
+            let result;
+            if (payload.saved_inputs) {
+                // The project's saved inputs, served from their precompute when one exists
+                const options = { ...(payload.options || {}) };
+                if (payload.discount_rate !== undefined && payload.discount_rate !== null) {
+                    options.discount_rate = payload.discount_rate;
+                }
+                result = await this.executePythonScript('speculative_precompute.py', [
+                    '--project-id', projectId, '--options', JSON.stringify(options)
+                ]);
+            } else {
+                // Inputs come from the request, and nothing is stored or recorded as a run
+                result = await this.executePythonScript('calculate_dry_run.py', [], JSON.stringify(payload));
+            }
+
+            if (!result.success) {
+                return {
+                    success: false,
+                    error: result.error
+                };
+            }
+            return result;
+        } catch (error) {
+            logger.error(`Error performing dry run for project ${projectId}:`, error);
+            return {
+                success: false,
+                error: 'Error performing dry run: ' + error.message
+            };
+        }
+    }
+
+    async enqueueCalculationJob(projectId, { stages, options = {}, maxAttempts, priority = 'interactive' } = {},
+                                userId = null) {
+        try {
+            const requested = stages && stages.length > 0 ? stages : JOB_STAGES;
+            const unknown = requested.filter((stage) => !JOB_STAGES.includes(stage));
+            if (unknown.length > 0) {
+                return {
+                    success: false,
+                    error: `Unknown stage: ${unknown.join(', ')}`
+                };
+            }
+            if (!calculationJobRepository.PRIORITY_CLASSES.includes(priority)) {
+                return {
+                    success: false,
+                    error: `priority must be one of: ${calculationJobRepository.PRIORITY_CLASSES.join(', ')}`
+                };
+            }
+            if (maxAttempts !== undefined && !(Number.isInteger(maxAttempts) && maxAttempts >= 1)) {
+                return {
+                    success: false,
+                    error: 'max_attempts must be a positive integer'
+                };
+            }
+
+            // Same validation as the synchronous monthly calculation
+            this.buildMonthlyScriptArgs({
+                cashSweep: options.cash_sweep,
+                minCash: options.min_cash,
+                sweepPriority: options.sweep_priority,
+                solveCircular: options.solve_circular,
+                depositRate: options.deposit_rate,
+                method: options.method,
+                computeTax: options.compute_tax,
+                openingTaxLosses: options.opening_tax_losses,
+                lossCapPct: options.loss_cap_pct,
+                lossCapAmount: options.loss_cap_amount
+            });
+
+            // Stages always run in pipeline order
+            const { job, coalesced } = await calculationJobRepository.enqueueJob({
+                project_id: projectId,
+                stages: JOB_STAGES.filter((stage) => requested.includes(stage)),
+                options,
+                max_attempts: maxAttempts,
+                priority_class: priority,
+                created_by: userId
+            });
+
+            if (coalesced) {
+                logger.info(`Calculation request for project ${projectId} coalesced into ${job.status} job ${job.id}`);
+            } else {
+                logger.info(`Calculation job ${job.id} queued for project ${projectId}: ${job.stages.join(', ')}`);
+            }
+            return {
+                success: true,
+                job,
+                coalesced
+            };
+        } catch (error) {
+            logger.error(`Error enqueueing calculation job for project ${projectId}:`, error);
+            return {
+                success: false,
+                error: 'Error enqueueing calculation job: ' + error.message
+            };
+        }
+    }
+
+    // Queue a bulk dry run of the project's saved inputs with the options of its latest
+    // calculation request, for that request to be served or promoted from when repeated
+    async enqueuePrecompute(projectId, userId = null) {
+        try {
+            const options = await calculationJobRepository.getLatestJobOptions(projectId, [PRECOMPUTE_STAGE]);
+            const { job, coalesced } = await calculationJobRepository.enqueueJob({
+                project_id: projectId,
+                stages: [PRECOMPUTE_STAGE],
+                options,
+                priority_class: 'bulk',
+                created_by: userId
+            });
+
+            if (!coalesced) {
+                logger.info(`Precompute job ${job.id} queued for project ${projectId}`);
+            }
+            return {
+                success: true,
+                job,
+                coalesced
+            };
+        } catch (error) {
+            logger.error(`Error enqueueing precompute for project ${projectId}:`, error);
+            return {
+                success: false,
+                error: 'Error enqueueing precompute: ' + error.message
+            };
+        }
+    }
+
+    async getCalculationJob(projectId, jobId) {
+        try {
+            const job = await calculationJobRepository.getJob(projectId, jobId);
+            if (!job) {
+                return {
+                    success: false,
+                    error: 'Calculation job not found'
+                };
+            }
+
+            // A superseded job's request is answered by the job that replaced it
+            const latestJob = job.superseded_by
+                ? await calculationJobRepository.getLatestJob(projectId, jobId)
+                : job;
+            return {
+                success: true,
+                job,
+                latestJob
+            };
+        } catch (error) {
+            logger.error('Error getting calculation job:', error);
+            return {
+                success: false,
+                error: 'Error getting calculation job: ' + error.message
+            };
+        }
+    }
+
+    async getCalculationJobMetrics() {
+        try {
+            const metrics = await calculationJobRepository.getQueueMetrics();
+            return {
+                success: true,
+                metrics
+            };
+        } catch (error) {
+            logger.error('Error getting calculation job metrics:', error);
+            return {
+                success: false,
+                error: 'Error getting calculation job metrics: ' + error.message
+            };
+        }
+    }
+
+    async getCalculationJobs(projectId) {
+        try {
+            const jobs = await calculationJobRepository.getProjectJobs(projectId);
+            return {
+                success: true,
+                jobs
+            };
+        } catch (error) {
+            logger.error('Error getting calculation jobs:', error);
+            return {
+                success: false,
+                error: 'Error getting calculation jobs: ' + error.message
+            };
+        }
+    }
+
     async performQuarterlyCalculation(projectId, monthlyCalculationRunId) {
+        return singleFlight.run(singleFlight.key(projectId, 'quarterly_consolidated', { monthlyCalculationRunId }),
+            () => this.runQuarterlyCalculation(projectId, monthlyCalculationRunId));
+    }
+
+    async runQuarterlyCalculation(projectId, monthlyCalculationRunId) {
         try {
             // Create calculation run
             const calculationRun = await consolidatedRepository.createCalculationRun({
@@ -152,6 +436,11 @@ class ConsolidatedService {
     }
 
     async performYearlyCalculation(projectId, monthlyCalculationRunId) {
+        return singleFlight.run(singleFlight.key(projectId, 'yearly_consolidated', { monthlyCalculationRunId }),
+            () => this.runYearlyCalculation(projectId, monthlyCalculationRunId));
+    }
+
+    async runYearlyCalculation(projectId, monthlyCalculationRunId) {
         try {
             // Create calculation run
             const calculationRun = await consolidatedRepository.createCalculationRun({
@@ -201,16 +490,29 @@ class ConsolidatedService {
         }
     }
 
-    async executePythonScript(scriptName, args) {
+    async executePythonScript(scriptName, args, input = null) {
         return new Promise((resolve, reject) => {
             const scriptPath = path.join(this.scriptsPath, scriptName);
-            const pythonProcess = spawn('/opt/venv/bin/python3', [scriptPath, ...args]);
+            // Tables are streamed as NDJSON and parsed while the script is still running
+            const pythonProcess = spawn('/opt/venv/bin/python3', [scriptPath, ...args, '--format', 'ndjson']);
+
+            if (input !== null) {
+                pythonProcess.stdin.end(input);
+            }
 
-            let stdout = '';
+            const parser = new PythonResultParser();
+            let parseError = null;
             let stderr = '';
 
             pythonProcess.stdout.on('data', (data) => {
-                stdout += data.toString();
+                if (parseError) {
+                    return;
+                }
+                try {
+                    parser.push(data);
+                } catch (error) {
+                    parseError = error;
+                }
             });
 
             pythonProcess.stderr.on('data', (data) => {
@@ -220,8 +522,10 @@ class ConsolidatedService {
             pythonProcess.on('close', (code) => {
                 if (code === 0) {
                     try {
-                        const result = JSON.parse(stdout);
-                        resolve(result);
+                        if (parseError) {
+                            throw parseError;
+                        }
+                        resolve(parser.end());
                     } catch (error) {
                         resolve({
                             success: false,
@@ -2,6 +2,8 @@ const debtCalculationRepository = require('../repositories/debtCalculationReposi
 const debtStructureRepository = require('../repositories/debtStructureRepository');
 const balanceSheetRepository = require('../repositories/balanceSheetRepository');
 const auditService = require('./auditService');
+const singleFlight = require('./singleFlight');
+const { parseResultText } = require('./pythonResultParser');
 const loggerService = require('./logger');
 const logger = loggerService.logger;
 
@@ -27,9 +29,30 @@ class DebtCalculationService {
     }
   }
 
-  async performDebtCalculation(projectId, userId, changeReason = 'Debt calculation performed') {
+  buildScriptOptions({ repaymentMode, targetDscr } = {}) {
+    if (!repaymentMode || repaymentMode === 'annuity') {
+      return '';
+    }
+    if (repaymentMode !== 'sculpted') {
+      throw new Error(`Unsupported repayment mode: ${repaymentMode}`);
+    }
+    const dscr = Number(targetDscr);
+    if (!Number.isFinite(dscr) || dscr <= 0) {
+      throw new Error('A positive target DSCR is required for sculpted repayment');
+    }
+    return ` --repayment-mode sculpted --target-dscr ${dscr}`;
+  }
+
+  // Concurrent requests with the same options share one run
+  async performDebtCalculation(projectId, userId, changeReason = 'Debt calculation performed', options = {}) {
+    return singleFlight.run(singleFlight.key(projectId, 'debt_calculation', options),
+      () => this.runDebtCalculation(projectId, userId, changeReason, options));
+  }
+
+  async runDebtCalculation(projectId, userId, changeReason, options) {
     try {
       const startTime = Date.now();
+      const scriptOptions = this.buildScriptOptions(options);
       
       // Validate required data
       const { debtStructureData, balanceSheetData } = await this.validateRequiredData(projectId);
@@ -39,7 +62,7 @@ class DebtCalculationService {
         project_id: projectId,
         run_name: `Debt Calculation ${new Date().toISOString()}`,
         calculation_type: 'debt_calculation',
-        input_data: { debtStructureData, balanceSheetData },
+        input_data: { debtStructureData, balanceSheetData, options },
         output_data: {},
         status: 'running',
         created_by: userId
@@ -50,8 +73,8 @@ class DebtCalculationService {
       const util = require('util');
       const execAsync = util.promisify(exec);
       
-      const { stdout, stderr } = await execAsync(`python3 scripts/calculate_debt_schedule.py ${projectId} ${calculationRun.id}`);
-      const result = JSON.parse(stdout);
+      const { stdout, stderr } = await execAsync(`python3 scripts/calculate_debt_schedule.py ${projectId} ${calculationRun.id}${scriptOptions} --format ndjson`);
+      const result = parseResultText(stdout);
       
       if (!result.success) {
         throw new Error(result.error || 'Python calculation failed');
@@ -1,6 +1,8 @@
 const depreciationScheduleRepository = require('../repositories/depreciationScheduleRepository');
 const balanceSheetRepository = require('../repositories/balanceSheetRepository');
 const auditService = require('./auditService');
+const singleFlight = require('./singleFlight');
+const { parseResultText } = require('./pythonResultParser');
 const loggerService = require('./logger');
 const logger = loggerService.logger;
 
@@ -20,9 +22,46 @@ class DepreciationScheduleService {
     }
   }
 
-  async performDepreciationCalculation(projectId, userId, changeReason = 'Depreciation calculation performed') {
+  buildScriptOptions({ assetClasses } = {}) {
+    if (!assetClasses) {
+      return '';
+    }
+    if (!Array.isArray(assetClasses) || assetClasses.length === 0) {
+      throw new Error('asset_classes must be a non-empty array');
+    }
+    const methods = ['straight_line', 'declining_balance', 'sum_of_years'];
+    const classes = assetClasses.map((assetClass) => {
+      const name = String(assetClass.name || '').trim();
+      const share = Number(assetClass.share);
+      const lifeYears = Number(assetClass.life_years);
+      const method = assetClass.method || 'straight_line';
+      if (!name || !Number.isFinite(share) || share < 0 || !Number.isFinite(lifeYears) || lifeYears <= 0) {
+        throw new Error('Each asset class needs a name, a non-negative share and a positive life_years');
+      }
+      if (!methods.includes(method)) {
+        throw new Error(`Unsupported depreciation method: ${method}`);
+      }
+      const parsed = { name, share, life_years: lifeYears, method };
+      if (assetClass.factor !== undefined) {
+        parsed.factor = Number(assetClass.factor);
+      }
+      return parsed;
+    });
+    // Single-quote the JSON for the shell, escaping any embedded quotes
+    const json = JSON.stringify(classes).replace(/'/g, `'\\''`);
+    return ` --asset-classes '${json}'`;
+  }
+
+  // Concurrent requests with the same options share one run
+  async performDepreciationCalculation(projectId, userId, changeReason = 'Depreciation calculation performed', options = {}) {
+    return singleFlight.run(singleFlight.key(projectId, 'depreciation_schedule', options),
+      () => this.runDepreciationCalculation(projectId, userId, changeReason, options));
+  }
+
+  async runDepreciationCalculation(projectId, userId, changeReason, options) {
     try {
       const startTime = Date.now();
+      const scriptOptions = this.buildScriptOptions(options);
       
       // Validate required data
       const { balanceSheetData } = await this.validateRequiredData(projectId);
@@ -32,7 +71,7 @@ class DepreciationScheduleService {
         project_id: projectId,
         run_name: `Depreciation Schedule ${new Date().toISOString()}`,
         calculation_type: 'depreciation_schedule',
-        input_data: { balanceSheetData },
+        input_data: { balanceSheetData, options },
         output_data: {},
         status: 'running',
         created_by: userId
@@ -43,8 +82,8 @@ class DepreciationScheduleService {
       const util = require('util');
       const execAsync = util.promisify(exec);
       
-      const { stdout, stderr } = await execAsync(`python3 scripts/calculate_depreciation_schedule.py ${projectId} ${calculationRun.id}`);
-      const result = JSON.parse(stdout);
+      const { stdout, stderr } = await execAsync(`python3 scripts/calculate_depreciation_schedule.py ${projectId} ${calculationRun.id}${scriptOptions} --format ndjson`);
+      const result = parseResultText(stdout);
       
       if (!result.success) {
         throw new Error(result.error || 'Python calculation failed');
@@ -60,7 +99,8 @@ class DepreciationScheduleService {
           total_months: result.total_months,
           summary: {
             total_depreciation: result.total_depreciation,
-            final_net_book_value: result.final_net_book_value
+            final_net_book_value: result.final_net_book_value,
+            classes: result.classes
           }
         },
         status: 'completed',
@@ -92,7 +132,8 @@ class DepreciationScheduleService {
         summary: {
           total_months: result.total_months,
           total_depreciation: result.total_depreciation,
-          final_net_book_value: result.final_net_book_value
+          final_net_book_value: result.final_net_book_value,
+          classes: result.classes
         }
       };
 
@@ -3,6 +3,8 @@ const loggerService = require('./logger');
 const logger = loggerService.logger;
 const { spawn } = require('child_process');
 const path = require('path');
+const { PythonResultParser } = require('./pythonResultParser');
+const singleFlight = require('./singleFlight');
 
 class KpiService {
     constructor() {
@@ -37,7 +39,13 @@ class KpiService {
         }
     }
 
+    // Concurrent requests for the project share one run
     async performKpiCalculation(projectId) {
+        return singleFlight.run(singleFlight.key(projectId, 'kpi_calculation'),
+            () => this.runKpiCalculation(projectId));
+    }
+
+    async runKpiCalculation(projectId) {
         try {
             // Validate required data
             const validation = await this.validateRequiredData(projectId);
@@ -94,15 +102,23 @@ class KpiService {
         return new Promise((resolve) => {
             const scriptPath = path.join(__dirname, '..', 'scripts', scriptName);
             
-            const pythonProcess = spawn(this.pythonPath, [scriptPath, ...args], {
+            const pythonProcess = spawn(this.pythonPath, [scriptPath, ...args, '--format', 'ndjson'], {
                 stdio: ['pipe', 'pipe', 'pipe']
             });
 
-            let stdout = '';
+            const parser = new PythonResultParser();
+            let parseError = null;
             let stderr = '';
 
             pythonProcess.stdout.on('data', (data) => {
-                stdout += data.toString();
+                if (parseError) {
+                    return;
+                }
+                try {
+                    parser.push(data);
+                } catch (error) {
+                    parseError = error;
+                }
             });
 
             pythonProcess.stderr.on('data', (data) => {
@@ -112,24 +128,19 @@ class KpiService {
             pythonProcess.on('close', (code) => {
                 if (code === 0) {
                     try {
-                        // Try to parse the output as JSON
-                        const lines = stdout.trim().split('\n');
-                        const results = {};
-                        
-                        lines.forEach(line => {
-                            if (line.includes(':')) {
-                                const [key, value] = line.split(': ', 2);
-                                try {
-                                    results[key] = JSON.parse(value);
-                                } catch (e) {
-                                    results[key] = value;
-                                }
-                            }
-                        });
-                        
-                        resolve({ success: true, data: results });
+                        if (parseError) {
+                            throw parseError;
+                        }
+                        // Per-level results arrive as the monthly, quarterly and yearly stages
+                        const { success, error, stages, ...summary } = parser.end();
+                        if (success === false) {
+                            resolve({ success: false, error: error || 'KPI calculation failed' });
+                            return;
+                        }
+                        resolve({ success: true, data: stages || summary });
                     } catch (error) {
-                        resolve({ success: true, data: stdout });
+                        logger.error('Invalid output from Python script:', error);
+                        resolve({ success: false, error: 'Invalid output from Python script' });
                     }
                 } else {
                     logger.error(`Python script failed with code ${code}:`, stderr);
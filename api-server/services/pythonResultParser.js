@@ -0,0 +1,113 @@
+/**
+ * Reader for the result protocol of the calculation scripts (scripts/result_protocol.py).
+ *
+ * Scripts run with `--format ndjson` write one JSON line per table or stage as soon
+ * as it is ready and a final "result" line; the parser handles each line as it
+ * arrives instead of buffering the whole output. Output in the single-object json
+ * format, or from scripts without the protocol, is parsed once at the end.
+ */
+
+const PROTOCOL_VERSION = 1;
+
+class PythonResultParser {
+    constructor() {
+        this.buffer = '';
+        this.pending = '';
+        this.streaming = false;
+        this.result = {};
+        this.tables = {};
+        this.stages = {};
+        this.finished = false;
+    }
+
+    push(chunk) {
+        this.buffer += chunk.toString();
+        let newline = this.buffer.indexOf('\n');
+        while (newline !== -1) {
+            this.handleLine(this.buffer.slice(0, newline));
+            this.buffer = this.buffer.slice(newline + 1);
+            newline = this.buffer.indexOf('\n');
+        }
+    }
+
+    handleLine(line) {
+        if (!line.trim()) {
+            return;
+        }
+        // Lines of a streamed result all start with the protocol field
+        if (line.startsWith('{"protocol":')) {
+            const message = JSON.parse(line);
+            if (message.protocol > PROTOCOL_VERSION) {
+                throw new Error(`Unsupported result protocol version ${message.protocol}`);
+            }
+            if (message.stage !== undefined) {
+                this.streaming = true;
+                this.handleMessage(message);
+                return;
+            }
+        }
+        this.pending += line + '\n';
+    }
+
+    handleMessage({ protocol, stage, ...data }) {
+        if (stage === 'table') {
+            this.tables[data.name] = data.columns;
+        } else if (stage === 'result') {
+            Object.assign(this.result, data);
+            this.finished = true;
+        } else {
+            this.stages[stage] = data;
+        }
+    }
+
+    end() {
+        this.pending += this.buffer;
+        this.buffer = '';
+
+        if (!this.streaming) {
+            const { protocol, ...result } = JSON.parse(this.pending);
+            return result;
+        }
+        if (!this.finished) {
+            throw new Error('Python script output ended before the final result');
+        }
+        const result = { ...this.result };
+        if (Object.keys(this.stages).length > 0) {
+            result.stages = this.stages;
+        }
+        if (Object.keys(this.tables).length > 0) {
+            result.tables = this.tables;
+        }
+        return result;
+    }
+}
+
+function parseResultText(text) {
+    const parser = new PythonResultParser();
+    parser.push(text);
+    return parser.end();
+}
+
+/**
+ * Columnar table ({column: [values]}) back to a list of row objects
+ */
+function tableRows(columns) {
+    const names = Object.keys(columns || {});
+    const length = names.length > 0 ? columns[names[0]].length : 0;
+    const rows = new Array(length);
+    for (let i = 0; i < length; i++) {
+        const row = {};
+        for (const name of names) {
+            row[name] = columns[name][i];
+        }
+        rows[i] = row;
+    }
+    return rows;
+}
+
+module.exports = {
+    PROTOCOL_VERSION,
+    PythonResultParser,
+    parseResultText,
+    tableRows
+};
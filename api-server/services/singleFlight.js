@@ -0,0 +1,28 @@
+// Coalesces concurrent calls with the same key into one execution whose result every
+// caller receives, so a double-click or an autosave overlapping a manual trigger runs
+// a calculation once. This covers one API process; scripts/project_lock.py keeps
+// calculations of a project from overlapping across processes and containers.
+class SingleFlight {
+    constructor() {
+        this.inFlight = new Map();
+    }
+
+    run(key, fn) {
+        if (this.inFlight.has(key)) {
+            return this.inFlight.get(key);
+        }
+
+        const execution = Promise.resolve()
+            .then(fn)
+            .finally(() => this.inFlight.delete(key));
+        this.inFlight.set(key, execution);
+        return execution;
+    }
+
+    // Key of a project's calculation stage with the options that change its result
+    key(projectId, stage, options = {}) {
+        return `${projectId}:${stage}:${JSON.stringify(options)}`;
+    }
+}
+
+module.exports = new SingleFlight();
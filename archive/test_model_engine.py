@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Regression check of the vectorized model engine (api-server/scripts/model_engine.py)
+against the loops it replaced, on random inputs:
+
+- debt_schedule / combined_debt_schedule against the DebtScheduleCalculator loop
+- irr against numpy_financial.irr
+- cash_waterfall: cash and debt balances reconcile month by month, and without a
+  sweep it reproduces the scheduled debt service
+- DebtCapacitySolver: the batched bisection finds known maxima, and the goal-seek
+  on synthetic inputs returns the largest feasible loan, reports infeasible and
+  unbounded searches, and runs through solve_projects
+
+Needs no database. Run with: python3 archive/test_model_engine.py
+"""
+
+import os
+import sys
+import warnings
+
+import numpy as np
+import numpy_financial as npf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api-server', 'scripts'))
+
+import model_engine
+from calculate_debt_capacity import DebtCapacitySolver, solve_projects
+from calculate_debt_schedule import DebtScheduleCalculator
+
+SEED = 20240601
+CASES = 25
+TOLERANCE = 1e-6
+
+
+def random_inputs(rng):
+    """Random debt structure and balance sheet rows, as loaded from the input tables"""
+    balance_sheet = {
+        'senior_secured': float(rng.choice([0, rng.uniform(1e4, 5e6)])),
+        'debt_tranche1': float(rng.choice([0, rng.uniform(1e3, 1e6)])),
+    }
+    debt_structure = {}
+    for suffix in ('senior_secured', 'short_term'):
+        maturity_y = int(rng.integers(1, 11))
+        debt_structure.update({
+            f'additional_loan_{suffix}': float(rng.choice([0, rng.uniform(0, 1e6)])),
+            f'bank_base_rate_{suffix}': float(rng.choice([0, rng.uniform(0, 8)])),
+            f'liquidity_premiums_{suffix}': float(rng.uniform(0, 2)),
+            f'credit_risk_premiums_{suffix}': float(rng.uniform(0, 3)),
+            f'maturity_y_{suffix}': maturity_y,
+            # The loop divides by the repayment period, so it must be at least a year
+            f'amortization_y_{suffix}': int(rng.integers(0, maturity_y)),
+        })
+    return debt_structure, balance_sheet
+
+
+def solver_inputs(rate=4.0):
+    """Debt structure, balance sheet and profit & loss rows of one synthetic project"""
+    debt_structure = {
+        'additional_loan_senior_secured': 0.0, 'bank_base_rate_senior_secured': rate,
+        'liquidity_premiums_senior_secured': rate / 4, 'credit_risk_premiums_senior_secured': rate / 2,
+        'maturity_y_senior_secured': 7, 'amortization_y_senior_secured': 1,
+        'additional_loan_short_term': 0.0, 'bank_base_rate_short_term': rate,
+        'liquidity_premiums_short_term': 0.0, 'credit_risk_premiums_short_term': 0.0,
+        'maturity_y_short_term': 2, 'amortization_y_short_term': 0,
+    }
+    balance_sheet = {'senior_secured': 1e6, 'debt_tranche1': 1e5}
+    profit_loss = {'revenue': 6e5, 'cogs': 2.5e5, 'operating_expenses': 1.5e5}
+    return debt_structure, balance_sheet, profit_loss
+
+
+def offline_solver(inputs, **options):
+    """A DebtCapacitySolver reading inputs ({project_id: rows}) instead of the database"""
+    solver = DebtCapacitySolver(None, **options)
+    solver.get_inputs = lambda project_id: inputs[project_id]
+    return solver
+
+
+def loop_schedule(debt_structure, balance_sheet):
+    """The combined schedule of the DebtScheduleCalculator loop, without the database"""
+    calculator = DebtScheduleCalculator()
+    calculator.get_debt_structure_data = lambda project_id: debt_structure
+    calculator.get_balance_sheet_data = lambda project_id: balance_sheet
+    calculator.save_schedule = lambda project_id, calculation_run_id, total: total
+    with warnings.catch_warnings():
+        # The loop writes floats into integer-initialised frames
+        warnings.simplefilter('ignore', FutureWarning)
+        return calculator.calculate_debt_schedule(None)
+
+
+def assert_close(name, actual, expected, tolerance=TOLERANCE):
+    actual, expected = np.asarray(actual, dtype=float), np.asarray(expected, dtype=float)
+    scale = max(1.0, float(np.max(np.abs(expected), initial=0)))
+    difference = float(np.max(np.abs(actual - expected), initial=0)) / scale
+    assert difference <= tolerance, f"{name}: relative difference {difference:.3e} above {tolerance:.0e}"
+    return difference
+
+
+def test_debt_schedule():
+    """Closed-form schedule against the month-by-month loop"""
+    rng = np.random.default_rng(SEED)
+    worst = 0.0
+    for _ in range(CASES):
+        debt_structure, balance_sheet = random_inputs(rng)
+        expected = loop_schedule(debt_structure, balance_sheet)
+        total = model_engine.combined_debt_schedule(
+            model_engine.tranche_terms(debt_structure, balance_sheet))['total']
+        for column in ('Opening', 'Interest', 'Repayment', 'Closing'):
+            worst = max(worst, assert_close(f"debt {column}", total[column.lower()][0], expected[column]))
+    print(f"debt_schedule: {CASES} cases, worst relative difference {worst:.2e}")
+
+
+def test_irr():
+    """Batched IRR against numpy_financial.irr row by row"""
+    rng = np.random.default_rng(SEED)
+    cash_flows = np.concatenate([
+        -rng.uniform(1e3, 1e6, (CASES, 1)),
+        rng.uniform(-2e4, 5e4, (CASES, 120)),
+    ], axis=1)
+    solved = model_engine.irr(cash_flows)
+    worst = 0.0
+    for i, row in enumerate(cash_flows):
+        expected = npf.irr(row)
+        if np.isnan(expected):
+            assert not solved['converged'][i], f"irr row {i}: converged where numpy_financial has no root"
+            continue
+        assert solved['converged'][i], f"irr row {i}: not converged"
+        worst = max(worst, assert_close(f"irr row {i}", solved['rate'][i], expected, 1e-7))
+
+    # Rows without both inflows and outflows have no IRR
+    degenerate = np.array([[0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [-1.0, -2.0, 0.0, 0.0]])
+    solved = model_engine.irr(degenerate)
+    for i, row in enumerate(degenerate):
+        assert np.isnan(npf.irr(row)), f"irr degenerate row {i}: numpy_financial found a root"
+        assert np.isnan(solved['rate'][i]) and not solved['converged'][i], f"irr degenerate row {i}: solved"
+    print(f"irr: {CASES} rows, worst difference {worst:.2e}; {len(degenerate)} degenerate rows unsolved")
+
+
+def test_cash_waterfall():
+    """Swept cash and debt reconcile every month; without a sweep the schedule is unchanged"""
+    rng = np.random.default_rng(SEED)
+    for case in range(CASES):
+        debt_structure, balance_sheet = random_inputs(rng)
+        terms = model_engine.tranche_terms(debt_structure, balance_sheet)
+        operating_cash_flow = rng.uniform(-1e4, 8e4, model_engine.NB_MONTHS)
+        opening_cash = float(rng.uniform(0, 1e5))
+        min_cash = float(rng.uniform(0, 5e4))
+
+        result = model_engine.cash_waterfall(terms, operating_cash_flow, opening_cash, min_cash=min_cash)
+        total = result['total']
+        assert result['converged'], f"waterfall case {case}: not converged"
+
+        # Cash moves by the operating flow, the loan proceeds and the debt service
+        flow = operating_cash_flow + total['additional_loan'][0] + total['repayment'][0]
+        assert_close(f"waterfall case {case} cash", result['closing_cash'][0] - result['opening_cash'][0], flow)
+        assert_close(f"waterfall case {case} cash roll", result['opening_cash'][0, 1:], result['closing_cash'][0, :-1])
+
+        # Every tranche rolls forward, is never negative and is only swept down
+        for name, tranche in result['tranches'].items():
+            assert_close(f"waterfall case {case} {name} opening", tranche['opening'][0, 1:], tranche['closing'][0, :-1])
+            assert np.all(tranche['closing'] >= 0), f"waterfall case {case} {name}: negative balance"
+            assert np.all(tranche['prepayment'] <= 0), f"waterfall case {case} {name}: prepayment is not an outflow"
+
+        # With no cash above min_cash nothing is swept and the annuity schedule stands
+        unswept = model_engine.cash_waterfall(terms, operating_cash_flow, opening_cash, min_cash=1e15)
+        scheduled = model_engine.combined_debt_schedule(terms)['total']
+        for key in ('opening', 'interest', 'repayment', 'closing'):
+            assert_close(f"waterfall case {case} unswept {key}", unswept['total'][key], scheduled[key], 1e-5)
+    print(f"cash_waterfall: {CASES} cases reconcile")
+
+
+def test_search_maximum():
+    """Bracketing and bisection find the largest value of a monotone predicate"""
+    solver = DebtCapacitySolver(None, points=4, max_iterations=100)
+    for answer in (0.37, 999.0, 12345.678, 8.5e7):
+        value, _, _, bounded = solver.search_maximum(lambda c: np.asarray(c) <= answer, 0.0, 1000.0, 1e-3)
+        assert bounded and answer - 1e-3 <= value <= answer, f"search {answer}: found {value}"
+
+        # With a limit the bracket is [lower, limit] from the start
+        value, _, _, bounded = solver.search_maximum(lambda c: np.asarray(c) <= answer, 0.0, 1e8, 1e-3,
+                                                     limit=1e8)
+        assert bounded and answer - 1e-3 <= value <= answer, f"search {answer} below limit: found {value}"
+
+    always = lambda c: np.ones(len(c), dtype=bool)
+    value, iterations, evaluations, bounded = solver.search_maximum(always, 0.0, 50.0, 1e-3, limit=50.0)
+    assert (value, iterations, evaluations, bounded) == (50.0, 1, 1, False), "search: feasible limit not returned"
+    value, _, _, bounded = solver.search_maximum(always, 0.0, 1000.0, 1e-3)
+    assert not bounded and value > 1000.0, "search: unbounded expansion reported as bounded"
+    print("search_maximum: known maxima found, feasible limit and unbounded expansion reported")
+
+
+def test_debt_capacity_solver():
+    """Goal-seek on synthetic inputs against direct evaluation of the neighbouring candidates"""
+    solver = offline_solver({'project': solver_inputs()}, points=8, tolerance=1.0)
+    terms = model_engine.tranche_terms(*solver_inputs()[:2])
+    ebitda = model_engine.monthly_ebitda(solver_inputs()[2])
+
+    def feasible(tranche, term, value, constraints):
+        summary = solver.evaluate(terms, ebitda, tranche, term, [value])
+        return bool(solver.is_feasible(summary, constraints)[0])
+
+    for constraints in ({'max_debt_to_ebitda': 12.0}, {'min_dscr': 1.2}, {'min_interest_coverage': 4.0},
+                        {'min_dscr': 1.1, 'max_debt_to_ebitda': 15.0}):
+        result = solver.solve('project', 'additional_loan_senior_secured', constraints)
+        assert result['feasible'] and result['bounded'], f"loan {constraints}: {result}"
+        value = result['value']
+        # Rounded to cents, so step a cent inside the tolerance on either side
+        assert feasible('senior_secured', 'additional_loan', value - 0.01, constraints), \
+            f"loan {constraints}: {value} is infeasible"
+        assert not feasible('senior_secured', 'additional_loan', value + solver.tolerance + 0.01, constraints), \
+            f"loan {constraints}: {value} is more than the tolerance below the maximum"
+
+    constraints = {'min_interest_coverage': 2.0}
+    result = solver.solve('project', 'credit_risk_premiums_senior_secured', constraints)
+    assert result['feasible'] and result['bounded'], f"spread: {result}"
+    assert feasible('senior_secured', 'credit_risk_premiums', result['value'] - 0.0001, constraints)
+    assert not feasible('senior_secured', 'credit_risk_premiums', result['value'] + 0.0003, constraints)
+
+    # Longer maturities lower the debt service, so the shortest one meeting the DSCR is sought
+    constraints = {'min_dscr': 3.0}
+    result = solver.solve('project', 'maturity_y_senior_secured', constraints)
+    assert result['feasible'] and result['value'] > terms['senior_secured']['amortization_y'] + 1, f"maturity: {result}"
+    assert feasible('senior_secured', 'maturity_y', result['value'], constraints), "maturity: infeasible"
+    assert not feasible('senior_secured', 'maturity_y', result['value'] - 1, constraints), "maturity: not the shortest"
+
+    # Covenants the existing debt already breaks cannot be met by any loan
+    result = solver.solve('project', 'additional_loan_senior_secured', {'min_dscr': 1e6})
+    assert not result['feasible'] and result['bounded'] and result['value'] is None, f"infeasible: {result}"
+    assert 'kpis' not in result
+
+    # Without interest the coverage covenant never binds, however large the loan
+    unbounded = offline_solver({'project': solver_inputs(rate=0.0)}, points=8)
+    result = unbounded.solve('project', 'additional_loan_senior_secured', {'min_interest_coverage': 3.0})
+    assert result['feasible'] and not result['bounded'], f"unbounded: {result}"
+    print("debt capacity: largest feasible values within tolerance, infeasible and unbounded searches reported")
+
+
+def test_solve_projects():
+    """solve_projects solves every project in order and reports failures per project"""
+    inputs = {'low': solver_inputs(rate=2.0), 'high': solver_inputs(rate=8.0)}
+    constraints = {'min_dscr': 1.2}
+    get_inputs = DebtCapacitySolver.get_inputs
+
+    def offline_inputs(self, project_id):
+        if project_id not in inputs:
+            raise ValueError("Required data not found")
+        return inputs[project_id]
+
+    DebtCapacitySolver.get_inputs = offline_inputs
+    try:
+        results = solve_projects(None, ['low', 'missing', 'high'], 'additional_loan_senior_secured', constraints,
+                                 workers=1, points=8)
+    finally:
+        DebtCapacitySolver.get_inputs = get_inputs
+
+    assert [r['project_id'] for r in results] == ['low', 'missing', 'high'], "solve_projects: order changed"
+    assert results[1] == {'project_id': 'missing', 'success': False, 'error': "Required data not found"}
+    for result in (results[0], results[2]):
+        expected = offline_solver(inputs, points=8).solve(result['project_id'], 'additional_loan_senior_secured',
+                                                           constraints)
+        assert result == expected, f"solve_projects {result['project_id']}: differs from solve"
+    assert results[0]['value'] > results[2]['value'], "solve_projects: cheaper debt should allow a larger loan"
+    print(f"solve_projects: {len(results)} projects, one failure reported")
+
+
+if __name__ == "__main__":
+    test_debt_schedule()
+    test_irr()
+    test_cash_waterfall()
+    test_search_maximum()
+    test_debt_capacity_solver()
+    test_solve_projects()